@@ -0,0 +1,139 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the per-batch dispatch overhead of broadcasting admitted prompts in the multi-host server.
+
+Simulates a multi-host server with several CPU processes connected by gloo
+collectives, and times the broadcast of one main loop iteration on process 0
+for two protocols:
+
+* padded: JSON text prompts padded to `MAX_REQUEST_SIZE` bytes, broadcast every
+  iteration.
+* two_phase: a 4-byte length broadcast, then the binary token-ID payload padded
+  to a power-of-two bucket (`broadcast_utils.PayloadBroadcaster`).
+
+Each is measured for an idle iteration and for batches of prompts of several sizes.
+
+Command:
+  python -m benchmarks.api_server.benchmark_broadcast --num_processes=4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+MAX_REQUEST_SIZE = 65536 * 10
+# (prompts per batch, tokens per prompt); (0, 0) is an idle iteration.
+BATCH_SHAPES = ((0, 0), (1, 128), (8, 512), (32, 1024))
+# Average characters per token of the JSON text prompts of the padded protocol.
+CHARS_PER_TOKEN = 4
+PARAMS = {"max_tokens": 128, "logprobs": None, "echo": False, "stop": None, "temperature": 0.0}
+
+
+def _batch(num_prompts, num_tokens, rs):
+  """Returns the keys, text prompts, token-ID prompts and params of a synthetic batch."""
+  keys = [[f"req_{i}", 0] for i in range(num_prompts)]
+  text_prompts = ["x" * (num_tokens * CHARS_PER_TOKEN) for _ in range(num_prompts)]
+  token_prompts = [rs.randint(0, 128_000, size=num_tokens).tolist() for _ in range(num_prompts)]
+  return keys, text_prompts, token_prompts, [PARAMS] * num_prompts
+
+
+def _padded_broadcast(payload_bytes):
+  """The protocol that pads every payload to MAX_REQUEST_SIZE, as the server did before."""
+  # pylint: disable=import-outside-toplevel
+  from jax.experimental import multihost_utils
+
+  payload_len = len(payload_bytes)
+  data = np.zeros(MAX_REQUEST_SIZE, dtype=np.uint8)
+  data[:payload_len] = np.frombuffer(payload_bytes, dtype=np.uint8)
+  received_len, received_data = multihost_utils.broadcast_one_to_all((np.array([payload_len], dtype=np.int32), data))
+  payload_len = int(received_len[0])
+  return json.loads(received_data[:payload_len].tobytes()) if payload_len else None
+
+
+def run_worker(process_id, num_processes, port, num_iters):
+  """Runs every protocol and batch shape on one simulated host and logs the timings on process 0."""
+  # pylint: disable=import-outside-toplevel
+  import jax
+
+  jax.config.update("jax_cpu_collectives_implementation", "gloo")
+  jax.distributed.initialize(f"localhost:{port}", num_processes=num_processes, process_id=process_id)
+  from benchmarks.api_server import broadcast_utils
+
+  broadcaster = broadcast_utils.PayloadBroadcaster(MAX_REQUEST_SIZE)
+  rs = np.random.RandomState(0)
+
+  for num_prompts, num_tokens in BATCH_SHAPES:
+    keys, text_prompts, token_prompts, params = _batch(num_prompts, num_tokens, rs)
+
+    def padded_step(num_prompts=num_prompts, keys=keys, text_prompts=text_prompts, params=params):
+      payload = b""
+      if num_prompts:
+        payload = json.dumps({"keys": keys, "prompts": text_prompts, "params": params}).encode("utf-8")
+      return _padded_broadcast(payload if jax.process_index() == 0 else b"")
+
+    def two_phase_step(num_prompts=num_prompts, keys=keys, token_prompts=token_prompts, params=params):
+      payload = broadcast_utils.encode_batch(keys, token_prompts, params) if num_prompts else None
+      received = broadcaster.broadcast(payload if jax.process_index() == 0 else None)
+      return broadcast_utils.decode_batch(received) if received is not None else None
+
+    for name, step in (("padded", padded_step), ("two_phase", two_phase_step)):
+      step()  # Warmup / compile.
+      start = time.perf_counter()
+      for _ in range(num_iters):
+        step()
+      elapsed_ms = (time.perf_counter() - start) / num_iters * 1e3
+      if jax.process_index() == 0:
+        print(
+            f"processes={num_processes} prompts={num_prompts} tokens/prompt={num_tokens} "
+            f"protocol={name}: {elapsed_ms:.3f} ms/batch",
+            flush=True,
+        )
+
+  jax.distributed.shutdown()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--num_processes", type=int, default=4, help="Number of simulated hosts.")
+  parser.add_argument("--num_iters", type=int, default=50, help="Timed iterations per protocol and batch shape.")
+  parser.add_argument("--port", type=int, default=12355, help="Port of the JAX coordinator.")
+  parser.add_argument("--process_id", type=int, default=None, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.process_id is not None:
+    run_worker(args.process_id, args.num_processes, args.port, args.num_iters)
+    return
+
+  env = dict(os.environ, JAX_PLATFORMS="cpu")
+  workers = [
+      subprocess.Popen(  # pylint: disable=consider-using-with
+          [sys.executable, "-m", "benchmarks.api_server.benchmark_broadcast"]
+          + [f"--num_processes={args.num_processes}", f"--num_iters={args.num_iters}", f"--port={args.port}"]
+          + [f"--process_id={i}"],
+          env=env,
+      )
+      for i in range(args.num_processes)
+  ]
+  sys.exit(max(worker.wait() for worker in workers))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,174 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Broadcasting of admitted requests from the coordinator to all JAX processes.
+
+In a multi-host server every process must run the same inserts and generate
+steps, but only process 0 receives requests. Each main loop iteration therefore
+broadcasts the newly admitted prompts with a two-phase protocol:
+
+1. A small fixed-size header is broadcast: the payload length, followed by the
+   payload itself if it fits. Zero means there is no payload, which is the
+   common case while decoding, so most iterations cost one small collective.
+2. A payload that does not fit into the header is padded to the next power of
+   two (at least `min_bucket_size`) and broadcast in a second collective. Only
+   a handful of bucket shapes exist, so each is compiled once, and no payload
+   is padded to the maximum size.
+
+Prompts travel as int32 token IDs tokenized once on process 0, next to a small
+JSON header with the request keys and sampling parameters.
+"""
+
+from typing import Any, Callable, Dict, Optional, Sequence
+import json
+import struct
+
+import numpy as np
+
+import jax
+from jax.experimental import multihost_utils
+
+_HEADER_LEN = struct.Struct("<I")
+_PAYLOAD_LEN = struct.Struct("<I")
+
+
+def encode_batch(keys: Sequence[Any], token_ids: Sequence[Sequence[int]], params: Sequence[Dict[str, Any]]) -> bytes:
+  """
+  Encodes a batch of tokenized prompts for broadcasting.
+
+  The layout is a little-endian uint32 header length, a compact JSON header
+  holding the keys, sampling parameters and prompt lengths, and then the
+  concatenated int32 token IDs of all prompts.
+  """
+  lengths = [len(ids) for ids in token_ids]
+  header = json.dumps({"keys": list(keys), "params": list(params), "lengths": lengths}, separators=(",", ":"))
+  header_bytes = header.encode("utf-8")
+  tokens = np.concatenate([np.asarray(ids, dtype="<i4") for ids in token_ids]) if token_ids else np.zeros(0, "<i4")
+  return _HEADER_LEN.pack(len(header_bytes)) + header_bytes + tokens.tobytes()
+
+
+def decode_batch(payload: bytes) -> Dict[str, Any]:
+  """Decodes a payload of `encode_batch` into a dict with `keys`, `params` and `token_ids` lists."""
+  (header_len,) = _HEADER_LEN.unpack_from(payload)
+  header = json.loads(payload[_HEADER_LEN.size : _HEADER_LEN.size + header_len].decode("utf-8"))
+  tokens = np.frombuffer(payload, dtype="<i4", offset=_HEADER_LEN.size + header_len)
+  offsets = np.cumsum([0] + header["lengths"])
+  return {
+      "keys": header["keys"],
+      "params": header["params"],
+      "token_ids": [tokens[start:end].tolist() for start, end in zip(offsets[:-1], offsets[1:])],
+  }
+
+
+def bucket_size(payload_len: int, min_bucket_size: int) -> int:
+  """Returns the smallest power of two that is at least `payload_len` and `min_bucket_size`."""
+  return max(min_bucket_size, 1 << max(payload_len - 1, 0).bit_length())
+
+
+class PayloadBroadcaster:
+  """
+  Broadcasts variable-size payloads from process 0 with the two-phase protocol.
+
+  Attributes:
+    max_payload_size: Largest payload in bytes that can be broadcast.
+    header_size: Size in bytes of the first broadcast, including the 4-byte length.
+    min_bucket_size: Smallest padded payload size in bytes of the second broadcast.
+  """
+
+  def __init__(
+      self,
+      max_payload_size: int,
+      header_size: int = 1024,
+      min_bucket_size: int = 4096,
+      broadcast_fn: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+  ):
+    """
+    Args:
+      max_payload_size: Largest payload in bytes that can be broadcast.
+      header_size: Size in bytes of the first broadcast, including the 4-byte
+        length. Smaller payloads are sent within it.
+      min_bucket_size: Smallest padded payload size in bytes of the second broadcast.
+      broadcast_fn: Collective that returns the array of process 0 on every
+        process. Defaults to `multihost_utils.broadcast_one_to_all`, and to no
+        communication at all with a single process.
+    """
+    self.max_payload_size = max_payload_size
+    self.header_size = header_size
+    self.min_bucket_size = min_bucket_size
+    if broadcast_fn is None and jax.process_count() > 1:
+      broadcast_fn = multihost_utils.broadcast_one_to_all
+    self._broadcast_fn = broadcast_fn
+
+  def broadcast(self, payload: Optional[bytes]) -> Optional[bytes]:
+    """
+    Broadcasts `payload` from process 0. Must be called by every process.
+
+    Args:
+      payload: The payload on process 0, or None if there is nothing to send.
+        Ignored on other processes.
+
+    Returns:
+      The payload of process 0, or None if it had nothing to send.
+    """
+    payload = payload or b""
+    if len(payload) > self.max_payload_size:
+      raise ValueError(f"Payload of {len(payload)} bytes exceeds the maximum of {self.max_payload_size} bytes.")
+    if self._broadcast_fn is None:
+      return payload or None
+
+    is_sender = jax.process_index() == 0
+    inline_capacity = self.header_size - _PAYLOAD_LEN.size
+    header = np.zeros(self.header_size, dtype=np.uint8)
+    if is_sender:
+      header[: _PAYLOAD_LEN.size] = np.frombuffer(_PAYLOAD_LEN.pack(len(payload)), dtype=np.uint8)
+      if len(payload) <= inline_capacity:
+        header[_PAYLOAD_LEN.size : _PAYLOAD_LEN.size + len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+    header = np.asarray(self._broadcast_fn(header))
+    (payload_len,) = _PAYLOAD_LEN.unpack_from(header.tobytes())
+    if payload_len == 0:
+      return None
+    if payload_len <= inline_capacity:
+      return header[_PAYLOAD_LEN.size : _PAYLOAD_LEN.size + payload_len].tobytes()
+
+    data = np.zeros(bucket_size(payload_len, self.min_bucket_size), dtype=np.uint8)
+    if is_sender:
+      data[:payload_len] = np.frombuffer(payload, dtype=np.uint8)
+    return np.asarray(self._broadcast_fn(data))[:payload_len].tobytes()
+
+
+class IdleBackoff:
+  """
+  Exponentially growing wait for the main loop while no request is being served.
+
+  Process 0 waits on its request queue, which wakes it as soon as a request
+  arrives, so the wait adds no latency; it only bounds how often an idle server
+  runs an empty broadcast. The wait starts at `min_wait_s` after every busy
+  iteration and doubles up to `max_wait_s` while the server stays idle.
+  """
+
+  def __init__(self, min_wait_s: float = 0.001, max_wait_s: float = 1.0):
+    self.min_wait_s = min_wait_s
+    self.max_wait_s = max_wait_s
+    self._wait_s = min_wait_s
+
+  def next_wait(self) -> float:
+    """Returns the wait of the next idle iteration and backs off further."""
+    wait_s = self._wait_s
+    self._wait_s = min(2 * self._wait_s, self.max_wait_s)
+    return wait_s
+
+  def reset(self):
+    """Called once work arrives, so the next idle period starts with a short wait."""
+    self._wait_s = self.min_wait_s
@@ -18,10 +18,15 @@ inference engine for the API server. It encapsulates the MaxText model,
 tokenizer, and the JAX-based generation logic for both prefill and
 autoregressive decoding steps. It handles batching, sampling, and the
 low-level details of running inference on TPUs.
+
+Besides whole-batch generation (`generate_batch`), the generator exposes a
+slot-level API for continuous batching: `insert_requests` prefills new prompts
+into free decode slots and `step` runs one generate step, returning the streams
+that finished so their slots can be refilled right away.
 """
 
 from io import StringIO
-from typing import Sequence, Optional, List, Union
+from typing import Any, Callable, Sequence, Optional, List, Tuple, Union
 import logging
 import os
 import sys
@@ -35,6 +40,8 @@ import numpy as np
 from dataclasses import dataclass, field
 
 from MaxText import max_utils, maxengine, pyconfig, multimodal_utils, max_logging
+from MaxText.inference.prefix_cache import PrefixCache
+from MaxText.tokenizer import IncrementalDetokenizer, StopSequenceMatcher
 
 # Set TF log level to avoid verbose startup messages.
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
@@ -84,6 +91,20 @@ class Completion:
   completion_token_count: int = 0
 
 
+@dataclass
+class SamplingParams:
+  """Per-prompt generation and sampling parameters."""
+
+  max_tokens: Optional[int] = None
+  logprobs: Optional[int] = None
+  echo: bool = False
+  stop: Optional[Union[str, List[str]]] = None
+  temperature: Optional[float] = None
+  seed: Optional[int] = None
+  top_k: Optional[int] = None
+  top_p: Optional[float] = None
+
+
 @dataclass
 class GenerationStream:
   """Holds the state for a single generation stream within a batch."""
@@ -92,6 +113,11 @@ class GenerationStream:
   tokens: np.ndarray
   true_length: int
   image: Optional[np.ndarray]
+  params: SamplingParams = field(default_factory=SamplingParams)
+  max_steps: int = 0
+  # Set when the request has stop sequences; fed every generated token.
+  detokenizer: Optional[IncrementalDetokenizer] = None
+  stop_matcher: Optional[StopSequenceMatcher] = None
 
   # Output accumulators
   generated_ids: List[int] = field(default_factory=list)
@@ -168,10 +194,19 @@ class MaxTextGenerator:
     self.logger.info("Chat Template available: %s", self.has_chat_template)
 
     self.batch_size = int(self.config.per_device_batch_size * jax.device_count())
+    # Shared system prompts and few-shot examples are prefilled once and then served from this cache.
+    self.prefix_cache = None
+    if self.config.enable_prefix_caching:
+      self.prefix_cache = PrefixCache(
+          self.config.prefill_chunk_size, self.config.prefix_caching_hbm_byte, self.config.prefix_caching_dram_byte
+      )
 
     self.rng, rng_init_decode = jax.random.split(self.rng)
     self.decode_state = self.engine.init_decode_state(rng=rng_init_decode)
     self._jitted_reset_state = jax.jit(lambda state: jax.tree_util.tree_map(jnp.zeros_like, state))
+    # Continuous batching state: the stream decoding in each slot and its caller-defined key.
+    self.slots: List[Optional[GenerationStream]] = [None] * self.batch_size
+    self.slot_keys: List[Any] = [None] * self.batch_size
 
     end_time = time.time()
     self.logger.info(
@@ -190,10 +225,16 @@ class MaxTextGenerator:
       seed: Optional[int] = None,
       top_k: Optional[int] = None,
       top_p: Optional[float] = None,
+      params: Optional[List[SamplingParams]] = None,
   ) -> List[Completion]:
     """
     Generates text for a batch of prompts, handling chunking automatically.
 
+    When `params` is given, every prompt is generated with its own sampling
+    parameters and the scalar keyword arguments are ignored. With
+    `decode_sampling_per_slot` enabled, prompts with different parameters share
+    a decode batch; otherwise they are grouped by identical parameters first.
+
     Args:
         prompts: A list of prompt strings.
         image_paths: An optional list of image paths, one for each prompt.
@@ -205,43 +246,212 @@ class MaxTextGenerator:
         seed: An optional seed for deterministic sampling.
         top_k: An optional integer for top-k sampling.
         top_p: An optional float for nucleus sampling.
+        params: An optional list of SamplingParams, one for each prompt.
 
     Returns:
         A list of generated Completion, corresponding to the input prompts.
     """
+    if self.num_active_slots:
+      raise RuntimeError("generate_batch cannot run while continuous batching slots are decoding.")
     if image_paths is None:
       image_paths = [None] * len(prompts)
     if len(prompts) != len(image_paths):
       raise ValueError("The number of prompts must equal the number of image paths.")
+    if params is None:
+      shared_params = SamplingParams(max_tokens, logprobs, echo, stop, temperature, seed, top_k, top_p)
+      params = [shared_params] * len(prompts)
+    if len(prompts) != len(params):
+      raise ValueError("The number of prompts must equal the number of sampling params.")
+
+    if self.config.decode_sampling_per_slot:
+      groups = [list(range(len(prompts)))]
+    else:
+      groups = self._group_by_params(params)
+
+    all_results = [None] * len(prompts)
+    for indices in groups:
+      for i in range(0, len(indices), self.batch_size):
+        chunk_indices = indices[i : i + self.batch_size]
+        chunk_results = self._process_chunk(
+            [prompts[j] for j in chunk_indices],
+            [image_paths[j] for j in chunk_indices],
+            [params[j] for j in chunk_indices],
+        )
+        for j, completion in zip(chunk_indices, chunk_results):
+          completion.index = j
+          all_results[j] = completion
+
+    return all_results
+
+  def _group_by_params(self, params: List[SamplingParams]) -> List[List[int]]:
+    """Groups prompt indices by identical sampling params, preserving first-seen order."""
+    groups = []
+    for i, p in enumerate(params):
+      for group_params, indices in groups:
+        if group_params == p:
+          indices.append(i)
+          break
+      else:
+        groups.append((p, [i]))
+    return [indices for _, indices in groups]
+
+  # ----------------------------
+  # Continuous batching
+  # ----------------------------
+
+  def reset_slots(self) -> List[Any]:
+    """
+    Clears every decode slot for continuous batching.
+
+    Called once before continuous batching starts and again to recover after a
+    failed step.
+
+    Returns:
+        The keys of the streams that were still decoding and got dropped.
+    """
+    dropped = [key for key, stream in zip(self.slot_keys, self.slots) if stream is not None]
+    for slot_idx, stream in enumerate(self.slots):
+      if stream is not None and getattr(self.config, "attention", "") == "paged":
+        self.engine.release_pages(slot=slot_idx)
+    self.decode_state = self._jitted_reset_state(self.decode_state)
+    self.slots = [None] * self.batch_size
+    self.slot_keys = [None] * self.batch_size
+    return dropped
+
+  @property
+  def num_free_slots(self) -> int:
+    return sum(stream is None for stream in self.slots)
+
+  @property
+  def num_active_slots(self) -> int:
+    return self.batch_size - self.num_free_slots
+
+  def shares_sampling(self, params: SamplingParams, other: SamplingParams) -> bool:
+    """
+    Whether prompts with `params` and `other` can decode in the same batch.
+
+    Without `decode_sampling_per_slot` the engine samples all slots with one set
+    of parameters and one RNG, so the prompts must agree on temperature, top-k,
+    top-p and seed.
+    """
+    if self.config.decode_sampling_per_slot:
+      return True
+    return (params.temperature, params.top_k, params.top_p, params.seed) == (
+        other.temperature,
+        other.top_k,
+        other.top_p,
+        other.seed,
+    )
 
-    all_results = []
-    num_prompts = len(prompts)
-    for i in range(0, num_prompts, self.batch_size):
-      prompt_chunk = prompts[i : i + self.batch_size]
-      image_chunk = image_paths[i : i + self.batch_size]
+  def can_admit(self, params: SamplingParams) -> bool:
+    """Whether a prompt with `params` can be inserted next to the streams that are decoding."""
+    if self.num_free_slots == 0:
+      return False
+    active = next((stream.params for stream in self.slots if stream is not None), None)
+    return active is None or self.shares_sampling(params, active)
 
-      # chunk_count = (i // self.batch_size) + 1
-      # total_chunks = (num_prompts + self.batch_size - 1) // self.batch_size
+  def insert_requests(
+      self,
+      keys: List[Any],
+      prompts: List[Union[str, List[int]]],
+      params: List[SamplingParams],
+      image_paths: Optional[List[Optional[str]]] = None,
+      on_token: Optional[Callable[[Any, int], None]] = None,
+  ) -> List[Tuple[Any, Completion]]:
+    """
+    Prefills prompts into free decode slots without disturbing the streams that are decoding.
 
-      chunk_results = self._process_chunk(
-          prompt_chunk, image_chunk, max_tokens, logprobs, echo, stop, temperature, seed, top_k, top_p
+    Args:
+        keys: Caller-defined identifiers, returned with the completion of each prompt.
+        prompts: A list of prompt strings, or of prompt token IDs from `encode_prompt`.
+        params: A list of SamplingParams, one for each prompt.
+        image_paths: An optional list of image paths, one for each prompt.
+        on_token: An optional callback invoked as `on_token(key, token_id)` with
+          the first generated token of every prompt, e.g. for streaming.
+
+    Returns:
+        (key, Completion) pairs for prompts that finished on their prefill token.
+    """
+    if image_paths is None:
+      image_paths = [None] * len(prompts)
+    if not len(keys) == len(prompts) == len(params) == len(image_paths):
+      raise ValueError("keys, prompts, params and image paths must have the same length.")
+    if len(prompts) > self.num_free_slots:
+      raise ValueError(f"Cannot insert {len(prompts)} prompts into {self.num_free_slots} free slots.")
+    active = [stream.params for stream in self.slots if stream is not None]
+    if params and not all(self.shares_sampling(p, (active or params)[0]) for p in params):
+      raise ValueError(
+          "Without decode_sampling_per_slot, prompts that decode together must share temperature, top_k, top_p and seed."
       )
-      all_results.extend(chunk_results)
+    # Without per-slot sampling the batch shares one RNG, seeded by the first prompt of an empty batch.
+    if params and not active and params[0].seed is not None and not self.config.decode_sampling_per_slot:
+      self.rng = jax.random.PRNGKey(params[0].seed)
+
+    finished = []
+    free_slots = [i for i, stream in enumerate(self.slots) if stream is None]
+    for key, prompt, image_path, p in zip(keys, prompts, image_paths, params):
+      stream = self._make_stream(prompt, image_path, p)
+      if p.max_tokens is not None and p.max_tokens <= 0:
+        finished.append((key, self._build_completion(0, stream)))
+        continue
+
+      slot = free_slots.pop(0)
+      self.rng, rng_prefill = jax.random.split(self.rng)
+      prefix = self._prefill_stream(stream, slot, rng_prefill)
+      if on_token is not None:
+        on_token(key, stream.generated_ids[-1])
+      if stream.finished:
+        if getattr(self.config, "attention", "") == "paged":
+          self.engine.release_pages(slot=slot)
+        finished.append((key, self._build_completion(0, stream)))
+        free_slots.insert(0, slot)
+        continue
+
+      self.decode_state = self.engine.insert(prefix=prefix, decode_state=self.decode_state, slot=slot)
+      self.slots[slot] = stream
+      self.slot_keys[slot] = key
+    return finished
+
+  def step(self, on_token: Optional[Callable[[Any, int], None]] = None) -> List[Tuple[Any, Completion]]:
+    """
+    Runs one generate step over the decode slots and frees the slots of finished streams.
 
-    return all_results
+    Args:
+        on_token: An optional callback invoked as `on_token(key, token_id)` with
+          the token generated for every active stream, e.g. for streaming.
+
+    Returns:
+        (key, Completion) pairs for the streams that finished on this step.
+    """
+    active_streams = [(i, stream) for i, stream in enumerate(self.slots) if stream is not None]
+    if not active_streams:
+      return []
+
+    self.rng, rng_generate = jax.random.split(self.rng)
+    self.decode_state, state_tokens, state_logp_np = self._generate_step(
+        self.decode_state, rng_generate, active_streams[0][1].params
+    )
+
+    finished = []
+    for slot_idx, stream in active_streams:
+      logp = None if state_logp_np is None else state_logp_np[slot_idx, 0]
+      tok_id = int(state_tokens[slot_idx, 0])
+      is_finished = self._append_token(stream, tok_id, logp)
+      if on_token is not None:
+        on_token(self.slot_keys[slot_idx], tok_id)
+      if is_finished:
+        if getattr(self.config, "attention", "") == "paged":
+          self.engine.release_pages(slot=slot_idx)
+        finished.append((self.slot_keys[slot_idx], self._build_completion(0, stream)))
+        self.slots[slot_idx] = None
+        self.slot_keys[slot_idx] = None
+    return finished
 
   def _process_chunk(
       self,
       prompts: List[str],
       image_paths: List[Optional[str]],
-      max_tokens: int,
-      logprobs: int = None,
-      echo: bool = False,
-      stop: Optional[Union[str, List[str]]] = None,
-      temperature: Optional[float] = None,
-      seed: Optional[int] = None,
-      top_k: Optional[int] = None,
-      top_p: Optional[float] = None,
+      params: List[SamplingParams],
   ) -> List[Completion]:
     """Orchestrates the generation process for a single chunk of prompts."""
     start_time = time.time()
@@ -252,7 +462,7 @@ class MaxTextGenerator:
     initialize_start_time = time.time()
     # Reset the state to handle the new batch while reusing memory.
     self.decode_state = self._jitted_reset_state(self.decode_state)
-    streams, rng = self._initialize_streams_and_state(prompts, image_paths, seed)
+    streams, rng = self._initialize_streams_and_state(prompts, image_paths, params)
     initialize_end_time = time.time()
     self.logger.info(
         "Initialization complete in %.2f seconds. Max batch size: %d",
@@ -260,26 +470,22 @@ class MaxTextGenerator:
         self.batch_size,
     )
 
-    if max_tokens is not None and max_tokens <= 0:
+    if all(s.params.max_tokens is not None and s.params.max_tokens <= 0 for s in streams):
       self.logger.warning("max_tokens <= 0, returning empty completions.")
       return [Completion(index=i, text="", tokens=[], logprobs=None) for i in range(len(streams))]
 
     prefill_start_time = time.time()
-    self.decode_state, rng = self._run_prefill_step(
-        streams, self.decode_state, rng, logprobs, echo, temperature, top_k, top_p
-    )
+    self.decode_state, rng = self._run_prefill_step(streams, self.decode_state, rng)
     prefill_end_time = time.time()
     self.logger.info("Prefill step took %.2fs.", prefill_end_time - prefill_start_time)
 
     generation_start_time = time.time()
-    self.decode_state = self._run_generation_loop(
-        streams, self.decode_state, rng, max_tokens, stop, temperature, top_k, top_p
-    )
+    self.decode_state = self._run_generation_loop(streams, self.decode_state, rng)
     generation_end_time = time.time()
     self.logger.info("Generation loop took %.2fs.", generation_end_time - generation_start_time)
 
     completions_start_time = time.time()
-    completions = self._build_completions(streams, logprobs, echo)
+    completions = self._build_completions(streams)
     completions_end_time = time.time()
     self.logger.info("Completions loop took %.2fs.", completions_end_time - completions_start_time)
 
@@ -287,22 +493,37 @@ class MaxTextGenerator:
     self.logger.info("Processed %d prompts in %.2fs.", len(prompts), end_time - start_time)
     return completions
 
-  def _initialize_streams_and_state(self, prompts, image_paths, seed):
+  def _initialize_streams_and_state(self, prompts, image_paths, params):
     """Tokenizes inputs, sets up stream objects, and initializes the decode state."""
-    prefill_length = getattr(self.config, "max_prefill_predict_length", 1024)
-    streams = []
-    for prompt, image_path in zip(prompts, image_paths):
-      toks, tlen, imgs = self._preprocess_inputs(prompt, prefill_length, image_path)
-      assert tlen <= prefill_length, f"Input token length {tlen} is > {prefill_length}"
-      streams.append(GenerationStream(tokens=toks, true_length=tlen, image=imgs))
+    streams = [self._make_stream(prompt, image_path, p) for prompt, image_path, p in zip(prompts, image_paths, params)]
 
-    if seed is not None:
+    # Per-slot sampling seeds each slot in the engine; otherwise the chunk shares one set of params.
+    seed = params[0].seed
+    if seed is not None and not self.config.decode_sampling_per_slot:
       rng = jax.random.PRNGKey(seed)
     else:
       self.rng, rng = jax.random.split(self.rng)
 
     return streams, rng
 
+  def _make_stream(self, prompt, image_path, params):
+    """Tokenizes one input and sets up its stream object, including its stop sequences and step budget."""
+    prefill_length = getattr(self.config, "max_prefill_predict_length", 1024)
+    target_length = getattr(self.config, "max_target_length", 2048)
+    toks, tlen, imgs = self._preprocess_inputs(prompt, prefill_length, image_path)
+    assert tlen <= prefill_length, f"Input token length {tlen} is > {prefill_length}"
+
+    max_steps = target_length - prefill_length
+    if params.max_tokens is not None:
+      max_steps = min(max_steps, params.max_tokens - 1)  # -1 for the token from prefill
+    stream = GenerationStream(tokens=toks, true_length=tlen, image=imgs, params=params, max_steps=max_steps)
+    stop_sequences = [s for s in ([params.stop] if isinstance(params.stop, str) else params.stop or []) if s]
+    if stop_sequences:
+      stream.detokenizer = IncrementalDetokenizer(self.tokenizer, skip_token_ids=self.eos_ids)
+      stream.stop_matcher = StopSequenceMatcher(stop_sequences)
+    stream.finished = max_steps <= 0
+    return stream
+
   def _determine_sampling_algorithm(self, temperature, top_k, top_p):
     """Determines the sampling algorithm based on user-provided parameters."""
     if temperature == 0.0:
@@ -319,69 +540,93 @@ class MaxTextGenerator:
     # engine use its default configured `decode_sampling_strategy`.
     return None
 
-  def _run_prefill_step(self, streams, decode_state, rng, logprobs, echo, temperature, top_k, top_p):
+  def _run_prefill_step(self, streams, decode_state, rng):
     """Runs the prefill step for each stream and inserts results into the decode state."""
-    sampling_algorithm = self._determine_sampling_algorithm(temperature, top_k, top_p)
     prefill_results_to_insert = {}
 
     for i, stream in enumerate(streams):
       rng, rng_prefill = jax.random.split(rng)
-      want_prompt_logp = logprobs is not None and echo
+      prefill_results_to_insert[i] = self._prefill_stream(stream, i, rng_prefill)
+
+    for slot_idx, result in prefill_results_to_insert.items():
+      decode_state = self.engine.insert(prefix=result, decode_state=decode_state, slot=slot_idx)
+
+    return decode_state, rng
 
+  def _prefill_stream(self, stream, slot, rng):
+    """Prefills one stream for `slot` and records its prompt and first generated token."""
+    p = stream.params
+    want_prompt_logp = p.logprobs is not None and p.echo
+
+    sampling_kwargs = {
+        "temperature": p.temperature,
+        "algorithm": self._determine_sampling_algorithm(p.temperature, p.top_k, p.top_p),
+        "topk": p.top_k,
+        "nucleus_topp": p.top_p,
+        "seed": p.seed,
+    }
+    if self.prefix_cache is not None and stream.image is None:
+      prefill_result, _ = self.engine.prefill_with_prefix_cache(
+          params=self.params,
+          prefix_cache=self.prefix_cache,
+          tokens=stream.tokens[: stream.true_length],
+          rng=rng,
+          slot=slot,
+          return_prompt_logp=want_prompt_logp,
+          **sampling_kwargs,
+      )
+    else:
       prefill_result, _ = self.engine.prefill(
           params=self.params,
           padded_tokens=stream.tokens,
           true_length=stream.true_length,
           images=stream.image,
-          rng=rng_prefill,
-          slot=i,
+          rng=rng,
+          slot=slot,
           return_prompt_logp=want_prompt_logp,
-          temperature=temperature,
-          algorithm=sampling_algorithm,
-          topk=top_k,
-          nucleus_topp=top_p,
+          **sampling_kwargs,
       )
-      prefill_results_to_insert[i] = prefill_result
-
-      p_ids = list(map(int, np.array(stream.tokens[: stream.true_length], dtype=np.int32).tolist()))
-      stream.prompt_ids.extend(p_ids)
-      if prefill_result.get("prompt_logp") is not None:
-        p_logp_arr = np.array(prefill_result["prompt_logp"])[0, : stream.true_length]
-        stream.prompt_logprobs.extend([float(x) for x in p_logp_arr.tolist()])
 
-      first_token_id = int(np.array(prefill_result["tokens"])[0, 0])
-      stream.generated_ids.append(first_token_id)
-      if prefill_result.get("token_logp") is not None:
-        first_logp = float(np.array(prefill_result["token_logp"])[0, 0])
-        stream.generated_logprobs.append(first_logp)
-
-    for slot_idx, result in prefill_results_to_insert.items():
-      decode_state = self.engine.insert(prefix=result, decode_state=decode_state, slot=slot_idx)
+    p_ids = list(map(int, np.array(stream.tokens[: stream.true_length], dtype=np.int32).tolist()))
+    stream.prompt_ids.extend(p_ids)
+    if want_prompt_logp and prefill_result.get("prompt_logp") is not None:
+      p_logp_arr = np.array(prefill_result["prompt_logp"])[0, : stream.true_length]
+      stream.prompt_logprobs.extend([float(x) for x in p_logp_arr.tolist()])
+
+    first_token_id = int(np.array(prefill_result["tokens"])[0, 0])
+    stream.generated_ids.append(first_token_id)
+    if prefill_result.get("token_logp") is not None:
+      first_logp = float(np.array(prefill_result["token_logp"])[0, 0])
+      stream.generated_logprobs.append(first_logp)
+    if self._stop_sequence_found(stream, first_token_id):
+      stream.finished = True
+      stream.finish_reason = "stop"
+
+    return prefill_result
+
+  def _generate_step(self, decode_state, rng, shared):
+    """Runs one engine generate step and returns the decode state with host copies of tokens and logprobs."""
+    decode_state, _ = self.engine.generate(
+        self.params,
+        decode_state,
+        rng=rng,
+        temperature=shared.temperature,
+        algorithm=self._determine_sampling_algorithm(shared.temperature, shared.top_k, shared.top_p),
+        topk=shared.top_k,
+        nucleus_topp=shared.top_p,
+    )
 
-    return decode_state, rng
+    state_tokens = np.array(decode_state["tokens"])
+    state_logp_np = None
+    if (logp := decode_state.get("token_logp")) is not None:
+      state_logp_np = np.array(logp)
+    return decode_state, state_tokens, state_logp_np
 
-  def _run_generation_loop(self, streams, decode_state, rng, max_tokens, stop, temperature, top_k, top_p):
+  def _run_generation_loop(self, streams, decode_state, rng):
     """Runs the autoregressive generation loop."""
-    target_length = getattr(self.config, "max_target_length", 2048)
-    prefill_length = getattr(self.config, "max_prefill_predict_length", 1024)
-    sampling_algorithm = self._determine_sampling_algorithm(temperature, top_k, top_p)
-
-    stop_sequences = []
-    max_stop_seq_len_tokens = 0
-    if stop:
-      # Ensure stop is a list of non-empty strings
-      stop_sequences = [s for s in ([stop] if isinstance(stop, str) else stop) if s]
-      if stop_sequences:
-        # Calculate the max token length for any stop sequence to define a lookback window.
-        for seq in stop_sequences:
-          # Use the underlying tokenizer here to avoid potential errors with the wrapper
-          # on single-token sequences, as this is a safe, internal calculation.
-          token_ids = self.tokenizer.tokenizer.encode(seq, add_special_tokens=False)
-          max_stop_seq_len_tokens = max(max_stop_seq_len_tokens, len(token_ids))
-
-    total_steps = target_length - prefill_length
-    if max_tokens is not None:
-      total_steps = min(total_steps, max_tokens - 1)  # -1 for the token from prefill
+    # Used only when the engine does not sample per slot, in which case all streams share the same params.
+    shared = streams[0].params
+    total_steps = max((s.max_steps for s in streams), default=0)
 
     for step in range(total_steps):
       self.logger.debug("Generation step %d/%d", step + 1, total_steps)
@@ -391,107 +636,109 @@ class MaxTextGenerator:
         break
 
       rng, rng_generate = jax.random.split(rng)
-      decode_state, _ = self.engine.generate(
-          self.params,
-          decode_state,
-          rng=rng_generate,
-          temperature=temperature,
-          algorithm=sampling_algorithm,
-          topk=top_k,
-          nucleus_topp=top_p,
-      )
-
-      state_tokens = np.array(decode_state["tokens"])
-      state_logp_np = None
-      if (logp := decode_state.get("token_logp")) is not None:
-        state_logp_np = np.array(logp)
+      decode_state, state_tokens, state_logp_np = self._generate_step(decode_state, rng_generate, shared)
 
       for slot_idx, stream in active_streams:
-        tok_id = int(state_tokens[slot_idx, 0])
-        stream.generated_ids.append(tok_id)
-        if state_logp_np is not None:
-          stream.generated_logprobs.append(float(state_logp_np[slot_idx, 0]))
-
-        # Check for finish conditions
-        current_len = stream.true_length + 1 + step
-        is_max_len = current_len >= target_length
-        is_eos = tok_id in self.eos_ids
-        stop_sequence_found = False
-
-        if stop_sequences:
-          # Define a lookback window for decoding that is slightly larger
-          # than the longest stop sequence in tokens.
-          lookback_window = max_stop_seq_len_tokens + 2
-          start_index = max(0, len(stream.generated_ids) - lookback_window)
-          trailing_ids = stream.generated_ids[start_index:]
-
-          if trailing_ids:
-            # Use the standard jetstream wrapper for decoding as requested.
-            trailing_text = self.tokenizer.decode([int(tid) for tid in trailing_ids])
-            stop_sequence_found = next(
-                (
-                    True
-                    for stop_seq in stop_sequences
-                    # Use 'in' for a more robust check.
-                    if stop_seq in trailing_text
-                ),
-                False,
-            )
-
-        if is_max_len or is_eos or stop_sequence_found:
-          stream.finished = True
-          if is_eos or stop_sequence_found:
-            stream.finish_reason = "stop"
+        logp = None if state_logp_np is None else state_logp_np[slot_idx, 0]
+        if self._append_token(stream, int(state_tokens[slot_idx, 0]), logp):
           if getattr(self.config, "attention", "") == "paged":
             self.engine.release_pages(slot=slot_idx)
 
     return decode_state
 
-  def _build_completions(self, streams, logprobs, echo):
+  def _append_token(self, stream, tok_id, logp=None) -> bool:
+    """Appends a generated token to `stream` and returns whether the stream just finished."""
+    target_length = getattr(self.config, "max_target_length", 2048)
+    stream.generated_ids.append(tok_id)
+    if logp is not None:
+      stream.generated_logprobs.append(float(logp))
+
+    # Check for finish conditions
+    step = len(stream.generated_ids) - 2  # The first generated token comes from prefill.
+    current_len = stream.true_length + 1 + step
+    is_max_len = current_len >= target_length or step + 1 >= stream.max_steps
+    is_eos = tok_id in self.eos_ids
+    stop_sequence_found = self._stop_sequence_found(stream, tok_id)
+
+    if is_max_len or is_eos or stop_sequence_found:
+      stream.finished = True
+      if is_eos or stop_sequence_found:
+        stream.finish_reason = "stop"
+    return stream.finished
+
+  def _stop_sequence_found(self, stream, tok_id) -> bool:
+    """Feeds the text of `tok_id` to the stream's stop matcher and returns whether a stop sequence completed."""
+    if stream.stop_matcher is None:
+      return False
+    return stream.stop_matcher.feed(stream.detokenizer.add(tok_id)) != -1
+
+  def _build_completions(self, streams):
     """Builds the final Completion objects from the generated stream states."""
-    completions = []
-    for i, stream in enumerate(streams):
-      gen_ids_for_text = stream.generated_ids[:]
-      gen_logps_for_text = stream.generated_logprobs[:]
-
-      if gen_ids_for_text and gen_ids_for_text[-1] in self.eos_ids:
-        gen_ids_for_text = gen_ids_for_text[:-1]
-        if len(gen_logps_for_text) >= len(stream.generated_ids):
-          gen_logps_for_text = gen_logps_for_text[:-1]
-
-      tokens_for_text = stream.prompt_ids + gen_ids_for_text if echo else gen_ids_for_text
-      logps_for_text = stream.prompt_logprobs + gen_logps_for_text if echo else gen_logps_for_text
-
-      text = self.tokenizer.decode(tokens_for_text)
-      offsets = self._token_offsets(tokens_for_text, 0)
-
-      lp_payload = None
-      if logprobs is not None:
-        if len(tokens_for_text) != len(logps_for_text):
-          self.logger.warning("[warn] Mismatched token/logprob lengths for stream %d. No logprobs returned.", i)
-        else:
-          lp_payload = LogProbs(
-              tokens=tokens_for_text,
-              token_logprobs=logps_for_text,
-              top_logprobs=None,
-              text_offset=offsets,
-          )
-
-      completions.append(
-          Completion(
-              index=i,
-              text=text,
-              tokens=tokens_for_text,
-              logprobs=lp_payload,
-              finish_reason=stream.finish_reason,
-              prompt_token_count=len(stream.prompt_ids),
-              completion_token_count=len(gen_ids_for_text),
-          )
-      )
-    return completions
+    return [self._build_completion(i, stream) for i, stream in enumerate(streams)]
+
+  def _build_completion(self, i, stream):
+    """Builds the Completion object of a single finished stream."""
+    logprobs, echo = stream.params.logprobs, stream.params.echo
+    if stream.params.max_tokens is not None and stream.params.max_tokens <= 0:
+      return Completion(index=i, text="", tokens=[], logprobs=None)
+    gen_ids_for_text = stream.generated_ids[:]
+    gen_logps_for_text = stream.generated_logprobs[:]
+
+    if gen_ids_for_text and gen_ids_for_text[-1] in self.eos_ids:
+      gen_ids_for_text = gen_ids_for_text[:-1]
+      if len(gen_logps_for_text) >= len(stream.generated_ids):
+        gen_logps_for_text = gen_logps_for_text[:-1]
+
+    tokens_for_text = stream.prompt_ids + gen_ids_for_text if echo else gen_ids_for_text
+    logps_for_text = stream.prompt_logprobs + gen_logps_for_text if echo else gen_logps_for_text
+
+    text = self.tokenizer.decode(tokens_for_text)
+    offsets = None
+    if logprobs is not None:
+      detokenizer = IncrementalDetokenizer(self.tokenizer)
+      for tid in tokens_for_text:
+        detokenizer.add(tid)
+      detokenizer.flush()
+      offsets = detokenizer.offsets
+
+    lp_payload = None
+    if logprobs is not None:
+      if len(tokens_for_text) != len(logps_for_text):
+        self.logger.warning("[warn] Mismatched token/logprob lengths for stream %d. No logprobs returned.", i)
+      else:
+        lp_payload = LogProbs(
+            tokens=tokens_for_text,
+            token_logprobs=logps_for_text,
+            top_logprobs=None,
+            text_offset=offsets,
+        )
+
+    return Completion(
+        index=i,
+        text=text,
+        tokens=tokens_for_text,
+        logprobs=lp_payload,
+        finish_reason=stream.finish_reason,
+        prompt_token_count=len(stream.prompt_ids),
+        completion_token_count=len(gen_ids_for_text),
+    )
+
+  def encode_prompt(self, prompt: str) -> List[int]:
+    """Tokenizes a text prompt, e.g. once on the coordinator before broadcasting it as token IDs."""
+    prefill_length = getattr(self.config, "max_prefill_predict_length", 1024)
+    tokens, true_length = self.tokenizer.encode(
+        prompt, is_bos=not self.has_chat_template, prefill_lengths=[prefill_length]
+    )
+    return [int(t) for t in np.asarray(tokens)[:true_length]]
 
   def _preprocess_inputs(self, text, prefill_length, image_path):
-    """Helper to preprocess a single text and optional image input."""
+    """Helper to preprocess a single text, or the token IDs of `encode_prompt`, and optional image input."""
+    if not isinstance(text, str):
+      true_length = len(text)
+      tokens = np.full((max(prefill_length, true_length),), self.tokenizer.pad_id, dtype=np.int32)
+      tokens[:true_length] = text
+      return tokens, true_length, None
+
     processor_output = multimodal_utils.PreprocessorOutput()
     images = None
     if self.config.use_multimodal and image_path:
@@ -521,27 +768,6 @@ class MaxTextGenerator:
     assert config.quantization != "nanoo_fp8", "NANOO fp8 on AMD MI300/MI325 GPUs is not supported in decode.py yet"
     assert config.per_device_batch_size * jax.device_count() >= 1, "Total batch size must be at least 1."
 
-  def _token_offsets(self, token_ids: List[int], start: int = 0) -> List[int]:
-    """
-    Compute char offsets by decoding cumulatively so context-dependent
-    whitespace/normalization is handled correctly (SentencePiece/LLaMA quirk).
-    """
-    offsets: List[int] = []
-    pos = start
-    decoded_so_far = ""
-    prefix_ids: List[int] = []
-    for tid in token_ids:
-      offsets.append(pos)
-      prefix_ids.append(int(tid))
-      new_text = self.tokenizer.decode(prefix_ids)
-      piece_len = len(new_text) - len(decoded_so_far)
-      # Guard for weird edge cases; shouldn't happen but better safe:
-      if piece_len < 0:
-        piece_len = len(self.tokenizer.decode([int(tid)]))
-      pos += piece_len
-      decoded_so_far = new_text
-    return offsets
-
 
 def main():
   def dump_completion(i, comp):
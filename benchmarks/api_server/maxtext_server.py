@@ -18,12 +18,14 @@ This script implements an OpenAI-compatible API server for MaxText models.
 It uses FastAPI to create endpoints for `/v1/completions` and
 `/v1/chat/completions`. The server runs in a multi-process JAX environment,
 with the coordinator process (rank 0) managing the web server and all
-processes participating in a batched inference loop to handle incoming
-requests efficiently.
+processes participating in a continuous-batching inference loop: new
+requests are inserted into free decode slots between generate steps and
+finished ones are returned right away.
 """
 
 from typing import Union
 import asyncio
+import collections
 import json
 import logging
 import os
@@ -36,10 +38,9 @@ import uuid
 import uvicorn
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 
 import jax
-import jax.numpy as jnp
-from jax.experimental import multihost_utils
 
 from openai_harmony import (
     load_harmony_encoding,
@@ -47,7 +48,7 @@ from openai_harmony import (
     Role,
 )
 
-from benchmarks.api_server.maxtext_generator import MaxTextGenerator
+from benchmarks.api_server.maxtext_generator import MaxTextGenerator, SamplingParams
 from benchmarks.api_server.server_models import (
     CompletionRequest,
     CompletionResponse,
@@ -57,7 +58,13 @@ from benchmarks.api_server.server_models import (
     ChatCompletionResponse,
     ChatCompletionChoice,
     ChatMessage,
+    CompletionStreamResponse,
+    CompletionStreamChoice,
+    ChatCompletionChunk,
+    ChatCompletionStreamChoice,
+    ChatCompletionDelta,
 )
+from benchmarks.api_server import broadcast_utils
 from benchmarks.api_server import server_utils
 
 # ----------------------------
@@ -95,8 +102,24 @@ request_queue = queue.Queue()
 response_dict = {}
 response_lock = threading.Lock()
 
+# Per-request event queues of streaming requests, keyed by request_id. Each entry
+# is (event_loop, asyncio.Queue); the main loop feeds it from its own thread.
+stream_queues = {}
+stream_lock = threading.Lock()
+# Time-to-first-token and inter-token latency of all requests.
+metrics = server_utils.LatencyMetrics()
+
+# Continuous batching state, owned by the main loop on rank 0.
+# Prompts waiting for a free decode slot, in arrival order.
+pending_prompts = collections.deque()
+# Requests with prompts still pending or decoding, keyed by request_id.
+inflight_requests = {}
+
 # Batching configuration
-BATCH_TIMEOUT_S = 0.1  # 100ms
+# An idle main loop waits for a new request for IDLE_WAIT_MIN_S, doubling up to
+# IDLE_WAIT_MAX_S while it stays idle. A new request ends the wait right away.
+IDLE_WAIT_MIN_S = 0.01  # 10ms
+IDLE_WAIT_MAX_S = 1.0
 # Timeout for a client waiting for a response.
 REQUEST_TIMEOUT_S = int(os.environ.get("MAXTEXT_REQUEST_TIMEOUT_S", "36000"))
 
@@ -121,7 +144,7 @@ async def _queue_and_wait_for_response(request: Union[CompletionRequest, ChatCom
                      during processing (500).
   """
   request_id = f"req_{uuid.uuid4().hex}"
-  request_queue.put((request_id, request))
+  request_queue.put((request_id, request, time.time()))
 
   start_time = time.time()
   while time.time() - start_time < REQUEST_TIMEOUT_S:
@@ -137,18 +160,112 @@ async def _queue_and_wait_for_response(request: Union[CompletionRequest, ChatCom
   raise HTTPException(status_code=504, detail="Request timed out.")
 
 
+def _sse(data) -> str:
+  """Formats a pydantic model or dict as a server-sent event."""
+  payload = data.model_dump_json() if hasattr(data, "model_dump_json") else json.dumps(data)
+  return f"data: {payload}\n\n"
+
+
+def _stream_chunk(request, response_id, index, text, finish_reason=None, role=None):
+  """Builds one streamed chunk for a completion or chat completion request."""
+  if isinstance(request, ChatCompletionRequest):
+    return ChatCompletionChunk(
+        id=response_id,
+        model=request.model,
+        choices=[
+            ChatCompletionStreamChoice(
+                index=index, delta=ChatCompletionDelta(role=role, content=text), finish_reason=finish_reason
+            )
+        ],
+    )
+  return CompletionStreamResponse(
+      id=response_id,
+      model=request.model,
+      choices=[CompletionStreamChoice(text=text, index=index, finish_reason=finish_reason)],
+  )
+
+
+async def _stream_response(request: Union[CompletionRequest, ChatCompletionRequest]):
+  """
+  Puts a streaming request on the processing queue and yields its tokens as server-sent events.
+
+  The main loop pushes `("chunk", index, text, finish_reason)` events for every
+  decode step that produced new text, `("done",)` once all prompts finished and
+  `("error", message)` on failure. The stream ends with `data: [DONE]`.
+  Log probabilities are not streamed.
+
+  Args:
+      request: The incoming request object, either for a completion or a chat completion.
+
+  Yields:
+      Server-sent event strings.
+  """
+  request_id = f"req_{uuid.uuid4().hex}"
+  is_chat = isinstance(request, ChatCompletionRequest)
+  response_id = f"chatcmpl-{uuid.uuid4().hex}" if is_chat else f"cmpl-{uuid.uuid4().hex}"
+  events = asyncio.Queue()
+  with stream_lock:
+    stream_queues[request_id] = (asyncio.get_running_loop(), events)
+  request_queue.put((request_id, request, time.time()))
+
+  try:
+    if is_chat:
+      yield _sse(_stream_chunk(request, response_id, 0, "", role="assistant"))
+    while True:
+      event = await asyncio.wait_for(events.get(), timeout=REQUEST_TIMEOUT_S)
+      if event[0] == "done":
+        break
+      if event[0] == "error":
+        yield _sse({"error": {"message": event[1]}})
+        break
+      _, index, text, finish_reason = event
+      yield _sse(_stream_chunk(request, response_id, index, text, finish_reason))
+  except asyncio.TimeoutError:
+    yield _sse({"error": {"message": "Request timed out."}})
+  finally:
+    with stream_lock:
+      stream_queues.pop(request_id, None)
+  yield "data: [DONE]\n\n"
+
+
+def _push_stream_event(request_id, event):
+  """Hands a streaming event to the request's event loop; a no-op if the client went away."""
+  with stream_lock:
+    target = stream_queues.get(request_id)
+  if target is None:
+    return
+  loop, events = target
+  try:
+    loop.call_soon_threadsafe(events.put_nowait, event)
+  except RuntimeError:
+    pass  # The event loop is closed.
+
+
 @app.post("/v1/completions", response_model=CompletionResponse)
 async def create_completion(request: CompletionRequest):
-  """Handles completion requests with dynamic batching."""
+  """Handles completion requests with dynamic batching, streamed as server-sent events if `stream` is set."""
+  if request.stream:
+    return StreamingResponse(_stream_response(request), media_type="text/event-stream")
   return await _queue_and_wait_for_response(request)
 
 
 @app.post("/v1/chat/completions", response_model=ChatCompletionResponse)
 async def create_chat_completion(request: ChatCompletionRequest):
-  """Handles chat completion requests with dynamic batching."""
+  """Handles chat completion requests with dynamic batching, streamed as server-sent events if `stream` is set."""
+  if request.stream:
+    return StreamingResponse(_stream_response(request), media_type="text/event-stream")
   return await _queue_and_wait_for_response(request)
 
 
+@app.get("/metrics")
+def get_metrics():
+  """Reports time-to-first-token and inter-token latency over recent tokens, and prefix cache counters."""
+  summary = metrics.summary()
+  if LLM.prefix_cache is not None:
+    summary["prefix_cache"] = LLM.prefix_cache.stats.summary()
+  return summary
+
+
 @app.get("/")
 def health_check():
   """
@@ -165,9 +282,10 @@ def run_server():
   uvicorn.run(app, host="0.0.0.0", port=8000)
 
 
-# Define a maximum size for the request payload to be broadcasted.
-# This avoids broadcasting variable-sized arrays, which can be complex.
+# Maximum size of the admitted prompts broadcast in one main loop iteration.
+# Payloads are padded to power-of-two buckets, see `broadcast_utils`.
 MAX_REQUEST_SIZE = 65536 * 10
+broadcaster = broadcast_utils.PayloadBroadcaster(MAX_REQUEST_SIZE)
 
 
 def _build_chat_completion_response(request, completion_result, llm):
@@ -265,119 +383,238 @@ def _create_response(request, completions, prompts, is_chat, llm):
     return _build_completion_response(request, completions, prompts, llm)
 
 
-def _collect_batched_requests():
-  """Waits for and collects a batch of requests from the queue."""
-  batched_items = []
-  start_time = time.time()
-  while len(batched_items) < LLM.batch_size and (time.time() - start_time) < BATCH_TIMEOUT_S:
-    try:
-      item = request_queue.get(timeout=0.01)
-      batched_items.append(item)
-    except queue.Empty:
-      if batched_items:
-        break  # Process what we have if timeout is reached
-  return batched_items
-
-
-def _prepare_batch_for_broadcast(batched_items):
-  """Prepares the batch payload and request map for broadcasting."""
-  _, first_request = batched_items[0]
-
+def _sampling_params_for_request(request):
+  """Extracts the generation parameters of a single request as a JSON-serializable dict."""
   logprobs_param = None
-  if isinstance(first_request, ChatCompletionRequest):
-    if first_request.logprobs:
-      logprobs_param = first_request.top_logprobs if first_request.top_logprobs is not None else 1
+  if isinstance(request, ChatCompletionRequest):
+    if request.logprobs:
+      logprobs_param = request.top_logprobs if request.top_logprobs is not None else 1
   else:  # CompletionRequest
-    logprobs_param = first_request.logprobs
+    logprobs_param = request.logprobs
 
-  params = {
-      "max_tokens": first_request.max_tokens,
+  return {
+      "max_tokens": request.max_tokens,
       "logprobs": logprobs_param,
-      "echo": getattr(first_request, "echo", False),
-      "stop": first_request.stop,
-      "temperature": first_request.temperature,
-      "seed": first_request.seed,
-      "top_k": first_request.top_k,
-      "top_p": first_request.top_p,
+      "echo": getattr(request, "echo", False),
+      "stop": request.stop,
+      "temperature": request.temperature,
+      "seed": request.seed,
+      "top_k": request.top_k,
+      "top_p": request.top_p,
   }
 
-  all_prompts = []
-  request_info_map = []
-  for req_id, req in batched_items:
+
+def _drain_request_queue(timeout):
+  """
+  Moves newly queued requests into the pending-prompt queue.
+
+  Each prompt of a request becomes its own pending entry, keyed by
+  `[request_id, prompt_index]`, so a multi-prompt request can be spread over
+  several decode slots and steps.
+
+  Args:
+      timeout: How long to wait for the first request. Used when no slot is
+        decoding, so the loop does not spin.
+  """
+  while True:
+    try:
+      req_id, req, arrival_time = request_queue.get(timeout=timeout) if timeout else request_queue.get_nowait()
+    except queue.Empty:
+      return
+    timeout = 0.0
+
     is_chat = isinstance(req, ChatCompletionRequest)
     prompts_for_req = server_utils.get_prompts_for_request(req, LLM)
-    all_prompts.extend(prompts_for_req)
-    request_info_map.append((req_id, req, is_chat, len(prompts_for_req)))
+    params = _sampling_params_for_request(req)
+    inflight_requests[req_id] = {
+        "request": req,
+        "is_chat": is_chat,
+        "prompts": prompts_for_req,
+        "completions": [None] * len(prompts_for_req),
+        "remaining": len(prompts_for_req),
+        "arrival_time": arrival_time,
+        "last_token_times": [None] * len(prompts_for_req),
+        "text_streams": [server_utils.TextStream(LLM, req.stop) for _ in prompts_for_req] if req.stream else None,
+    }
+    for idx, prompt in enumerate(prompts_for_req):
+      pending_prompts.append({"key": [req_id, idx], "prompt": prompt, "params": params})
+      if req.stream and params["echo"]:
+        _push_stream_event(req_id, ("chunk", idx, prompt, None))
 
-  broadcast_payload = {"prompts": all_prompts, "params": params}
-  payload_bytes = json.dumps(broadcast_payload).encode("utf-8")
-  payload_len = len(payload_bytes)
 
-  if payload_len > MAX_REQUEST_SIZE:
-    logger.error("Batched request is too large (%d bytes > %d)", payload_len, MAX_REQUEST_SIZE)
-    for req_id, _, _, _ in request_info_map:
-      with response_lock:
-        response_dict[req_id] = {"error": "Batched request payload is too large."}
-    return 0, b"", []  # Signal other ranks to skip
+def _admit_pending_prompts():
+  """
+  Pops the pending prompts that fit into the free decode slots, in arrival order.
 
-  return payload_len, payload_bytes, request_info_map
+  Admission stops at the first prompt the generator cannot take next to the
+  decoding streams, so requests are never reordered.
+  """
+  admitted = []
+  while pending_prompts and len(admitted) < LLM.num_free_slots:
+    entry = pending_prompts[0]
+    if admitted:
+      # Prompts admitted in this round must also agree with each other.
+      if not LLM.shares_sampling(SamplingParams(**entry["params"]), SamplingParams(**admitted[0]["params"])):
+        break
+    elif not LLM.can_admit(SamplingParams(**entry["params"])):
+      break
+    admitted.append(pending_prompts.popleft())
+  return admitted
+
+
+def _prepare_batch_for_broadcast(admitted):
+  """
+  Tokenizes newly admitted prompts and encodes them for broadcasting.
 
+  Returns:
+      The encoded payload, or None if no prompt is left to insert, in which
+      case the affected requests have already failed.
+  """
+  token_ids = {}
+  for entry in admitted:
+    try:
+      token_ids[tuple(entry["key"])] = LLM.encode_prompt(entry["prompt"])
+    except (ValueError, AssertionError) as e:
+      logger.error("Failed to tokenize prompt of request %s: %s", entry["key"][0], e)
+      _fail_requests({entry["key"][0]}, f"Failed to tokenize prompt: {e}")
+  admitted = [entry for entry in admitted if entry["key"][0] in inflight_requests]
+  if not admitted:
+    return None
+
+  payload_bytes = broadcast_utils.encode_batch(
+      keys=[entry["key"] for entry in admitted],
+      token_ids=[token_ids[tuple(entry["key"])] for entry in admitted],
+      params=[entry["params"] for entry in admitted],
+  )
+  if len(payload_bytes) > MAX_REQUEST_SIZE:
+    logger.error("Batched request is too large (%d bytes > %d)", len(payload_bytes), MAX_REQUEST_SIZE)
+    _fail_requests({entry["key"][0] for entry in admitted}, "Batched request payload is too large.")
+    return None
 
-def _process_results(completions, request_info_map, payload):
-  """Processes completions and sends responses back to the waiting threads."""
-  logger.info("Batched generation finished. Processing %d completions.", len(completions))
-  completion_idx = 0
-  for req_id, req, is_chat, num_prompts in request_info_map:
-    completions_for_req = completions[completion_idx : completion_idx + num_prompts]
-    prompts_for_req = payload["prompts"][completion_idx : completion_idx + num_prompts]
-    completion_idx += num_prompts
+  return payload_bytes
 
-    response = _create_response(req, completions_for_req, prompts_for_req, is_chat, LLM)
+
+def _fail_requests(req_ids, error):
+  """Responds with `error` to the given requests and forgets their remaining prompts."""
+  for req_id in req_ids:
+    info = inflight_requests.pop(req_id, None)
+    if info is None:
+      continue
+    if info["text_streams"] is not None:
+      _push_stream_event(req_id, ("error", error))
+      continue
     with response_lock:
-      response_dict[req_id] = response
+      response_dict[req_id] = {"error": error}
+  remaining = [entry for entry in pending_prompts if entry["key"][0] in inflight_requests]
+  pending_prompts.clear()
+  pending_prompts.extend(remaining)
+
+
+def _on_token(key, token_id):
+  """Records token latency metrics and streams the new text of streaming requests."""
+  req_id, idx = key
+  info = inflight_requests.get(req_id)
+  if info is None:
+    return
+
+  now = time.time()
+  last_token_time = info["last_token_times"][idx]
+  if last_token_time is None:
+    metrics.record_first_token(now - info["arrival_time"])
+  else:
+    metrics.record_next_token(now - last_token_time)
+  info["last_token_times"][idx] = now
+
+  if info["text_streams"] is not None:
+    text = info["text_streams"][idx].add(token_id)
+    if text:
+      _push_stream_event(req_id, ("chunk", idx, text, None))
+
+
+def _process_results(finished):
+  """Records finished prompts and responds to the requests whose prompts have all finished."""
+  for key, completion in finished:
+    req_id, idx = key
+    info = inflight_requests.get(req_id)
+    if info is None:
+      continue  # The request already failed.
+    completion.index = idx
+    info["completions"][idx] = completion
+    info["remaining"] -= 1
+
+    if info["text_streams"] is not None:
+      text_stream = info["text_streams"][idx]
+      text = text_stream.finish()
+      finish_reason = "stop" if text_stream.stopped else completion.finish_reason
+      _push_stream_event(req_id, ("chunk", idx, text, finish_reason))
+      if info["remaining"] == 0:
+        del inflight_requests[req_id]
+        _push_stream_event(req_id, ("done",))
+      continue
+
+    if info["remaining"] == 0:
+      del inflight_requests[req_id]
+      response = _create_response(info["request"], info["completions"], info["prompts"], info["is_chat"], LLM)
+      with response_lock:
+        response_dict[req_id] = response
 
 
 def main_loop():
-  """The main processing loop with dynamic batching for all JAX processes."""
+  """
+  The main processing loop with continuous batching for all JAX processes.
+
+  Every iteration admits pending prompts into free decode slots, runs a single
+  generate step, and responds to the requests whose prompts have all finished.
+  New requests therefore never wait for the slowest stream of a batch. All
+  ranks run the same inserts and steps; only rank 0 owns the request queue.
+  """
+  LLM.reset_slots()
+  idle_backoff = broadcast_utils.IdleBackoff(IDLE_WAIT_MIN_S, IDLE_WAIT_MAX_S)
   while True:
-    payload_len, payload_bytes, request_info_map = 0, b"", []
+    payload_bytes = None
     if jax.process_index() == 0:
-      batched_items = _collect_batched_requests()
-      if batched_items:
-        payload_len, payload_bytes, request_info_map = _prepare_batch_for_broadcast(batched_items)
-
-    # Broadcast the payload to all ranks
-    data_to_broadcast = (
-        jnp.array([payload_len], dtype=jnp.int32),
-        jnp.pad(jnp.frombuffer(payload_bytes, dtype=jnp.uint8), (0, MAX_REQUEST_SIZE - payload_len)),
-    )
-    received_len_array, received_data_array = multihost_utils.broadcast_one_to_all(data_to_broadcast)
-
-    received_len = int(received_len_array[0])
-    if received_len == 0:
-      time.sleep(0.01)
+      if LLM.num_active_slots == 0 and not pending_prompts:
+        _drain_request_queue(timeout=idle_backoff.next_wait())
+      else:
+        _drain_request_queue(timeout=0.0)
+      admitted = _admit_pending_prompts()
+      if admitted:
+        payload_bytes = _prepare_batch_for_broadcast(admitted)
+
+    # Other ranks wait in the broadcast until rank 0 has work or its idle wait expires.
+    payload_bytes = broadcaster.broadcast(payload_bytes)
+    payload = None if payload_bytes is None else broadcast_utils.decode_batch(payload_bytes)
+    if payload is None and LLM.num_active_slots == 0:
       continue
-
-    broadcasted_data = received_data_array[:received_len].tobytes().decode("utf-8")
-    payload = json.loads(broadcasted_data)
+    idle_backoff.reset()
 
     try:
-      if jax.process_index() == 0:
-        logger.info(
-            "Starting batched generation for %d prompts with params: %s", len(payload["prompts"]), payload["params"]
+      on_token = _on_token if jax.process_index() == 0 else None
+      finished = []
+      if payload is not None:
+        if jax.process_index() == 0:
+          logger.info("Inserting %d prompts with params: %s", len(payload["token_ids"]), payload["params"])
+        finished.extend(
+            LLM.insert_requests(
+                keys=[tuple(key) for key in payload["keys"]],
+                prompts=payload["token_ids"],
+                params=[SamplingParams(**p) for p in payload["params"]],
+                on_token=on_token,
+            )
         )
-
-      completions = LLM.generate_batch(prompts=payload["prompts"], **payload["params"])
+      finished.extend(LLM.step(on_token=on_token))
 
       if jax.process_index() == 0:
-        _process_results(completions, request_info_map, payload)
+        _process_results(finished)
 
     except (ValueError, RuntimeError) as e:
-      logger.error("Inference failed for batch: %s", e, exc_info=True)
+      logger.error("Inference failed: %s", e, exc_info=True)
+      dropped = LLM.reset_slots()
       if jax.process_index() == 0:
-        for req_id, _, _, _ in request_info_map:
-          with response_lock:
-            response_dict[req_id] = {"error": f"Inference failed: {e}"}
+        failed = {key[0] for key in dropped}
+        if payload is not None:
+          failed.update(key[0] for key in payload["keys"])
+        _fail_requests(failed, f"Inference failed: {e}")
 
 
 def main():
@@ -0,0 +1,153 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replays a synthetic request trace against the MaxTextGenerator slot API.
+
+Requests arrive at given decode steps and are admitted into free decode slots
+either continuously (`continuous=True`, as the API server does) or only once the
+whole batch has drained (static batching). Comparing both modes on mixed-length
+traffic shows the latency and slot utilization gained by continuous batching.
+
+Command:
+  python -m benchmarks.api_server.request_replayer src/MaxText/configs/base.yml \
+    per_device_batch_size=4 base_num_decoder_layers=2 base_emb_dim=256 ...
+"""
+
+from dataclasses import dataclass
+from typing import List, Optional
+import logging
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.api_server.maxtext_generator import Completion, MaxTextGenerator, SamplingParams
+
+
+@dataclass
+class SyntheticRequest:
+  """A single request of a synthetic trace."""
+
+  key: str
+  prompt: str
+  params: SamplingParams
+  arrival_step: int = 0
+
+  # Filled in by `replay`.
+  admit_step: Optional[int] = None
+  finish_step: Optional[int] = None
+  finish_time: Optional[float] = None
+  completion: Optional[Completion] = None
+
+
+@dataclass
+class ReplayStats:
+  """Aggregate results of a replay."""
+
+  num_requests: int
+  num_steps: int
+  wall_time_s: float
+  mean_latency_steps: float
+  p99_latency_steps: float
+  slot_utilization: float
+
+
+def synthetic_requests(
+    num_requests: int,
+    min_tokens: int = 4,
+    max_tokens: int = 64,
+    arrival_interval: int = 2,
+    seed: int = 0,
+) -> List[SyntheticRequest]:
+  """Builds a trace of greedy requests with uniformly random output lengths and fixed arrival spacing."""
+  rs = np.random.RandomState(seed)
+  words = ["the", "quick", "brown", "fox", "jumps", "over", "a", "lazy", "dog", "and", "runs", "away"]
+  requests = []
+  for i in range(num_requests):
+    prompt = " ".join(rs.choice(words, size=rs.randint(3, 16)))
+    params = SamplingParams(max_tokens=int(rs.randint(min_tokens, max_tokens + 1)), temperature=0.0)
+    requests.append(SyntheticRequest(key=f"req_{i}", prompt=prompt, params=params, arrival_step=i * arrival_interval))
+  return requests
+
+
+def replay(llm: MaxTextGenerator, requests: List[SyntheticRequest], continuous: bool = True) -> ReplayStats:
+  """
+  Replays `requests` against `llm`, advancing one decode step at a time.
+
+  Args:
+      llm: The generator to run the requests on.
+      requests: The trace, sorted by `arrival_step`. Results are written back into it.
+      continuous: Whether to refill free slots between generate steps. If False,
+        new requests are only admitted once every slot is free.
+
+  Returns:
+      Aggregate latency and utilization statistics.
+  """
+  llm.reset_slots()
+  by_key = {r.key: r for r in requests}
+  pending = list(requests)
+  step = 0
+  busy_slot_steps = 0
+  start_time = time.time()
+
+  def _record(finished):
+    for key, completion in finished:
+      request = by_key[key]
+      request.finish_step, request.finish_time, request.completion = step, time.time(), completion
+
+  while pending or llm.num_active_slots:
+    if continuous or not llm.num_active_slots:
+      admitted = []
+      while pending and pending[0].arrival_step <= step and llm.num_free_slots > len(admitted):
+        if not llm.can_admit(pending[0].params) or not llm.shares_sampling(
+            pending[0].params, (admitted or pending)[0].params
+        ):
+          break
+        admitted.append(pending.pop(0))
+      for request in admitted:
+        request.admit_step = step
+      if admitted:
+        _record(
+            llm.insert_requests([r.key for r in admitted], [r.prompt for r in admitted], [r.params for r in admitted])
+        )
+
+    busy_slot_steps += llm.num_active_slots
+    _record(llm.step())
+    step += 1
+
+  latencies = np.array([r.finish_step - r.arrival_step for r in requests])
+  return ReplayStats(
+      num_requests=len(requests),
+      num_steps=step,
+      wall_time_s=time.time() - start_time,
+      mean_latency_steps=float(latencies.mean()) if len(latencies) else 0.0,
+      p99_latency_steps=float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+      slot_utilization=busy_slot_steps / max(step * llm.batch_size, 1),
+  )
+
+
+def main():
+  logging.basicConfig(level=logging.WARNING)
+  llm = MaxTextGenerator(sys.argv)
+  # Keep every request running to its max_tokens so both modes decode the same number of tokens.
+  llm.eos_ids = []
+  for continuous in (False, True):
+    stats = replay(llm, synthetic_requests(num_requests=8 * llm.batch_size), continuous=continuous)
+    mode = "continuous" if continuous else "static"
+    print(f"{mode}: {stats}")
+
+
+if __name__ == "__main__":
+  main()
@@ -222,3 +222,72 @@ class ChatCompletionResponse(BaseCompletionResponse[ChatCompletionChoice]):
 
   id: str = Field(default_factory=lambda: f"chatcmpl-{uuid.uuid4().hex}")
   object: str = "chat.completion"
+
+
+class CompletionStreamChoice(BaseModel):
+  """
+  Represents a single choice in a streamed `CompletionStreamResponse` chunk.
+
+  Attributes:
+      text: The text generated since the previous chunk.
+      index: The index of the prompt this choice belongs to.
+      logprobs: Always None; log probabilities are not streamed.
+      finish_reason: Set on the last chunk of a choice, otherwise None.
+  """
+
+  text: str
+  index: int
+  logprobs: Optional[LogProbsPayload] = None
+  finish_reason: Optional[str] = None
+
+
+class CompletionStreamResponse(BaseModel):
+  """
+  A server-sent event chunk of a streamed completion request.
+  """
+
+  id: str
+  object: str = "text_completion"
+  created: int = Field(default_factory=lambda: int(time.time()))
+  model: str
+  choices: List[CompletionStreamChoice]
+
+
+class ChatCompletionDelta(BaseModel):
+  """
+  The incremental message content of a streamed chat completion chunk.
+
+  Attributes:
+      role: The role of the author, sent only on the first chunk.
+      content: The text generated since the previous chunk.
+  """
+
+  role: Optional[str] = None
+  content: Optional[str] = None
+
+
+class ChatCompletionStreamChoice(BaseModel):
+  """
+  Represents a single choice in a streamed `ChatCompletionChunk`.
+
+  Attributes:
+      index: The index of this choice.
+      delta: The message content generated since the previous chunk.
+      finish_reason: Set on the last chunk, otherwise None.
+  """
+
+  index: int
+  delta: ChatCompletionDelta
+  finish_reason: Optional[str] = None
+
+
+class ChatCompletionChunk(BaseModel):
+  """
+  A server-sent event chunk of a streamed chat completion request.
+  """
+
+  id: str
+  object: str = "chat.completion.chunk"
+  created: int = Field(default_factory=lambda: int(time.time()))
+  model: str
+  choices: List[ChatCompletionStreamChoice]
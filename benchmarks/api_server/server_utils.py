@@ -16,15 +16,17 @@
 This module provides utility functions for the MaxText API server.
 
 It includes helpers for processing requests, formatting responses to be
-OpenAI-compatible, handling log probabilities, counting tokens, and managing
-debug logging.
+OpenAI-compatible, handling log probabilities, counting tokens, managing
+debug logging, and streaming text and latency metrics.
 """
 
 import os
 import bisect
+import collections
 import math
 import json
 import logging
+import threading
 from datetime import datetime, timezone
 from typing import List, Optional, Union, Dict, Any
 
@@ -32,6 +34,7 @@ from fastapi import HTTPException
 
 from benchmarks.api_server.maxtext_generator import MaxTextGenerator
 from benchmarks.api_server.server_models import LogProbsPayload
+from MaxText.tokenizer import IncrementalDetokenizer, StopSequenceMatcher
 
 # ----------------------------
 # Debugging
@@ -300,3 +303,99 @@ def apply_stops_to_text_and_logprobs(
     return new_text, new_logprobs, "stop"
 
   return new_text, logprobs_payload, "stop"
+
+
+# ----------------------------
+# Streaming Helpers
+# ----------------------------
+
+
+class TextStream:
+  """
+  Incrementally detokenizes one generation stream and applies stop sequences.
+
+  Text that could still turn into a stop sequence is held back, so a streamed
+  response never contains text past a stop sequence, matching
+  `apply_stops_to_text_and_logprobs` on the full text.
+  """
+
+  def __init__(self, llm: MaxTextGenerator, stop: Optional[Union[str, List[str]]] = None):
+    self._detokenizer = IncrementalDetokenizer(llm.tokenizer, skip_token_ids=llm.eos_ids)
+    self._matcher = StopSequenceMatcher([stop] if isinstance(stop, str) else (stop or []))
+    # Text received from the detokenizer but not sent yet, and the index of its first character.
+    self._unsent = ""
+    self._sent = 0
+    self.stopped = False
+
+  def add(self, token_id: int) -> str:
+    """Consumes a generated token and returns the text that is safe to send."""
+    if self.stopped:
+      return ""
+    return self._take(self._detokenizer.add(token_id), final=False)
+
+  def finish(self) -> str:
+    """Returns the remaining text once generation has finished."""
+    if self.stopped:
+      return ""
+    return self._take(self._detokenizer.flush(), final=True)
+
+  def _take(self, text: str, final: bool) -> str:
+    """Appends `text` and returns the unsent text up to a stop sequence or, unless `final`, up to the held-back tail."""
+    stop_index = self._matcher.feed(text)
+    self._unsent += text
+    if stop_index != -1:
+      self.stopped = True
+      num_chars = stop_index - self._sent
+    elif final:
+      num_chars = len(self._unsent)
+    else:
+      num_chars = len(self._unsent) - self._matcher.num_pending_chars
+    if num_chars <= 0:
+      return ""
+    delta, self._unsent = self._unsent[:num_chars], self._unsent[num_chars:]
+    self._sent += num_chars
+    return delta
+
+
+class LatencyMetrics:
+  """
+  Thread-safe recorder of time-to-first-token and inter-token latency samples.
+
+  Keeps the most recent `window` samples of each metric and summarizes them
+  for the `/metrics` endpoint.
+  """
+
+  def __init__(self, window: int = 10000):
+    self._lock = threading.Lock()
+    self._ttft = collections.deque(maxlen=window)
+    self._itl = collections.deque(maxlen=window)
+    self._num_tokens = 0
+
+  def record_first_token(self, latency_s: float):
+    with self._lock:
+      self._ttft.append(latency_s)
+      self._num_tokens += 1
+
+  def record_next_token(self, latency_s: float):
+    with self._lock:
+      self._itl.append(latency_s)
+      self._num_tokens += 1
+
+  def summary(self) -> Dict[str, Any]:
+    """Returns count, mean and percentiles (in milliseconds) of both metrics."""
+
+    def _summarize(samples):
+      if not samples:
+        return {"count": 0}
+      ms = sorted(1e3 * s for s in samples)
+      summary = {"count": len(ms), "mean_ms": sum(ms) / len(ms)}
+      for p in (50, 90, 99):
+        summary[f"p{p}_ms"] = ms[min(len(ms) - 1, int(p / 100 * len(ms)))]
+      return summary
+
+    with self._lock:
+      return {
+          "time_to_first_token": _summarize(list(self._ttft)),
+          "inter_token_latency": _summarize(list(self._itl)),
+          "num_tokens": self._num_tokens,
+      }
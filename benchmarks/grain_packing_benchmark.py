@@ -0,0 +1,145 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the packing efficiency and throughput of the Grain packing types on C4.
+
+Tokenizes C4 documents from the ArrayRecord shards of `local_datasets` once,
+truncated or chunked to `max_target_length` as in the pretraining pipeline, and
+then packs them with each `grain_packing_type`. For each it reports:
+
+* efficiency: the fraction of packed tokens that are not padding.
+* segments/row: the average number of documents per packed row.
+* throughput: packed rows and input examples per second of the packing alone.
+
+Generate the data with `python local_datasets/get_minimal_c4_en_dataset.py` first.
+
+Command:
+  python -m benchmarks.grain_packing_benchmark --max_target_length=2048 --num_packing_bins=32
+"""
+
+import argparse
+import glob
+import os
+import time
+
+import grain.python as grain
+import numpy as np
+
+from MaxText import tokenizer
+from MaxText.globals import MAXTEXT_ASSETS_ROOT, MAXTEXT_REPO_ROOT
+from MaxText.input_pipeline import _grain_packing
+from MaxText.input_pipeline import _grain_tokenizer
+from MaxText.input_pipeline import _input_pipeline_utils
+
+DEFAULT_FILES = os.path.join(
+    MAXTEXT_REPO_ROOT, "local_datasets", "c4_en_dataset_minimal", "c4", "en", "3.1.0", "c4-train.array_record*"
+)
+PACKING_TYPES = ("first_fit", "best_fit", "numpy_first_fit", "concat_then_split")
+
+
+def load_examples(data_files, tokenizer_path, max_target_length, num_examples, use_truncation):
+  """Returns up to `num_examples` tokenized examples with `inputs` and `targets` features."""
+  files = sorted(glob.glob(data_files))
+  if not files:
+    raise FileNotFoundError(f"No files found matching pattern: {data_files}")
+  tokenizer_model = tokenizer.build_tokenizer(tokenizer_path, "sentencepiece", True, True, None, "grain")
+  dataset = grain.MapDataset.source(grain.ArrayRecordDataSource(files))
+  dataset = dataset.map(_input_pipeline_utils.ParseFeatures(["text"], True))
+  dataset = dataset.map(_input_pipeline_utils.NormalizeFeatures(["text"], True))
+  if use_truncation:
+    dataset = dataset.map(_grain_tokenizer.TokenizeAndTrim("text", max_target_length, tokenizer_model)).to_iter_dataset()
+  else:
+    dataset = dataset.to_iter_dataset().apply(
+        _grain_tokenizer.TokenizeAndChunk("text", max_target_length, tokenizer_model)
+    )
+  examples = []
+  for example in dataset:
+    examples.append({"inputs": example["text"], "targets": example["text"]})
+    if len(examples) == num_examples:
+      break
+  return examples
+
+
+def pack(packing_type, dataset, max_target_length, num_packing_bins, max_segments):
+  """Applies the packing of `_grain_data_processing.pretrain_preprocessing_pipeline` for `packing_type`."""
+  length_struct = {"inputs": max_target_length, "targets": max_target_length}
+  if packing_type == "first_fit":
+    return grain.experimental.FirstFitPackIterDataset(
+        dataset, length_struct=length_struct, num_packing_bins=num_packing_bins, max_sequences_per_bin=max_segments
+    )
+  elif packing_type == "best_fit":
+    return grain.experimental.BestFitPackIterDataset(
+        dataset, length_struct=length_struct, num_packing_bins=num_packing_bins
+    )
+  elif packing_type == "numpy_first_fit":
+    return _grain_packing.NumpyFirstFitPackIterDataset(
+        dataset, length_struct=length_struct, num_packing_bins=num_packing_bins, max_sequences_per_bin=max_segments
+    )
+  elif packing_type == "concat_then_split":
+    return grain.experimental.ConcatThenSplitIterDataset(dataset, length_struct=length_struct)
+  raise ValueError(f"Unknown packing type: {packing_type}")
+
+
+def run(packing_type, examples, max_target_length, num_packing_bins, max_segments, num_iters):
+  """Packs `examples` `num_iters` times and prints the efficiency and the best throughput."""
+  best_s = float("inf")
+  for _ in range(num_iters):
+    dataset = pack(
+        packing_type,
+        # Without prefetching, so that the packing dominates the time.
+        grain.MapDataset.source(examples).to_iter_dataset(grain.ReadOptions(prefetch_buffer_size=0)),
+        max_target_length,
+        num_packing_bins,
+        max_segments,
+    )
+    start = time.perf_counter()
+    rows = list(dataset)
+    best_s = min(best_s, time.perf_counter() - start)
+
+  segment_ids = np.stack([row["targets_segment_ids"] for row in rows])
+  efficiency = np.count_nonzero(segment_ids) / segment_ids.size
+  segments_per_row = np.mean([len(np.unique(s[s > 0])) for s in segment_ids])
+  print(
+      f"packing_type={packing_type:<18} efficiency={efficiency:.4f} segments/row={segments_per_row:.2f} "
+      f"rows/s={len(rows) / best_s:,.0f} examples/s={len(examples) / best_s:,.0f}",
+      flush=True,
+  )
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--data_files", default=DEFAULT_FILES, help="ArrayRecord file pattern of C4.")
+  parser.add_argument("--tokenizer_path", default=os.path.join(MAXTEXT_ASSETS_ROOT, "tokenizer"))
+  parser.add_argument("--max_target_length", type=int, default=2048)
+  parser.add_argument("--num_packing_bins", type=int, default=32, help="Per-host batch size.")
+  parser.add_argument("--max_segments_per_seq", type=int, default=-1, help="-1 for no limit.")
+  parser.add_argument("--num_examples", type=int, default=20_000, help="Tokenized examples to pack.")
+  parser.add_argument("--use_truncation", action="store_true", help="Trim documents instead of chunking them.")
+  parser.add_argument("--num_iters", type=int, default=3, help="Timed repetitions; the fastest is reported.")
+  parser.add_argument("--packing_types", nargs="+", default=PACKING_TYPES, choices=PACKING_TYPES)
+  args = parser.parse_args()
+
+  examples = load_examples(
+      args.data_files, args.tokenizer_path, args.max_target_length, args.num_examples, args.use_truncation
+  )
+  lengths = np.array([len(example["targets"]) for example in examples])
+  print(f"examples={len(examples)} mean_length={lengths.mean():.1f} max_target_length={args.max_target_length}")
+  max_segments = args.max_segments_per_seq if args.max_segments_per_seq > 0 else None
+  for packing_type in args.packing_types:
+    run(packing_type, examples, args.max_target_length, args.num_packing_bins, max_segments, args.num_iters)
+
+
+if __name__ == "__main__":
+  main()
@@ -15,6 +15,17 @@
 """This is a simple script for MMLU benchmark for a trained checkpoint.
 Dataset: https://huggingface.co/datasets/lighteval/mmlu
 
+All questions are evaluated in one batched run of the OfflineEngine, with
+length-sorted prompts packed into shared prefills (`--enable_batch_prefill`,
+requires scan_layers=False). Two evaluation modes are supported:
+  * `--eval_mode=generate` (default): generates up to
+    max_target_length - max_prefill_predict_length tokens per question and
+    parses the answer from the text. Keep this small for zero-shot prompting.
+  * `--eval_mode=score`: a single prefill per question scores the answer
+    letters A/B/C/D as the next token, without any decoding.
+Per-subject, subcategory and category accuracies are reported together with
+the throughput in questions per second.
+
 To get optimal performance the prompt template needs to be adjusted (e.g. CoT or 5-shot prompt) per model.
 
 
@@ -22,46 +33,54 @@ To run the MMLU benchmark:
 # Default is zero-shot prompting
 python3 -m benchmarks.mmlu.mmlu_eval src/MaxText/configs/base.yml \
   tokenizer_path=src/MaxText/assets/tokenizer_llama3.tiktoken \
-  load_parameters_path=check_point_path model_name=llama3.1-8b \
-  max_prefill_predict_length=1024 max_target_length=2048 ici_tensor_parallelism=4 per_device_batch_size=1
+  load_parameters_path=check_point_path model_name=llama3.1-8b scan_layers=False return_log_prob=True \
+  max_prefill_predict_length=1024 max_target_length=1032 ici_tensor_parallelism=4 per_device_batch_size=1
+
+# Example of logit scoring of the answer letters, without decoding:
+python3 -m benchmarks.mmlu.mmlu_eval src/MaxText/configs/base.yml \
+  tokenizer_path=src/MaxText/assets/tokenizer_llama3.tiktoken \
+  load_parameters_path=check_point_path model_name=llama3.1-8b scan_layers=False return_log_prob=True \
+  max_prefill_predict_length=1024 max_target_length=1032 ici_tensor_parallelism=4 per_device_batch_size=1 \
+  --eval_mode=score
 
 # Example of using the prompt_template flag for Chain-of-Thought (CoT) prompting:
 python3 -m benchmarks.mmlu.mmlu_eval src/MaxText/configs/base.yml \
   tokenizer_path=src/MaxText/assets/tokenizer_llama3.tiktoken \
-  load_parameters_path=check_point_path model_name=llama3.1-8b \
+  load_parameters_path=check_point_path model_name=llama3.1-8b scan_layers=False return_log_prob=True \
   max_prefill_predict_length=1024 max_target_length=2048 ici_tensor_parallelism=4 per_device_batch_size=1 \
-  prompt_template="The following are multiple choice questions (with answers) about {subject}.\n\n{question}\n
+  --prompt_template="The following are multiple choice questions (with answers) about {subject}.\n\n{question}\n
   {choices}\nAnswer: Let's think step by step."
 
 # Example of using the prompt_template flag for 5-shot prompting (replace with actual examples):
 python3 -m benchmarks.mmlu.mmlu_eval src/MaxText/configs/base.yml \
   tokenizer_path=src/MaxText/assets/tokenizer_llama3.tiktoken \
-  load_parameters_path=check_point_path model_name=llama3.1-8b \
-  max_prefill_predict_length=1024 max_target_length=2048 ici_tensor_parallelism=4 per_device_batch_size=1 \
-  prompt_template='Example 1:\nQuestion: What is the capital of France?\nChoices:\nA. London\nB. Paris\nC. Rome\nD. Berlin\nAnswer: B\n\nExample 2:\nQuestion: What is the highest mountain in the world?\nChoices:\nA. K2\nB. Kangchenjunga\nC. Mount Everest\nD. Lhotse\nAnswer: C\n\nExample 3:\nQuestion: What is the chemical symbol for water?\nChoices:\nA. H2O\nB. CO2\nC. O2\nD. NaCl\nAnswer: A\n\nExample 4:\nQuestion: Who painted the Mona Lisa?\nChoices:\nA. Michelangelo\nB. Leonardo da Vinci\nC. Raphael\nD. Donatello\nAnswer: B\n\nExample 5:\nQuestion: Which planet is known as the Red Planet?\nChoices:\nA. Venus\nB. Mars\nC. Jupiter\nD. Saturn\nAnswer: B\n\nThe following are multiple choice questions (with answers) about {subject}.\n\n{question}\n{choices}\nAnswer:'   # pylint: disable=line-too-long
+  load_parameters_path=check_point_path model_name=llama3.1-8b scan_layers=False return_log_prob=True \
+  max_prefill_predict_length=1024 max_target_length=1032 ici_tensor_parallelism=4 per_device_batch_size=1 \
+  --prompt_template='Example 1:\nQuestion: What is the capital of France?\nChoices:\nA. London\nB. Paris\nC. Rome\nD. Berlin\nAnswer: B\n\nExample 2:\nQuestion: What is the highest mountain in the world?\nChoices:\nA. K2\nB. Kangchenjunga\nC. Mount Everest\nD. Lhotse\nAnswer: C\n\nExample 3:\nQuestion: What is the chemical symbol for water?\nChoices:\nA. H2O\nB. CO2\nC. O2\nD. NaCl\nAnswer: A\n\nExample 4:\nQuestion: Who painted the Mona Lisa?\nChoices:\nA. Michelangelo\nB. Leonardo da Vinci\nC. Raphael\nD. Donatello\nAnswer: B\n\nExample 5:\nQuestion: Which planet is known as the Red Planet?\nChoices:\nA. Venus\nB. Mars\nC. Jupiter\nD. Saturn\nAnswer: B\n\nThe following are multiple choice questions (with answers) about {subject}.\n\n{question}\n{choices}\nAnswer:'   # pylint: disable=line-too-long
 """
 
 import collections
 import re
 import sys
+import time
 
 from absl import flags
 
 import datasets
 
 import jax
+import numpy as np
 
 from benchmarks.mmlu.mmlu_categories import categories
 from benchmarks.mmlu.mmlu_categories import subcategories
 
-from tqdm import tqdm
-
 from MaxText import pyconfig
 from MaxText import max_logging
 from MaxText import max_utils
-from MaxText import maxengine
+from MaxText.inference.offline_engine import InputData, OfflineEngine
 
 ASCII_UPPERCASE_A = ord("A")  # ASCII value for uppercase 'A'
+MAX_NUM_CHOICES = 4
 
 DEFAULT_PROMPT_TEMPLATE = """The following are multiple choice questions (with answers) about {subject}.
 
@@ -75,6 +94,23 @@ _PROMPT_TEMPLATE = flags.DEFINE_string(
     default=DEFAULT_PROMPT_TEMPLATE,
     help="prompt template",
 )
+_EVAL_MODE = flags.DEFINE_enum(
+    "eval_mode",
+    default="generate",
+    enum_values=["generate", "score"],
+    help="generate: parse the answer from generated text. score: pick the answer letter with the highest"
+    " next-token log probability after the prompt, with a single prefill and no decoding.",
+)
+_ENABLE_BATCH_PREFILL = flags.DEFINE_bool(
+    "enable_batch_prefill",
+    default=True,
+    help="Pack length-sorted prompts into shared prefills. Requires scan_layers=False.",
+)
+_MAX_EXAMPLES = flags.DEFINE_integer(
+    "max_examples",
+    default=-1,
+    help="Evaluate only the first max_examples questions; all if not positive.",
+)
 
 
 def construct_prompt(subject, question, choices):
@@ -90,15 +126,55 @@ def parse_answer(output):
   return predicted_answer
 
 
-def main(config):
-  engine = maxengine.MaxEngine(config)
-  params = engine.load_params()
+def build_inputs(dataset, tokenizer, max_prefill_predict_length):
+  """Tokenizes the prompt of every example into an InputData, truncating prompts longer than the max prefill length."""
+  prompts, inputs = [], []
+  for idx, example in enumerate(dataset):
+    prompt = construct_prompt(example["subject"], example["question"], example["choices"])
+    tokens, true_length = tokenizer.encode(prompt, is_bos=True, prefill_lengths=[max_prefill_predict_length])
+    if true_length > max_prefill_predict_length:
+      max_logging.log(
+          f"Warning: Prompt length {true_length} exceeds max prefill length" f" {max_prefill_predict_length}. Truncating."
+      )
+      true_length = max_prefill_predict_length
+    prompts.append(prompt)
+    inputs.append(InputData(id=idx, tokens=np.asarray(tokens[:true_length], dtype=np.int32), true_length=true_length))
+  return prompts, inputs
+
+
+def predict_by_generation(offline_engine, dataset, prompts, inputs):
+  """Generates a completion for every question in one batched run and parses the answers from the text."""
+  completions = {int(c.index): c for c in offline_engine.batch_inference(inputs, desc="mmlu")}
+  predictions, outputs = [], []
+  for idx in range(len(dataset)):
+    completion = completions[idx]
+    output = offline_engine.tokenizer.decode(completion.token_ids[completion.prompt_length :].tolist())
+    predictions.append(parse_answer(prompts[idx] + output))
+    outputs.append(output)
+  return predictions, outputs
+
+
+def predict_by_scoring(offline_engine, dataset, inputs):
+  """Predicts the answer letter with the highest next-token log probability after every prompt."""
+  letter_ids = []
+  for idx in range(MAX_NUM_CHOICES):
+    # The prompt ends with "Answer:", so the answer continues with " A", " B", ...
+    # SentencePiece encodes " A" as ["▁", "▁A"], so the letter is the last token.
+    tokens, true_length = offline_engine.tokenizer.encode(f" {chr(ASCII_UPPERCASE_A + idx)}", is_bos=False)
+    letter_ids.append(int(tokens[true_length - 1]))
+
+  scores = offline_engine.score_next_tokens(inputs, letter_ids)
+  predictions, outputs = [], []
+  for idx, example in enumerate(dataset):
+    letter_logprobs = scores[idx][: len(example["choices"])]
+    predictions.append(chr(ASCII_UPPERCASE_A + int(np.argmax(letter_logprobs))))
+    outputs.append(" ".join(f"{chr(ASCII_UPPERCASE_A + i)}={lp:.3f}" for i, lp in enumerate(letter_logprobs)))
+  return predictions, outputs
 
-  metadata = engine.get_tokenizer()
-  tokenizer = engine.build_tokenizer(metadata)
 
+def main(config):
+  offline_engine = OfflineEngine(config=config, enable_batch_prefill=_ENABLE_BATCH_PREFILL.value)
   max_prefill_predict_length = getattr(config, "max_prefill_predict_length", 1024)
-  max_target_length = getattr(config, "max_target_length", 2048)
 
   # Initialize counters for overall and per-subject accuracies
   correct_count = 0
@@ -109,49 +185,21 @@ def main(config):
   subcat_total = collections.defaultdict(int)
 
   mmlu_test_ds = datasets.load_dataset("lighteval/mmlu", "all", split="test")
-  for idx, example in enumerate(tqdm(mmlu_test_ds, desc="Evaluating MMLU dataset")):
-    subject = example["subject"]
-    question = example["question"]
-    choices = example["choices"]
-    label = example["answer"]
-    prompt = construct_prompt(subject, question, choices)
-
-    # Tokenize the input
-    tokens, true_length = tokenizer.encode(prompt, is_bos=True, prefill_lengths=[max_prefill_predict_length])
-    if true_length > max_prefill_predict_length:
-      max_logging.log(
-          f"Warning: Prompt length {true_length} exceeds max prefill length" f" {max_prefill_predict_length}. Truncating."
-      )
-      tokens = tokens[:max_prefill_predict_length]
-      true_length = max_prefill_predict_length
-    assert config.quantization != "fp8", "fp8 on NVIDIA GPUs is not supported in decode.py yet"
-    assert config.quantization != "nanoo_fp8", "NANOO fp8 on AMD MI300/MI325 GPUs is not supported in decode.py yet"
-
-    # Perform prefill
-    prefill_result, first_token = engine.prefill(params=params, padded_tokens=tokens, true_length=true_length)
-    slot = 0
+  if _MAX_EXAMPLES.value > 0:
+    mmlu_test_ds = mmlu_test_ds.select(range(min(_MAX_EXAMPLES.value, len(mmlu_test_ds))))
 
-    # Initialize decode state
-    decode_state = engine.init_decode_state()
-    decode_state = engine.insert(prefill_result, decode_state, slot=slot)
-
-    steps = range(max_prefill_predict_length, max_target_length)
-    sampled_tokens = [first_token.get_result_at_slot(slot).tokens.item()]
-
-    predicted_answer = ""
-
-    for _ in steps:
-      # Decode generated tokens so far
-      output = tokenizer.decode(sampled_tokens)
-      predicted_answer = parse_answer(prompt + output)
-      if predicted_answer:
-        break
+  start_time = time.time()
+  prompts, inputs = build_inputs(mmlu_test_ds, offline_engine.tokenizer, max_prefill_predict_length)
+  if _EVAL_MODE.value == "score":
+    predictions, outputs = predict_by_scoring(offline_engine, mmlu_test_ds, inputs)
+  else:
+    predictions, outputs = predict_by_generation(offline_engine, mmlu_test_ds, prompts, inputs)
+  elapsed_s = time.time() - start_time
 
-      # Generate next token
-      decode_state, sampled_token = engine.generate(params, decode_state)
-      sampled_tokens.append(sampled_token.get_result_at_slot(slot).tokens.item())
-      if sampled_tokens[-1] == tokenizer.eos_id:
-        break
+  for idx, example in enumerate(mmlu_test_ds):
+    subject = example["subject"]
+    choices = example["choices"]
+    predicted_answer = predictions[idx]
 
     if not predicted_answer:
       max_logging.log("Could not extract an answer from the model's output for example" f" {total_count + 1}")
@@ -159,11 +207,11 @@ def main(config):
       max_logging.log(f"Invalid or missing predicted answer for subject '{subject}' in example {total_count + 1}")
 
     # Convert the label index to the corresponding letter
-    correct_answer = chr(65 + label)
+    correct_answer = chr(ASCII_UPPERCASE_A + example["answer"])
 
     # Log answer
     max_logging.log(
-        f"{total_count + 1} | {prompt}\n[Model output] {output}\n"
+        f"{total_count + 1} | {prompts[idx]}\n[Model output] {outputs[idx]}\n"
         f"[Correct answer] {correct_answer}, Matching: {predicted_answer == correct_answer}"
     )
 
@@ -174,18 +222,22 @@ def main(config):
     total_count += 1
     subject_total[subject] += 1
 
-    if idx % 50 == 0:
-      max_logging.log(f" Accuracy: {correct_count / total_count:.4f} | Processed: {total_count}/{len(mmlu_test_ds)}")
-
   # Final accuracy
   if total_count > 0:
     accuracy = correct_count / total_count
     max_logging.log(f"\nFinal accuracy on MMLU dataset: {accuracy:.4f}")
+    max_logging.log(
+        f"Evaluated {total_count} questions in {elapsed_s:.2f}s ({total_count / elapsed_s:.2f} questions/s,"
+        f" eval_mode={_EVAL_MODE.value})"
+    )
   else:
     max_logging.log("No valid predictions were made.")
 
   # Calculate subject accuracies
   subject_acc = {subject: subject_correct[subject] / subject_total[subject] for subject in subject_total}
+  max_logging.log("\nSubject Accuracies:")
+  for subject, acc in sorted(subject_acc.items()):
+    max_logging.log(f"Accuracy for subject '{subject}': {acc:.4f} ({subject_total[subject]} questions)")
 
   # Map subject accuracies to subcategories
   for subject in subject_acc:
@@ -226,12 +278,14 @@ def validate_config(config):
       "Decode doesn't operate on full states! Convert to parameter checkpoint"
       " first. Using generate_param_only_checkpoint."
   )
+  assert config.return_log_prob, "OfflineEngine requires return_log_prob=True."
 
 
 if __name__ == "__main__":
   jax.config.update("jax_default_prng_impl", "unsafe_rbg")
-  flags.FLAGS(sys.argv)
-  cfg = pyconfig.initialize(sys.argv)
+  # The remaining arguments are the config file and its overrides.
+  config_argv = flags.FLAGS(sys.argv, known_only=True)
+  cfg = pyconfig.initialize(config_argv)
   validate_config(cfg)
   max_utils.print_system_information()
   main(cfg)
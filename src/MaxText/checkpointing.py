@@ -14,6 +14,8 @@
 
 """Create an Orbax CheckpointManager with specified (Async or not) Checkpointer."""
 
+import queue
+import threading
 import time
 from typing import Any, Optional
 
@@ -21,8 +23,10 @@ from absl import flags
 from etils import epath
 from flax.training import train_state
 import jax
+import jax.numpy as jnp
 from MaxText import exceptions
 from MaxText import max_logging
+from MaxText.data_loader import ReadAheadIterator
 from MaxText.globals import DEFAULT_OCDBT_TARGET_DATA_FILE_SIZE
 from MaxText.multihost_dataloading import MultiHostDataLoadIterator, RemoteIterator
 from MaxText.input_pipeline.input_pipeline_interface import PlaceHolderDataIterator
@@ -34,6 +38,7 @@ from orbax.checkpoint._src.checkpoint_managers import preservation_policy as pre
 from orbax.checkpoint._src.checkpoint_managers import save_decision_policy as save_decision_policy_lib
 import orbax.checkpoint.experimental.emergency.checkpoint_manager as emergency_checkpoint_manager
 import orbax.checkpoint.experimental.emergency.replicator_checkpoint_manager as emergency_replicator_checkpoint_manager
+
 # pylint: disable=too-many-positional-arguments
 import dataclasses
 import json
@@ -51,6 +56,13 @@ PersistentCheckpointOptions = emergency_checkpoint_manager.PersistentCheckpointO
 EmergencyReplicatorCheckpointManager = emergency_replicator_checkpoint_manager.ReplicatorCheckpointManager
 
 
+def _is_dataset_iterator(item) -> bool:
+  """Whether the state of `item` is the dict of a `grain.DatasetIterator` rather than bytes."""
+  if isinstance(item, ReadAheadIterator):
+    item = item.iterator
+  return isinstance(item, grain.DatasetIterator)
+
+
 class GrainCheckpointHandler(PyGrainCheckpointHandler, ocp.CheckpointHandler):
   """A CheckpointHandler that allows specifying process_index and process_count."""
 
@@ -67,7 +79,7 @@ class GrainCheckpointHandler(PyGrainCheckpointHandler, ocp.CheckpointHandler):
 
     def save_single_process(item, process_index, process_count):
       filename = directory / f"process_{process_index}-of-{process_count}.json"
-      if isinstance(item, grain.DatasetIterator):
+      if _is_dataset_iterator(item):
         state = json.dumps(item.get_state(), indent=4)
       else:
         state = item.get_state().decode()
@@ -96,7 +108,7 @@ class GrainCheckpointHandler(PyGrainCheckpointHandler, ocp.CheckpointHandler):
       if not filename.exists():
         raise ValueError(f"File {filename} does not exist.")
       state = filename.read_text()
-      if isinstance(item, grain.DatasetIterator):
+      if _is_dataset_iterator(item):
         state = json.loads(state)
       else:
         state = state.encode()
@@ -128,6 +140,227 @@ class GrainCheckpointRestore(ocp.args.CheckpointArgs):
   process_count: Optional[int] = None
 
 
+def _byte_planes(x: jax.Array) -> jax.Array:
+  """The bytes of `x` as a [bytes_per_element, *x.shape] uint8 array, with byte i of every element in plane i."""
+  if x.dtype.itemsize == 1:
+    return jax.lax.bitcast_convert_type(x, jnp.uint8)[None]
+  return jnp.moveaxis(jax.lax.bitcast_convert_type(x, jnp.uint8), -1, 0)
+
+
+def _from_byte_planes(planes: jax.Array, dtype) -> jax.Array:
+  """Inverse of `_byte_planes`."""
+  if jnp.dtype(dtype).itemsize == 1:
+    return jax.lax.bitcast_convert_type(planes[0], dtype)
+  return jax.lax.bitcast_convert_type(jnp.moveaxis(planes, 0, -1), dtype)
+
+
+@jax.jit
+def _xor_byte_planes(x: jax.Array, base: jax.Array) -> jax.Array:
+  return _byte_planes(x) ^ _byte_planes(base)
+
+
+def _xor_delta(state, base_state):
+  """The byte planes of the bitwise XOR of every array of `state` with the same array of `base_state`.
+
+  The arrays of `base_state` may be in host memory, and are copied to the memory of `state` one at a time.
+  """
+  return jax.tree.map(lambda x, base: _xor_byte_planes(x, jax.device_put(base, x.sharding)), state, base_state)
+
+
+@jax.jit
+def _apply_xor_delta(base_state, delta):
+  """Inverse of `_xor_delta`: the state whose XOR delta against `base_state` is `delta`."""
+  return jax.tree.map(lambda base, planes: _from_byte_planes(planes ^ _byte_planes(base), base.dtype), base_state, delta)
+
+
+def _to_pinned_host(state):
+  """Starts copying the arrays of `state` to pinned host memory and returns the host arrays."""
+  arrays, treedef = jax.tree.flatten(state)
+  is_array = [isinstance(x, jax.Array) for x in arrays]
+  device_arrays = [x for x, a in zip(arrays, is_array) if a]
+  host_arrays = iter(jax.device_put(device_arrays, [x.sharding.with_memory_kind("pinned_host") for x in device_arrays]))
+  return jax.tree.unflatten(treedef, [next(host_arrays) if a else x for x, a in zip(arrays, is_array)])
+
+
+def _abstract_xor_delta(abstract_state):
+  """The abstract arrays of the XOR delta of a state, sharded like the arrays of the state."""
+
+  def abstract_planes(x):
+    sharding = getattr(x, "sharding", None)
+    if isinstance(sharding, jax.sharding.NamedSharding):
+      sharding = jax.sharding.NamedSharding(sharding.mesh, jax.sharding.PartitionSpec(None, *sharding.spec))
+    return jax.ShapeDtypeStruct((x.dtype.itemsize, *x.shape), jnp.uint8, sharding=sharding)
+
+  return jax.tree.map(abstract_planes, abstract_state)
+
+
+class DeltaCheckpointManager(CheckpointManager):
+  """A CheckpointManager that saves the full state every `base_period` steps, and only its delta in between.
+
+  A delta checkpoint holds a `delta` item instead of `items`: the bitwise XOR of every array of the state with
+  the same array of the last full checkpoint, stored as byte planes. The sign and exponent bits of parameters
+  and optimizer moments rarely change between checkpoints, so their planes are mostly zeros and compress away.
+  The delta is exact, and restoring a delta checkpoint applies it to the latest full checkpoint before it.
+
+  The base state is kept as a copy in pinned host memory, so that it does not take device memory.
+  """
+
+  def __init__(self, *args, base_period: int, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.base_period = base_period
+    self._base_step = None
+    self._base_state = None
+
+  def _set_base(self, step: int, state):
+    # The train step donates the buffers of the state, so the base is a copy.
+    self._base_step = step
+    self._base_state = _to_pinned_host(state)
+
+  def is_delta_step(self, step: int) -> bool:
+    return (self.directory / str(step) / "delta").exists()
+
+  def base_step(self, step: int) -> int:
+    """The step of the full checkpoint that the delta checkpoint of `step` applies to."""
+    base_steps = [s for s in self.all_steps() if s < step and (self.directory / str(s) / "items").exists()]
+    if not base_steps:
+      raise FileNotFoundError(f"No full checkpoint before the delta checkpoint of step {step} in {self.directory}.")
+    return max(base_steps)
+
+  def state_item_to_save(self, step: int, state, force: bool = False) -> tuple[str, Any]:
+    """The item name and the pytree to save for `state` at `step`: the state itself or its XOR delta."""
+    if not force and not self.should_save(step):
+      return "items", state
+    if self._base_state is None or step % self.base_period == 0:
+      self._set_base(step, state)
+      return "items", state
+    return "delta", _xor_delta(state, self._base_state)
+
+  def restore(self, step, items=None, restore_kwargs=None, directory=None, args=None):
+    """Restores like `CheckpointManager.restore`, applying the delta of a delta checkpoint to its base."""
+    step = self.latest_step() if step is None else step
+    if not isinstance(args, Composite) or "items" not in args:
+      return super().restore(step, items, restore_kwargs, directory, args)
+    if not self.is_delta_step(step):
+      restored = super().restore(step, args=args, directory=directory)
+      self._set_base(step, restored["items"])
+      return restored
+
+    abstract_delta = _abstract_xor_delta(args["items"].item)
+    delta_args = ocp.args.PyTreeRestore(
+        item=abstract_delta, restore_args=ocp.checkpoint_utils.construct_restore_args(abstract_delta)
+    )
+    other_args = {k: v for k, v in args.items() if k != "items"}
+    restored = super().restore(step, args=Composite(delta=delta_args, **other_args), directory=directory)
+    base_step = self.base_step(step)
+    max_logging.log(f"restoring the delta checkpoint of step {step} onto the full checkpoint of step {base_step}")
+    base_state = super().restore(base_step, args=Composite(items=args["items"]), directory=directory)["items"]
+    self._set_base(base_step, base_state)
+    state = _apply_xor_delta(base_state, restored["delta"])
+    return Composite(items=state, **{k: restored[k] for k in other_args})
+
+
+class _IteratorStateSnapshot:
+  """The state of a data iterator when it was snapshotted, saved by `GrainCheckpointHandler` like the iterator."""
+
+  def __init__(self, iterator):
+    state = iterator.get_state()
+    if isinstance(iterator, grain.DatasetIterator):
+      state = json.dumps(state, indent=4).encode()
+    self._state = state
+
+  def get_state(self) -> bytes:
+    return self._state
+
+
+class HostSnapshotCheckpointManager(CheckpointManager):
+  """A CheckpointManager whose saves snapshot the state to pinned host memory and write it in the background.
+
+  `save` starts asynchronous device-to-host copies of the state and returns without waiting for the step that
+  produced it, so the training loop is not stalled by the save. A background thread then saves the host copy with
+  the regular `CheckpointManager.save`. At most two snapshots are held in host memory: the one being written and
+  the next one, and a save only blocks when both are in use. The state of the data iterators is captured at the
+  time of the snapshot, so that it matches the step of the saved state.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self._free_snapshots = threading.Semaphore(2)
+    self._snapshots = queue.Queue()
+    self._pending = 0
+    self._pending_lock = threading.Condition()
+    self._error = None
+    self._writer = threading.Thread(target=self._write_snapshots, daemon=True, name="checkpoint_snapshot_writer")
+    self._writer.start()
+
+  def _write_snapshots(self):
+    """Saves the queued snapshots in order, until the queue yields None."""
+    while (snapshot := self._snapshots.get()) is not None:
+      step, args, force = snapshot
+      try:
+        super().save(step, args=args, force=force)
+        super().wait_until_finished()
+      except Exception as e:  # pylint: disable=broad-exception-caught
+        self._error = e
+      finally:
+        del snapshot, args
+        self._free_snapshots.release()
+        with self._pending_lock:
+          self._pending -= 1
+          self._pending_lock.notify_all()
+
+  def _raise_error(self):
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+  def save(self, step, items=None, save_kwargs=None, metrics=None, force=False, args=None, custom_metadata=None):
+    """Snapshots the items of `args` to host memory and queues them to be saved, returning if a save is queued."""
+    self._raise_error()
+    if args is None or items is not None or save_kwargs is not None or metrics is not None or custom_metadata:
+      raise ValueError("HostSnapshotCheckpointManager only supports saving `args`.")
+    if not force and not self.should_save(step):
+      return False
+    self._free_snapshots.acquire()  # pylint: disable=consider-using-with
+    try:
+      snapshot_args = {}
+      for name, item_args in args.items():
+        if isinstance(item_args, ocp.args.PyTreeSave):
+          item_args = dataclasses.replace(item_args, item=_to_pinned_host(item_args.item))
+        elif isinstance(item_args, GrainCheckpointSave):
+          iterators = item_args.item
+          if isinstance(iterators, list):
+            iterators = [(_IteratorStateSnapshot(it), index, count) for it, index, count in iterators]
+          else:
+            iterators = _IteratorStateSnapshot(iterators)
+          item_args = GrainCheckpointSave(item=iterators)
+        snapshot_args[name] = item_args
+    except BaseException:
+      # Nothing is queued that would release the snapshot.
+      self._free_snapshots.release()
+      raise
+    with self._pending_lock:
+      self._pending += 1
+    self._snapshots.put((step, Composite(**snapshot_args), force))
+    return True
+
+  def wait_until_finished(self):
+    """Waits until the queued snapshots are saved."""
+    if threading.current_thread() is self._writer:
+      # Called by `CheckpointManager.save` in the writer thread.
+      super().wait_until_finished()
+      return
+    with self._pending_lock:
+      self._pending_lock.wait_for(lambda: self._pending == 0)
+    super().wait_until_finished()
+    self._raise_error()
+
+  def close(self):
+    self.wait_until_finished()
+    self._snapshots.put(None)
+    self._writer.join()
+    super().close()
+
+
 def _is_remote_iterator(data_iterator):
   """Check if data_iterator is a RemoteIterator or contains RemoteIterator instances."""
   if isinstance(data_iterator, RemoteIterator):
@@ -198,8 +431,15 @@ def create_orbax_checkpoint_manager(
     use_zarr3: bool = True,
     enable_continuous_checkpointing: bool = False,
     max_num_checkpoints_to_keep: int = 10,
+    delta_checkpoint_base_period: int = 0,
+    enable_host_snapshot: bool = False,
 ):
-  """Returns specified Orbax (async or not) CheckpointManager or None if checkpointing is disabled."""
+  """Returns specified Orbax (async or not) CheckpointManager or None if checkpointing is disabled.
+
+  With a positive `delta_checkpoint_base_period`, returns a `DeltaCheckpointManager` that saves the full state
+  every `delta_checkpoint_base_period` steps and deltas at the other checkpoint steps. With `enable_host_snapshot`,
+  returns a `HostSnapshotCheckpointManager` that snapshots the state to host memory and saves it in the background.
+  """
   if not enable_checkpointing:
     max_logging.log("Checkpointing disabled, not creating checkpoint manager.")
     return None
@@ -211,6 +451,10 @@ def create_orbax_checkpoint_manager(
   # we need to use ocdbt and zarr3 to control max file size in the checkpoint
   item_handlers = {"items": PyTreeCheckpointHandler(use_ocdbt=use_ocdbt, use_zarr3=use_zarr3)}
 
+  if delta_checkpoint_base_period > 0:
+    item_names += ("delta",)
+    item_handlers["delta"] = PyTreeCheckpointHandler(use_ocdbt=use_ocdbt, use_zarr3=use_zarr3)
+
   if dataset_type == "grain":
     item_names += ("iter",)
     item_handlers["iter"] = GrainCheckpointHandler()
@@ -230,7 +474,14 @@ def create_orbax_checkpoint_manager(
     preservation_policy = preservation_policy_lib.LatestN(
         max_num_checkpoints_to_keep
     )
-  manager = CheckpointManager(
+  manager_kwargs = {}
+  manager_cls = CheckpointManager
+  if delta_checkpoint_base_period > 0:
+    manager_cls = DeltaCheckpointManager
+    manager_kwargs["base_period"] = delta_checkpoint_base_period
+  elif enable_host_snapshot:
+    manager_cls = HostSnapshotCheckpointManager
+  manager = manager_cls(
       p,
       item_names=item_names,
       item_handlers=item_handlers,
@@ -241,6 +492,7 @@ def create_orbax_checkpoint_manager(
           preservation_policy=preservation_policy,
           ),
       logger=orbax_logger,
+      **manager_kwargs,
   )
 
   max_logging.log("Checkpoint manager created!")
@@ -353,8 +605,19 @@ def cleanup_replicator_error_file(error_file: str):
     max_logging.log("replicator_error_handler: Failed to remove replicator errors file:" f" {e}")
 
 
-def print_save_message(step, async_checkpointing):
-  if async_checkpointing:
+def checkpoint_size_bytes(checkpoint_manager, step: int) -> int:
+  """The number of bytes in the directory of the checkpoint of `step`."""
+
+  def size(path):
+    return sum(size(p) if p.is_dir() else p.stat().length for p in path.iterdir())
+
+  return size(checkpoint_manager.directory / str(step))
+
+
+def print_save_message(step, async_checkpointing, host_snapshot=False):
+  if host_snapshot:
+    max_logging.log(f"Queued a host snapshot of step {step} to be saved in the background")
+  elif async_checkpointing:
     max_logging.log(f"Started an asynchronous checkpoint save for step {step}")
   else:
     max_logging.log(f"Saved a checkpoint at step {step}.")
@@ -693,7 +956,9 @@ def maybe_save_checkpoint(checkpoint_manager, state, config, data_iterator, step
   try:
     checkpoint_saved = save_checkpoint(checkpoint_manager, actual_step, state, config, data_iterator, force_ckpt_save)
     if checkpoint_saved:
-      print_save_message(actual_step, config.async_checkpointing)
+      print_save_message(
+          actual_step, config.async_checkpointing, isinstance(checkpoint_manager, HostSnapshotCheckpointManager)
+      )
   except Exception as e:
     raise exceptions.StopTraining(f"Checkpointing failed. {str(e)}") from e
 
@@ -708,7 +973,7 @@ def maybe_save_checkpoint(checkpoint_manager, state, config, data_iterator, step
 
 def save_checkpoint(checkpoint_manager, step, state, config=None, data_iterator=None, force=False):
   """Wrapper for saving checkpoint."""
-  if config and config.enable_checkpointing:
+  if config and config.enable_checkpointing and not isinstance(checkpoint_manager, HostSnapshotCheckpointManager):
     if (
         force
         or (step % config.checkpoint_period == 0)
@@ -729,12 +994,16 @@ def save_checkpoint(checkpoint_manager, step, state, config=None, data_iterator=
       config.checkpoint_storage_target_data_file_size_bytes if config else DEFAULT_OCDBT_TARGET_DATA_FILE_SIZE
   )
 
+  item_name = "items"
+  if isinstance(checkpoint_manager, DeltaCheckpointManager):
+    item_name, state = checkpoint_manager.state_item_to_save(step, state, force)
+
   checkpoint_args = ocp.args.PyTreeSave(
       item=state,
       save_args=jax.tree.map(lambda _: ocp.SaveArgs(chunk_byte_size=chunk_byte_size), state),
       ocdbt_target_data_file_size=chunk_byte_size,
   )
-  save_args_composite = {"items": checkpoint_args}
+  save_args_composite = {item_name: checkpoint_args}
 
   if (
       config
@@ -283,6 +283,16 @@ class Checkpointing(BaseModel):
       True, description="If True, saves a final checkpoint upon training completion."
   )
   enable_continuous_checkpointing: bool = Field(False, description="If True, enables continuous checkpointing.")
+  delta_checkpoint_base_period: NonNegativeInt = Field(
+      0,
+      description="Save the full state every this many steps, and only its XOR delta against the last full "
+      "checkpoint at the other checkpoint steps. Must be a multiple of `checkpoint_period`. 0 to disable.",
+  )
+  checkpoint_host_snapshot: bool = Field(
+      False,
+      description="Snapshot the state to pinned host memory when saving a checkpoint and write it from a background "
+      "thread, without stalling the training loop.",
+  )
 
 
 class OrbaxStorage(BaseModel):
@@ -457,6 +467,10 @@ class Attention(BaseModel):
   use_post_attn_norm: bool = Field(False, description="Apply LayerNorm after the attention block.")
   use_post_ffw_norm: bool = Field(False, description="Apply LayerNorm after the feed-forward block.")
   use_ragged_attention: bool = Field(False, description="Whether to use ragged attention kernels.")
+  use_local_window_kv_cache: bool = Field(
+      False,
+      description="Size the AR KV cache of local_sliding and chunk attention layers to their window, as a ring buffer.",
+  )
   use_tokamax_gmm: bool = Field(
       False,
       description="Whether to use the Tokamax library for GMM kernel implementation.",
@@ -541,6 +555,21 @@ class PagedAttention(BaseModel):
   pagedattn_tokens_per_page: int = Field(32, description="Number of tokens each page can hold.")
   pagedattn_pages_per_compute_block: int = Field(4, description="Number of pages processed together in pallas kernels.")
   pagedattn_max_pages_per_group: int = Field(-1, description="Max pages per request; -1 defaults to max_target_length.")
+  pagedattn_free_list_allocator: bool = Field(
+      False,
+      description="Track free pages with an on-device free stack so allocating k pages costs O(k) instead of O(num_pages).",
+  )
+  pagedattn_preemption_mode: Literal["recompute", "swap"] = Field(
+      "swap",
+      description="How pages of sequences preempted under memory pressure are freed: dropped to be recomputed on resume,"
+      " or swapped to host memory and restored on resume.",
+  )
+  pagedattn_kv_quant_dtype: Literal["", "int8", "fp8"] = Field(
+      "", description="Storage dtype of quantized KV pages; empty to store them unquantized in `dtype`."
+  )
+  pagedattn_kv_quant_granularity: Literal["token", "page"] = Field(
+      "token", description="Scale granularity of quantized KV pages: per KV head and token, or per KV head and page."
+  )
   # Alignment of head_dim to the nearest multiple of this value, set to 0 to disable alignment. On
   # TPUs, the head_dim is padded to the nearest multiple of 128.
   pagedattn_head_dim_alignment: int = Field(128, description="Alignment of head_dim to the nearest multiple.")
@@ -880,9 +909,10 @@ class DatasetGeneral(BaseModel):
       True,
       description="Whether to pack multiple short examples into a single sequence.",
   )
-  grain_packing_type: Literal["first_fit", "best_fit", "concat_then_split"] = Field(
+  grain_packing_type: Literal["first_fit", "best_fit", "concat_then_split", "numpy_first_fit"] = Field(
       "first_fit",
-      description="Packing type when using Grain pipeline. 'first_fit', 'best_fit' or 'concat_then_split'.",
+      description="Packing type when using Grain pipeline. 'first_fit', 'best_fit', 'concat_then_split' or"
+      " 'numpy_first_fit', the MaxText first-fit packer with array-backed bin state.",
   )
   max_segments_per_seq: int = Field(
       -1,
@@ -891,6 +921,10 @@ class DatasetGeneral(BaseModel):
   num_epoch: int = Field(1, description="Number of epochs to train for.")
   expansion_factor_real_data: float = Field(-1.0, description="Factor for partial data loading on hosts.")
   reuse_example_batch: int = Field(0, description="For performance testing, repeatedly uses the same batch.")
+  data_prefetch_depth: NonNegativeInt = Field(
+      0,
+      description="Number of batches read and sharded ahead of the training step on a background thread. 0 disables.",
+  )
   generate_padding_batch_train: bool = Field(
       False,
       description="Whether to generate a padding batch for training to ensure divisibility.",
@@ -1026,6 +1060,11 @@ class Optimizer(BaseModel):
   gradient_accumulation_steps: PositiveInt = Field(
       1, description="Number of steps to accumulate gradients before updating."
   )
+  gradient_accumulation_overlap_reduction_axes: list[str] = Field(
+      [],
+      description="Mesh axes whose gradient reduction is reduce-scattered from every microbatch inside the gradient"
+      " accumulation loop, overlapping with the compute of the next microbatches, instead of once after the loop.",
+  )
   gradient_clipping_threshold: NonNegativeFloat = Field(
       1.0, description="The threshold for gradient clipping. 0 disables clipping."
   )
@@ -1152,6 +1191,33 @@ class Decoding(BaseModel):
   decode_sampling_nucleus_p: int | float = Field(-1.0, description="Nucleus (top-p) sampling probability. -1 to disable.")
   decode_sampling_top_k: int = Field(0, description="Top-k sampling value. 0 to disable.")
   decode_sampling_temperature: float = Field(1.0, description="Sampling temperature.")
+  decode_sampling_per_slot: bool = Field(
+      False,
+      description="Store temperature/top-k/top-p/seed per decode slot so one generate step can serve requests with "
+      "different sampling parameters.",
+  )
+  decode_sampling_per_slot_max_top_k: NonNegativeInt = Field(
+      256,
+      description="Upper bound on the top-k/top-p candidates of a slot, whose logits are sorted when a slot has "
+      "top-k or top-p filtering. 0 sorts the full vocabulary.",
+  )
+  decode_state_logits: bool = Field(
+      True,
+      description="Keep the full-vocabulary logits of the last step in the decode state. When False, only the sampled "
+      "tokens and their log probabilities are kept.",
+  )
+  decode_state_top_logprobs: NonNegativeInt = Field(
+      0,
+      description="Number of most likely tokens per slot whose log probabilities are computed on device and kept in "
+      "the decode state. 0 to disable.",
+  )
+  speculative_num_draft_tokens: NonNegativeInt = Field(
+      0, description="Number of draft tokens proposed per speculative decoding step. 0 disables speculative decoding."
+  )
+  speculative_draft_overrides: dict[str, Any] = Field(
+      default_factory=dict,
+      description="Config overrides of the draft model of speculative decoding (e.g., {'model_name': 'llama3.1-8b'}).",
+  )
 
 
 class InferenceLayout(BaseModel):
@@ -1178,7 +1244,10 @@ class InferenceBenchmark(BaseModel):
   inference_microbenchmark_prefill_lengths: str = Field(
       "64,128,256,512,1024", description="Prefill lengths to benchmark."
   )
-  inference_microbenchmark_stages: str = Field("prefill,generate", description="Stages to benchmark.")
+  inference_microbenchmark_stages: str = Field(
+      "prefill,generate",
+      description="Comma-separated stages to benchmark: prefill, prefill-multisampling, generate and speculative.",
+  )
   inference_microbenchmark_loop_iters: int = Field(10, description="Number of iterations for the benchmark loop.")
   inference_microbenchmark_log_file_path: PathStr = Field("", description="Path to log benchmark results.")
   inference_microbenchmark_num_samples: list[int] = Field([1, 2, 3, 4, 5], description="Number of samples to benchmark.")
@@ -1187,7 +1256,7 @@ class InferenceBenchmark(BaseModel):
 
 
 class PrefixCaching(BaseModel):
-  """Configuration for Prefix Caching in JetStream."""
+  """Configuration for prefix caching in JetStream, OfflineEngine and the API server."""
 
   enable_prefix_caching: bool = Field(False, description="Enable prefix caching.")
   prefix_caching_hbm_byte: int = Field(10_000_000_000, description="HBM memory allocation for prefix caching in bytes.")
@@ -1529,7 +1598,7 @@ class DerivedValues(BaseModel):
 
   num_target_devices: None | int = Field(
       None,
-      description="The number of devices computed from topology in train_compile or jax.devices() in train",
+      description="The number of devices computed from topology in train_compile or jax.devices() in train, if not set.",
   )
 
   global_batch_size_to_train_on: None | int = Field(
@@ -1809,11 +1878,13 @@ class MaxTextConfig(
       else:
         return len(jax.devices())
 
-    self.num_target_devices = 1  # Default for validation when JAX is not initialized
-    try:
-      self.num_target_devices = get_num_target_devices()
-    except (RuntimeError, IndexError):
-      logger.warning("JAX device system not available for config validation. Assuming 1 device.")
+    # A set value is kept, e.g. for a config of a subset of the devices.
+    if self.num_target_devices is None:  # pylint: disable=access-member-before-definition
+      self.num_target_devices = 1  # Default for validation when JAX is not initialized
+      try:
+        self.num_target_devices = get_num_target_devices()
+      except (RuntimeError, IndexError):
+        logger.warning("JAX device system not available for config validation. Assuming 1 device.")
 
     # Automatically determine number of slices if not specified.
     raw_keys_for_num_slices = {
@@ -2033,6 +2104,23 @@ class MaxTextConfig(
         raise ValueError("`local_checkpoint_directory` must be set for emergency checkpointing.")
       if self.local_checkpoint_period <= 0:
         raise ValueError("`local_checkpoint_period` must be > 0 for emergency checkpointing.")
+    if self.delta_checkpoint_base_period > 0:
+      if self.delta_checkpoint_base_period % self.checkpoint_period != 0:
+        raise ValueError("`delta_checkpoint_base_period` must be a multiple of `checkpoint_period`.")
+      if self.enable_emergency_checkpoint or self.enable_multi_tier_checkpointing or self.enable_continuous_checkpointing:
+        raise ValueError("Delta checkpoints are not supported with emergency, multi-tier or continuous checkpointing.")
+      deltas_per_base = self.delta_checkpoint_base_period // self.checkpoint_period
+      # The latest full checkpoint, the deltas until the next one and a forced save, e.g. on completion.
+      min_num_checkpoints_to_keep = deltas_per_base + 1
+      if self.max_num_checkpoints_to_keep is not None and self.max_num_checkpoints_to_keep < min_num_checkpoints_to_keep:
+        raise ValueError(
+            f"`max_num_checkpoints_to_keep` must be at least {min_num_checkpoints_to_keep} with delta checkpoints, so "
+            "that the latest full checkpoint is kept while delta checkpoints refer to it."
+        )
+    if self.checkpoint_host_snapshot and (
+        self.delta_checkpoint_base_period > 0 or self.enable_emergency_checkpoint or self.enable_multi_tier_checkpointing
+    ):
+      raise ValueError("Host snapshot checkpoints are not supported with delta, emergency or multi-tier checkpointing.")
     if self.moba and self.attention not in ("dot_product"):
       raise ValueError("MoBA is only supported with dot_product attention.")
     if self.attention_type == AttentionType.CHUNK.value and (
@@ -2043,6 +2131,8 @@ class MaxTextConfig(
         not isinstance(self.sliding_window_size, int) or self.sliding_window_size <= 0
     ):
       raise ValueError("`sliding_window_size` must be an integer > 0 for 'local_sliding' attention.")
+    if self.use_local_window_kv_cache and self.use_ragged_attention:
+      raise ValueError("`use_local_window_kv_cache` is not supported with ragged attention.")
     if self.quantize_kvcache and not self.kv_quant_axis:
       raise ValueError("`kv_quant_axis` cannot be empty when quantize_kvcache is True.")
     if (
@@ -2095,6 +2185,13 @@ class MaxTextConfig(
         )
       if self.quantization:
         raise ValueError("Quantization is not supported with 'explicit' sharding.")
+      if self.gradient_accumulation_overlap_reduction_axes:
+        raise ValueError("`gradient_accumulation_overlap_reduction_axes` is not supported with 'explicit' sharding.")
+    unknown_axes = set(self.gradient_accumulation_overlap_reduction_axes) - set(self.mesh_axes)
+    if unknown_axes:
+      raise ValueError(
+          f"`gradient_accumulation_overlap_reduction_axes` {sorted(unknown_axes)} are not in `mesh_axes` {self.mesh_axes}."
+      )
     if (
         self.per_device_batch_size > 0
         and (self.per_device_batch_size * self.max_target_length) % self.num_vocab_tiling != 0
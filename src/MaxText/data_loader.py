@@ -15,6 +15,10 @@
 # pytype: disable=unsupported-operands
 """Module to load data for training."""
 
+import queue
+import threading
+import time
+
 import jax
 import jax.numpy as jnp
 from jax.experimental import checkify
@@ -27,9 +31,83 @@ from MaxText.utils.goodput_utils import (
 )
 
 
+class ReadAheadIterator:
+  """
+  Wraps a checkpointable (Grain) local iterator that the prefetcher reads ahead of training.
+
+  Checkpoints save the state after the last batch handed to the training loop,
+  not after the last batch read by the prefetcher, so restored runs do not skip
+  the batches that were still in the prefetch queue. The state has the format of
+  the wrapped `iterator`, which `GrainCheckpointHandler` looks through.
+  """
+
+  def __init__(self, iterator):
+    self.iterator = iterator
+    self.consumed_state = iterator.get_state()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    return next(self.iterator)
+
+  def get_state(self):
+    return self.consumed_state
+
+  def set_state(self, state):
+    self.iterator.set_state(state)
+    self.consumed_state = state
+
+
+class _BatchPrefetcher:
+  """Calls `fetch_fn` on a background thread and keeps up to `depth` results ready."""
+
+  def __init__(self, fetch_fn, depth: int):
+    self._fetch_fn = fetch_fn
+    self._queue = queue.Queue(maxsize=depth)
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name="data_prefetch", daemon=True)
+    self._thread.start()
+
+  def _run(self):
+    """Fetches results until stopped; an exception is queued and ends the thread."""
+    while not self._stop.is_set():
+      try:
+        item = (self._fetch_fn(), None)
+      except Exception as e:  # pylint: disable=broad-except
+        item = (None, e)
+      while not self._stop.is_set():
+        try:
+          self._queue.put(item, timeout=0.1)
+          break
+        except queue.Full:
+          continue
+      if item[1] is not None:
+        return
+
+  def qsize(self) -> int:
+    """Returns the number of results ready to be consumed."""
+    return self._queue.qsize()
+
+  def get(self):
+    """Returns the next result of `fetch_fn`, re-raising its exception if it failed."""
+    result, error = self._queue.get()
+    if error is not None:
+      raise error
+    return result
+
+  def close(self):
+    self._stop.set()
+    self._thread.join()
+
+
 class DataLoader:
   """
   Loads preprocessed data for training.
+
+  With `data_prefetch_depth > 0`, a background thread reads and shards up to that
+  many batches ahead of the training loop, so reading input overlaps with the
+  training step instead of adding to it.
   """
 
   def __init__(self, config, mesh, data_iterator, goodput_recorder):
@@ -43,6 +121,10 @@ class DataLoader:
       self.data_iterator = data_iterator
     self.last_batch = None
     self.input_data_shardings = get_input_data_sharding(config, mesh)
+    # Started by the first load, after the iterator state may have been restored from a checkpoint.
+    self.prefetcher = None
+    self.prefetch_queue_depth = 0
+    self.data_wait_time = 0.0
 
   def update_data_iterator(self):
     """Update to the next data iterator in the list, if applicable."""
@@ -54,11 +136,15 @@ class DataLoader:
     """Loads the next batch w/o sharding. Can keep reusing the same batch for performance reasons."""
     with maybe_record_goodput(self.goodput_recorder, GoodputEvent.DATA_LOADING):
       try:
+        start = time.time()
         if self.config.reuse_example_batch and self.last_batch:
           example_batch = self.last_batch
+        elif self.config.data_prefetch_depth > 0 and not self.config.reuse_example_batch:
+          example_batch = self._next_prefetched_batch()
         else:
           example_batch = next(self.data_iterator)
           self.update_data_iterator()
+        self.data_wait_time += time.time() - start
         self.last_batch = example_batch
         self.check_example_batch()
       except Exception as e:  # pylint: disable=broad-except
@@ -68,6 +154,46 @@ class DataLoader:
           raise exceptions.StopTraining(f"`load_next_batch()` failed with {type(e)} exception: ({e}).")
     return self.last_batch
 
+  def _prefetch_batch(self):
+    """Reads and shards the next batch on the prefetch thread."""
+    data_iterator = self.data_iterator
+    example_batch = next(data_iterator)
+    self.update_data_iterator()
+    example_batch = jax.device_put(example_batch, self.input_data_shardings)
+    local_iterator = getattr(data_iterator, "local_iterator", None)
+    if isinstance(local_iterator, ReadAheadIterator):
+      return example_batch, local_iterator, local_iterator.iterator.get_state()
+    return example_batch, None, None
+
+  def _next_prefetched_batch(self):
+    """Returns the next batch of the prefetch thread, starting it on the first call."""
+    if self.prefetcher is None:
+      data_iterators = getattr(self, "data_iterator_list", [self.data_iterator])
+      for data_iterator in data_iterators:
+        local_iterator = getattr(data_iterator, "local_iterator", None)
+        if hasattr(local_iterator, "get_state") and not isinstance(local_iterator, ReadAheadIterator):
+          data_iterator.local_iterator = ReadAheadIterator(local_iterator)
+      self.prefetcher = _BatchPrefetcher(self._prefetch_batch, self.config.data_prefetch_depth)
+    self.prefetch_queue_depth = self.prefetcher.qsize()
+    example_batch, local_iterator, state = self.prefetcher.get()
+    if local_iterator is not None:
+      local_iterator.consumed_state = state
+    return example_batch
+
+  def get_metrics(self):
+    """Returns data loading metrics since the previous call, for `MetricLogger`."""
+    metrics = {"perf/data_wait_time_seconds": self.data_wait_time}
+    if self.prefetcher is not None:
+      metrics["perf/data_prefetch_queue_depth"] = self.prefetch_queue_depth
+    self.data_wait_time = 0.0
+    return metrics
+
+  def close(self):
+    """Stops the prefetch thread, if any."""
+    if self.prefetcher is not None:
+      self.prefetcher.close()
+      self.prefetcher = None
+
   def load_next_batch(self, *args, **kwargs):
     """Loads the next batch with sharding hint"""
     return jax.device_put(
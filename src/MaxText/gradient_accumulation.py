@@ -19,7 +19,7 @@ import jax.numpy as jnp
 from jax.sharding import NamedSharding
 
 from MaxText.common_types import ShardMode
-from MaxText.sharding import maybe_shard_with_name
+from MaxText.sharding import add_axes_to_sharding, maybe_shard_with_name
 
 
 def gradient_accumulation_loss_and_grad(
@@ -43,11 +43,19 @@ def gradient_accumulation_loss_and_grad(
   parameters are cast to bf16 and sharded *before* the accumulation loop
   to perform the all-gather in lower precision.
 
+  The gradients are partial sums over the mesh axes that shard the batch. By
+  default XLA reduces them once, after the loop. The mesh axes listed in
+  `gradient_accumulation_overlap_reduction_axes` are instead reduce-scattered
+  from the gradients of every microbatch inside the loop, so that the
+  collectives overlap with the compute of the next microbatches, and the
+  accumulated gradients are kept sharded over these axes until the end.
+
   Args:
       _loss_fn: The loss function to differentiate. Its signature is expected
           to be: `(model, config, data, dropout_rng, params, *extra_args, is_train=True)`.
       config: Model and training configuration object. Must contain
-          `gradient_accumulation_steps` and `shard_optimizer_over_data`.
+          `gradient_accumulation_steps`, `shard_optimizer_over_data` and
+          `gradient_accumulation_overlap_reduction_axes`.
       model: The model module.
       params: The model parameters (PyTree).
       params_shardings: The sharding constraints for the parameters (PyTree).
@@ -73,6 +81,14 @@ def gradient_accumulation_loss_and_grad(
     grad_shardings = jax.tree.map(update_sharding_for_unreduced, params_shardings)
   else:
     ga_params_shardings = grad_shardings = params_shardings
+  if config.gradient_accumulation_overlap_reduction_axes:
+    grad_shardings = jax.tree.map(
+        lambda param, sharding: add_axes_to_sharding(
+            param, sharding, config.gradient_accumulation_overlap_reduction_axes
+        ),
+        params,
+        grad_shardings,
+    )
   # When using Zero-1 optimizer sharding, cast params to lower precision and apply sharding constraints
   # so that all-gather is done once in the lower precision before the gradient accumulation loop
   if config.shard_optimizer_over_data:
@@ -92,6 +108,8 @@ def gradient_accumulation_loss_and_grad(
   def accumulate_gradient(acc_grad_and_loss, data):
     ga_params = acc_grad_and_loss["ga_params"]
     (_, aux), cur_batch_gradient = grad_func(model, config, data, dropout_rng, ga_params, *extra_dpo_args, is_train=True)
+    if config.gradient_accumulation_overlap_reduction_axes:
+      cur_batch_gradient = jax.tree.map(_maybe_shard_with_name, cur_batch_gradient, grad_shardings)
     acc_grad_and_loss["loss"] += aux["total_loss"]
     acc_grad_and_loss["moe_lb_loss"] += aux["moe_lb_loss"]
     acc_grad_and_loss["mtp_loss"] += aux["mtp_loss"]
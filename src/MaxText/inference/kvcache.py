@@ -29,7 +29,7 @@ from aqt.jax.v2.flax import aqt_flax
 from MaxText.layers import nnx_wrappers
 from MaxText.layers.initializers import variable_to_logically_partitioned
 
-from MaxText.common_types import Array, AxisNames, AxisIdxes, Config, CACHE_BATCH_PREFILL, DType, MODEL_MODE_PREFILL, MODEL_MODE_TRAIN, MODEL_MODE_AUTOREGRESSIVE, CACHE_HEADS_NONE, DECODING_ACTIVE_SEQUENCE_INDICATOR
+from MaxText.common_types import Array, AttentionType, AxisNames, AxisIdxes, Config, CACHE_BATCH_PREFILL, DType, MODEL_MODE_PREFILL, MODEL_MODE_TRAIN, MODEL_MODE_AUTOREGRESSIVE, CACHE_HEADS_NONE, DECODING_ACTIVE_SEQUENCE_INDICATOR
 from MaxText.common_types import CACHE_BATCH, CACHE_SEQUENCE, CACHE_HEADS, CACHE_KV, CACHE_SCALE_BATCH, CACHE_SCALE_SEQUENCE, CACHE_SCALE_HEADS, CACHE_SCALE_KV
 
 
@@ -174,6 +174,8 @@ def kv_cache_as_linen(
     key_axis_order: AxisIdxes = (2, 0, 1, 3),
     use_chunked_prefill: bool = False,
     model_mode: str = MODEL_MODE_PREFILL,
+    attention_type: AttentionType = AttentionType.GLOBAL,
+    local_window_size: int | None = None,
     name: str | None = None,
 ):
   """Initializes the KVCache module and returns it as a Linen module.
@@ -198,6 +200,11 @@ def kv_cache_as_linen(
     key_axis_order: The axis order for the key.
     use_chunked_prefill: Whether to use chunked prefill.
     model_mode: The model mode.
+    attention_type: The attention type of the layer, LOCAL_SLIDING or CHUNK
+      for a `local_window_size` cache.
+    local_window_size: The sliding window or chunk size of a local attention
+      layer, to keep only the AR cache entries in the window. None for a full
+      AR cache.
     name: The name of the Linen module.
 
   Returns:
@@ -224,6 +231,8 @@ def kv_cache_as_linen(
       key_axis_order=key_axis_order,
       use_chunked_prefill=use_chunked_prefill,
       model_mode=model_mode,
+      attention_type=attention_type,
+      local_window_size=local_window_size,
       metadata_fn=variable_to_logically_partitioned,
       name=name,
       abstract_init=False,
@@ -231,7 +240,16 @@ def kv_cache_as_linen(
 
 
 class KVCache(nnx.Module):
-  """Implementation of the KVCache."""
+  """Implementation of the KVCache.
+
+  The AR cache is a ring buffer written at `cache_ar_index`. For local
+  attention layers with `local_window_size`, it holds only the last
+  `local_window_size` tokens, which are all a LOCAL_SLIDING or CHUNK layer can
+  attend to, and autoregression masks the cached tokens outside the window of
+  the decoded token in the returned segment ids. With speculative decoding, it
+  has `speculative_num_draft_tokens` more positions, so that a verified block of
+  draft tokens never overwrites the oldest tokens of a full-length sequence.
+  """
 
   def __init__(
       self,
@@ -261,6 +279,9 @@ class KVCache(nnx.Module):
       key_axis_order: AxisIdxes = (2, 0, 1, 3),
       use_chunked_prefill: bool = False,
       model_mode: str = MODEL_MODE_PREFILL,
+      attention_type: AttentionType = AttentionType.GLOBAL,
+      local_window_size: int | None = None,
+      speculative_num_draft_tokens: int = 0,
       *,
       # Not used in KVCache but passed in by nnx_wrappers.to_linen.
       # TODO: Remove when bridge no longer needed
@@ -288,6 +309,13 @@ class KVCache(nnx.Module):
       key_axis_order: The axis order for the key.
       model_mode: The model mode.
       use_chunked_prefill: Whether to use chunked prefill.
+      attention_type: The attention type of the layer, LOCAL_SLIDING or CHUNK
+        for a `local_window_size` cache.
+      local_window_size: The sliding window or chunk size of a local attention
+        layer, to keep only the AR cache entries in the window. None for a full
+        AR cache.
+      speculative_num_draft_tokens: The number of draft tokens verified per
+        speculative decoding step, added to the length of a full AR cache.
       rngs: The random number generators for initialization.
     """
     self.max_prefill_length = max_prefill_length
@@ -309,6 +337,11 @@ class KVCache(nnx.Module):
     self.key_axis_order = key_axis_order
     self.model_mode = model_mode
     self.use_chunked_prefill = use_chunked_prefill
+    if local_window_size is not None and attention_type not in (AttentionType.LOCAL_SLIDING, AttentionType.CHUNK):
+      raise ValueError(f"local_window_size requires local_sliding or chunk attention, got {attention_type}.")
+    self.attention_type = attention_type
+    self.local_window_size = local_window_size
+    self.speculative_num_draft_tokens = speculative_num_draft_tokens
 
     if model_mode in (MODEL_MODE_PREFILL, MODEL_MODE_AUTOREGRESSIVE):
       self._initialize_prefill_caches(model_mode)
@@ -330,6 +363,13 @@ class KVCache(nnx.Module):
   def ar_value_vars(self):
     return (self.cached_ar_value, self.cached_ar_value_scale)
 
+  @property
+  def ar_cache_length(self) -> int:
+    cache_length = self.max_target_length - self.max_prefill_length
+    if self.local_window_size:
+      return min(cache_length, self.local_window_size)
+    return cache_length + self.speculative_num_draft_tokens
+
   def _get_cached_kv_dtype(self):
     return self.kv_quant.dtype if self.kv_quant else self.dtype
 
@@ -411,7 +451,7 @@ class KVCache(nnx.Module):
           f"max_target_length: {self.max_target_length} should be greater than max_prefill_length:"
           f" {self.max_prefill_length}!"
       )
-    cache_length = self.max_target_length - self.max_prefill_length
+    cache_length = self.ar_cache_length
 
     if model_mode == MODEL_MODE_PREFILL:
       cache_logical_axis_names = self.prefill_cache_logical_axis_names
@@ -752,61 +792,115 @@ class KVCache(nnx.Module):
     """In autoregressive mode, we update the cache for this entry and
        then return the full cache.
 
+    A block of several tokens per sequence, e.g. the draft tokens verified by
+    speculative decoding, is written to consecutive cache positions. Its
+    columns are marked active in the stored segment ids, but in the returned
+    segment ids column `j` of the block is marked `-(j + 1)`, so that
+    `AttentionOp.generate_attention_mask` can mask it causally.
+
     Args:
-      key: in shape [b, 1, n, d].
-      value: in shape [b, 1, n, d].
+      key: in shape [b, s, n, d].
+      value: in shape [b, s, n, d].
       decoder_segment_ids: [b, 1] -- marking segment ids for tokens
 
     Returns:
       tuple of (key, value, segment_id) for both prefill and ar cache,
     Raises:
-      ValueError: when key/value shape is not [batch, 1, num_heads, heads_dim].
+      ValueError: when key/value shape is not [batch, 1, num_heads, heads_dim]
+        with ragged attention.
     """
     _, sequence, _, _ = value.shape
-    if sequence != 1:
-      raise ValueError(f"Sequence length should be 1 during autoregression, got {sequence=}")
+    if sequence != 1 and use_ragged_attention:
+      raise ValueError(f"Sequence length should be 1 during ragged autoregression, got {sequence=}")
+    if self.local_window_size and (sequence != 1 or use_ragged_attention):
+      raise ValueError("A local window AR cache supports one token per step without ragged attention.")
 
     cached_ar_key_vars, cached_ar_value_vars, cached_ar_segment_id_var, cache_ar_index_var, cache_ar_lengths_var = (
         self._get_ar_cache_vars()
     )
-
-    self.update_ar_key_value(
-        key,
-        value,
-        cached_ar_key_vars,
-        cached_ar_value_vars,
-        cache_ar_index_var.value,
-        cache_ar_lengths_var.value,
-        use_ragged_attention,
-    )
+    cache_length = self.ar_cache_length
+
+    for i in range(sequence):
+      self.update_ar_key_value(
+          key[:, i : i + 1],
+          value[:, i : i + 1],
+          cached_ar_key_vars,
+          cached_ar_value_vars,
+          jnp.mod(cache_ar_index_var.value + i, cache_length),
+          cache_ar_lengths_var.value + i,
+          use_ragged_attention,
+      )
     active_indicator = jnp.zeros((self.batch, 1), dtype=jnp.int32) + DECODING_ACTIVE_SEQUENCE_INDICATOR
 
     # Align batch size for cached segment IDs with indicator in decoding
     if cached_ar_segment_id_var.value.shape[0] != active_indicator.shape[0]:
       cached_ar_segment_id_var.value = jnp.repeat(cached_ar_segment_id_var.value, active_indicator.shape[0], axis=0)
 
-    cached_ar_segment_id_var.value = jax.lax.dynamic_update_index_in_dim(
-        cached_ar_segment_id_var.value, active_indicator, jnp.squeeze(cache_ar_index_var.value), 1
-    )
-    cache_ar_index_var.value = jnp.mod(cache_ar_index_var.value + 1, self.max_target_length - self.max_prefill_length)
-    cache_ar_lengths_var.value = cache_ar_lengths_var.value.at[:].add(1)
+    if sequence == 1:
+      cached_ar_segment_id_var.value = jax.lax.dynamic_update_index_in_dim(
+          cached_ar_segment_id_var.value, active_indicator, jnp.squeeze(cache_ar_index_var.value), 1
+      )
+      ar_segment_ids = cached_ar_segment_id_var.value
+    else:
+      block_indices = jnp.mod(jnp.squeeze(cache_ar_index_var.value) + jnp.arange(sequence), cache_length)
+      cached_ar_segment_id_var.value = cached_ar_segment_id_var.value.at[:, block_indices].set(active_indicator)
+      ar_segment_ids = cached_ar_segment_id_var.value.at[:, block_indices].set(-1 - jnp.arange(sequence, dtype=jnp.int32))
+    cache_ar_index_var.value = jnp.mod(cache_ar_index_var.value + sequence, cache_length)
+    cache_ar_lengths_var.value = cache_ar_lengths_var.value.at[:].add(sequence)
 
     cached_prefill_key_vars, cached_prefill_value_vars, cached_prefill_segment_id_var = self._get_prefill_cache_vars()
+    prefill_segment_ids = cached_prefill_segment_id_var.value
+    if self.local_window_size:
+      prefill_segment_ids, ar_segment_ids = self._mask_outside_local_window(
+          prefill_segment_ids, ar_segment_ids, jnp.squeeze(cache_ar_index_var.value), cache_ar_lengths_var.value
+      )
 
     cached_prefill = (
         self.get_cached_values(cached_prefill_key_vars, key.dtype, self.prefill_cache_axis_order),
         self.get_cached_values(cached_prefill_value_vars, value.dtype, self.prefill_cache_axis_order),
-        cached_prefill_segment_id_var.value,
+        prefill_segment_ids,
     )
 
     cached_ar = (
         self.get_cached_values(cached_ar_key_vars, key.dtype, self.ar_cache_axis_order),
         self.get_cached_values(cached_ar_value_vars, value.dtype, self.ar_cache_axis_order),
-        cached_ar_segment_id_var.value,
+        ar_segment_ids,
         cache_ar_lengths_var.value,
     )
     return cached_prefill, cached_ar
 
+  def _mask_outside_local_window(
+      self, prefill_segment_ids: Array, ar_segment_ids: Array, ar_index: Array, ar_lengths: Array
+  ) -> tuple[Array, Array]:
+    """Zeroes the segment ids of the cached tokens outside the local window of the decoded token.
+
+    Args:
+      prefill_segment_ids: [b, max_prefill_length] segment ids of the prompts.
+      ar_segment_ids: [b, ar_cache_length] segment ids of the AR cache.
+      ar_index: The AR cache index after writing the decoded token.
+      ar_lengths: [b] number of tokens written to the AR cache of each sequence,
+        including the decoded token.
+
+    Returns:
+      The prefill and AR segment ids.
+    """
+    prompt_lengths = jnp.sum(prefill_segment_ids != 0, axis=1, keepdims=True)
+    query_positions = prompt_lengths + ar_lengths[:, None] - 1
+    prefill_positions = jnp.arange(prefill_segment_ids.shape[1])[None, :]
+    # The decoded token was written at `ar_index - 1`, each earlier AR cache entry one position before.
+    ar_cache_length = ar_segment_ids.shape[1]
+    ar_positions = query_positions - jnp.mod(ar_index - 1 - jnp.arange(ar_cache_length), ar_cache_length)[None, :]
+
+    def in_window(positions):
+      if self.attention_type == AttentionType.CHUNK:
+        return positions // self.local_window_size == query_positions // self.local_window_size
+      return positions > query_positions - self.local_window_size
+
+    return (
+        jnp.where(in_window(prefill_positions), prefill_segment_ids, 0),
+        jnp.where(in_window(ar_positions), ar_segment_ids, 0),
+    )
+
   def __call__(
       self,
       key: Array,
@@ -941,6 +1035,7 @@ class MlaKVCache(KVCache):
       key_axis_order: AxisIdxes = (2, 0, 1, 3),
       use_chunked_prefill: bool = False,
       model_mode: str = MODEL_MODE_PREFILL,
+      speculative_num_draft_tokens: int = 0,
       *,
       # Not used in MlaKVCache but passed in by nnx_wrappers.to_linen.
       # TODO: Remove when bridge no longer needed
@@ -970,6 +1065,8 @@ class MlaKVCache(KVCache):
       key_axis_order: The axis order for the key.
       use_chunked_prefill: Whether to use chunked prefill.
       model_mode: The model mode.
+      speculative_num_draft_tokens: The number of draft tokens verified per
+        speculative decoding step, added to the length of the AR cache.
       rngs: The random number generators for initialization.
     """
     super().__init__(
@@ -992,6 +1089,7 @@ class MlaKVCache(KVCache):
         key_axis_order=key_axis_order,
         use_chunked_prefill=use_chunked_prefill,
         model_mode=model_mode,
+        speculative_num_draft_tokens=speculative_num_draft_tokens,
         rngs=rngs,
     )
 
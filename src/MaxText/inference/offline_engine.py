@@ -45,18 +45,21 @@ import dataclasses
 from enum import Enum
 from typing import Any, Callable
 from collections.abc import Hashable
-from collections import defaultdict
 import time
 
 import jax
+import jax.numpy as jnp
 import numpy as np
-from jax.sharding import Mesh
+from jax.sharding import Mesh, NamedSharding, PartitionSpec as P
 from jax.experimental import mesh_utils
 
 from MaxText.maxengine import MaxEngine
 from MaxText import max_utils
+from MaxText import pyconfig
 from MaxText.prefill_packing import PrefillProcessor, BatchedPrefillProcessor
+from MaxText.inference.prefix_cache import PrefixCache
 from MaxText import max_logging
+from MaxText.tokenizer import IncrementalDetokenizer, StopSequenceMatcher
 
 DecodeState = Any
 Params = Any
@@ -87,20 +90,15 @@ class CompletionOutput:
       token_ids: The token IDs of the prompt and generated output text.
       logprobs: The log probabilities of the prompt and generated output tokens.
       prompt_length: The number of prompt tokens.
+      text: The generated text up to the first stop sequence. Only set when
+        the engine was created with stop sequences.
   """
 
   index: str
   token_ids: np.ndarray
   logprobs: np.ndarray
   prompt_length: int
-
-
-@dataclasses.dataclass
-class TokenOutput:
-  """Container for individual token generation result."""
-
-  token: np.ndarray
-  log_prob: np.ndarray
+  text: str | None = None
 
 
 @dataclasses.dataclass
@@ -114,9 +112,101 @@ class DetokenizationTask:
   prompt_logp: Any = None
   prompt_ids: list = None
   slots: list = None
-  # For decode tasks
-  tokens_buffer: list = None
-  logprob_buffer: list = None
+  # For decode tasks: [max_decode_steps_per_loop, batch] buffers of which the first `num_steps` rows were generated
+  tokens_buffer: Any = None
+  logprob_buffer: Any = None
+  num_steps: Any = None
+  decode_block: int = None
+  dispatch_index: int = None
+
+
+@dataclasses.dataclass
+class DetokenizationResult:
+  """Slots freed by a processed DetokenizationTask, sent back to the dispatching thread."""
+
+  freed_slots: list[int]
+  # For decode tasks: the decode block and the time its tokens reached the host
+  decode_block: int | None = None
+  dispatch_index: int | None = None
+  completion_time: float | None = None
+
+
+@dataclasses.dataclass
+class DispatchStats:
+  """Counters of the work dispatched to the devices during an inference run.
+
+  Attributes:
+    dispatches: Number of prefill and decode dispatches.
+    decode_blocks: Number of decode blocks dispatched.
+    idle_gaps: Number of times the devices ran out of queued work.
+    idle_seconds: Total time between the end of the queued work and the next
+      dispatch. The end of a decode block is observed by the detokenization
+      thread, so this is a lower bound.
+  """
+
+  dispatches: int = 0
+  decode_blocks: int = 0
+  idle_gaps: int = 0
+  idle_seconds: float = 0.0
+
+  def summary(self) -> dict[str, Any]:
+    return dataclasses.asdict(self)
+
+
+class DevicePoolMonitor:
+  """Measures the busy time of a pool of devices from the completion of the work dispatched to it.
+
+  The work of a pool runs in dispatch order, so every tracked computation is
+  taken to start once it was dispatched and the one before it completed. Work
+  that is not tracked is counted towards the next tracked computation if it
+  delays it.
+
+  Attributes:
+    busy_seconds: Time the tracked work of the last run kept the pool busy.
+    wall_seconds: Duration of the last run.
+  """
+
+  def __init__(self, name: str):
+    self.name = name
+    self.busy_seconds = 0.0
+    self.wall_seconds = 0.0
+    self._queue = queue.SimpleQueue()
+    self._thread = None
+    self._start_time = None
+    self._last_completion = None
+
+  @property
+  def utilization(self) -> float:
+    return self.busy_seconds / self.wall_seconds if self.wall_seconds else 0.0
+
+  def start(self):
+    """Start a run, watching the tracked work on a background thread."""
+    self.busy_seconds = 0.0
+    self.wall_seconds = 0.0
+    self._start_time = self._last_completion = time.perf_counter()
+    self._thread = SafeThread(target=self._watch, name=f"{self.name}_pool_monitor", daemon=True)
+    self._thread.start()
+
+  def track(self, result: Any):
+    """Record that the computation producing `result` was just dispatched to the pool."""
+    self._queue.put((result, time.perf_counter()))
+
+  def stop(self):
+    """End the run once all tracked work has completed."""
+    self._queue.put(None)
+    self._thread.join()
+    self.wall_seconds = time.perf_counter() - self._start_time
+
+  def summary(self) -> dict[str, Any]:
+    return {"busy_seconds": self.busy_seconds, "wall_seconds": self.wall_seconds, "utilization": self.utilization}
+
+  def _watch(self):
+    while (item := self._queue.get()) is not None:
+      result, dispatch_time = item
+      jax.block_until_ready(result)
+      completion_time = time.perf_counter()
+      self.busy_seconds += completion_time - max(dispatch_time, self._last_completion)
+      self._last_completion = completion_time
 
 
 class SafeThread(threading.Thread):
@@ -138,6 +228,15 @@ class PrefillType(Enum):
   BATCH = "batch"
 
 
+class SchedulingPolicy(Enum):
+  """Enumeration of the orders in which inputs are prefilled, see `RequestScheduler`."""
+
+  FIFO = "fifo"
+  SHORTEST_PROMPT_FIRST = "shortest_prompt_first"
+  BUCKET_FILL = "bucket_fill"
+  PREDICTED_OUTPUT_LENGTH = "predicted_output_length"
+
+
 @dataclasses.dataclass
 class PrefillResult:
   """Result from prefill processing operation."""
@@ -147,11 +246,37 @@ class PrefillResult:
   prompt_logp: None | jax.Array
 
 
+@dataclasses.dataclass
+class PrefillStats:
+  """Counters of the prefills run by the prefill processors.
+
+  Attributes:
+    num_prefills: Number of prefill calls, a packed prefill counting once.
+    prompt_tokens: Number of prompt tokens prefilled.
+    prefill_tokens: Number of tokens computed by the prefills, including padding.
+  """
+
+  num_prefills: int = 0
+  prompt_tokens: int = 0
+  prefill_tokens: int = 0
+
+  @property
+  def packing_efficiency(self) -> float:
+    return self.prompt_tokens / self.prefill_tokens if self.prefill_tokens else 0.0
+
+  def summary(self) -> dict[str, Any]:
+    return dataclasses.asdict(self) | {"packing_efficiency": self.packing_efficiency}
+
+
 class PrefillHelper:
   """Abstraction layer for different prefill processing strategies.
 
   Provides a unified interface for both default (single-sequence) and batch
   (packed multi-sequence) prefill processing methods.
+
+  With a separate prefill engine, inputs are prefilled on its devices and
+  their KV caches are moved to the decode slots of `engine` with
+  `jax.device_put`, so prefill and decode run on disjoint device pools.
   """
 
   def __init__(
@@ -161,6 +286,10 @@ class PrefillHelper:
       prefill_lengths: list[int],
       batch_prefill_max_batch_size: int = 16,
       rng=None,
+      prefix_cache: PrefixCache | None = None,
+      prefill_engine: MaxEngine | None = None,
+      prefill_params: Params | None = None,
+      pool_monitor: DevicePoolMonitor | None = None,
   ):
     """Initialize the PrefillHelper.
 
@@ -170,13 +299,25 @@ class PrefillHelper:
         prefill_lengths: list of prompt lengths to support
         batch_prefill_max_batch_size: Maximum number of prompts in one packed
             sequence for batch prefill
+        prefix_cache: If set, every input is prefilled with chunked prefill
+            from its longest cached prefix instead of with the prefill processors
+        prefill_engine: If set, the MaxEngine on the devices of the prefill
+            pool, which prefills every input instead of `engine`. Only
+            supported with the default prefill type.
+        prefill_params: Model parameters sharded for `prefill_engine`
+        pool_monitor: Tracks the prefills run by `prefill_engine`
     """
     self._type = prefill_type
     self.engine = engine
+    self.prefix_cache = prefix_cache
+    self.prefill_engine = prefill_engine
+    self.prefill_params = prefill_params
+    self.pool_monitor = pool_monitor
     self.prefill_lengths = sorted(prefill_lengths)
     self.max_prefill_length = self.prefill_lengths[-1]
     self.batch_prefill_max_batch_size = batch_prefill_max_batch_size
     self.rng = jax.random.PRNGKey(0) if rng is None else rng
+    self.stats = PrefillStats()
     if prefill_type == PrefillType.DEFAULT:
       self._processor = PrefillProcessor(engine)
     elif prefill_type == PrefillType.BATCH:
@@ -189,6 +330,8 @@ class PrefillHelper:
       self._processor = PrefillProcessor(engine)
     else:
       raise ValueError(f"Invalid prefill type: {prefill_type}")
+    if prefill_engine is not None and (prefill_type != PrefillType.DEFAULT or prefix_cache is not None):
+      raise ValueError("A separate prefill engine is only supported with default prefill and no prefix cache")
 
   @functools.partial(jax.jit, static_argnums=(0), donate_argnames=("decode_state",))
   def _jitted_single_prefill(
@@ -234,8 +377,50 @@ class PrefillHelper:
         prefill_done: Callback function called when prefill completes
     """
     padded_length = len(input_tokens_padded)
+    if self.prefix_cache is not None:
+      saved_prefill_tokens = self.prefix_cache.stats.saved_prefill_tokens
+      prefill_result, first_token = self.engine.prefill_with_prefix_cache(
+          params=model_params,
+          prefix_cache=self.prefix_cache,
+          tokens=input_tokens_padded[:input_true_length],
+          rng=self.rng,
+          slot=decode_slot,
+          return_prompt_logp=True,
+      )
+      self._count_chunked_prefills(self.prefix_cache.stats.saved_prefill_tokens - saved_prefill_tokens, input_true_length)
+      prompt_logp = prefill_result["prompt_logp"]
+      decode_state = self.engine.insert(prefill_result, decode_state, decode_slot)
+      prefill_done(
+          [PrefillResult(first_token, decode_slot, prompt_logp)],
+          [input_id],
+          decode_state,
+      )
+    elif self.prefill_engine is not None:
+      self.stats.num_prefills += 1
+      self.stats.prompt_tokens += input_true_length
+      self.stats.prefill_tokens += padded_length
+      prefix, first_token = self.prefill_engine.prefill(
+          params=self.prefill_params,
+          padded_tokens=input_tokens_padded,
+          true_length=input_true_length,
+          rng=self.rng,
+          return_prompt_logp=True,
+      )
+      if self.pool_monitor is not None:
+        self.pool_monitor.track(first_token.data)
+      # The prompt log probabilities only go to the host, so they stay on the prefill devices.
+      prompt_logp = prefix.pop("prompt_logp")
+      decode_state = self.engine.insert(self._to_decode_devices(prefix), decode_state, decode_slot)
+      prefill_done(
+          [PrefillResult(self._to_decode_devices(first_token), decode_slot, prompt_logp)],
+          [input_id],
+          decode_state,
+      )
     # Use default processor if configured or if input is already at max length
-    if self._type == PrefillType.DEFAULT or padded_length == self.max_prefill_length:
+    elif self._type == PrefillType.DEFAULT or padded_length == self.max_prefill_length:
+      self.stats.num_prefills += 1
+      self.stats.prompt_tokens += input_true_length
+      self.stats.prefill_tokens += padded_length
       first_token, decode_state, prompt_logp = self._jitted_single_prefill(
           model_params,
           input_tokens_padded,
@@ -251,6 +436,7 @@ class PrefillHelper:
       )
     # Use batch processor for inputs that can benefit from prefill packing
     elif self._type == PrefillType.BATCH:
+      self.stats.prompt_tokens += input_true_length
       self._batch_processor.process(
           model_params,
           decode_state,
@@ -259,10 +445,38 @@ class PrefillHelper:
           input_tokens_padded[:input_true_length],
           padded_length,
           self.max_prefill_length,
-          prefill_done,
+          self._count_packed_prefill(prefill_done),
           return_prompt_logp=True,
       )
 
+  def _to_decode_devices(self, tree: Any) -> Any:
+    """Move arrays from the prefill devices to the decode devices, keeping the partitioning of each."""
+
+    def decode_sharding(x):
+      spec = x.sharding.spec if isinstance(x.sharding, NamedSharding) else P()
+      return NamedSharding(self.engine.mesh, spec)
+
+    return jax.device_put(tree, jax.tree.map(decode_sharding, tree))
+
+  def _count_chunked_prefills(self, start: int, true_length: int) -> None:
+    """Counts the chunk prefills of a prompt resumed at `start` from the prefix cache, as run by the engine."""
+    self.stats.prompt_tokens += true_length - start
+    while start < true_length:
+      chunk_length = min(self.engine.prefill_chunk_size, self.engine.max_prefill_length - start)
+      self.stats.num_prefills += 1
+      self.stats.prefill_tokens += chunk_length
+      start += chunk_length
+
+  def _count_packed_prefill(self, prefill_done: Callable) -> Callable:
+    """Wraps `prefill_done` of the batch processor to count its packed prefills of `max_prefill_length` tokens."""
+
+    def counted_prefill_done(prefill_result, prompt_ids, decode_state):
+      self.stats.num_prefills += 1
+      self.stats.prefill_tokens += self.max_prefill_length
+      prefill_done(prefill_result, prompt_ids, decode_state)
+
+    return counted_prefill_done
+
   def finalize(
       self,
       model_params: Params,
@@ -281,7 +495,123 @@ class PrefillHelper:
       pass
     elif self._type == PrefillType.BATCH:
       # Flush any remaining inputs in the batch processor
-      self._batch_processor.flush(model_params, decode_state, prefill_done, return_prompt_logp=True)
+      self._batch_processor.flush(
+          model_params, decode_state, self._count_packed_prefill(prefill_done), return_prompt_logp=True
+      )
+
+
+class RequestScheduler:
+  """Orders the inputs of an inference run before continuous batching.
+
+  The order decides which inputs are packed into the same prefill and which
+  share the decode batch; the outputs are returned in input order regardless.
+
+  Policies:
+      FIFO: The given order.
+      SHORTEST_PROMPT_FIRST: By prompt length, which also groups the inputs by
+        padded length for prefill packing.
+      BUCKET_FILL: By padded length, and within a padded length in packs that
+        fill a packed prefill, formed first-fit with the longest prompts first.
+      PREDICTED_OUTPUT_LENGTH: Longest predicted output first, so that the
+        decode batch does not end with a long tail of a few long sequences.
+        Without a predictor, the output length is predicted as the mean output
+        length of earlier inputs of similar prompt length.
+
+  Custom policies can override `order`.
+  """
+
+  def __init__(
+      self,
+      policy: SchedulingPolicy | str = SchedulingPolicy.FIFO,
+      output_length_predictor: Callable[[InputData], float] | None = None,
+  ):
+    """
+    Args:
+        policy: The scheduling policy.
+        output_length_predictor: Predicts the number of generated tokens of an
+          input, for PREDICTED_OUTPUT_LENGTH.
+    """
+    self.policy = SchedulingPolicy(policy)
+    self.output_length_predictor = output_length_predictor
+    # Sum and count of the output lengths observed per prompt length bucket.
+    self._output_lengths: dict[int, list[int]] = {}
+
+  def order(self, data: list[InputData], prefill_capacity: int, max_prompts_per_prefill: int) -> list[InputData]:
+    """Returns the inputs in the order in which to prefill them.
+
+    Args:
+        data: list of padded InputData objects
+        prefill_capacity: Number of tokens of a packed prefill
+        max_prompts_per_prefill: Maximum number of inputs in a packed prefill
+    """
+    if self.policy == SchedulingPolicy.FIFO:
+      return list(data)
+    elif self.policy == SchedulingPolicy.SHORTEST_PROMPT_FIRST:
+      return sorted(data, key=lambda row: row.true_length)
+    elif self.policy == SchedulingPolicy.BUCKET_FILL:
+      return self._bucket_fill_order(data, prefill_capacity, max_prompts_per_prefill)
+    elif self.policy == SchedulingPolicy.PREDICTED_OUTPUT_LENGTH:
+      predict = self.output_length_predictor or self._predict_output_length
+      return sorted(data, key=lambda row: -predict(row))
+    raise ValueError(f"Invalid scheduling policy: {self.policy}")
+
+  def observe(self, outputs: list[CompletionOutput]) -> None:
+    """Records the output lengths of finished inputs for the output length prediction."""
+    for output in outputs:
+      totals = self._output_lengths.setdefault(_length_bucket(output.prompt_length), [0, 0])
+      totals[0] += len(output.token_ids) - output.prompt_length
+      totals[1] += 1
+
+  def _predict_output_length(self, row: InputData) -> float:
+    totals = self._output_lengths.get(_length_bucket(row.true_length))
+    if totals is None:
+      totals = np.sum(list(self._output_lengths.values()) or [[0, 1]], axis=0)
+    return totals[0] / totals[1]
+
+  @staticmethod
+  def _bucket_fill_order(data: list[InputData], prefill_capacity: int, max_prompts: int) -> list[InputData]:
+    """Orders the inputs of every padded length in first-fit decreasing packs."""
+    buckets: dict[int, list[InputData]] = {}
+    for row in data:
+      buckets.setdefault(len(row.tokens), []).append(row)
+    ordered = []
+    for padded_length in sorted(buckets):
+      packs, pack_lengths = [], []
+      for row in sorted(buckets[padded_length], key=lambda row: -row.true_length):
+        for i, pack in enumerate(packs):
+          if pack_lengths[i] + row.true_length <= prefill_capacity and len(pack) < max_prompts:
+            pack.append(row)
+            pack_lengths[i] += row.true_length
+            break
+        else:
+          packs.append([row])
+          pack_lengths.append(row.true_length)
+      for pack in packs:
+        ordered.extend(pack)
+    return ordered
+
+
+def _length_bucket(length: int) -> int:
+  """Power-of-two bucket of a prompt length."""
+  return max(length - 1, 0).bit_length()
+
+
+def _deprecated_kwarg(old_name: str, new_name: str):
+  """Decorates a function to also accept the keyword argument `new_name` under its deprecated name `old_name`."""
+
+  def decorator(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      if old_name in kwargs:
+        if new_name in kwargs:
+          raise TypeError(f"{fn.__qualname__}() got both `{old_name}` and `{new_name}`.")
+        max_logging.log(f"WARNING: `{old_name}` is deprecated. Please use `{new_name}`.")
+        kwargs[new_name] = kwargs.pop(old_name)
+      return fn(*args, **kwargs)
+
+    return wrapper
+
+  return decorator
 
 
 class InferenceWorker:
@@ -297,6 +627,20 @@ class InferenceWorker:
     5. Refill newly available decode slots with prefill
     6. Repeat until all sequences complete
 
+    Dispatch pipelining:
+        Prefill and decode are dispatched asynchronously. After dispatching a
+        decode block, the worker only waits until the detokenization thread
+        has processed the block before it, so the next block is already
+        queued on the devices while finished slots are refilled. Freed slots
+        are sent back by the detokenization thread through a queue.
+
+    Disaggregated prefill:
+        With `prefill_devices`, inputs are prefilled by a second MaxEngine on
+        those devices while `devices` only decode. The KV cache of every
+        prefilled input is moved into its decode slot with `jax.device_put`,
+        so long prompts do not hold up the decode blocks. The busy time of
+        each pool is reported after every run.
+
     Prefill Packing:
         When enable_batch_prefill is True, the prefill processor
         will pack multiple inputs into a single sequence before
@@ -306,8 +650,9 @@ class InferenceWorker:
         contains inputs with the same padded length. Only inputs with the same
         padded length can be packed together.
 
-        It is important to sort the inputs by padded length so that the
-        buckets fill up quickly.
+        The scheduler orders the inputs before prefill, by default by
+        length so that the buckets fill up quickly. The outputs are returned
+        in input order.
 
         When a decode slot frees up, the prefill processor will add the
         sequence to a bucket. If the bucket becomes full, the packed sequence
@@ -320,11 +665,12 @@ class InferenceWorker:
 
   """
 
+  @_deprecated_kwarg("min_decode_steps", "max_decode_steps_per_loop")
   def __init__(
       self,
       config: MaxTextConfig,
       params: Params | None,
-      min_decode_steps: int,
+      max_decode_steps_per_loop: int,
       enable_batch_prefill: bool,
       devices: list[Any],
       tokenizer: Any,
@@ -336,12 +682,16 @@ class InferenceWorker:
       rng: jax.random.PRNGKey = None,
       mesh: Mesh = None,
       debug: bool = False,
+      stop_sequences: list[str] | None = None,
+      scheduler: RequestScheduler | None = None,
+      prefill_devices: list[Any] | None = None,
   ):
     """
     Args:
         config: MaxText configuration
         params: Model parameters, if None, the params will be loaded from the config
-        min_decode_steps: Minimum number of decode steps to run at once
+        max_decode_steps_per_loop: Maximum number of decode steps run in one on-device loop.
+          Also accepted under its deprecated name `min_decode_steps`.
         enable_batch_prefill: Whether to enable batch prefill
         devices: JAX devices to use for this worker
         tokenizer: Tokenizer to use
@@ -353,6 +703,12 @@ class InferenceWorker:
         rng: Random number generator key
         mesh: JAX mesh for distributed computation
         is_pw_reshard: Whether to use Pathways for resharding
+        stop_sequences: Strings that end generation once they appear in the
+          generated text
+        scheduler: Orders the inputs before prefill. If None, they are
+          processed in the given order.
+        prefill_devices: JAX devices to prefill on, disjoint from `devices`.
+          If None, prefill runs on `devices`.
     """
     # Configurations
     self.config = config
@@ -367,41 +723,84 @@ class InferenceWorker:
     self.eos_ids = eos_ids
     self.tokenizer = tokenizer
     self.batch_prefill_max_batch_size = batch_prefill_max_batch_size
-    self.min_decode_steps = min_decode_steps
+    self.max_decode_steps_per_loop = max_decode_steps_per_loop
     self.mesh = mesh
     self.rng = jax.random.PRNGKey(0) if rng is None else rng
     self.debug = debug
+    self.stop_sequences = [s for s in (stop_sequences or []) if s]
+    self.scheduler = RequestScheduler() if scheduler is None else scheduler
 
     # Inference state (initialized later)
     self.running = False
     self.detokenization_queue = queue.Queue()
+    # Owned by the dispatching thread, which learns about freed slots from `detokenization_results`.
+    self.detokenization_results = queue.SimpleQueue()
     self.empty_decode_slots = set()
     self.slot_to_id: dict[int, None | int] = {}
-    self.completed_sequences: set = set()
+    self.num_pending_decode_blocks = 0
+    self.dispatch_stats = DispatchStats()
+    # Host time of every dispatch of the run, and the end of the last decode
+    # block if no work was queued after it.
+    self.dispatch_times: list[float] = []
+    self.idle_since: float | None = None
 
     self.decode_state: DecodeState = None
-    self.completion_tokens_by_id: dict[Hashable, list[TokenOutput]] = {}
-    self.prompt_logprobs_by_id: dict[Hashable, list[np.ndarray]] = {}
-    self.true_lengths: dict[Hashable, int] = {}
+    # On-device counterparts of the slot state, used by the decode block to stop
+    # once a sequence ends: whether a slot has no unfinished sequence, and the
+    # number of tokens generated in it.
+    self.decode_done: jax.Array = None
+    self.decode_lengths: jax.Array = None
+    self.prompt_tokens_by_id: dict[Hashable, np.ndarray] = {}
+    # Prompt and generated tokens and log probabilities of the finished sequences.
+    self.token_ids_by_id: dict[Hashable, np.ndarray] = {}
+    self.logprobs_by_id: dict[Hashable, np.ndarray] = {}
+    # Per-slot result buffers, owned by the detokenization thread and reused by
+    # every sequence decoded in the slot. A row holds the prompt followed by the
+    # generated tokens, and `slot_lengths` is its filled length.
+    self.slot_token_ids: np.ndarray = None
+    self.slot_logprobs: np.ndarray = None
+    self.slot_lengths: np.ndarray = None
+    self.slot_num_generated: np.ndarray = None
+    self.slot_active: np.ndarray = None
+    self.slot_prompt_ids: list[Hashable | None] = []
+    # Only used with stop sequences: the generated text of every prompt, built one token at a time.
+    self.detokenizers_by_id: dict[Hashable, IncrementalDetokenizer] = {}
+    self.stop_matchers_by_id: dict[Hashable, StopSequenceMatcher] = {}
 
     # Model components (initialized later)
     self.engine = None
     self.decode_batch_size = None
     self.prefill_helper = None
     self.generate_fn = None
+    self.prefill_engine = None
+    # Busy time of the prefill and decode devices, only tracked when they are disjoint.
+    self.pool_monitors: dict[str, DevicePoolMonitor] = {}
 
     start_time = time.time()
     # Initialize MaxEngine(s)
     self.params, self.engine = self._init_engine(self.params)
     self.tokenizer = self._init_tokenizer()
     self.decode_batch_size = self.engine.max_concurrent_decodes
+    prefill_params = None
+    if prefill_devices is not None:
+      self.prefill_engine, prefill_params = self._init_prefill_engine(prefill_devices)
+      self.pool_monitors = {name: DevicePoolMonitor(name) for name in ("prefill", "decode")}
     # Initialize prefill helper
+    self.prefix_cache = None
+    if config.enable_prefix_caching:
+      self.prefix_cache = PrefixCache(
+          config.prefill_chunk_size, config.prefix_caching_hbm_byte, config.prefix_caching_dram_byte
+      )
     self.prefill_helper = PrefillHelper(
         self.prefill_type,
         self.engine,
         self.prefill_lengths,
         self.batch_prefill_max_batch_size,
         rng=self.rng,
+        prefix_cache=self.prefix_cache,
+        prefill_engine=self.prefill_engine,
+        prefill_params=prefill_params,
+        pool_monitor=self.pool_monitors.get("prefill"),
     )
     # Initialize decode state
     start_time_decode_state = time.time()
@@ -427,13 +826,28 @@ class InferenceWorker:
     max_logging.log(f"Time taken to initialize engine: {time.time() - start_time} seconds")
     return params, engine
 
+  def _init_prefill_engine(self, prefill_devices: list[Any]):
+    """Initialize the MaxEngine of the prefill devices with the params of the decode engine.
+
+    Args:
+        prefill_devices: JAX devices of the prefill engine
+
+    Returns:
+        tuple of (engine, params resharded onto its devices)
+    """
+    start_time = time.time()
+    engine = MaxEngine(self.config, prefill_devices)
+    params = engine.load_params(params=self.params, rng=self.rng)
+    max_logging.log(f"Time taken to initialize prefill engine: {time.time() - start_time} seconds")
+    return engine, params
+
   def _init_tokenizer(self):
     """Initialize the tokenizer.
 
     Returns:
         Initialized tokenizer
     """
-    if self.eos_ids is None and self.tokenizer is None:
+    if self.tokenizer is None and (self.eos_ids is None or self.stop_sequences):
       tokenizer_params = self.engine.get_tokenizer()
       self.tokenizer = self.engine.build_tokenizer(tokenizer_params)
     if self.eos_ids is None:
@@ -446,6 +860,12 @@ class InferenceWorker:
   ):
     """Update the model parameters"""
     self.params = params
+    if self.prefill_engine is not None:
+      prefill_shardings = jax.tree.map(lambda x: x.sharding, self.prefill_helper.prefill_params)
+      self.prefill_helper.prefill_params = jax.device_put(params, prefill_shardings)
+    # Cached prefixes were computed with the old parameters.
+    if self.prefix_cache is not None:
+      self.prefix_cache.clear()
 
   def reset_state(self):
     """Reset all worker state for a new inference run.
@@ -457,15 +877,31 @@ class InferenceWorker:
 
     # Reset inference state
     self.running = False
-    self.completion_tokens_by_id = defaultdict(list)
-    self.prompt_logprobs_by_id = defaultdict(list)
     self.empty_decode_slots = set()
     for i in range(self.decode_batch_size):
       self.empty_decode_slots.add(i)
     self.slot_to_id = {}
-    self.true_lengths = {}
+    self.prompt_tokens_by_id = {}
+    self.token_ids_by_id = {}
+    self.logprobs_by_id = {}
+    buffer_length = self.max_prefill_length + self.max_decode_length
+    self.slot_token_ids = np.zeros((self.decode_batch_size, buffer_length), dtype=np.int32)
+    self.slot_logprobs = np.zeros((self.decode_batch_size, buffer_length), dtype=np.float32)
+    self.slot_lengths = np.zeros(self.decode_batch_size, dtype=np.int32)
+    self.slot_num_generated = np.zeros(self.decode_batch_size, dtype=np.int32)
+    self.slot_active = np.zeros(self.decode_batch_size, dtype=bool)
+    self.slot_prompt_ids = [None] * self.decode_batch_size
+    self.decode_done = jnp.ones(self.decode_batch_size, dtype=jnp.bool_)
+    self.decode_lengths = jnp.zeros(self.decode_batch_size, dtype=jnp.int32)
+    self.detokenizers_by_id = {}
+    self.stop_matchers_by_id = {}
     self.detokenization_queue = queue.Queue()
-    self.completed_sequences = set()
+    self.detokenization_results = queue.SimpleQueue()
+    self.num_pending_decode_blocks = 0
+    self.dispatch_stats = DispatchStats()
+    self.dispatch_times = []
+    self.idle_since = None
+    self.prefill_helper.stats = PrefillStats()
 
     max_logging.log("InferenceWorker state reset complete")
 
@@ -485,14 +921,27 @@ class InferenceWorker:
       self.rng = rng
 
     # Set up state for this inference run
-    self.true_lengths = {input.id: input.true_length for input in data}
+    self.prompt_tokens_by_id = {input.id: np.asarray(input.tokens[: input.true_length]).reshape(-1) for input in data}
     self.running = True
 
     max_logging.log("Continuous batching started")
 
-    self._run_continuous_batching(data)
+    self._run_continuous_batching(self._schedule(data))
+    max_logging.log(f"Prefill: {self.prefill_helper.stats.summary()}")
+    max_logging.log(f"Dispatch: {self.dispatch_stats.summary()}")
+    if self.pool_monitors:
+      pools = {name: monitor.summary() for name, monitor in self.pool_monitors.items()}
+      max_logging.log(f"Device pools: {pools}")
+    if self.prefix_cache is not None:
+      max_logging.log(f"Prefix cache: {self.prefix_cache.stats.summary()}")
+
+    outputs = self._build_final_outputs(data)
+    self.scheduler.observe(outputs)
+    return outputs
 
-    return self._build_final_outputs(data)
+  def _schedule(self, data: list[InputData]) -> list[InputData]:
+    """Order the inputs with the scheduler."""
+    return self.scheduler.order(data, self.max_prefill_length, self.batch_prefill_max_batch_size)
 
   def _run_continuous_batching(
       self,
@@ -510,11 +959,17 @@ class InferenceWorker:
         name="detokenization",
     )
     detokenization_thread.start()
+    for monitor in self.pool_monitors.values():
+      monitor.start()
 
     # Process each input
     for row in data:
       # 1. Wait for an empty slot
+      self._collect_detokenization_results()
       while not self.empty_decode_slots:
+        # With batch prefill, all slots can be waiting in partly filled buckets.
+        if all(value is None for value in self.slot_to_id.values()):
+          self.prefill_helper.finalize(self.params, self.decode_state, self.prefill_done)
         self.decode()
       # 2. Get an available slot
       slot = self.empty_decode_slots.pop()
@@ -545,6 +1000,85 @@ class InferenceWorker:
       detokenization_thread.join()
 
     max_logging.log(f"Inference worker: detokenization thread joined in {time.time() - start_time} seconds")
+    for monitor in self.pool_monitors.values():
+      monitor.stop()
+
+  def score_next_tokens(self, data: list[InputData], candidate_token_ids: list[int]) -> dict[Hashable, np.ndarray]:
+    """Score candidate next tokens after every input with prefill only.
+
+    The log probabilities are read from the prefill logits at the last prompt
+    position, so no decode slot is used and nothing is generated. With batch
+    prefill, inputs are packed several to a prefill sequence in the order of
+    the scheduler.
+
+    Args:
+        data: list of padded InputData objects
+        candidate_token_ids: Token IDs whose log probabilities to return
+
+    Returns:
+        Map from input ID to the log probabilities of the candidate tokens
+    """
+    candidates = jnp.asarray(candidate_token_ids, dtype=jnp.int32)
+    scores = {}
+    if self.prefill_type == PrefillType.DEFAULT:
+      for row in data:
+        scores[row.id] = self._jitted_score_single(
+            self.params, self.engine.page_state, row.tokens, row.true_length, candidates
+        )
+    else:
+      for pack in self._pack_inputs(self._schedule(data)):
+        packed = _pack_prompts(
+            [row.tokens[: row.true_length] for row in pack], self.prefill_lengths, self.batch_prefill_max_batch_size
+        )
+        logprobs = self._jitted_score_packed(self.params, *packed, self.batch_prefill_max_batch_size, candidates)
+        for i, row in enumerate(pack):
+          scores[row.id] = logprobs[i]
+    # Dispatch is asynchronous, so only transfer once every prefill is queued.
+    return {input_id: np.asarray(logprobs) for input_id, logprobs in scores.items()}
+
+  def _pack_inputs(self, data: list[InputData]) -> list[list[InputData]]:
+    """Greedily group consecutive inputs into packs that fit one max-length prefill."""
+    packs, pack, pack_length = [], [], 0
+    for row in data:
+      if pack and (
+          pack_length + row.true_length > self.max_prefill_length or len(pack) == self.batch_prefill_max_batch_size
+      ):
+        packs.append(pack)
+        pack, pack_length = [], 0
+      pack.append(row)
+      pack_length += row.true_length
+    if pack:
+      packs.append(pack)
+    return packs
+
+  @functools.partial(jax.jit, static_argnums=(0,))
+  def _jitted_score_single(self, params, page_state, tokens, true_length, candidates):
+    """Candidate log probabilities after a single prefilled input."""
+    # The public prefill reserves pages on the host, which would only run at trace time. Scoring
+    # discards the KV cache, so call the pure prefill with the current page state instead.
+    prefix, _ = self.engine._prefill_jit(  # pylint: disable=protected-access
+        params=params, padded_tokens=tokens, true_length=true_length, rng=self.rng, page_state=page_state
+    )
+    logits = prefix["logits"].reshape(-1)
+    return jax.nn.log_softmax(logits.astype(jnp.float32))[candidates]
+
+  @functools.partial(jax.jit, static_argnums=(0, 7))
+  def _jitted_score_packed(
+      self, params, tokens, positions, segment_ids, start_pos, true_lengths, num_prompts, candidates
+  ):
+    """Candidate log probabilities after every input of a packed prefill."""
+    _, prefix, _ = self.engine.prefill_concat(
+        params=params,
+        padded_tokens=tokens,
+        decoder_positions=positions,
+        decoder_segment_ids=segment_ids,
+        start_pos=start_pos,
+        true_lengths=true_lengths,
+        num_prompts=num_prompts,
+        rng=self.rng,
+    )
+    logits = prefix["logits"].reshape(num_prompts, -1)
+    return jax.nn.log_softmax(logits.astype(jnp.float32), axis=-1)[:, candidates]
 
   def _build_final_outputs(self, input_data: list[InputData]) -> list[CompletionOutput]:
     """Build the final list of CompletionOutput."""
@@ -553,31 +1087,19 @@ class InferenceWorker:
       completion_outputs = []
       for row in input_data:
         input_id = row.id
-        prompt_length = row.true_length
-        prompt_tokens = row.tokens[: row.true_length].squeeze()
-        completion_tokens = np.array(
-            [token_output.token for token_output in self.completion_tokens_by_id[input_id]]
-        ).flatten()
-        logprobs = np.array(
-            [token_output.log_prob.flatten() for token_output in self.completion_tokens_by_id[input_id]]
-        ).flatten()
-        prompt_logprobs = np.array(self.prompt_logprobs_by_id[input_id]).flatten()
+        text = None
+        if self.stop_sequences:
+          detokenizer = self.detokenizers_by_id[input_id]
+          match_start = self.stop_matchers_by_id[input_id].match_start
+          detokenizer.flush()
+          text = detokenizer.text if match_start == -1 else detokenizer.text[:match_start]
         completion_outputs.append(
             CompletionOutput(
                 index=str(input_id),
-                prompt_length=prompt_length,
-                token_ids=np.concatenate(
-                    (
-                        prompt_tokens,
-                        completion_tokens,
-                    )
-                ),
-                logprobs=np.concatenate(
-                    (
-                        prompt_logprobs,
-                        logprobs,
-                    )
-                ),
+                prompt_length=row.true_length,
+                token_ids=self.token_ids_by_id[input_id],
+                logprobs=self.logprobs_by_id[input_id],
+                text=text,
             )
         )
     return completion_outputs
@@ -593,6 +1115,7 @@ class InferenceWorker:
     """
     # Update decode state
     self.decode_state = decode_state
+    self._record_dispatch()
     # Process each prefill result
     slots = []
     result_tokens_list = []
@@ -604,6 +1127,10 @@ class InferenceWorker:
       slots.append(slot)
       result_tokens_list.append(result.result_tokens)
       prompt_logp_list.append(result.prompt_logp)
+    first_tokens = jnp.concatenate([result.result_tokens.data[:, 0] for result in prefill_result])
+    self.decode_done, self.decode_lengths = self._jitted_start_slots(
+        self.decode_done, self.decode_lengths, jnp.asarray(slots, dtype=jnp.int32), first_tokens
+    )
 
     # Queue detokenization task
     task = DetokenizationTask(
@@ -616,32 +1143,132 @@ class InferenceWorker:
     self.detokenization_queue.put_nowait(task)
 
   def decode(self):
-    """Run decode steps on current decoder state.
+    """Run a block of decode steps on current decoder state.
+
+    Runs up to `self.max_decode_steps_per_loop` decode steps in a single on-device
+    loop, which returns early after the first step that ends a sequence with
+    EOS or the maximum length. The tokens of the block are queued as one task
+    for background processing.
 
-    Performs `self.min_decode_steps` decode operations
-    and queues results for background processing.
+    The block is dispatched without waiting for it. Only the previous block
+    is waited for, so that the slots it freed can be refilled while this one
+    runs.
     """
+    self.decode_state, self.decode_done, self.decode_lengths, result_tokens, log_prob, num_steps = (
+        self._jitted_generate_steps(self.params, self.decode_state, self.decode_done, self.decode_lengths, self.rng)
+    )
+    self._record_dispatch()
+    if self.pool_monitors:
+      self.pool_monitors["decode"].track(num_steps)
+    self.dispatch_stats.decode_blocks += 1
+    self.num_pending_decode_blocks += 1
 
-    for i in range(self.min_decode_steps):
-      # Generate next tokens
-      self.decode_state, result_tokens, log_prob = self._jitted_generate_fn(self.params, self.decode_state, self.rng)
-      if i == self.min_decode_steps - 1:
-        # Block on the last token
-        jax.block_until_ready(result_tokens)
-
-      # Queue detokenization task
-      task = DetokenizationTask(
-          task_type="decode",
-          tokens_buffer=result_tokens,
-          logprob_buffer=log_prob,
-      )
+    # Queue detokenization task
+    task = DetokenizationTask(
+        task_type="decode",
+        tokens_buffer=result_tokens,
+        logprob_buffer=log_prob,
+        num_steps=num_steps,
+        decode_block=self.dispatch_stats.decode_blocks,
+        dispatch_index=len(self.dispatch_times) - 1,
+    )
+    self.detokenization_queue.put_nowait(task)
+    self._collect_detokenization_results(max_pending_decode_blocks=1)
+
+  def _record_dispatch(self):
+    """Record that work was queued on the devices, ending an idle gap if they had run out of work."""
+    now = time.perf_counter()
+    if self.idle_since is not None:
+      self._add_idle_gap(now - self.idle_since)
+      self.idle_since = None
+    self.dispatch_times.append(now)
+    self.dispatch_stats.dispatches += 1
 
-      self.detokenization_queue.put_nowait(task)
+  def _add_idle_gap(self, seconds: float):
+    if seconds > 0:
+      self.dispatch_stats.idle_gaps += 1
+      self.dispatch_stats.idle_seconds += seconds
+
+  def _collect_detokenization_results(self, max_pending_decode_blocks: int | None = None):
+    """Free the slots reported by the detokenization thread.
+
+    Args:
+        max_pending_decode_blocks: If set, wait until at most this many
+          dispatched decode blocks have not been processed yet.
+    """
+    while True:
+      wait = max_pending_decode_blocks is not None and self.num_pending_decode_blocks > max_pending_decode_blocks
+      try:
+        result = self.detokenization_results.get(block=wait)
+      except queue.Empty:
+        return
+      for slot in result.freed_slots:
+        self.slot_to_id[slot] = None
+        self.empty_decode_slots.add(slot)
+      if result.decode_block is not None:
+        self.num_pending_decode_blocks -= 1
+        # The devices were idle from the end of the block until the next dispatch.
+        next_dispatch = result.dispatch_index + 1
+        if next_dispatch < len(self.dispatch_times):
+          self._add_idle_gap(self.dispatch_times[next_dispatch] - result.completion_time)
+        else:
+          self.idle_since = result.completion_time
 
   @functools.partial(jax.jit, static_argnums=(0,), donate_argnums=(2,))
-  def _jitted_generate_fn(self, params, decode_state, rng):
-    decode_state, result_tokens = self.engine.generate(params, decode_state, rng=rng)
-    return decode_state, result_tokens.data[:, 0], result_tokens.log_prob
+  def _jitted_generate_steps(self, params, decode_state, done, lengths, rng):
+    """Generates up to `max_decode_steps_per_loop` tokens for all slots, stopping after a sequence ends.
+
+    Args:
+        params: Model parameters
+        decode_state: Current decode state
+        done: [batch] whether a slot has no unfinished sequence
+        lengths: [batch] number of tokens generated in each slot
+        rng: Random number generator key
+
+    Returns:
+        tuple of (decode_state, done, lengths, tokens, log_probs, num_steps),
+        where tokens and log_probs are [max_decode_steps_per_loop, batch] buffers whose
+        first num_steps rows were generated
+    """
+    batch_size = done.shape[0]
+    eos_ids = jnp.asarray(self.eos_ids, dtype=jnp.int32)
+
+    def cond(carry):
+      step, *_, any_finished = carry
+      return (step < self.max_decode_steps_per_loop) & ~any_finished
+
+    def body(carry):
+      step, decode_state, done, lengths, tokens_buffer, logprob_buffer, _ = carry
+      decode_state, result_tokens = self.engine.generate(params, decode_state, rng=rng)
+      tokens = result_tokens.data[:, 0].astype(jnp.int32)
+      log_prob = result_tokens.log_prob.reshape(batch_size, -1)[:, 0].astype(jnp.float32)
+      tokens_buffer = tokens_buffer.at[step].set(tokens)
+      logprob_buffer = logprob_buffer.at[step].set(log_prob)
+      lengths = jnp.where(done, lengths, lengths + 1)
+      finished = ~done & (jnp.isin(tokens, eos_ids) | (lengths >= self.max_decode_length))
+      return step + 1, decode_state, done | finished, lengths, tokens_buffer, logprob_buffer, jnp.any(finished)
+
+    # Batch prefill leaves the prompt log probabilities of its last packed
+    # prefill in the decode state, which generate does not carry over.
+    decode_state = {k: v for k, v in decode_state.items() if k != "prompt_logp"}
+    carry = (
+        jnp.int32(0),
+        decode_state,
+        done,
+        lengths,
+        jnp.zeros((self.max_decode_steps_per_loop, batch_size), dtype=jnp.int32),
+        jnp.zeros((self.max_decode_steps_per_loop, batch_size), dtype=jnp.float32),
+        jnp.bool_(False),
+    )
+    num_steps, decode_state, done, lengths, tokens_buffer, logprob_buffer, _ = jax.lax.while_loop(cond, body, carry)
+    return decode_state, done, lengths, tokens_buffer, logprob_buffer, num_steps
+
+  @functools.partial(jax.jit, static_argnums=(0,))
+  def _jitted_start_slots(self, done, lengths, slots, first_tokens):
+    """Marks the slots of newly inserted sequences as unfinished unless their first token already ends them."""
+    first_done = jnp.isin(first_tokens, jnp.asarray(self.eos_ids, dtype=first_tokens.dtype))
+    first_done |= self.max_decode_length <= 1
+    return done.at[slots].set(first_done), lengths.at[slots].set(1)
 
   def background_detokenization(self):
     """Background thread that handles all GPU-to-CPU transfers and token emission.
@@ -664,102 +1291,175 @@ class InferenceWorker:
 
       if task.task_type == "prefill":
 
-        # Process prefill results - convert to numpy and emit
+        # Process prefill results - convert to numpy and start the sequences in their slots
         with jax.profiler.TraceAnnotation("convert_to_numpy_and_emit_prefill"):
           for i, result_tokens in enumerate(task.result_tokens):
             prompt_id = task.prompt_ids[i]
-            slot = task.slots[i]
-
-            prompt_logp = task.prompt_logp[i]
-            true_length = self.true_lengths[prompt_id]
-
-            # Convert to numpy
-            first_token = np.array(result_tokens.data[:, 0])
-            log_prob = np.array(result_tokens.log_prob)
-            prompt_logp_np = np.array(prompt_logp)[:, :true_length]
-
-            # Emit token directly
-            should_terminate = self.emit_token(prompt_id, int(first_token), log_prob, prompt_logp=prompt_logp_np)
-            if should_terminate:
-              newly_empty.append(slot)
+            prompt_length = len(self.prompt_tokens_by_id[prompt_id])
+            first_token = np.asarray(result_tokens.data)[0, 0]
+            log_prob = np.asarray(result_tokens.log_prob).reshape(-1)[0]
+            prompt_logp = np.asarray(task.prompt_logp[i])[0, :prompt_length]
+            newly_empty.extend(self._start_slot(task.slots[i], prompt_id, first_token, log_prob, prompt_logp))
 
       elif task.task_type == "decode":
 
-        # Check if there are any active sequences before expensive numpy conversion
-        active_slots = []
-        for slot, id_ in self.slot_to_id.items():
-          if id_ is not None and id_ not in self.completed_sequences:
-            active_slots.append((slot, id_))
+        # Wait for the end of the decode block
+        num_steps = int(task.num_steps)
+        result = DetokenizationResult(
+            newly_empty,
+            decode_block=task.decode_block,
+            dispatch_index=task.dispatch_index,
+            completion_time=time.perf_counter(),
+        )
 
-        # Skip processing entirely if no active sequences
-        if not active_slots:
+        # Skip processing entirely if no active sequences, before the expensive numpy conversion.
+        # Slots only become active once their prefill task is processed, so tokens decoded
+        # before a prefill was inserted are never attributed to the new sequence.
+        active_slots = np.flatnonzero(self.slot_active)
+        if not active_slots.size:
+          self.detokenization_results.put(result)
           continue
 
-        # Process single decode step - convert to numpy and emit
+        # Process the decode block - one transfer, then append each step to all active slots at once
         with jax.profiler.TraceAnnotation("convert_to_numpy_and_emit_decode_step"):
-          result_tokens_step = np.array(task.tokens_buffer)  # Single step tokens
-          log_prob_step = np.array(task.logprob_buffer)  # Single step logprobs
-
-          for slot, id_ in active_slots:
-            log_prob_at_slot = log_prob_step[slot]
-            result_tokens_at_slot = result_tokens_step[slot]
-            should_terminate = self.emit_token(id_, int(result_tokens_at_slot), log_prob_at_slot)
-            if should_terminate:
-              newly_empty.append(slot)
-      # Update decode slots
-      for slot in newly_empty:
-        self.slot_to_id[slot] = None
-        self.empty_decode_slots.add(slot)
+          result_tokens_block = np.asarray(task.tokens_buffer)[:num_steps]
+          log_prob_block = np.asarray(task.logprob_buffer)[:num_steps]
+          for result_tokens_step, log_prob_step in zip(result_tokens_block, log_prob_block):
+            newly_empty.extend(
+                self._append_tokens(active_slots, result_tokens_step[active_slots], log_prob_step[active_slots])
+            )
+            active_slots = np.flatnonzero(self.slot_active)
+      # Send the freed decode slots to the dispatching thread
+      if task.task_type == "decode":
+        self.detokenization_results.put(result)
+      elif newly_empty:
+        self.detokenization_results.put(DetokenizationResult(newly_empty))
 
       if self.debug:
         max_logging.log(f"Inference worker: detokenization in {time.time() - start_time} seconds")
 
-  def emit_token(
-      self,
-      prompt_id,
-      result_token: int,
-      log_prob: float,
-      prompt_logp: None | np.ndarray = None,
-  ):
-    """Adds the token to the results for the specified prompt ID and
-    determines if generation should terminate.
+  def _start_slot(self, slot: int, prompt_id, first_token: int, log_prob: float, prompt_logp: np.ndarray):
+    """Writes the prompt and the first generated token of a sequence into the buffers of its slot.
 
     Args:
+        slot: Decode slot of the sequence
         prompt_id: ID of the prompt
-        result_token: Token to emit
-        log_prob: Log probability of the token
-        prompt_logp: Log probabilities for the prompt tokens
+        first_token: Token generated by the prefill
+        log_prob: Log probability of the first token
+        prompt_logp: Log probabilities of the prompt tokens
 
     Returns:
-        True if this token signals the end of generation, False otherwise
+        The slot if the first token already ends generation, else nothing
     """
-    # Skip if sequence already completed
-    if prompt_id in self.completed_sequences:
-      return True
+    prompt_tokens = self.prompt_tokens_by_id[prompt_id]
+    self.slot_token_ids[slot, : len(prompt_tokens)] = prompt_tokens
+    self.slot_logprobs[slot, : len(prompt_tokens)] = prompt_logp
+    self.slot_lengths[slot] = len(prompt_tokens)
+    self.slot_num_generated[slot] = 0
+    self.slot_prompt_ids[slot] = prompt_id
+    self.slot_active[slot] = True
+    return self._append_tokens(np.array([slot]), np.array([first_token]), np.array([log_prob]))
 
-    index = len(self.completion_tokens_by_id[prompt_id])
-    if prompt_logp is not None:
-      self.prompt_logprobs_by_id[prompt_id] = [prompt_logp]
+  def _append_tokens(self, slots: np.ndarray, result_tokens: np.ndarray, log_probs: np.ndarray) -> list[int]:
+    """Appends one generated token to each of the given active slots and finishes the completed sequences.
 
-    self.completion_tokens_by_id[prompt_id].append(TokenOutput(np.array(result_token), np.array(log_prob)))
+    EOS and maximum length are checked for all slots at once; only stop
+    sequences need the text of each sequence.
 
-    # Check if this token completes the sequence
-    should_terminate = (result_token in self.eos_ids) or (index + 1 == self.max_decode_length)
-    if should_terminate:
-      self.completed_sequences.add(prompt_id)
+    Args:
+        slots: Active decode slots
+        result_tokens: Generated token of each slot
+        log_probs: Log probability of each token
 
-    return should_terminate
+    Returns:
+        The slots whose sequence ended with this token
+    """
+    positions = self.slot_lengths[slots]
+    self.slot_token_ids[slots, positions] = result_tokens
+    self.slot_logprobs[slots, positions] = log_probs
+    self.slot_lengths[slots] += 1
+    self.slot_num_generated[slots] += 1
+
+    done = np.isin(result_tokens, self.eos_ids) | (self.slot_num_generated[slots] >= self.max_decode_length)
+    if self.stop_sequences:
+      for i, slot in enumerate(slots):
+        if self._stop_sequence_found(self.slot_prompt_ids[slot], int(result_tokens[i])):
+          done[i] = True
+
+    finished = [int(slot) for slot in slots[done]]
+    for slot in finished:
+      # The only copy of the results: the slot buffers are reused by the next sequence.
+      prompt_id = self.slot_prompt_ids[slot]
+      self.token_ids_by_id[prompt_id] = self.slot_token_ids[slot, : self.slot_lengths[slot]].copy()
+      self.logprobs_by_id[prompt_id] = self.slot_logprobs[slot, : self.slot_lengths[slot]].copy()
+      self.slot_prompt_ids[slot] = None
+      self.slot_active[slot] = False
+    return finished
+
+  def _stop_sequence_found(self, prompt_id, result_token: int) -> bool:
+    """Detokenizes the token and returns whether the text of the prompt now contains a stop sequence."""
+    if prompt_id not in self.detokenizers_by_id:
+      self.detokenizers_by_id[prompt_id] = IncrementalDetokenizer(self.tokenizer, skip_token_ids=self.eos_ids)
+      self.stop_matchers_by_id[prompt_id] = StopSequenceMatcher(self.stop_sequences)
+    delta = self.detokenizers_by_id[prompt_id].add(result_token)
+    return self.stop_matchers_by_id[prompt_id].feed(delta) != -1
+
+
+def _pack_prompts(prompts: list[np.ndarray], prefill_lengths: list[int], max_prompts: int):
+  """Concatenate prompts into one sequence padded to the smallest fitting prefill length.
+
+  The per-prompt arrays are zero-padded to `max_prompts` entries, so the
+  compiled prefill only depends on the padded sequence length.
+
+  Returns:
+      tuple of (tokens, positions, segment_ids, start_pos, true_lengths)
+      as expected by `MaxEngine.prefill_concat`
+  """
+  lengths = [len(prompt) for prompt in prompts]
+  total_length = sum(lengths)
+  padded_length = next((length for length in prefill_lengths if length >= total_length), prefill_lengths[-1])
+  padding = padded_length - total_length
+  tokens = np.concatenate(list(prompts) + [np.zeros(padding, dtype=np.int32)]).astype(np.int32)
+  positions = np.concatenate([np.arange(length) for length in lengths] + [np.arange(padding)])
+  # Odd segment IDs per prompt, 0 for padding, as in prefill packing.
+  segment_ids = np.concatenate([np.full(length, 2 * i + 1) for i, length in enumerate(lengths)] + [np.zeros(padding)])
+  start_pos = np.zeros(max_prompts, dtype=np.int32)
+  start_pos[1 : len(lengths)] = np.cumsum(lengths[:-1])
+  true_lengths = np.zeros(max_prompts, dtype=np.int32)
+  true_lengths[: len(lengths)] = lengths
+  return (
+      jnp.asarray(tokens),
+      jnp.asarray(positions, dtype=jnp.int32),
+      jnp.asarray(segment_ids, dtype=jnp.int32),
+      jnp.asarray(start_pos),
+      jnp.asarray(true_lengths),
+  )
+
+
+def _config_for_num_devices(config: MaxTextConfig, num_devices: int) -> MaxTextConfig:
+  """Returns `config` with the batch sizes of `num_devices` devices.
+
+  The KV cache of MaxEngine holds `micro_batch_size_to_train_on` sequences,
+  which the config computes for all devices, while its decode batch is
+  `per_device_batch_size` times the devices of its mesh. The config is
+  validated again, which recomputes its batch sizes for `num_devices`.
+  """
+  pydantic_config = config._pydantic_config  # pylint: disable=protected-access
+  return pyconfig.HyperParameters(
+      type(pydantic_config)(**(pydantic_config.model_dump() | {"num_target_devices": num_devices}))
+  )
 
 
 class OfflineEngine:
   """Class for handling offline inference on batches of inputs."""
 
+  @_deprecated_kwarg("min_decode_steps", "max_decode_steps_per_loop")
   def __init__(
       self,
       config: Any,
       params: None | Params = None,
       enable_batch_prefill: bool = False,
-      min_decode_steps: int = 10,
+      max_decode_steps_per_loop: int = 10,
       tokenizer: Any = None,
       eos_ids: list[int] | None = None,
       prefill_lengths: list[int] | str = "auto",
@@ -767,6 +1467,9 @@ class OfflineEngine:
       mesh: Mesh = None,
       rng: jax.random.PRNGKey = None,
       debug: bool = False,
+      stop_sequences: list[str] | None = None,
+      scheduler: RequestScheduler | SchedulingPolicy | str | None = None,
+      num_prefill_devices: int = 0,
   ):
     """Initialize the OfflineEngine.
 
@@ -776,8 +1479,10 @@ class OfflineEngine:
         params: Model parameters (loaded from engine if None)
         enable_batch_prefill: Whether to use prefill packing.
             config.scan_layers must be False if this is True
-        min_decode_steps: Number of decode steps to perform at a time,
-            before checking for completion.
+        max_decode_steps_per_loop: Maximum number of decode steps run in one
+            on-device loop. The loop returns early once a sequence ends
+            with EOS or the maximum length. Also accepted under its
+            deprecated name `min_decode_steps`.
         eos_ids: list of EOS token IDs for checking sequence completion.
           If None, the tokenizer's EOS token will be used.
         tokenizer: Tokenizer instance for encoding/decoding text. If None,
@@ -794,12 +1499,26 @@ class OfflineEngine:
           reserve the rest for other tasks. If None, OfflineEngine will create the mesh
           automatically.
         rng: Random number generator key. If None, a new key will be created.
+        stop_sequences: Strings that end the generation of an input once they
+          appear in its generated text. The text before the first stop
+          sequence is returned as `CompletionOutput.text`. Requires a
+          tokenizer, which is created from the config if not provided.
+        scheduler: RequestScheduler or SchedulingPolicy ordering the inputs
+          before prefill. If None, inputs are prefilled shortest prompt first
+          with batch prefill and in the given order otherwise. Outputs are
+          always returned in input order.
+        num_prefill_devices: If positive, the first devices of the mesh
+          only prefill and the rest only decode, with the KV caches moved
+          from one pool to the other. The pools are meshed like `mesh`
+          with the unspecified ICI axes filled in, so at least one axis of
+          `config.ici_parallelism` must be -1. Requires
+          enable_batch_prefill=False and no prefix caching.
     """
     max_logging.log("Initializing OfflineEngine")
     # Configurations
     self.config = config
     self.params = params
-    self.min_decode_steps = min_decode_steps
+    self.max_decode_steps_per_loop = max_decode_steps_per_loop
     self.enable_batch_prefill = enable_batch_prefill
     self.mesh = mesh
     self.tokenizer = tokenizer
@@ -810,6 +1529,7 @@ class OfflineEngine:
     self.max_decode_length = self.config.max_target_length - self.max_prefill_length
     self.rng = jax.random.PRNGKey(0) if rng is None else rng
     self.debug = debug
+    self.num_prefill_devices = num_prefill_devices
     self._validate_config()
 
     # Create prefill buckets: [0, 64], (64, 128], (128, 256], ..., [max_length//2, max_length]
@@ -821,11 +1541,22 @@ class OfflineEngine:
     # Create meshes
     if not self.mesh:
       self.mesh = OfflineEngine.create_mesh(jax.devices(), self.config)
+    worker_config, prefill_devices = self.config, None
+    if self.num_prefill_devices:
+      devices = self.mesh.devices.flatten()
+      if self.num_prefill_devices >= len(devices):
+        raise ValueError(
+            f"num_prefill_devices must leave devices to decode on, got {self.num_prefill_devices} of {len(devices)}"
+        )
+      prefill_devices = list(devices[: self.num_prefill_devices])
+      self.mesh = OfflineEngine.create_mesh(devices[self.num_prefill_devices :], self.config)
+      # The decode batch is sized for the decode devices only.
+      worker_config = _config_for_num_devices(self.config, self.mesh.size)
 
     self.worker = InferenceWorker(
-        config=self.config,
+        config=worker_config,
         params=self.params,
-        min_decode_steps=self.min_decode_steps,
+        max_decode_steps_per_loop=self.max_decode_steps_per_loop,
         enable_batch_prefill=self.enable_batch_prefill,
         mesh=self.mesh,
         devices=self.mesh.devices.flatten(),
@@ -836,6 +1567,9 @@ class OfflineEngine:
         batch_prefill_max_batch_size=self.batch_prefill_max_batch_size,
         rng=self.rng,
         debug=self.debug,
+        stop_sequences=stop_sequences,
+        scheduler=self._create_scheduler(scheduler),
+        prefill_devices=prefill_devices,
     )
 
     self.tokenizer = self.worker.tokenizer
@@ -847,6 +1581,17 @@ class OfflineEngine:
     """Update model weights."""
     self.worker.update_params(params)
 
+  def update_scheduler(self, scheduler: RequestScheduler | SchedulingPolicy | str | None):
+    """Update the order in which inputs are prefilled, see `__init__`."""
+    self.worker.scheduler = self._create_scheduler(scheduler)
+
+  def _create_scheduler(self, scheduler: RequestScheduler | SchedulingPolicy | str | None) -> RequestScheduler:
+    if isinstance(scheduler, RequestScheduler):
+      return scheduler
+    if scheduler is None:
+      scheduler = SchedulingPolicy.SHORTEST_PROMPT_FIRST if self.enable_batch_prefill else SchedulingPolicy.FIFO
+    return RequestScheduler(scheduler)
+
   def batch_inference(
       self,
       data: list[InputData] | list[jax.Array] | list[np.ndarray],
@@ -868,8 +1613,32 @@ class OfflineEngine:
 
     return self.worker.run_inference(data, rng)
 
+  def score_next_tokens(
+      self,
+      data: list[InputData] | list[jax.Array] | list[np.ndarray],
+      candidate_token_ids: list[int],
+  ) -> dict[Hashable, np.ndarray]:
+    """Score candidate next tokens after every input without decoding.
+
+    Useful for multiple-choice evaluation: a single prefill per input (packed
+    with others if batch prefill is enabled) yields the log probability of
+    every answer token.
+
+    Args:
+        data: list of InputData objects, or JAX or numpy arrays.
+            If input is JAX or numpy array, it must not contain padding tokens.
+        candidate_token_ids: Token IDs whose log probabilities to return
+
+    Returns:
+        Map from input ID to an array with the log probability of each
+        candidate token
+    """
+    data = self.prepare_data(data)
+
+    return self.worker.score_next_tokens(data, candidate_token_ids)
+
   def prepare_data(self, data: list[InputData | jax.Array | np.ndarray]) -> list[InputData]:
-    """Pad and if batch prefill is enabled, sort data by length.
+    """Convert data to InputData objects and pad them.
 
     Args:
         data: list of InputData objects, or JAX or numpy arrays
@@ -893,12 +1662,7 @@ class OfflineEngine:
     if len(data) != len({item.id for item in data}):
       raise ValueError("All data ids must be unique")
 
-    data = self.pad_data(data)
-
-    if self.enable_batch_prefill:
-      return sorted(data, key=lambda x: x.tokens.shape[0])
-
-    return data
+    return self.pad_data(data)
 
   def pad_data(self, data: list[InputData]) -> list[InputData]:
     """For each input, pad it to the next length in self.prefill_lengths
@@ -958,6 +1722,13 @@ class OfflineEngine:
     if self.enable_batch_prefill and self.config.scan_layers:
       raise ValueError("scan_layers must be False if enable_batch_prefill is True")
 
+    if self.num_prefill_devices < 0:
+      raise ValueError(f"num_prefill_devices must not be negative, got {self.num_prefill_devices}")
+    if self.num_prefill_devices and (self.enable_batch_prefill or self.config.enable_prefix_caching):
+      raise ValueError("num_prefill_devices requires enable_batch_prefill=False and enable_prefix_caching=False")
+    if self.num_prefill_devices and self.config.attention == "paged":
+      raise ValueError("num_prefill_devices is not supported with paged attention")
+
     if self.max_decode_length <= 0:
       raise ValueError("Make sure max_target_length - max_prefill_predict_length is greater than 0")
     if self.config.scan_layers:
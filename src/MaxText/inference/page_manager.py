@@ -20,12 +20,29 @@ handling of variable-length sequences by dividing the attention context into
 fixed-size pages, similar to virtual memory systems. Pages are managed globally
 (not per-layer) and assigned to page groups, where each group typically
 represents an individual request or sequence.
+
+Two allocators are provided. The default one tracks free pages only through
+`PageState.page_status` and scans it for every allocated page. The free-list
+allocator (`pagedattn_free_list_allocator=True`) additionally keeps an on-device
+stack of free page indices in `FreeListPageState`, so reserving or releasing `k`
+pages costs O(k) instead of O(num_pages), and decode-time allocation for all
+page groups is a single vectorized update.
+
+`PageManager` leaves a page group without pages when fewer pages are free than
+it needs. `MemoryPressurePolicy` gives callers admission control on top of it:
+they check whether a request fits before inserting it, and can preempt the
+lowest-priority running groups to make room, either dropping their pages to be
+recomputed later or swapping them to host memory until they resume.
 """
 
+import dataclasses
+from enum import Enum
 from functools import partial
+from typing import Any
 
 import jax
 import jax.numpy as jnp
+import numpy as np
 
 from flax import struct
 
@@ -33,10 +50,10 @@ from jaxtyping import Array, Integer, Bool
 
 from MaxText.common_types import Config
 
-
 # Aliases using <Dims><Type><Rank>d convention
 # We use string names for dimensions as they are symbolic within the type hints.
 PagesInt1d = Integer[Array, "num_pages"]
+GroupPagesInt1d = Integer[Array, "max_pages_per_group"]
 GroupsPagesInt2d = Integer[Array, "max_page_groups max_pages_per_group"]
 GroupsInt1d = Integer[Array, "max_page_groups"]
 GroupsBool1d = Bool[Array, "max_page_groups"]
@@ -411,6 +428,225 @@ def _update_decode_pages_global(
   return final_state
 
 
+@struct.dataclass
+class FreeListPageState(PageState):
+  """`PageState` variant used by the free-list allocator.
+
+  In addition to the fields of `PageState` (which are kept up to date so that
+  attention kernels and callers can use either variant), it keeps a stack of
+  free page indices on device.
+
+  Attributes:
+    free_pages: A `jnp.ndarray` of shape `[num_pages]`. Entries
+      `[0, num_free_pages)` hold the global indices of the free pages; the top of
+      the stack is `free_pages[num_free_pages - 1]`. Remaining entries are unused.
+    num_free_pages: A scalar `jnp.ndarray` with the number of free pages on the
+      stack.
+  """
+
+  free_pages: PagesInt1d
+  num_free_pages: ScalarInt
+
+
+def initialize_free_list_page_state(
+    num_pages: int,
+    max_page_groups: int,
+    max_pages_per_group: int,
+) -> FreeListPageState:
+  """Creates and initializes a global `FreeListPageState` object.
+
+  The free stack is filled in descending order so that pages are handed out
+  lowest index first, matching the allocation order of the scanning allocator.
+  Page 0 is never placed on the stack (see `initialize_page_state`).
+
+  Args:
+    num_pages: The total number of available pages in the global pool.
+    max_page_groups: The maximum number of page groups the system can track.
+    max_pages_per_group: The maximum number of pages per page group.
+
+  Returns:
+    An initialized `FreeListPageState` with every page except page 0 free.
+  """
+  base_state = initialize_page_state(num_pages, max_page_groups, max_pages_per_group)
+  free_pages = jnp.zeros((num_pages,), dtype=jnp.int32)
+  free_pages = free_pages.at[: num_pages - 1].set(jnp.arange(num_pages - 1, 0, -1, dtype=jnp.int32))
+  return FreeListPageState(
+      **{field: getattr(base_state, field) for field in base_state.__dataclass_fields__},
+      free_pages=free_pages,
+      num_free_pages=jnp.array(num_pages - 1, dtype=jnp.int32),
+  )
+
+
+def _push_free_pages(
+    page_state: FreeListPageState,
+    pages: GroupPagesInt1d,
+    release_mask: Bool[Array, "n"],
+) -> FreeListPageState:
+  """Marks the masked `pages` free and pushes them onto the free stack."""
+  num_pages = page_state.page_status.shape[0]
+  stack_positions = page_state.num_free_pages + jnp.cumsum(release_mask) - 1
+  stack_positions = jnp.where(release_mask, stack_positions, num_pages)
+  status_positions = jnp.where(release_mask, pages, num_pages)
+  return page_state.replace(
+      page_status=page_state.page_status.at[status_positions].set(0, mode="drop"),
+      free_pages=page_state.free_pages.at[stack_positions].set(pages, mode="drop"),
+      num_free_pages=page_state.num_free_pages + jnp.sum(release_mask, dtype=jnp.int32),
+  )
+
+
+def _pop_free_pages(
+    page_state: FreeListPageState,
+    ranks: Integer[Array, "n"],
+    pop_mask: Bool[Array, "n"],
+) -> tuple[FreeListPageState, Integer[Array, "n"]]:
+  """Pops free pages off the stack for the masked entries.
+
+  Entry `i` with `pop_mask[i]` set receives the page `ranks[i]` positions below
+  the top of the stack. Ranks of the masked entries must be `0..k-1` with
+  `k <= num_free_pages`. Unmasked entries receive page index 0.
+
+  Returns:
+    The updated state (pages marked allocated, stack shrunk by `k`) and the
+    popped page indices.
+  """
+  num_pages = page_state.page_status.shape[0]
+  stack_positions = jnp.clip(page_state.num_free_pages - 1 - ranks, 0, num_pages - 1)
+  popped_pages = jnp.where(pop_mask, page_state.free_pages[stack_positions], 0)
+  status_positions = jnp.where(pop_mask, popped_pages, num_pages)
+  new_state = page_state.replace(
+      page_status=page_state.page_status.at[status_positions].set(1, mode="drop"),
+      num_free_pages=page_state.num_free_pages - jnp.sum(pop_mask, dtype=jnp.int32),
+  )
+  return new_state, popped_pages
+
+
+@partial(jax.jit, static_argnames=("max_pages_per_group",))
+def _release_pages_for_group_free_list(
+    page_state: FreeListPageState,
+    page_group_id: ScalarInt,
+    max_pages_per_group: int,
+) -> FreeListPageState:
+  """Free-list counterpart of `_release_pages_for_group`.
+
+  Pushes the pages of `page_group_id` back onto the free stack with a single
+  scatter, so the cost depends on `max_pages_per_group` rather than on the size
+  of the global pool.
+  """
+  group_pages = page_state.page_map[page_group_id]
+  in_use = jnp.arange(max_pages_per_group) < page_state.num_pages_used[page_group_id]
+  release_mask = jnp.logical_and(in_use, group_pages > 0)
+  released_state = _push_free_pages(page_state, group_pages, release_mask)
+  return released_state.replace(
+      num_pages_used=page_state.num_pages_used.at[page_group_id].set(0),
+      sequence_lengths=page_state.sequence_lengths.at[page_group_id].set(0),
+      active_page=page_state.active_page.at[page_group_id].set(0),
+      has_active_page=page_state.has_active_page.at[page_group_id].set(False),
+      active_page_position=page_state.active_page_position.at[page_group_id].set(0),
+  )
+
+
+@partial(jax.jit, static_argnames=("tokens_per_page", "max_pages_per_group"))
+def _reserve_pages_for_group_free_list(
+    released_state: FreeListPageState,
+    page_group_id: ScalarInt,
+    true_length: ScalarInt,
+    tokens_per_page: int,
+    max_pages_per_group: int,
+) -> FreeListPageState:
+  """Free-list counterpart of `_reserve_pages_for_group`.
+
+  PRECONDITION: `true_length` must be > 0.
+
+  Pops all pages needed for `true_length` off the free stack at once. If the
+  stack holds fewer pages than needed, or the group lacks capacity, the
+  `released_state` is returned unchanged.
+  """
+  num_pages_needed = (true_length + tokens_per_page - 1) // tokens_per_page
+  last_page_position_idx = (true_length - 1) % tokens_per_page
+  next_write_position = (last_page_position_idx + 1) % tokens_per_page
+
+  group_has_capacity = jax.lax.le(num_pages_needed, max_pages_per_group)
+  sufficient_free_pages = jax.lax.ge(released_state.num_free_pages, num_pages_needed)
+  has_enough_resources = jnp.logical_and(sufficient_free_pages, group_has_capacity)
+
+  def allocate_and_update_state(state: FreeListPageState) -> FreeListPageState:
+    page_idx_in_group = jnp.arange(max_pages_per_group)
+    pop_mask = page_idx_in_group < num_pages_needed
+    state, new_pages = _pop_free_pages(state, page_idx_in_group, pop_mask)
+    group_map = jnp.where(pop_mask, new_pages, state.page_map[page_group_id])
+    return state.replace(
+        page_map=state.page_map.at[page_group_id].set(group_map),
+        num_pages_used=state.num_pages_used.at[page_group_id].set(num_pages_needed),
+        sequence_lengths=state.sequence_lengths.at[page_group_id].set(true_length),
+        active_page=state.active_page.at[page_group_id].set(new_pages[num_pages_needed - 1]),
+        has_active_page=state.has_active_page.at[page_group_id].set(True),
+        active_page_position=state.active_page_position.at[page_group_id].set(next_write_position),
+    )
+
+  return jax.lax.cond(has_enough_resources, allocate_and_update_state, lambda s: s, released_state)
+
+
+@partial(jax.jit, static_argnames=("tokens_per_page", "max_pages_per_group"))
+def _release_and_reserve_for_group_free_list(
+    page_state: FreeListPageState,
+    page_group_id: ScalarInt,
+    true_length: ScalarInt,
+    tokens_per_page: int,
+    max_pages_per_group: int,
+) -> FreeListPageState:
+  """Free-list counterpart of `_release_and_reserve_for_group`."""
+  released_state = _release_pages_for_group_free_list(page_state, page_group_id, max_pages_per_group)
+  return _reserve_pages_for_group_free_list(
+      released_state, page_group_id, true_length, tokens_per_page, max_pages_per_group
+  )
+
+
+@partial(jax.jit, static_argnames=("tokens_per_page", "max_pages_per_group"))
+def _update_decode_pages_global_free_list(
+    page_state: FreeListPageState,
+    tokens_per_page: ScalarInt,
+    max_pages_per_group: ScalarInt,
+) -> FreeListPageState:
+  """Free-list counterpart of `_update_decode_pages_global`.
+
+  Instead of looping over the page groups and scanning `page_status` for each
+  of them, every group that crosses a page boundary is ranked with a prefix sum
+  and the first `num_free_pages` of them pop their page off the free stack in
+  one vectorized update. Groups are served in increasing group index, as in the
+  scanning allocator.
+  """
+  max_page_groups = page_state.sequence_lengths.shape[0]
+
+  seq_len_increment = jnp.where(page_state.has_active_page, 1, 0)
+  new_sequence_lengths = page_state.sequence_lengths + seq_len_increment
+
+  new_active_page_position = jnp.where(
+      page_state.has_active_page,
+      (new_sequence_lengths - 1) % tokens_per_page,
+      page_state.active_page_position,
+  )
+
+  required_pages_per_group = (new_sequence_lengths + tokens_per_page - 1) // tokens_per_page
+  needs_new_page_mask = jnp.logical_and(page_state.has_active_page, required_pages_per_group > page_state.num_pages_used)
+  has_capacity_mask = required_pages_per_group <= max_pages_per_group
+  needs_allocation_mask = jnp.logical_and(needs_new_page_mask, has_capacity_mask)
+
+  allocation_rank = jnp.cumsum(needs_allocation_mask) - 1
+  can_allocate = jnp.logical_and(needs_allocation_mask, allocation_rank < page_state.num_free_pages)
+  new_state, new_pages = _pop_free_pages(page_state, allocation_rank, can_allocate)
+
+  map_columns = jnp.where(can_allocate, page_state.num_pages_used, max_pages_per_group)
+  new_page_map = page_state.page_map.at[jnp.arange(max_page_groups), map_columns].set(new_pages, mode="drop")
+
+  return new_state.replace(
+      page_map=new_page_map,
+      num_pages_used=page_state.num_pages_used + can_allocate.astype(jnp.int32),
+      sequence_lengths=new_sequence_lengths,
+      active_page=jnp.where(can_allocate, new_pages, page_state.active_page),
+      active_page_position=new_active_page_position,
+  )
+
+
 class PageManager:
   """Manages the global allocation and release of pages for paged attention.
 
@@ -459,6 +695,9 @@ class PageManager:
           page groups (`max_page_groups`) the system can manage.
         * `pagedattn_max_pages_per_group`: The maximum number of pages that can be
           allocated to a single page group.
+        * `pagedattn_free_list_allocator`: Whether to track free pages with an
+          on-device free stack (`FreeListPageState`) instead of scanning
+          `page_status` for every allocation.
 
     Raises:
       ValueError: If the configuration parameters are invalid (e.g., non-positive
@@ -469,6 +708,7 @@ class PageManager:
     self.max_target_length: int = config.max_target_length
     self.max_page_groups: int = config.global_batch_size_to_load
     self.max_pages_per_group: int = config.pagedattn_max_pages_per_group
+    self.use_free_list: bool = config.pagedattn_free_list_allocator
     self._validate_init_params()
 
   def _validate_init_params(self) -> None:
@@ -530,6 +770,10 @@ class PageManager:
     if true_length <= 0 or true_length > self.max_target_length:
       raise ValueError(f"PageManager: true_length ({true_length}) out of range (0, {self.max_target_length}]")
 
+    if self.use_free_list:
+      return _release_and_reserve_for_group_free_list(
+          page_state, page_group_id, true_length, self.tokens_per_page, self.max_pages_per_group
+      )
     return _release_and_reserve_for_group(
         page_state, page_group_id, true_length, self.tokens_per_page, self.max_pages_per_group
     )
@@ -559,6 +803,8 @@ class PageManager:
       state = page_manager.update_decode_pages(state)
       ```
     """
+    if self.use_free_list:
+      return _update_decode_pages_global_free_list(page_state, self.tokens_per_page, self.max_pages_per_group)
     return _update_decode_pages_global(page_state, self.tokens_per_page, self.max_pages_per_group)
 
   def release_pages(self, page_state: PageState, page_group_id: int) -> PageState:
@@ -594,18 +840,21 @@ class PageManager:
     """
     if page_group_id < 0 or page_group_id >= self.max_page_groups:
       raise ValueError(f"PageManager: page_group_id ({page_group_id}) out of range [0, {self.max_page_groups})")
+    if self.use_free_list:
+      return _release_pages_for_group_free_list(page_state, page_group_id, self.max_pages_per_group)
     return _release_pages_for_group(page_state, page_group_id, self.max_pages_per_group)
 
   def get_initial_page_state(self) -> PageState:
     """Creates and returns an initial global `PageState`.
 
-    This is a convenience method that calls `initialize_page_state` with
-    the parameters (`num_pages`, `max_page_groups`, `max_pages_per_group`)
+    This is a convenience method that calls `initialize_page_state` (or
+    `initialize_free_list_page_state` when the free-list allocator is enabled)
+    with the parameters (`num_pages`, `max_page_groups`, `max_pages_per_group`)
     stored during the `PageManager` initialization.
 
     Returns:
-      An initialized `PageState` object where all pages are free (except possibly 0)
-      and no groups are active.
+      An initialized `PageState` (or `FreeListPageState`) object where all pages
+      are free (except possibly 0) and no groups are active.
 
     Example:
       ```python
@@ -613,8 +862,252 @@ class PageManager:
       initial_state = page_manager.get_initial_page_state()
       ```
     """
+    if self.use_free_list:
+      return initialize_free_list_page_state(
+          num_pages=self.num_pages,
+          max_page_groups=self.max_page_groups,
+          max_pages_per_group=self.max_pages_per_group,
+      )
     return initialize_page_state(
         num_pages=self.num_pages,
         max_page_groups=self.max_page_groups,
         max_pages_per_group=self.max_pages_per_group,
     )
+
+
+class PreemptionMode(Enum):
+  """How `MemoryPressurePolicy` frees the pages of a preempted page group."""
+
+  # Drop the pages; the caller prefills the sequence again to resume it.
+  RECOMPUTE = "recompute"
+  # Copy the pages to host memory and write them back on resume.
+  SWAP = "swap"
+
+
+@dataclasses.dataclass
+class PreemptedGroup:
+  """A page group preempted by `MemoryPressurePolicy`.
+
+  Attributes:
+    page_group_id: The page group the sequence was running in.
+    priority: The priority of the sequence.
+    sequence_length: The number of tokens held by its pages.
+    mode: How its pages were freed.
+    host_pages: With `PreemptionMode.SWAP`, the pages of every key and value
+      cache on the host, in the order of `_kv_pages_leaves`. None otherwise.
+    slot_state: State of the sequence outside of the pages, kept by the caller
+      to restore on resume, e.g. the decode state rows of its slot.
+  """
+
+  page_group_id: int
+  priority: float
+  sequence_length: int
+  mode: PreemptionMode
+  host_pages: list[np.ndarray] | None = None
+  slot_state: Any = None
+
+
+def _is_kv_pages(path) -> bool:
+  return getattr(path[-1], "key", None) in ("key_pages", "value_pages", "key_scale_pages", "value_scale_pages")
+
+
+def _kv_pages_leaves(kv_cache: Any) -> list[jax.Array]:
+  """The key and value page arrays of a cache pytree, in flattening order.
+
+  Every array is `[..., num_kv_heads, num_pages, tokens_per_page, head_dim]`,
+  with a leading layer axis if the layers are scanned. The scales of quantized
+  pages are included, with size 1 trailing axes where they are shared.
+  """
+  return [leaf for path, leaf in jax.tree_util.tree_flatten_with_path(kv_cache)[0] if _is_kv_pages(path)]
+
+
+@jax.jit
+def _read_pages(kv_cache: Any, pages: Integer[Array, "n"]) -> list[jax.Array]:
+  """Gathers `pages` from every key and value page array of `kv_cache`."""
+  return [jnp.take(leaf, pages, axis=leaf.ndim - 3) for leaf in _kv_pages_leaves(kv_cache)]
+
+
+@partial(jax.jit, donate_argnums=(0,))
+def _write_pages(kv_cache: Any, pages: Integer[Array, "n"], group_pages: list[jax.Array]) -> Any:
+  """Writes `group_pages`, as read by `_read_pages`, into `pages` of `kv_cache`."""
+  leaves, treedef = jax.tree_util.tree_flatten_with_path(kv_cache)
+  group_pages = iter(group_pages)
+  new_leaves = []
+  for path, leaf in leaves:
+    if _is_kv_pages(path):
+      index = (slice(None),) * (leaf.ndim - 3) + (pages,)
+      leaf = leaf.at[index].set(next(group_pages).astype(leaf.dtype))
+    new_leaves.append(leaf)
+  return jax.tree_util.tree_unflatten(treedef, new_leaves)
+
+
+class MemoryPressurePolicy:
+  """Admission control and preemption of page groups for a `PageManager`.
+
+  Before inserting a request, callers check `can_admit`. If the request does
+  not fit, `make_room` preempts running page groups with a lower priority than
+  the request, lowest priority first, until enough pages are free. Preempted
+  groups are returned to the caller, which stops decoding them and queues them
+  again. With `PreemptionMode.SWAP`, `resume` writes their pages back into a
+  page group; with `PreemptionMode.RECOMPUTE`, the caller prefills them again.
+
+  Priorities are registered with `set_priority` when a group is inserted; a
+  higher value is more important and unregistered groups have priority 0.
+
+  Example:
+    ```python
+    policy = MemoryPressurePolicy(page_manager, PreemptionMode.SWAP)
+    if not policy.can_admit(state, true_length + max_new_tokens, page_group_id=slot):
+      state, preempted = policy.make_room(state, cache, true_length + max_new_tokens, priority=1.0)
+    ...
+    state, cache = policy.resume(state, cache, preempted[0], page_group_id=free_slot)
+    ```
+  """
+
+  def __init__(self, page_manager: PageManager, mode: PreemptionMode | str = PreemptionMode.SWAP):
+    self.page_manager = page_manager
+    self.mode = PreemptionMode(mode)
+    self.priorities: dict[int, float] = {}
+
+  def set_priority(self, page_group_id: int, priority: float) -> None:
+    """Records the priority of the sequence inserted into `page_group_id`."""
+    self.priorities[page_group_id] = priority
+
+  def num_pages_needed(self, num_tokens: int) -> int:
+    """The number of pages holding `num_tokens` tokens."""
+    return -(-num_tokens // self.page_manager.tokens_per_page)
+
+  def num_free_pages(self, page_state: PageState, page_group_id: int | None = None) -> int:
+    """The number of free pages, counting those of `page_group_id`, which a prefill into it releases first."""
+    if isinstance(page_state, FreeListPageState):
+      num_free = page_state.num_free_pages
+    else:
+      num_free = jnp.sum(page_state.page_status == 0)
+    if page_group_id is not None:
+      num_free += page_state.num_pages_used[page_group_id]
+    return int(num_free)
+
+  def can_admit(self, page_state: PageState, num_tokens: int, page_group_id: int | None = None) -> bool:
+    """Whether a sequence of up to `num_tokens` tokens fits into the free pages.
+
+    Args:
+      page_state: The current global `PageState`.
+      num_tokens: The number of tokens to reserve pages for, e.g. the prompt
+        length plus the maximum number of generated tokens.
+      page_group_id: The page group the sequence would be inserted into, whose
+        pages are released by the insertion.
+    """
+    return self.num_pages_needed(num_tokens) <= self.num_free_pages(page_state, page_group_id)
+
+  def select_victims(
+      self, page_state: PageState, num_tokens: int, priority: float, page_group_id: int | None = None
+  ) -> list[int] | None:
+    """Chooses the running page groups to preempt so that `num_tokens` tokens fit.
+
+    Groups with a lower priority than `priority` are taken lowest priority
+    first, and the one holding the most pages first among equal priorities.
+
+    Returns:
+      The page groups to preempt, empty if the sequence already fits, or None
+      if preempting every eligible group would not free enough pages.
+    """
+    shortfall = self.num_pages_needed(num_tokens) - self.num_free_pages(page_state, page_group_id)
+    if shortfall <= 0:
+      return []
+    num_pages_used = np.asarray(page_state.num_pages_used)
+    running = np.flatnonzero(np.asarray(page_state.has_active_page) & (num_pages_used > 0))
+    candidates = [
+        int(group) for group in running if group != page_group_id and self.priorities.get(int(group), 0.0) < priority
+    ]
+    candidates.sort(key=lambda group: (self.priorities.get(group, 0.0), -num_pages_used[group]))
+    victims = []
+    for group in candidates:
+      if shortfall <= 0:
+        break
+      victims.append(group)
+      shortfall -= int(num_pages_used[group])
+    return victims if shortfall <= 0 else None
+
+  def preempt(self, page_state: PageState, kv_cache: Any, page_group_id: int) -> tuple[PageState, PreemptedGroup]:
+    """Preempts the sequence of `page_group_id` and releases its pages.
+
+    Args:
+      page_state: The current global `PageState`.
+      kv_cache: The cache pytree holding the key and value pages. Only read,
+        to copy the pages to host memory with `PreemptionMode.SWAP`.
+      page_group_id: The page group to preempt.
+
+    Returns:
+      The `PageState` with the pages of the group released, and the record of
+      the preempted sequence.
+    """
+    num_pages_used = int(page_state.num_pages_used[page_group_id])
+    preempted = PreemptedGroup(
+        page_group_id=page_group_id,
+        priority=self.priorities.pop(page_group_id, 0.0),
+        sequence_length=int(page_state.sequence_lengths[page_group_id]),
+        mode=self.mode,
+    )
+    if self.mode == PreemptionMode.SWAP:
+      pages = page_state.page_map[page_group_id, :num_pages_used]
+      preempted.host_pages = jax.device_get(_read_pages(kv_cache, pages))
+    return self.page_manager.release_pages(page_state, page_group_id), preempted
+
+  def make_room(
+      self,
+      page_state: PageState,
+      kv_cache: Any,
+      num_tokens: int,
+      priority: float = 0.0,
+      page_group_id: int | None = None,
+  ) -> tuple[PageState, list[PreemptedGroup]]:
+    """Preempts lower-priority sequences until `num_tokens` tokens fit, see `select_victims`.
+
+    Nothing is preempted if the sequence cannot be made to fit, so callers
+    check `can_admit` again afterwards.
+
+    Returns:
+      The updated `PageState` and the preempted sequences.
+    """
+    victims = self.select_victims(page_state, num_tokens, priority, page_group_id) or []
+    preempted = []
+    for group in victims:
+      page_state, record = self.preempt(page_state, kv_cache, group)
+      preempted.append(record)
+    return page_state, preempted
+
+  def resume(
+      self,
+      page_state: PageState,
+      kv_cache: Any,
+      preempted: PreemptedGroup,
+      page_group_id: int | None = None,
+  ) -> tuple[PageState, Any]:
+    """Reserves pages for a swapped-out sequence and writes its pages back.
+
+    Args:
+      page_state: The current global `PageState`.
+      kv_cache: The cache pytree holding the key and value pages. It is
+        donated.
+      preempted: A sequence preempted with `PreemptionMode.SWAP`.
+      page_group_id: The page group to resume the sequence in, by default the
+        one it was preempted from.
+
+    Returns:
+      The updated `PageState` and cache.
+
+    Raises:
+      ValueError: If the sequence was not swapped out or its pages do not fit.
+    """
+    if preempted.mode != PreemptionMode.SWAP:
+      raise ValueError("Only swapped-out sequences can be resumed, recomputed ones must be prefilled again.")
+    page_group_id = preempted.page_group_id if page_group_id is None else page_group_id
+    if not self.can_admit(page_state, preempted.sequence_length, page_group_id):
+      raise ValueError(
+          f"Not enough free pages to resume a sequence of {preempted.sequence_length} tokens in group {page_group_id}."
+      )
+    page_state = self.page_manager.update_prefill_pages(page_state, page_group_id, preempted.sequence_length)
+    pages = page_state.page_map[page_group_id, : self.num_pages_needed(preempted.sequence_length)]
+    kv_cache = _write_pages(kv_cache, pages, preempted.host_pages)
+    self.priorities[page_group_id] = preempted.priority
+    return page_state, kv_cache
@@ -22,6 +22,7 @@ import functools
 import jax
 import jax.numpy as jnp
 from jax.experimental.pallas.ops.tpu.paged_attention import paged_attention_kernel
+from jax.experimental.pallas.ops.tpu.paged_attention import quantization_utils
 from jax.sharding import PartitionSpec as P
 from jax.sharding import Mesh
 
@@ -36,6 +37,32 @@ from MaxText.layers.initializers import variable_to_logically_partitioned
 
 _use_kernel_v2 = False
 
+# Storage dtypes of quantized KV pages, see `PagedAttentionOp`.
+KV_QUANT_DTYPES = {"int8": jnp.int8, "fp8": jnp.float8_e4m3fn}
+
+
+def quantize_kv_pages(x: Array, dtype: DType, axis: int | tuple[int, ...]) -> tuple[Array, Array]:
+  """Quantizes `x` to `dtype` with absmax scales reduced over `axis`.
+
+  Returns:
+    A tuple (quantized, scale) such that `x ~= quantized * scale`, where `scale`
+    is float32 and keeps the reduced axes with size 1.
+  """
+  x = x.astype(jnp.float32)
+  max_value = jnp.iinfo(dtype).max if jnp.issubdtype(dtype, jnp.integer) else jnp.finfo(dtype).max
+  scale = jnp.max(jnp.abs(x), axis=axis, keepdims=True) / float(max_value)
+  # All-zero blocks, e.g. unused pages, keep a unit scale instead of dividing by zero.
+  scale = jnp.where(scale == 0, 1.0, scale)
+  x = x / scale
+  if jnp.issubdtype(dtype, jnp.integer):
+    x = jnp.clip(jnp.rint(x), -max_value, max_value)
+  return x.astype(dtype), scale
+
+
+def dequantize_kv_pages(x: Array, scale: Array, dtype: DType = jnp.float32) -> Array:
+  """Inverse of `quantize_kv_pages`."""
+  return (x.astype(jnp.float32) * scale).astype(dtype)
+
 
 def paged_attention_op_as_linen(
     *,
@@ -56,6 +83,8 @@ def paged_attention_op_as_linen(
         "tokens_per_page",
         "paged_kv_head_dim_size",
     ),
+    kv_quant_dtype: str = "",
+    kv_quant_granularity: str = "token",
 ):
   """A factory function to create a PagedAttentionOp as a Linen module.
 
@@ -77,6 +106,10 @@ def paged_attention_op_as_linen(
     attn_logits_soft_cap: The soft cap for attention logits.
     query_axis_names: The logical axis names for the query tensor.
     kv_pages_axis_names: The logical axis names for the KV cache pages.
+    kv_quant_dtype: Storage dtype of quantized KV pages, "int8" or "fp8", or ""
+      to store them in `dtype`.
+    kv_quant_granularity: Scale granularity of quantized KV pages, "token" or
+      "page".
 
   Returns:
     A Linen module that wraps the NNX `PagedAttentionOp` module.
@@ -96,6 +129,8 @@ def paged_attention_op_as_linen(
       attn_logits_soft_cap=attn_logits_soft_cap,
       query_axis_names=query_axis_names,
       kv_pages_axis_names=kv_pages_axis_names,
+      kv_quant_dtype=kv_quant_dtype,
+      kv_quant_granularity=kv_quant_granularity,
       metadata_fn=variable_to_logically_partitioned,
   )
 
@@ -106,6 +141,13 @@ class PagedAttentionOp(nnx.Module):
   This module implements the paged attention mechanism, which is an efficient
   method for handling attention in autoregressive models with long sequences.
   It divides the KV cache into fixed-size "pages" to manage memory dynamically.
+
+  With `kv_quant_dtype`, the pages are stored as int8 or fp8 together with
+  float32 absmax scales of each KV head, either per token ("token") or per page
+  ("page"). The pages are quantized when written, and a page of the "page"
+  granularity is requantized when a decode step appends to it. Decode attention
+  dequantizes int8 pages in the v1 kernel and fp8 pages in
+  `paged_attention_reference_decode`.
   """
 
   def __init__(
@@ -127,6 +169,8 @@ class PagedAttentionOp(nnx.Module):
           "tokens_per_page",
           "paged_kv_head_dim_size",
       ),
+      kv_quant_dtype: str = "",
+      kv_quant_granularity: str = "token",
       *,
       # Not used in Embed but passed in by nnx.bridge.to_linen.
       # TODO: Remove when bridge no longer needed
@@ -147,6 +191,10 @@ class PagedAttentionOp(nnx.Module):
       attn_logits_soft_cap: The soft cap for attention logits.
       query_axis_names: The logical axis names for the query tensor.
       kv_pages_axis_names: The logical axis names for the KV cache pages.
+      kv_quant_dtype: Storage dtype of quantized KV pages, "int8" or "fp8", or ""
+        to store them in `dtype`.
+      kv_quant_granularity: Scale granularity of quantized KV pages, "token" for
+        a scale per KV head and token, "page" for a scale per KV head and page.
       rngs: The random number generators for initialization (required by NNX).
     """
 
@@ -162,6 +210,12 @@ class PagedAttentionOp(nnx.Module):
     self.attn_logits_soft_cap = attn_logits_soft_cap
     self.query_axis_names = query_axis_names
     self.kv_pages_axis_names = kv_pages_axis_names
+    if kv_quant_dtype and kv_quant_dtype not in KV_QUANT_DTYPES:
+      raise ValueError(f"Invalid kv_quant_dtype {kv_quant_dtype!r}, expected one of {list(KV_QUANT_DTYPES)} or ''.")
+    if kv_quant_granularity not in ("token", "page"):
+      raise ValueError(f"Invalid kv_quant_granularity {kv_quant_granularity!r}, expected 'token' or 'page'.")
+    self.kv_quant_dtype = KV_QUANT_DTYPES.get(kv_quant_dtype)
+    self.kv_quant_granularity = kv_quant_granularity
 
     self.kv_pages_shape = (
         self.num_kv_heads,
@@ -169,24 +223,45 @@ class PagedAttentionOp(nnx.Module):
         self.tokens_per_page,
         self.kv_head_dim_size,
     )
+    self.kv_pages_dtype = self.kv_quant_dtype or self.dtype
 
     self.key_pages = nnx.Cache(
-        jnp.zeros(self.kv_pages_shape, dtype=self.dtype),
+        jnp.zeros(self.kv_pages_shape, dtype=self.kv_pages_dtype),
         sharding=self.kv_pages_axis_names,
     )
     self.value_pages = nnx.Cache(
-        jnp.zeros(self.kv_pages_shape, dtype=self.dtype),
+        jnp.zeros(self.kv_pages_shape, dtype=self.kv_pages_dtype),
         sharding=self.kv_pages_axis_names,
     )
 
-  def _maybe_materialize_cache(self, cache: nnx.Cache) -> nnx.Cache:
+    if self.kv_quant_dtype is not None:
+      if kv_quant_granularity == "token":
+        # Reduced over head_dim.
+        self.kv_scale_axis = -1
+        self.kv_scale_pages_shape = (self.num_kv_heads, self.num_pages, self.tokens_per_page, 1)
+        self.kv_scale_pages_axis_names = (*self.kv_pages_axis_names[:3], None)
+      else:
+        # Reduced over the tokens and head_dim of a page.
+        self.kv_scale_axis = (-2, -1)
+        self.kv_scale_pages_shape = (self.num_kv_heads, self.num_pages, 1, 1)
+        self.kv_scale_pages_axis_names = (*self.kv_pages_axis_names[:2], None, None)
+      self.key_scale_pages = nnx.Cache(
+          jnp.zeros(self.kv_scale_pages_shape, dtype=jnp.float32),
+          sharding=self.kv_scale_pages_axis_names,
+      )
+      self.value_scale_pages = nnx.Cache(
+          jnp.zeros(self.kv_scale_pages_shape, dtype=jnp.float32),
+          sharding=self.kv_scale_pages_axis_names,
+      )
+
+  def _maybe_materialize_cache(self, cache: nnx.Cache, shape=None, dtype=None) -> nnx.Cache:
     """Materializes the cache if it's currently a ShapeDtypeStruct."""
     if isinstance(cache.value, jax.ShapeDtypeStruct):
       # This is needed because the Linen bridge lazily creates this state. We
       # need to ensure the cache state is accessible at runtime.
       # TODO: Delete this function when the to_linen bridge is no longer needed.
       return nnx.Cache(
-          jnp.zeros(self.kv_pages_shape, dtype=self.dtype),
+          jnp.zeros(shape or self.kv_pages_shape, dtype=dtype or self.kv_pages_dtype),
           sharding=cache.sharding,
       )
     return cache
@@ -210,6 +285,21 @@ class PagedAttentionOp(nnx.Module):
     self.value_pages.value = nn.with_logical_constraint(self.value_pages.value, self.kv_pages_axis_names)
     return self.key_pages, self.value_pages
 
+  def get_kv_scale_pages(self):
+    """Retrieves the key and value scale caches of quantized pages, or (None, None) if unquantized."""
+    if self.kv_quant_dtype is None:
+      return None, None
+
+    # TODO: Remove once to_linen bridge is no longer needed
+    self.key_scale_pages = self._maybe_materialize_cache(self.key_scale_pages, self.kv_scale_pages_shape, jnp.float32)
+    self.value_scale_pages = self._maybe_materialize_cache(self.value_scale_pages, self.kv_scale_pages_shape, jnp.float32)
+
+    self.key_scale_pages.value = nn.with_logical_constraint(self.key_scale_pages.value, self.kv_scale_pages_axis_names)
+    self.value_scale_pages.value = nn.with_logical_constraint(
+        self.value_scale_pages.value, self.kv_scale_pages_axis_names
+    )
+    return self.key_scale_pages, self.value_scale_pages
+
   def pad_qkv(self, *qkv):
     """Pad input to kv_head_dim_size"""
 
@@ -321,8 +411,24 @@ class PagedAttentionOp(nnx.Module):
       key_pages_cache: nnx.Cache,
       value_pages_cache: nnx.Cache,
       page_state: page_manager.PageState,
+      key_scale_pages_cache: nnx.Cache | None = None,
+      value_scale_pages_cache: nnx.Cache | None = None,
   ) -> Array:
-    """Apply Paged Attention v1 in decode only."""
+    """Apply Paged Attention v1 in decode only.
+
+    Int8 pages are passed to the kernel with their scales and dequantized there.
+    """
+    k_pages, v_pages = key_pages_cache.value, value_pages_cache.value
+    if key_scale_pages_cache is not None:
+      # The kernel takes an absmax scale per token, i.e. x = q * scale / MAX_INT8.
+      scales_shape = (*k_pages.shape[:-1], 1)
+
+      def kernel_scales(scales):
+        return jnp.broadcast_to(scales, scales_shape) * quantization_utils.MAX_INT8
+
+      k_pages = quantization_utils.QuantizedTensor(k_pages, kernel_scales(key_scale_pages_cache.value))
+      v_pages = quantization_utils.QuantizedTensor(v_pages, kernel_scales(value_scale_pages_cache.value))
+
     kv_pages_pspec = logical_to_mesh_axes(("paged_kv_heads", None, None, None), self.mesh)
     q_pspec = logical_to_mesh_axes((None, None, "paged_kv_heads", None), self.mesh)
 
@@ -354,13 +460,54 @@ class PagedAttentionOp(nnx.Module):
 
     return wrap_paged_attention(
         query,
-        key_pages_cache.value,
-        value_pages_cache.value,
+        k_pages,
+        v_pages,
         page_state.sequence_lengths,
         page_state.page_map,
         self.pages_per_compute_block,
     )
 
+  def paged_attention_reference_decode(
+      self,
+      query: Array,
+      key_pages_cache: nnx.Cache,
+      value_pages_cache: nnx.Cache,
+      page_state: page_manager.PageState,
+      key_scale_pages_cache: nnx.Cache | None = None,
+      value_scale_pages_cache: nnx.Cache | None = None,
+  ) -> Array:
+    """Apply decode attention over the gathered, and dequantized, pages of each slot.
+
+    This is the reference of the paged attention kernels and the decode path of
+    fp8 pages, which the kernels do not support. It materializes the
+    `max_pages_per_slot` pages of every slot in float32.
+    """
+    batch_size, _, num_heads, head_dim = query.shape
+    num_kv_heads = key_pages_cache.value.shape[0]
+
+    def gather(pages_cache, scale_pages_cache):
+      # [num_kv_heads, batch_size, max_pages_per_slot, tokens_per_page, head_dim]
+      pages = pages_cache.value[:, page_state.page_map]
+      if scale_pages_cache is None:
+        pages = pages.astype(jnp.float32)
+      else:
+        pages = dequantize_kv_pages(pages, scale_pages_cache.value[:, page_state.page_map])
+      return jnp.reshape(pages, (num_kv_heads, batch_size, -1, head_dim))
+
+    key = gather(key_pages_cache, key_scale_pages_cache)
+    value = gather(value_pages_cache, value_scale_pages_cache)
+    query = jnp.reshape(query, (batch_size, num_kv_heads, num_heads // num_kv_heads, head_dim)).astype(jnp.float32)
+
+    attn_weights = jnp.einsum("bkgd,kbsd->bkgs", query, key)
+    if self.attn_logits_soft_cap is not None:
+      attn_weights = jnp.tanh(attn_weights / self.attn_logits_soft_cap) * self.attn_logits_soft_cap
+    mask = jnp.arange(key.shape[2])[None, :] < page_state.sequence_lengths[:, None]
+    attn_weights = jnp.where(mask[:, None, None, :], attn_weights, -1e10)
+    attn_weights = jax.nn.softmax(attn_weights, axis=-1)
+
+    attn = jnp.einsum("bkgs,kbsd->bkgd", attn_weights, value)
+    return jnp.reshape(attn, (batch_size, 1, num_heads, head_dim)).astype(self.dtype)
+
   def __call__(
       self,
       query: Array,
@@ -400,12 +547,23 @@ class PagedAttentionOp(nnx.Module):
     """
 
     key_pages_cache, value_pages_cache = self.get_kv_pages()
+    key_scale_pages_cache, value_scale_pages_cache = self.get_kv_scale_pages()
     query, key, value = self.pad_qkv(query, key, value)
 
     # update kv pages and call page attention kernel
     if model_mode == MODEL_MODE_PREFILL:
-      self.update_prefill_step_pages(key_pages_cache, value_pages_cache, key, value, slot, page_state)
-      if _use_kernel_v2:
+      self.update_prefill_step_pages(
+          key_pages_cache,
+          value_pages_cache,
+          key,
+          value,
+          slot,
+          page_state,
+          key_scale_pages_cache=key_scale_pages_cache,
+          value_scale_pages_cache=value_scale_pages_cache,
+      )
+      # The v2 kernel reads the pages, which it cannot dequantize.
+      if _use_kernel_v2 and self.kv_quant_dtype is None:
         return (
             self.paged_attention_v2_prefill(query, key_pages_cache, value_pages_cache, page_state),
             None,
@@ -413,7 +571,25 @@ class PagedAttentionOp(nnx.Module):
         )
       return self.paged_dot_product_attention_with_max_and_sum(query, key, value)
     elif model_mode == MODEL_MODE_AUTOREGRESSIVE and page_state is not None:
-      self.update_decode_step_pages(key_pages_cache, value_pages_cache, key, value, page_state)
+      self.update_decode_step_pages(
+          key_pages_cache,
+          value_pages_cache,
+          key,
+          value,
+          page_state,
+          key_scale_pages_cache=key_scale_pages_cache,
+          value_scale_pages_cache=value_scale_pages_cache,
+      )
+      if self.kv_quant_dtype is not None:
+        if self.kv_quant_dtype == jnp.int8:
+          attn = self.paged_attention_v1_decode(
+              query, key_pages_cache, value_pages_cache, page_state, key_scale_pages_cache, value_scale_pages_cache
+          )
+        else:
+          attn = self.paged_attention_reference_decode(
+              query, key_pages_cache, value_pages_cache, page_state, key_scale_pages_cache, value_scale_pages_cache
+          )
+        return attn, None, None
       if _use_kernel_v2:
         return (
             self.paged_attention_v2_decode(query, key_pages_cache, value_pages_cache, page_state),
@@ -436,8 +612,10 @@ class PagedAttentionOp(nnx.Module):
       value: Array,
       slot: int,
       page_state: page_manager.PageState,
+      key_scale_pages_cache: nnx.Cache | None = None,
+      value_scale_pages_cache: nnx.Cache | None = None,
   ) -> None:
-    """Update pages for prefill step."""
+    """Update pages for prefill step, quantizing them if the pages are quantized."""
     assert (
         key.shape == value.shape
     ), f"prefill_step key/value should have the same shape, but getting {key.shape=} and {value.shape=} instead"
@@ -487,11 +665,31 @@ class PagedAttentionOp(nnx.Module):
         ),
     )
 
+    if self.kv_quant_dtype is not None:
+      key, key_scale = quantize_kv_pages(key, self.kv_quant_dtype, self.kv_scale_axis)
+      value, value_scale = quantize_kv_pages(value, self.kv_quant_dtype, self.kv_scale_axis)
+      key_scale_pages_cache.value = nn.with_logical_constraint(key_scale, self.kv_scale_pages_axis_names)
+      value_scale_pages_cache.value = nn.with_logical_constraint(value_scale, self.kv_scale_pages_axis_names)
+
     key_pages_cache.value = nn.with_logical_constraint(key, self.kv_pages_axis_names)
     value_pages_cache.value = nn.with_logical_constraint(value, self.kv_pages_axis_names)
 
-  def update_decode_step_pages(self, key_pages_cache, value_pages_cache, key, value, page_state):
+  def update_decode_step_pages(
+      self,
+      key_pages_cache,
+      value_pages_cache,
+      key,
+      value,
+      page_state,
+      key_scale_pages_cache=None,
+      value_scale_pages_cache=None,
+  ):
     """Update decode-step pages"""
+    if self.kv_quant_dtype is not None:
+      self._update_decode_step_quantized_pages(key_pages_cache, key_scale_pages_cache, key, page_state)
+      self._update_decode_step_quantized_pages(value_pages_cache, value_scale_pages_cache, value, page_state)
+      return key_pages_cache, value_pages_cache
+
     key_pages = key_pages_cache.value
     value_pages = value_pages_cache.value
 
@@ -516,3 +714,30 @@ class PagedAttentionOp(nnx.Module):
     key_pages_cache.value = key_pages_updated
     value_pages_cache.value = value_pages_updated
     return key_pages_cache, value_pages_cache
+
+  def _update_decode_step_quantized_pages(self, pages_cache, scale_pages_cache, new_kv, page_state):
+    """Writes the decode-step key or value of every slot into its quantized active page."""
+    batch_size, _, kv_heads, head_dim = new_kv.shape
+    new_kv = jnp.transpose(jnp.reshape(new_kv, (batch_size, kv_heads, head_dim)), (1, 0, 2))  # [n_kv_heads, b, d]
+    active_page = page_state.active_page
+    position = page_state.active_page_position
+
+    if self.kv_quant_granularity == "token":
+      new_kv, new_scale = quantize_kv_pages(new_kv, self.kv_quant_dtype, self.kv_scale_axis)
+      kv_indices = jnp.arange(kv_heads)[:, None]
+      pages_cache.value = pages_cache.value.at[kv_indices, active_page[None, :], position[None, :]].set(new_kv)
+      scale_pages_cache.value = scale_pages_cache.value.at[kv_indices, active_page[None, :], position[None, :]].set(
+          new_scale
+      )
+      return
+
+    # A page scale covers all tokens of the page, so the active page is dequantized, the token is
+    # written and the page is requantized. Tokens past the new one are left over from earlier
+    # sequences and are zeroed so that they do not inflate the scale.
+    page = dequantize_kv_pages(pages_cache.value[:, active_page], scale_pages_cache.value[:, active_page])
+    token_positions = jnp.arange(self.tokens_per_page)[None, None, :, None]
+    page = jnp.where(token_positions < position[None, :, None, None], page, 0.0)
+    page = jnp.where(token_positions == position[None, :, None, None], new_kv[:, :, None, :], page)
+    page, page_scale = quantize_kv_pages(page, self.kv_quant_dtype, self.kv_scale_axis)
+    pages_cache.value = pages_cache.value.at[:, active_page].set(page)
+    scale_pages_cache.value = scale_pages_cache.value.at[:, active_page].set(page_scale)
@@ -0,0 +1,308 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared-prefix cache of prefill KV caches.
+
+Few-shot prompts and chat system prompts share long token prefixes, and
+recomputing their KV cache for every request wastes prefill compute. The
+`PrefixCache` keeps the prefill KV caches of earlier prompts in a token trie
+and returns, for a new prompt, the cache of the longest previously seen prefix.
+`MaxEngine.prefill_with_prefix_cache` then resumes chunked prefill from there.
+
+The trie has one edge per `chunk_size` tokens, so keys are chunk-aligned and a
+lookup costs one dict access per chunk. An entry stored for a prompt also serves
+every shorter chunk-aligned prefix of it: the KV of a position only depends on
+the tokens before it, and chunked prefill overwrites and masks out the rest.
+Storing a prompt therefore drops entries whose key is a prefix of it.
+
+Entries live on device until `hbm_bytes` is exceeded. The least recently used
+ones are then moved to host memory, within `host_bytes`, and dropped after that.
+A host entry is moved back to device when it is hit. Stored caches are copies
+that are never donated or updated in place, so the prefill that reuses an entry
+always writes into a new buffer.
+"""
+
+import collections
+import dataclasses
+from typing import Any
+
+import jax
+import numpy as np
+
+Cache = Any
+
+
+@dataclasses.dataclass
+class PrefixCacheStats:
+  """Counters of prefix cache usage.
+
+  Attributes:
+    lookups: Number of prompts looked up.
+    hits: Number of lookups that found a cached prefix.
+    prompt_tokens: Total number of tokens of the looked up prompts.
+    saved_prefill_tokens: Number of prompt tokens that were not prefilled again.
+    insertions: Number of entries stored.
+    offloads: Number of entries moved from device to host memory.
+    evictions: Number of entries dropped to stay within the memory budget.
+  """
+
+  lookups: int = 0
+  hits: int = 0
+  prompt_tokens: int = 0
+  saved_prefill_tokens: int = 0
+  insertions: int = 0
+  offloads: int = 0
+  evictions: int = 0
+
+  @property
+  def hit_rate(self) -> float:
+    return self.hits / self.lookups if self.lookups else 0.0
+
+  @property
+  def saved_prefill_fraction(self) -> float:
+    return self.saved_prefill_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+  def summary(self) -> dict[str, Any]:
+    return dataclasses.asdict(self) | {
+        "hit_rate": self.hit_rate,
+        "saved_prefill_fraction": self.saved_prefill_fraction,
+    }
+
+
+@dataclasses.dataclass
+class PrefixCacheHit:
+  """Result of a successful `PrefixCache.lookup`.
+
+  Attributes:
+    num_tokens: Length of the cached prefix of the prompt, a multiple of `chunk_size`.
+    cache: Prefill KV cache holding at least the first `num_tokens` positions of the prompt.
+    prompt_logp: [1, num_tokens] log-probabilities of the prefix tokens.
+  """
+
+  num_tokens: int
+  cache: Cache
+  prompt_logp: jax.Array
+
+
+@dataclasses.dataclass(eq=False)
+class _Entry:
+  """A stored prefill cache, on device or in host memory."""
+
+  key: tuple[int, ...]
+  cache: Cache
+  prompt_logp: Any
+  nbytes: int
+  shardings: Any
+  on_host: bool = False
+  last_used: int = 0
+
+
+class _TrieNode:
+  """A trie node; `entries` are all entries whose key passes through this node."""
+
+  __slots__ = ("children", "entries")
+
+  def __init__(self):
+    self.children: dict[tuple[int, ...], _TrieNode] = {}
+    self.entries: dict[int, _Entry] = {}
+
+
+def _nbytes(tree) -> int:
+  return sum(x.nbytes for x in jax.tree.leaves(tree))
+
+
+class PrefixCache:
+  """Token trie of prefill KV caches with LRU eviction under a device and host byte budget."""
+
+  def __init__(self, chunk_size: int, hbm_bytes: int, host_bytes: int = 0):
+    """
+    Args:
+      chunk_size: Number of tokens per trie edge. Only chunk-aligned prefixes are cached.
+      hbm_bytes: Device memory budget of the cached entries in bytes.
+      host_bytes: Host memory budget in bytes for entries evicted from device
+        memory. Zero drops them instead.
+    """
+    if chunk_size <= 0:
+      raise ValueError(f"chunk_size must be positive, got {chunk_size}.")
+    self.chunk_size = chunk_size
+    self.hbm_bytes = hbm_bytes
+    self.host_bytes = host_bytes
+    self.stats = PrefixCacheStats()
+
+    self._root = _TrieNode()
+    # Both are ordered from least to most recently used.
+    self._device_entries: collections.OrderedDict[int, _Entry] = collections.OrderedDict()
+    self._host_entries: collections.OrderedDict[int, _Entry] = collections.OrderedDict()
+    self._device_bytes = 0
+    self._host_bytes_used = 0
+    self._clock = 0
+
+  def __len__(self) -> int:
+    return len(self._device_entries) + len(self._host_entries)
+
+  @property
+  def device_bytes(self) -> int:
+    return self._device_bytes
+
+  @property
+  def host_bytes_used(self) -> int:
+    return self._host_bytes_used
+
+  def _chunks(self, tokens: np.ndarray):
+    for start in range(0, len(tokens) - self.chunk_size + 1, self.chunk_size):
+      yield tuple(int(t) for t in tokens[start : start + self.chunk_size])
+
+  def _walk(self, tokens: np.ndarray) -> list[_TrieNode]:
+    """Returns the nodes of the longest chunk-aligned prefix of `tokens` in the trie, root excluded."""
+    path = []
+    node = self._root
+    for chunk in self._chunks(tokens):
+      node = node.children.get(chunk)
+      if node is None:
+        break
+      path.append(node)
+    return path
+
+  def lookup(self, tokens: np.ndarray) -> PrefixCacheHit | None:
+    """Returns the cache of the longest cached chunk-aligned prefix of `tokens`, or None on a miss.
+
+    Args:
+      tokens: The unpadded prompt tokens.
+    """
+    tokens = np.asarray(tokens)
+    self.stats.lookups += 1
+    self.stats.prompt_tokens += len(tokens)
+    path = self._walk(tokens)
+    if not path:
+      return None
+    entry = max(path[-1].entries.values(), key=lambda e: e.last_used)
+    self._touch(entry)
+    num_tokens = len(path) * self.chunk_size
+    self.stats.hits += 1
+    return PrefixCacheHit(num_tokens, entry.cache, entry.prompt_logp[:, :num_tokens])
+
+  def insert(self, tokens: np.ndarray, cache: Cache, prompt_logp: jax.Array) -> bool:
+    """Stores the prefill cache of a prompt under its longest chunk-aligned prefix.
+
+    The cache is copied, so the caller may donate `cache` afterwards.
+
+    Args:
+      tokens: The unpadded prompt tokens.
+      cache: The prefill KV cache holding at least the positions of `tokens`.
+      prompt_logp: [1, >= len(tokens)] log-probabilities of the prompt tokens.
+
+    Returns:
+      Whether a new entry was stored. Nothing is stored for prompts shorter than
+      a chunk, for prefixes already covered by an entry, and for caches larger
+      than the memory budget.
+    """
+    tokens = np.asarray(tokens)
+    num_tokens = len(tokens) // self.chunk_size * self.chunk_size
+    if num_tokens == 0:
+      return False
+    path = self._walk(tokens[:num_tokens])
+    if len(path) * self.chunk_size == num_tokens and path[-1].entries:
+      self._touch(max(path[-1].entries.values(), key=lambda e: e.last_used))
+      return False
+    nbytes = _nbytes(cache)
+    if nbytes > max(self.hbm_bytes, self.host_bytes):
+      return False
+
+    # Entries whose key is a prefix of the new key are served by the new entry.
+    for depth, node in enumerate(path, start=1):
+      for entry in [e for e in node.entries.values() if len(e.key) == depth * self.chunk_size]:
+        self._remove(entry)
+
+    entry = _Entry(
+        key=tuple(int(t) for t in tokens[:num_tokens]),
+        cache=jax.tree.map(lambda x: x.copy(), cache),
+        prompt_logp=prompt_logp[:, :num_tokens],
+        nbytes=nbytes,
+        shardings=jax.tree.map(lambda x: x.sharding, cache),
+    )
+    node = self._root
+    for chunk in self._chunks(np.asarray(entry.key)):
+      node = node.children.setdefault(chunk, _TrieNode())
+      node.entries[id(entry)] = entry
+    self._device_entries[id(entry)] = entry
+    self._device_bytes += nbytes
+    self._touch(entry)
+    self.stats.insertions += 1
+    self._evict()
+    return True
+
+  def clear(self):
+    """Drops all entries. Counters are kept."""
+    self._root = _TrieNode()
+    self._device_entries.clear()
+    self._host_entries.clear()
+    self._device_bytes = 0
+    self._host_bytes_used = 0
+
+  def _touch(self, entry: _Entry):
+    """Marks `entry` as most recently used, moving it back to device memory if needed."""
+    self._clock += 1
+    entry.last_used = self._clock
+    if entry.on_host:
+      del self._host_entries[id(entry)]
+      self._host_bytes_used -= entry.nbytes
+      entry.cache = jax.device_put(entry.cache, entry.shardings)
+      entry.on_host = False
+      self._device_entries[id(entry)] = entry
+      self._device_bytes += entry.nbytes
+      self._evict(keep=entry)
+    else:
+      self._device_entries.move_to_end(id(entry))
+
+  def _evict(self, keep: _Entry | None = None):
+    """Moves least recently used entries to host memory and drops them to stay within budget."""
+    while self._device_bytes > self.hbm_bytes and self._device_entries:
+      entry = next(iter(self._device_entries.values()))
+      if entry is keep:
+        break
+      del self._device_entries[id(entry)]
+      self._device_bytes -= entry.nbytes
+      if entry.nbytes <= self.host_bytes:
+        entry.cache = jax.device_get(entry.cache)
+        entry.on_host = True
+        self._host_entries[id(entry)] = entry
+        self._host_bytes_used += entry.nbytes
+        self.stats.offloads += 1
+      else:
+        self._unlink(entry)
+        self.stats.evictions += 1
+    while self._host_bytes_used > self.host_bytes and self._host_entries:
+      entry = next(iter(self._host_entries.values()))
+      self._remove(entry)
+      self.stats.evictions += 1
+
+  def _remove(self, entry: _Entry):
+    if entry.on_host:
+      del self._host_entries[id(entry)]
+      self._host_bytes_used -= entry.nbytes
+    else:
+      del self._device_entries[id(entry)]
+      self._device_bytes -= entry.nbytes
+    self._unlink(entry)
+
+  def _unlink(self, entry: _Entry):
+    """Removes `entry` from the trie and prunes the nodes no other entry passes through."""
+    parent = self._root
+    for chunk in self._chunks(np.asarray(entry.key)):
+      node = parent.children[chunk]
+      del node.entries[id(entry)]
+      if not node.entries:
+        del parent.children[chunk]
+        return
+      parent = node
@@ -184,6 +184,10 @@ def ar_benchmark(config, engine_generate, params, decode_state, global_batch_siz
   seconds_per_step = time_in_s / iters
   ar_average_ms = seconds_per_step * 1000
   total_throughput = global_batch_size / seconds_per_step
+  # The decode state besides the KV cache, which holds the full-vocab logits unless `decode_state_logits=False`.
+  _, decode_state_size, _ = max_utils.summarize_pytree_data(
+      {k: v for k, v in decode_state.items() if k != "cache"}, name="Decode state without cache", raw=True
+  )
 
   GB_per_step_per_device = (model_size + cache_size) / 1e9 / jax.device_count()
   bw_per_device = GB_per_step_per_device / seconds_per_step
@@ -193,7 +197,8 @@ def ar_benchmark(config, engine_generate, params, decode_state, global_batch_siz
       f"\tAR step average time per seq: {ar_average_ms/global_batch_size:.3f} ms\n"
       f"\tAR global batch size: {global_batch_size}\n"
       f"\tAR throughput: {total_throughput:.3f} tokens/second\n"
-      f"\tAR memory bandwidth per device: {bw_per_device:.3f} GB/s\n\n\n"
+      f"\tAR memory bandwidth per device: {bw_per_device:.3f} GB/s\n"
+      f"\tAR decode state size without cache: {decode_state_size / 1e6:.3f} MB\n\n\n"
   )
 
   result_dict = {
@@ -202,6 +207,69 @@ def ar_benchmark(config, engine_generate, params, decode_state, global_batch_siz
       "global_batch_size": global_batch_size,
       "total_throughput_tokens_per_second": total_throughput,
       "bw_per_device_GB_per_second": bw_per_device,
+      "decode_state_size_in_mb": decode_state_size / 1e6,
+  }
+  return result_dict, decode_state
+
+
+def speculative_benchmark(
+    config, engine, params, decode_state, draft_engine, draft_params, draft_decode_state, tokens, true_length, iters
+):
+  """Fills every slot with the prompt, then benchmarks speculative decoding steps and prints the results."""
+  rng = jax.random.PRNGKey(1234)
+  for slot in range(engine.max_concurrent_decodes):
+    rng, rng_prefill = jax.random.split(rng)
+    prefix, _ = engine.prefill(params=params, padded_tokens=tokens, true_length=true_length, rng=rng_prefill)
+    decode_state = engine.insert(prefix, decode_state, slot)
+    draft_prefix, _ = draft_engine.prefill(
+        params=draft_params, padded_tokens=tokens, true_length=true_length, rng=rng_prefill
+    )
+    draft_decode_state = draft_engine.insert(draft_prefix, draft_decode_state, slot)
+
+  def step(decode_state, draft_decode_state, rng):
+    decode_state, draft_decode_state, result = engine.generate_speculative(
+        params, decode_state, draft_engine, draft_params, draft_decode_state, rng
+    )
+    return decode_state, draft_decode_state, result.data[:, result.valid_idx[0] : result.valid_idx[1]].sum()
+
+  for _ in range(_WARMUP_ITERS):
+    rng, rng_generate = jax.random.split(rng)
+    decode_state, draft_decode_state, _ = step(decode_state, draft_decode_state, rng_generate)
+  jax.block_until_ready(decode_state)
+
+  prof = profiler.Profiler(config)
+  prof.activate(optional_postfix="speculative")
+  start = datetime.datetime.now()
+  num_tokens = []
+  for _ in range(iters):
+    rng, rng_generate = jax.random.split(rng)
+    decode_state, draft_decode_state, step_tokens = step(decode_state, draft_decode_state, rng_generate)
+    num_tokens.append(step_tokens)
+  jax.block_until_ready(decode_state)
+  end = datetime.datetime.now()
+  prof.deactivate()
+
+  global_batch_size = engine.max_concurrent_decodes
+  seconds_per_step = (end - start).total_seconds() / iters
+  tokens_per_step = float(sum(jax.device_get(num_tokens))) / iters / global_batch_size
+  num_draft_tokens = config.speculative_num_draft_tokens
+  acceptance_rate = (tokens_per_step - 1) / num_draft_tokens
+  total_throughput = global_batch_size * tokens_per_step / seconds_per_step
+  print(
+      f"Speculative decoding results with {num_draft_tokens} draft tokens:\n"
+      f"\tSpeculative step average time: {seconds_per_step * 1000:.3f} ms\n"
+      f"\tAccepted tokens per step per seq: {tokens_per_step:.3f}\n"
+      f"\tDraft token acceptance rate: {acceptance_rate * 100:.2f}%\n"
+      f"\tSpeculative throughput: {total_throughput:.3f} tokens/second\n\n\n"
+  )
+
+  result_dict = {
+      "step_in_ms": seconds_per_step * 1000,
+      "num_draft_tokens": num_draft_tokens,
+      "accepted_tokens_per_step": tokens_per_step,
+      "acceptance_rate_percent": acceptance_rate * 100,
+      "global_batch_size": global_batch_size,
+      "total_throughput_tokens_per_second": total_throughput,
   }
   return result_dict, decode_state
 
@@ -297,8 +365,11 @@ def summarize_prefill_result(engine_prefill, params, tokens, true_length):
   }
 
 
-def run_benchmarks(config):
-  """Run microbenchmarks."""
+def run_benchmarks(config, draft_config=None):
+  """Run microbenchmarks.
+
+  The `speculative` stage decodes with `draft_config` as the draft model of speculative decoding.
+  """
   engine = maxengine.MaxEngine(config)
   prefill_processor = prefill_packing.PrefillProcessor(engine)
   rng = jax.random.PRNGKey(1234)
@@ -416,6 +487,28 @@ def run_benchmarks(config):
         benchmark_loop_iters,
     )
 
+  if "speculative" in stages_to_benchmark:
+    if draft_config is None:
+      raise ValueError("The speculative stage requires speculative_num_draft_tokens > 0 and a draft model config.")
+    draft_engine = maxengine.MaxEngine(draft_config)
+    rng, rng_load_params, rng_init_decode = jax.random.split(rng, 3)
+    draft_params = draft_engine.load_params(rng_load_params)
+    tokens, true_length = tokenizer_model.encode(text, is_bos=True, prefill_lengths=[prefill_lengths[0]])
+    # Both engines have to decode the same prompts, so the stage starts from new decode states.
+    del decode_state
+    benchmark_results["speculative"], decode_state = speculative_benchmark(
+        config,
+        engine,
+        params,
+        engine.init_decode_state(rng=rng_init_decode),
+        draft_engine,
+        draft_params,
+        draft_engine.init_decode_state(rng=rng_init_decode),
+        tokens,
+        true_length,
+        benchmark_loop_iters,
+    )
+
   results = collate_results(config, benchmark_results, model_size, cache_size, num_model_params)
   print_results_for_analyze(results)
   if config.inference_microbenchmark_log_file_path:
@@ -438,7 +531,11 @@ def run_benchmarks(config):
 
 def run_benchmarks_with_unsafe_rbg(config, **kwargs):
   jax.config.update("jax_default_prng_impl", "unsafe_rbg")
-  return run_benchmarks(pyconfig.initialize(config, **kwargs))
+  target_config = pyconfig.initialize(config, **kwargs)
+  draft_config = None
+  if target_config.speculative_num_draft_tokens > 0:
+    draft_config = pyconfig.initialize(config, **(kwargs | target_config.speculative_draft_overrides))
+  return run_benchmarks(target_config, draft_config)
 
 
 def main(config, **kwargs):
@@ -241,3 +241,114 @@ def sample_topk_topp_weighted(logits, topk, nucleus_topp, temperature, rng):
   ).astype(jnp.int32)
 
   return sampled_token
+
+
+def per_slot_sampling_params(algorithm, topk=0, nucleus_topp=1.0, temperature=1.0):
+  """Maps a scalar sampling configuration to the (temperature, topk, nucleus_topp) triple used per slot.
+
+  `sample_per_slot` has no notion of an algorithm; every algorithm supported by
+  `sampling` is expressed through the three per-slot parameters instead:
+  greedy is temperature 0, a top-k of 0 disables top-k filtering and a top-p of
+  1.0 disables nucleus filtering.
+
+  Args:
+    algorithm: string representing supported algorithms
+    topk: restricting to topk logits before sampling
+    nucleus_topp: restricting to p probability mass before sampling
+    temperature: temperature parameter for scaling probability
+
+  Returns:
+    A tuple (temperature, topk, nucleus_topp).
+  """
+  if algorithm == "greedy":
+    return 0.0, 0, 1.0
+  elif algorithm == "weighted":
+    return temperature, 0, 1.0
+  elif algorithm == "nucleus":
+    return temperature, 0, nucleus_topp
+  elif algorithm == "topk":
+    return temperature, topk, 1.0
+  elif algorithm == "composite":
+    return temperature, topk, nucleus_topp
+  else:
+    raise ValueError(f"Sampling {algorithm=} not supported!")
+
+
+def per_slot_rngs(rng, seeds, step):
+  """Builds one rng key per slot for `sample_per_slot`.
+
+  Slots with a non-negative seed get a key derived only from their seed and
+  their decode step, so a seeded request produces the same tokens regardless of
+  which other requests share the batch. Unseeded slots get keys split from `rng`.
+
+  Args:
+    rng: rng key for the current step, used for unseeded slots.
+    seeds: int array of shape [batch]; negative values mean "not seeded".
+    step: int array of shape [batch] with the number of tokens generated so far.
+
+  Returns:
+    An array of rng keys with leading dimension [batch].
+  """
+  step_rngs = jax.random.split(rng, seeds.shape[0])
+  seeded_rngs = jax.vmap(lambda seed, i: jax.random.fold_in(jax.random.PRNGKey(seed), i))(jnp.maximum(seeds, 0), step)
+  is_seeded = (seeds >= 0).reshape((-1,) + (1,) * (step_rngs.ndim - 1))
+  return jnp.where(is_seeded, seeded_rngs, step_rngs)
+
+
+def sample_per_slot(logits, rngs, temperature, topk, nucleus_topp, max_topk=256):
+  """Applies per-slot top-k, top-p and temperature sampling in a single vectorized pass.
+
+  Unlike `sample_topk_topp_weighted`, every slot (leading batch row) of `logits`
+  has its own sampling parameters, so one compiled step can serve requests with
+  heterogeneous sampling settings.
+
+  Greedy slots take the argmax, and slots without top-k and top-p filtering are
+  sampled from all tempered logits. Only the slots with filtering need the
+  sorted candidates, which are skipped when no sampled slot has filtering.
+
+  Args:
+    logits: The unnormalized log probabilities, with shape `[batch, sequence, vocab_size]`.
+    rngs: rng keys with leading dimension `[batch]`, see `per_slot_rngs`.
+    temperature: float array of shape `[batch]`. Slots with temperature <= 0
+      are sampled greedily.
+    topk: int array of shape `[batch]`. Values <= 0 disable top-k filtering.
+    nucleus_topp: float array of shape `[batch]` in (0, 1]. A value of 1.0
+      disables nucleus filtering.
+    max_topk: Static upper bound for `topk`. The candidates of the slots with
+      filtering, including top-p only, are taken from the `max_topk` largest
+      logits; 0 uses the whole vocabulary.
+
+  Returns:
+    The sampled token indices, with shape `[batch, sequence]`.
+  """
+  vocab_size = logits.shape[-1]
+  num_candidates = vocab_size if max_topk <= 0 else min(max_topk, vocab_size)
+  scale = jnp.maximum(temperature, 1e-6)[:, None, None]
+  greedy_token = jnp.argmax(logits, axis=-1).astype(jnp.int32)
+  sampled_token = jax.vmap(jax.random.categorical)(rngs, logits / scale).astype(jnp.int32)
+  filtered = (temperature > 0) & ((topk > 0) | (nucleus_topp < 1.0))
+
+  def sample_filtered():
+    candidate_logits, candidate_idxs = jax.lax.top_k(logits, num_candidates)
+
+    # 1. Top-K filtering
+    ranks = jnp.arange(num_candidates)
+    slot_topk = jnp.where(topk > 0, jnp.minimum(topk, num_candidates), num_candidates)
+    keep = ranks < slot_topk[:, None, None]
+    topk_logits = jnp.where(keep, candidate_logits, NEG_INF)
+
+    # 2. Top-P filtering on the top-k results, keeping the element that crosses the threshold.
+    sorted_cum_probs = jnp.cumsum(jax.nn.softmax(topk_logits, axis=-1), axis=-1)
+    cutoff_index = jnp.sum(sorted_cum_probs < nucleus_topp[:, None, None], axis=-1, keepdims=True)
+    keep = jnp.logical_and(keep, ranks <= cutoff_index)
+    filtered_logits = jnp.where(keep, candidate_logits, NEG_INF)
+
+    # 3. Apply temperature and sample
+    sampled_index = jax.vmap(jax.random.categorical)(rngs, filtered_logits / scale).astype(jnp.int32)
+
+    # Map the index back to the original vocabulary
+    return jnp.take_along_axis(candidate_idxs, sampled_index[..., None], axis=-1)[..., 0].astype(jnp.int32)
+
+  filtered_token = jax.lax.cond(jnp.any(filtered), sample_filtered, lambda: sampled_token)
+  token = jnp.where(filtered[:, None], filtered_token, sampled_token)
+  return jnp.where(temperature[:, None] > 0, token, greedy_token)
@@ -28,6 +28,7 @@ import grain.python as grain
 
 from MaxText.utils import gcs_utils
 from MaxText.input_pipeline import _input_pipeline_utils
+from MaxText.input_pipeline import _grain_packing
 from MaxText.input_pipeline import _grain_tokenizer
 from MaxText import multihost_dataloading
 from MaxText import max_logging
@@ -252,6 +253,13 @@ def pretrain_preprocessing_pipeline(
           num_packing_bins=batch_size,
           max_sequences_per_bin=max_segments,
       )
+    elif config.grain_packing_type == "numpy_first_fit":
+      dataset = _grain_packing.NumpyFirstFitPackIterDataset(
+          dataset,
+          length_struct=length_struct,
+          num_packing_bins=batch_size,
+          max_sequences_per_bin=max_segments,
+      )
     elif config.grain_packing_type == "best_fit":
       dataset = BestFitPackIterDataset(dataset, length_struct=length_struct, num_packing_bins=batch_size)
     elif config.grain_packing_type == "concat_then_split":
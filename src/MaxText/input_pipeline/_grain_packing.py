@@ -0,0 +1,236 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""First-fit packing transform for Grain with array-backed bin state.
+
+`NumpyFirstFitPackIterDataset` is a drop-in replacement of Grain's
+`FirstFitPackIterDataset` for the flat dicts of tokenized features of the
+pretraining pipeline, and emits the same packed rows with `<feature>`,
+`<feature>_segment_ids` and `<feature>_positions`.
+
+Grain walks the feature pytree and writes the values, segment ids and positions
+of every example into the packed buffers as soon as it is placed. Here the fill
+level and segment count of all bins are NumPy arrays, so placing an example is
+a single vectorized fit test, and the examples of a packed batch are only
+written once the batch is complete: each feature is then scattered into the
+batch as one block, with one concatenation and one fancy-indexed assignment.
+
+Like Grain, the state is the parent state from which the batch being emitted is
+re-packed plus the number of rows already emitted, so the transform checkpoints
+with the Grain iterator.
+"""
+
+from typing import Any
+
+import grain.python as grain
+import numpy as np
+
+
+class _NumpyFirstFitPackIterator(grain.DatasetIterator):  # pylint: disable=abstract-method
+  """Packs the examples of the parent iterator into batches of `num_packing_bins` rows and emits them row by row."""
+
+  def __init__(
+      self,
+      parent: grain.DatasetIterator,
+      length_struct: dict[str, int],
+      num_packing_bins: int,
+      seed: int,
+      shuffle_bins: bool,
+      max_sequences_per_bin: int | None,
+  ):
+    super().__init__(parent)
+    self._features = list(length_struct)
+    self._capacities = np.array([length_struct[k] for k in self._features], dtype=np.int64)
+    self._num_packing_bins = num_packing_bins
+    self._seed = seed
+    self._shuffle_bins = shuffle_bins
+    self._max_sequences_per_bin = max_sequences_per_bin
+    self._reset()
+
+  def _reset(self):
+    """Drops the batch being packed or emitted, as after restoring the parent state."""
+    # The parent state from which the batch being emitted is packed again.
+    self._batch_parent_state = self._parent.get_state()
+    # The parent state from which the batch after it is packed.
+    self._next_batch_parent_state = None
+    # An example that did not fit into the last batch, with the parent state before it.
+    self._pending = None
+    self._packed_batch = None
+    self._num_rows = 0
+    self._shuffled_rows = None
+    self._next_row = 0
+    # Number of rows emitted in total, used to seed the shuffling of the rows.
+    self._counter = 0
+
+  def get_state(self) -> dict[str, Any]:
+    return {
+        "parent": self._batch_parent_state,
+        "next_row": self._next_row,
+        "counter": self._counter,
+    }
+
+  def set_state(self, state: dict[str, Any]):
+    self._parent.set_state(state["parent"])
+    self._reset()
+    self._next_row = state["next_row"]
+    self._counter = state["counter"]
+
+  def _next_example(self):
+    """Returns the next example of the parent and the parent state before it, or None when exhausted."""
+    if self._pending is not None:
+      pending, self._pending = self._pending, None
+      return pending
+    state = self._parent.get_state()
+    try:
+      return state, next(self._parent)
+    except StopIteration:
+      return None
+
+  def _pack_batch(self) -> bool:
+    """Packs the next batch, returning False when the parent is exhausted."""
+    capacities = self._capacities[:, None]
+    fill = np.zeros((len(self._features), self._num_packing_bins), dtype=np.int64)
+    num_segments = np.zeros(self._num_packing_bins, dtype=np.int32)
+    examples, example_lengths, rows, segment_ids = [], [], [], []
+    while True:
+      next_example = self._next_example()
+      if next_example is None:
+        self._next_batch_parent_state = self._parent.get_state()
+        break
+      state, example = next_example
+      lengths = np.array([len(example[k]) for k in self._features], dtype=np.int64)
+      if np.any(lengths > self._capacities):
+        raise ValueError(
+            "Inputs to NumpyFirstFitPackIterDataset must be truncated to max length. Got lengths "
+            f"{dict(zip(self._features, lengths.tolist()))} for max lengths "
+            f"{dict(zip(self._features, self._capacities.tolist()))}."
+        )
+      fits = np.all(fill + lengths[:, None] <= capacities, axis=0)
+      if self._max_sequences_per_bin is not None:
+        fits &= num_segments < self._max_sequences_per_bin
+      if not fits.any():
+        # Every example fits into an empty bin, so the batch holds at least one example.
+        self._pending = next_example
+        self._next_batch_parent_state = state
+        break
+      row = int(np.argmax(fits))
+      examples.append(example)
+      example_lengths.append(lengths)
+      rows.append(row)
+      num_segments[row] += 1
+      segment_ids.append(num_segments[row])
+      fill[:, row] += lengths
+    if not examples:
+      return False
+    # First fit only opens a new bin when no earlier one fits, so the used bins are a prefix.
+    self._num_rows = max(rows) + 1
+    self._packed_batch = self._write_batch(
+        examples, np.stack(example_lengths, axis=1), np.array(rows), np.array(segment_ids), fill[:, : self._num_rows]
+    )
+    if self._shuffle_bins:
+      seed = self._seed + self._counter - self._next_row
+      self._shuffled_rows = np.random.default_rng(seed).permuted(range(self._num_rows))
+    return True
+
+  def _write_batch(self, examples, lengths, rows, segment_ids, fill) -> dict[str, np.ndarray]:
+    """Writes the placed examples into the packed arrays, one block per feature.
+
+    The examples of a bin are contiguous in placement order, so ordering the
+    examples by bin and concatenating them gives the non-padding cells of the
+    packed arrays in row-major order.
+
+    Args:
+      examples: The examples of the batch.
+      lengths: [num_features, num_examples] lengths of the features.
+      rows: [num_examples] bin of each example.
+      segment_ids: [num_examples] 1-based segment id of each example in its bin.
+      fill: [num_features, num_rows] number of filled cells of each feature in each bin.
+    """
+    order = np.argsort(rows, kind="stable")
+    lengths = lengths[:, order]
+    segment_ids = segment_ids[order]
+    packed = {}
+    for i, (feature, capacity) in enumerate(zip(self._features, self._capacities)):
+      values = np.concatenate([np.asarray(examples[j][feature]) for j in order])
+      starts = np.cumsum(lengths[i]) - lengths[i]
+      filled = np.arange(capacity) < fill[i][:, None]
+
+      packed_values = np.zeros((*filled.shape, *values.shape[1:]), dtype=values.dtype)
+      packed_segment_ids = np.zeros(filled.shape, dtype=np.int32)
+      packed_positions = np.zeros(filled.shape, dtype=np.int32)
+      packed_values[filled] = values
+      packed_segment_ids[filled] = np.repeat(segment_ids, lengths[i])
+      packed_positions[filled] = np.arange(len(values)) - np.repeat(starts, lengths[i])
+      packed[feature] = packed_values
+      packed[f"{feature}_segment_ids"] = packed_segment_ids
+      packed[f"{feature}_positions"] = packed_positions
+    return packed
+
+  def __next__(self):
+    if self._packed_batch is None and not self._pack_batch():
+      raise StopIteration
+    row = self._shuffled_rows[self._next_row] if self._shuffle_bins else self._next_row
+    element = {k: v[row] for k, v in self._packed_batch.items()}
+    self._next_row += 1
+    self._counter += 1
+    if self._next_row >= self._num_rows:
+      self._packed_batch = None
+      self._shuffled_rows = None
+      self._batch_parent_state = self._next_batch_parent_state
+      self._next_batch_parent_state = None
+      self._next_row = 0
+    return element
+
+
+class NumpyFirstFitPackIterDataset(grain.IterDataset):  # pylint: disable=abstract-method
+  """First-fit packing of flat dicts of 1-D token arrays, with the outputs and state semantics of Grain's packer."""
+
+  def __init__(
+      self,
+      parent: grain.IterDataset,
+      *,
+      length_struct: dict[str, int],
+      num_packing_bins: int,
+      seed: int = 0,
+      shuffle_bins: bool = True,
+      max_sequences_per_bin: int | None = None,
+  ):
+    """
+    Args:
+      parent: Dataset of dicts of variable length sequences. Features not in
+        `length_struct` are dropped.
+      length_struct: Target sequence length of each packed feature.
+      num_packing_bins: Number of bins packed at once.
+      seed: Random seed of the row shuffling.
+      shuffle_bins: Whether to emit the rows of a packed batch in random order.
+      max_sequences_per_bin: Maximum number of examples per packed row. None for no limit.
+    """
+    super().__init__(parent)
+    if max_sequences_per_bin is not None and max_sequences_per_bin <= 0:
+      raise ValueError(f"max_sequences_per_bin must be positive if set, got {max_sequences_per_bin}.")
+    self._length_struct = dict(length_struct)
+    self._num_packing_bins = num_packing_bins
+    self._seed = seed
+    self._shuffle_bins = shuffle_bins
+    self._max_sequences_per_bin = max_sequences_per_bin
+
+  def __iter__(self) -> grain.DatasetIterator:
+    return _NumpyFirstFitPackIterator(
+        self._parent.__iter__(),
+        self._length_struct,
+        self._num_packing_bins,
+        self._seed,
+        self._shuffle_bins,
+        self._max_sequences_per_bin,
+    )
@@ -500,6 +500,8 @@ class MLA(Attention):
           kv_head_dim_size=head_dim,
           dtype=self.dtype,
           attn_logits_soft_cap=self.attn_logits_soft_cap,
+          kv_quant_dtype=self.config.pagedattn_kv_quant_dtype,
+          kv_quant_granularity=self.config.pagedattn_kv_quant_granularity,
           rngs=self.rngs,
       )
 
@@ -607,6 +609,7 @@ class MLA(Attention):
         ar_cache_axis_order=self.ar_cache_axis_order,
         model_mode=self.model_mode,
         use_chunked_prefill=self.config.use_chunked_prefill,
+        speculative_num_draft_tokens=self.config.speculative_num_draft_tokens,
         rngs=self.rngs,
     )
 
@@ -619,15 +619,22 @@ class AttentionOp(nnx.Module):
       [2] SARATHI: Efficient LLM Inference by Piggybacking Decodes with
           Chunked Prefills - ArXiv:2308.16369 (https://arxiv.org/abs/2308.16369)
     """
+    _, q_seq_len, _, _ = query.shape
+    _, kv_seq_len, _, _ = key.shape
+
     mask = None
     if model_mode == MODEL_MODE_AUTOREGRESSIVE:
       mask = decoder_segment_ids[:, None, None, None, :] == DECODING_ACTIVE_SEQUENCE_INDICATOR
+      if q_seq_len > 1:
+        # The AR cache marks column j of a multi-token block with -(j + 1), see
+        # `KVCache.kv_cache_autoregressive`; query i attends to columns j <= i.
+        row_ids = jax.lax.broadcasted_iota(jnp.int32, (q_seq_len, 1), 0)
+        block_ids = -decoder_segment_ids[:, None, None, None, :] - 1
+        mask = mask | ((block_ids >= 0) & (block_ids <= row_ids))
     elif decoder_segment_ids is not None:
       mask = decoder_segment_ids[:, :, None] == decoder_segment_ids[:, None, :]
       mask = mask[:, None, None, :, :]
 
-    _, q_seq_len, _, _ = query.shape
-    _, kv_seq_len, _, _ = key.shape
     next_pos = 0
     if previous_chunk is not None:
       next_pos = previous_chunk.shape[1]
@@ -657,7 +664,12 @@ class AttentionOp(nnx.Module):
     elif causal_mask is not None:
       output_mask = causal_mask
 
-    if self.attention_type == AttentionType.LOCAL_SLIDING and output_mask is not None:
+    # With `use_local_window_kv_cache`, the KV cache already masks the tokens outside the window
+    # of the decoded token in its segment ids.
+    apply_window_mask = output_mask is not None and not (
+        model_mode == MODEL_MODE_AUTOREGRESSIVE and self.config.use_local_window_kv_cache
+    )
+    if self.attention_type == AttentionType.LOCAL_SLIDING and apply_window_mask:
       if self.sliding_window_size is None:
         raise ValueError("Sliding_window_size must be set if Local Sliding attention type")
 
@@ -667,7 +679,7 @@ class AttentionOp(nnx.Module):
           col_ids_sliding <= row_ids_sliding
       )
       output_mask = sliding_mask * output_mask
-    elif self.attention_type == AttentionType.CHUNK and output_mask is not None:
+    elif self.attention_type == AttentionType.CHUNK and apply_window_mask:
       mask_shape = (q_seq_len, kv_seq_len)
       chunk_mask = _generate_chunk_attention_mask(
           mask_shape=(q_seq_len, kv_seq_len), chunk_size=self.chunk_attn_window_size, q_offset=next_pos
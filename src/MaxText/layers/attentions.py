@@ -469,6 +469,8 @@ class Attention(nnx.Module):
           kv_head_dim_size=self.head_dim,
           dtype=self.dtype,
           attn_logits_soft_cap=self.attn_logits_soft_cap,
+          kv_quant_dtype=self.config.pagedattn_kv_quant_dtype,
+          kv_quant_granularity=self.config.pagedattn_kv_quant_granularity,
           rngs=self.rngs,
       )
 
@@ -850,6 +852,15 @@ class Attention(nnx.Module):
     # KVCache.
     placeholder_seq_len = 1
 
+    # Local attention layers only attend to the last window of tokens, so their AR cache can be
+    # a ring buffer of the window size.
+    local_window_size = None
+    if self.config.use_local_window_kv_cache:
+      if self.attention_type == AttentionType.LOCAL_SLIDING:
+        local_window_size = self.sliding_window_size
+      elif self.attention_type == AttentionType.CHUNK:
+        local_window_size = self.config.chunk_attn_window_size
+
     return kvcache.KVCache(
         max_prefill_length=self.max_prefill_predict_length,
         max_target_length=self.max_target_length,
@@ -866,6 +877,9 @@ class Attention(nnx.Module):
         ar_cache_axis_order=self.ar_cache_axis_order,
         use_chunked_prefill=self.config.use_chunked_prefill,
         model_mode=self.model_mode,
+        attention_type=self.attention_type,
+        local_window_size=local_window_size,
+        speculative_num_draft_tokens=self.config.speculative_num_draft_tokens,
         rngs=self.rngs,
     )
 
@@ -31,6 +31,8 @@ if jax.__version_info__ >= (0, 6, 3):
 else:
   from jax.experimental.layout import DeviceLocalLayout as DLL  # type: ignore
 
+import numpy as np
+
 from flax import linen as nn
 from flax import struct
 from flax.linen import partitioning as nn_partitioning
@@ -50,11 +52,11 @@ from MaxText import multimodal_utils
 from MaxText import pyconfig
 from MaxText.common_types import MODEL_MODE_PREFILL, DECODING_ACTIVE_SEQUENCE_INDICATOR, MODEL_MODE_AUTOREGRESSIVE
 from MaxText.globals import MAXTEXT_PKG_DIR
-from MaxText.inference.page_manager import PageManager, PageState
+from MaxText.inference.page_manager import MemoryPressurePolicy, PageManager, PageState, PreemptedGroup
+from MaxText.inference.prefix_cache import PrefixCache
 from MaxText.layers import models, quantizations
 from MaxText.utils import lora_utils
 
-
 warnings.simplefilter("ignore", category=FutureWarning)
 DecodeState = Any
 Prefix = Any
@@ -62,6 +64,9 @@ PackedPrefix = Any
 Params = Any
 PRNGKeyType = Any
 
+# Decode state entries holding per-slot sampling parameters, see `decode_sampling_per_slot`.
+SAMPLING_PARAM_KEYS = ("sampling_temperature", "sampling_topk", "sampling_topp", "sampling_seed")
+
 
 # TODO(yuyanpeng): Should import ExistingPrefix from jetstream.engine.engine_api
 @struct.dataclass
@@ -132,9 +137,11 @@ class MaxEngine(engine_api.Engine):
     # Initialize page manager and page state
     self.page_manager = None
     self.page_state = None
+    self.memory_pressure_policy = None
     if self.config.attention == "paged":
       self.page_manager = PageManager(self.config)
       self.page_state = self.page_manager.get_initial_page_state()
+      self.memory_pressure_policy = MemoryPressurePolicy(self.page_manager, self.config.pagedattn_preemption_mode)
 
   def print_stats(self, label: str):
     max_utils.print_mem_stats(label)
@@ -386,6 +393,59 @@ class MaxEngine(engine_api.Engine):
 
     return res_cache
 
+  def _per_slot_sampling_params(
+      self,
+      batch_size: int,
+      algorithm: str | None,
+      topk: int | None,
+      nucleus_topp: float | None,
+      temperature: float | None,
+      seed: int | jax.Array = -1,
+  ) -> dict[str, jax.Array]:
+    """Per-slot sampling parameters for a prefix, or an empty dict if `decode_sampling_per_slot` is off."""
+    if not self.config.decode_sampling_per_slot:
+      return {}
+    slot_temperature, slot_topk, slot_topp = inference_utils.per_slot_sampling_params(
+        algorithm if algorithm is not None else self.config.decode_sampling_strategy,
+        topk=topk if topk is not None else self.config.decode_sampling_top_k,
+        nucleus_topp=nucleus_topp if nucleus_topp is not None else self.config.decode_sampling_nucleus_p,
+        temperature=temperature if temperature is not None else self.config.decode_sampling_temperature,
+    )
+    return {
+        "sampling_temperature": jnp.full((batch_size, 1), slot_temperature, dtype=jnp.float32),
+        "sampling_topk": jnp.full((batch_size, 1), slot_topk, dtype=jnp.int32),
+        "sampling_topp": jnp.full((batch_size, 1), slot_topp, dtype=jnp.float32),
+        "sampling_seed": jnp.full((batch_size, 1), seed, dtype=jnp.int32),
+    }
+
+  def _sample_per_slot(self, logits: jax.Array, rng: PRNGKeyType, sampling_params: dict[str, jax.Array], step: jax.Array):
+    """Samples one token per slot using the per-slot sampling parameters of a prefix or decode state."""
+    slot_rngs = inference_utils.per_slot_rngs(rng, sampling_params["sampling_seed"][:, 0], step)
+    return inference_utils.sample_per_slot(
+        logits,
+        slot_rngs,
+        sampling_params["sampling_temperature"][:, 0],
+        sampling_params["sampling_topk"][:, 0],
+        sampling_params["sampling_topp"][:, 0],
+        max_topk=self.config.decode_sampling_per_slot_max_top_k,
+    )
+
+  def _decode_state_logits(self, logits: jax.Array) -> dict[str, jax.Array]:
+    """The entries of a decode state derived from the [batch, 1, vocab_size] logits of its last step.
+
+    The full logits are only kept with `decode_state_logits`, and the log probabilities of the
+    `decode_state_top_logprobs` most likely tokens are computed on device instead of from the kept logits.
+    """
+    entries = {}
+    if self.config.decode_state_logits:
+      entries["logits"] = logits
+    if self.config.decode_state_top_logprobs:
+      log_probs = jax.nn.log_softmax(logits.astype(jnp.float32), axis=-1)
+      top_logprobs, top_logprob_tokens = jax.lax.top_k(log_probs, self.config.decode_state_top_logprobs)
+      entries["top_logprobs"] = top_logprobs
+      entries["top_logprob_tokens"] = top_logprob_tokens.astype(jnp.int32)
+    return entries
+
   def prefill_aot(  # pylint: disable=too-many-positional-arguments
       self,
       params: Params,
@@ -423,6 +483,7 @@ class MaxEngine(engine_api.Engine):
       topk: int | None = None,
       nucleus_topp: float | None = None,
       temperature: float | None = None,
+      seed: int = -1,
   ) -> tuple[Prefix, engine_api.ResultTokens]:
     """Performs a JIT-compiled prefill operation on a sequence of tokens.
 
@@ -451,6 +512,8 @@ class MaxEngine(engine_api.Engine):
       nucleus_topp: The value for top-p (nucleus) sampling. Overrides the
         engine's default.
       temperature: The sampling temperature. Overrides the engine's default.
+      seed: Sampling seed for this request, used when `decode_sampling_per_slot`
+        is enabled. Negative values mean the request is not seeded.
 
     Returns:
       A tuple containing:
@@ -525,14 +588,20 @@ class MaxEngine(engine_api.Engine):
 
     # sampling first token
     rng, new_rng = jax.random.split(rng)
-    first_generated_token = inference_utils.sampling(
-        selected_logits,
-        new_rng,
-        algorithm if algorithm is not None else self.config.decode_sampling_strategy,
-        topk=topk if topk is not None else self.config.decode_sampling_top_k,
-        nucleus_topp=nucleus_topp if nucleus_topp is not None else self.config.decode_sampling_nucleus_p,
-        temperature=temperature if temperature is not None else self.config.decode_sampling_temperature,
-    )
+    sampling_params = self._per_slot_sampling_params(1, algorithm, topk, nucleus_topp, temperature, seed)
+    if sampling_params:
+      first_generated_token = self._sample_per_slot(
+          selected_logits, new_rng, sampling_params, jnp.zeros((1,), dtype=jnp.int32)
+      )
+    else:
+      first_generated_token = inference_utils.sampling(
+          selected_logits,
+          new_rng,
+          algorithm if algorithm is not None else self.config.decode_sampling_strategy,
+          topk=topk if topk is not None else self.config.decode_sampling_top_k,
+          nucleus_topp=nucleus_topp if nucleus_topp is not None else self.config.decode_sampling_nucleus_p,
+          temperature=temperature if temperature is not None else self.config.decode_sampling_temperature,
+      )
 
     all_valid = jnp.ones(first_generated_token.shape, dtype=jnp.int8)
     if self.config.return_log_prob:
@@ -564,6 +633,7 @@ class MaxEngine(engine_api.Engine):
         "tokens": first_generated_token,
         "prompt_logp": prompt_logp,
         "token_logp": token_logp,
+        **sampling_params,
     }, result
 
   # Public non-JIT prefill method that updates page state
@@ -585,6 +655,7 @@ class MaxEngine(engine_api.Engine):
       topk: int | None = None,
       nucleus_topp: float | None = None,
       temperature: float | None = None,
+      seed: int | None = None,
   ) -> tuple[Prefix, engine_api.ResultTokens]:
     """Public API for prefill that updates page state outside JIT."""
     # Update page state before JIT call
@@ -618,8 +689,99 @@ class MaxEngine(engine_api.Engine):
         topk=topk,
         nucleus_topp=nucleus_topp,
         temperature=temperature,
+        seed=-1 if seed is None else seed,
     )
 
+  def prefill_with_prefix_cache(
+      self,
+      *,
+      params: Params,
+      prefix_cache: PrefixCache,
+      tokens: jax.Array | np.ndarray,
+      rng: PRNGKeyType | None = None,
+      slot: int | None = None,
+      return_prompt_logp: bool = False,
+      algorithm: str | None = None,
+      topk: int | None = None,
+      nucleus_topp: float | None = None,
+      temperature: float | None = None,
+      seed: int | None = None,
+  ) -> tuple[Prefix, engine_api.ResultTokens]:
+    """Prefills a prompt chunk by chunk, resuming from its longest cached prefix.
+
+    Looks up `tokens` in `prefix_cache`, runs chunked prefill over the remaining
+    tokens on top of the cached KV cache, and stores the resulting cache for
+    later prompts. The last cached token is prefilled again: this yields the
+    log-probability of the first uncached token, and a fully cached prompt still
+    gets the logits to sample its first generated token from.
+
+    Args:
+      params: The model parameters.
+      prefix_cache: The prefix cache to look up and update.
+      tokens: The prompt tokens, without padding.
+      rng: JAX random number generator key for sampling.
+      slot: The batch slot index for this request, as in `prefill`.
+      return_prompt_logp: If True, the prefix holds the `prompt_logp` of the
+        whole prompt, of shape [1, len(tokens)]. The cache stores them either
+        way, so they are always computed.
+      algorithm, topk, nucleus_topp, temperature, seed: Sampling parameters of
+        the first generated token, as in `prefill`.
+
+    Returns:
+      The prefix and first token, as returned by `prefill`.
+    """
+    if not self.use_chunked_prefill:
+      raise ValueError("Prefix caching requires chunked prefill.")
+    if self.config.attention == "paged" or self.config.stack_prefill_result_cache:
+      raise ValueError("Prefix caching supports neither paged attention nor stack_prefill_result_cache.")
+
+    tokens = np.asarray(tokens, dtype=np.int32)
+    true_length = len(tokens)
+    start, existing_prefix, prompt_logps = 0, None, []
+    hit = prefix_cache.lookup(tokens)
+    if hit is not None:
+      start = hit.num_tokens - 1
+      existing_prefix = ExistingPrefix(cache=hit.cache, common_prefix_tokens=jnp.asarray(tokens[:start]))
+      prompt_logps.append(hit.prompt_logp[:, : start + 1])
+      prefix_cache.stats.saved_prefill_tokens += start
+
+    prefill_result, first_token = None, None
+    while start < true_length:
+      padded_length = min(self.prefill_chunk_size, self.max_prefill_length - start)
+      chunk = tokens[start : start + padded_length]
+      padded_tokens = np.zeros((padded_length,), dtype=np.int32)
+      padded_tokens[: len(chunk)] = chunk
+      previous_result = prefill_result
+      prefill_result, first_token = self.prefill(
+          params=params,
+          existing_prefix=existing_prefix,
+          padded_tokens=jnp.asarray(padded_tokens),
+          true_length=len(chunk),
+          rng=rng,
+          slot=slot,
+          return_prompt_logp=True,
+          algorithm=algorithm,
+          topk=topk,
+          nucleus_topp=nucleus_topp,
+          temperature=temperature,
+          seed=seed,
+      )
+      # The log-probability of the first token of a chunk comes from the previous chunk, or from the cache.
+      chunk_logp = prefill_result["prompt_logp"][:, : len(chunk)]
+      if previous_result is not None:
+        boundary_logp = jax.nn.log_softmax(previous_result["logits"][:, -1, :], axis=-1)[:, chunk[0]]
+        chunk_logp = chunk_logp.at[:, 0].set(boundary_logp.astype(chunk_logp.dtype))
+      elif start > 0:
+        chunk_logp = chunk_logp[:, 1:]
+      prompt_logps.append(chunk_logp)
+      start += len(chunk)
+      existing_prefix = ExistingPrefix(cache=prefill_result["cache"], common_prefix_tokens=jnp.asarray(tokens[:start]))
+
+    prompt_logp = jnp.concatenate(prompt_logps, axis=1)
+    prefix_cache.insert(tokens, prefill_result["cache"], prompt_logp)
+    prefill_result["prompt_logp"] = prompt_logp if return_prompt_logp else None
+    return prefill_result, first_token
+
   def prefill_multisampling_aot(  # pylint: disable=too-many-positional-arguments
       self,
       params: Params,
@@ -780,6 +942,7 @@ class MaxEngine(engine_api.Engine):
         "next_pos": next_pos,
         "generated_tokens": generated_tokens,
         "tokens": first_generated_tokens,
+        **self._per_slot_sampling_params(num_samples, algorithm, topk, nucleus_topp, temperature),
     }, result
 
   @functools.partial(
@@ -878,7 +1041,7 @@ class MaxEngine(engine_api.Engine):
       if self.config.return_log_prob:
         token_logp = inference_utils.log_prob_of_chosen_token(selected_logits, first_generated_token)
       else:
-        token_logp = None
+        token_logp = jnp.zeros(first_generated_token.shape, dtype=jnp.float32)
       result = engine_api.ResultTokens(
           data=jnp.concatenate((first_generated_token, all_valid, generated_tokens), axis=1),
           # Tokens are shape [batch, speculations], so when we concatenate
@@ -898,6 +1061,8 @@ class MaxEngine(engine_api.Engine):
           "next_pos": next_pos,
           "generated_tokens": generated_tokens,
           "tokens": first_generated_token,
+          "token_logp": token_logp,
+          **self._per_slot_sampling_params(1, algorithm, topk, nucleus_topp, temperature),
       }, result
 
     prefill_results = defaultdict(list)
@@ -923,7 +1088,12 @@ class MaxEngine(engine_api.Engine):
       nucleus_topp: float | None = None,
       temperature: float | None = None,
   ) -> tuple[DecodeState, engine_api.ResultTokens]:
-    """Public API for generate that updates page state outside JIT."""
+    """Public API for generate that updates page state outside JIT.
+
+    With `decode_sampling_per_slot` enabled, every slot is sampled with the
+    parameters stored in `decode_state` at insert time and the scalar sampling
+    arguments are ignored.
+    """
 
     # Update page state before JIT call
     if self.page_manager is not None and self.page_state is not None:
@@ -987,6 +1157,8 @@ class MaxEngine(engine_api.Engine):
       nucleus_topp: The value for top-p (nucleus) sampling. Overrides the
         engine's default.
       temperature: The sampling temperature. Overrides the engine's default.
+        The scalar sampling arguments are ignored when the decode state holds
+        per-slot sampling parameters.
 
     Returns:
       A tuple containing:
@@ -1014,14 +1186,18 @@ class MaxEngine(engine_api.Engine):
     new_cache = jax.lax.with_sharding_constraint(new_vars["cache"], self.kv_cache_shardings)
     # sampling tokens
     rng, new_rng = jax.random.split(rng)
-    new_token = inference_utils.sampling(
-        out_logits,
-        new_rng,
-        algorithm if algorithm is not None else self.config.decode_sampling_strategy,
-        topk=topk if topk is not None else self.config.decode_sampling_top_k,
-        nucleus_topp=nucleus_topp if nucleus_topp is not None else self.config.decode_sampling_nucleus_p,
-        temperature=temperature if temperature is not None else self.config.decode_sampling_temperature,
-    )
+    sampling_params = {k: decode_state[k] for k in SAMPLING_PARAM_KEYS if k in decode_state}
+    if sampling_params:
+      new_token = self._sample_per_slot(out_logits, new_rng, sampling_params, decode_state["generated_tokens"][:, 0] + 1)
+    else:
+      new_token = inference_utils.sampling(
+          out_logits,
+          new_rng,
+          algorithm if algorithm is not None else self.config.decode_sampling_strategy,
+          topk=topk if topk is not None else self.config.decode_sampling_top_k,
+          nucleus_topp=nucleus_topp if nucleus_topp is not None else self.config.decode_sampling_nucleus_p,
+          temperature=temperature if temperature is not None else self.config.decode_sampling_temperature,
+      )
     all_valid = jnp.ones(new_token.shape, dtype=jnp.int8)
     if self.config.return_log_prob:
       token_logp = inference_utils.log_prob_of_chosen_token(out_logits, new_token)
@@ -1047,14 +1223,243 @@ class MaxEngine(engine_api.Engine):
     )
 
     return {
-        "logits": out_logits,
+        **self._decode_state_logits(out_logits),
         "cache": new_cache,
         "next_pos": next_pos,
         "generated_tokens": generated_tokens,
         "tokens": new_token,
         "token_logp": token_logp,
+        **sampling_params,
     }, result
 
+  def generate_speculative(
+      self,
+      params: Params,
+      decode_state: DecodeState,
+      draft_engine: "MaxEngine",
+      draft_params: Params,
+      draft_decode_state: DecodeState,
+      rng: PRNGKeyType | None = None,
+  ) -> tuple[DecodeState, DecodeState, engine_api.ResultTokens]:
+    """Generates up to `speculative_num_draft_tokens + 1` tokens per slot with a draft model.
+
+    `draft_engine` is a smaller MaxEngine with the same vocabulary, batch size
+    and cache lengths, whose decode state holds the same prompts in the same
+    slots as `decode_state`. It proposes `speculative_num_draft_tokens` tokens
+    per slot, which the target model verifies in a single forward pass, see
+    `_generate_speculative_jit`.
+
+    Returns:
+      The target and draft decode states after the step, and the `ResultTokens`
+      with one speculation per proposed token plus one; only the first
+      `1 + accepted` speculations of a slot are valid.
+    """
+    if self.config.speculative_num_draft_tokens <= 0:
+      raise ValueError("Speculative decoding requires speculative_num_draft_tokens > 0.")
+    if self.config.attention == "paged" or draft_engine.config.attention == "paged":
+      raise NotImplementedError("Speculative decoding does not support paged attention.")
+    if self.config.use_ragged_attention or draft_engine.config.use_ragged_attention:
+      raise NotImplementedError("Speculative decoding does not support ragged attention.")
+    if self.config.use_local_window_kv_cache or draft_engine.config.use_local_window_kv_cache:
+      # Rejected draft tokens would have overwritten the oldest tokens of a window sized cache.
+      raise NotImplementedError("Speculative decoding does not support use_local_window_kv_cache.")
+
+    if rng is None:
+      if self.rng is None:
+        self.rng = jax.random.PRNGKey(0)
+      self.rng, rng = jax.random.split(self.rng)
+
+    new_state, new_draft_state, result = self._generate_speculative_jit(
+        params, decode_state, draft_params, draft_decode_state, rng, draft_engine=draft_engine
+    )
+    return (
+        max_utils.unbox_logicallypartioned(new_state),
+        max_utils.unbox_logicallypartioned(new_draft_state),
+        result,
+    )
+
+  @functools.partial(jax.jit, static_argnums=(0,), static_argnames=("draft_engine",), donate_argnums=(2, 4))
+  def _generate_speculative_jit(
+      self,
+      params: Params,
+      decode_state: DecodeState,
+      draft_params: Params,
+      draft_decode_state: DecodeState,
+      rng: PRNGKeyType,
+      *,
+      draft_engine: "MaxEngine",
+  ) -> tuple[DecodeState, DecodeState, engine_api.ResultTokens]:
+    """Performs one JIT-compiled speculative decoding step.
+
+    With k draft tokens, the draft model runs k + 1 autoregressive steps from
+    the last token t of every slot, proposing d_1..d_k; the last step only adds
+    d_k to its KV cache. The target model then runs once on [t, d_1..d_k] and
+    samples y_0..y_k, where y_i follows d_1..d_i. The draft tokens are accepted
+    while d_{i+1} == y_i, so with m accepted tokens the step emits y_0..y_m,
+    which are exactly the tokens the target would have sampled one at a time.
+
+    Both KV caches then drop the k - m rejected tokens of the step per slot,
+    see `_rollback_ar_cache`. Local sliding-window and chunked attention are
+    not supported.
+
+    Args:
+      params: The target model parameters.
+      decode_state: The target decode state, donated.
+      draft_params: The draft model parameters.
+      draft_decode_state: The draft decode state, donated.
+      rng: JAX random number generator key for sampling.
+      draft_engine: The MaxEngine of the draft model.
+
+    Returns:
+      The updated target and draft decode states and the `ResultTokens` of the step.
+    """
+    num_draft_tokens = self.config.speculative_num_draft_tokens
+    draft_rng, verify_rng, sample_rng = jax.random.split(rng, 3)
+
+    # The draft starts from the last token of the target, which the draft prefill may not have sampled.
+    draft_decode_state = draft_decode_state | {"tokens": decode_state["tokens"], "next_pos": decode_state["next_pos"]}
+
+    def draft_step(state, step_rng):
+      state, _ = draft_engine._generate_jit(  # pylint: disable=protected-access
+          draft_params, state, rng=step_rng, page_state=None
+      )
+      state = max_utils.unbox_logicallypartioned(state)
+      return state, state["tokens"][:, 0]
+
+    draft_decode_state, draft_tokens = jax.lax.scan(
+        draft_step, draft_decode_state, jax.random.split(draft_rng, num_draft_tokens + 1)
+    )
+    draft_tokens = draft_tokens[:num_draft_tokens].T  # [batch, k]
+
+    # Verify the draft tokens in one target forward pass.
+    tokens = jnp.concatenate((decode_state["tokens"], draft_tokens), axis=1)
+    positions = decode_state["next_pos"] + jnp.arange(num_draft_tokens + 1)
+    with self._mesh, nn_partitioning.axis_rules(self.config.logical_axis_rules):
+      out_logits, new_vars = self.model.apply(
+          params | {"cache": decode_state["cache"]},
+          tokens,
+          positions,
+          enable_dropout=False,
+          model_mode=MODEL_MODE_AUTOREGRESSIVE,
+          rngs={"params": verify_rng},
+          mutable=["cache"],
+      )
+    out_logits = jax.lax.with_sharding_constraint(out_logits, self.replicated_sharding)
+    new_cache = jax.lax.with_sharding_constraint(new_vars["cache"], self.kv_cache_shardings)
+    new_cache = max_utils.unbox_logicallypartioned(new_cache)
+
+    sampling_params = {k: decode_state[k] for k in SAMPLING_PARAM_KEYS if k in decode_state}
+    if sampling_params:
+      target_tokens = self._sample_per_slot(
+          out_logits, sample_rng, sampling_params, decode_state["generated_tokens"][:, 0] + 1
+      )
+    else:
+      target_tokens = inference_utils.sampling(
+          out_logits,
+          sample_rng,
+          self.config.decode_sampling_strategy,
+          topk=self.config.decode_sampling_top_k,
+          nucleus_topp=self.config.decode_sampling_nucleus_p,
+          temperature=self.config.decode_sampling_temperature,
+      )
+    if self.config.return_log_prob:
+      token_logp = inference_utils.log_prob_of_chosen_token(out_logits, target_tokens)
+    else:
+      token_logp = jnp.zeros(target_tokens.shape, dtype=jnp.float32)
+
+    matches = draft_tokens == target_tokens[:, :num_draft_tokens]
+    num_accepted = jnp.sum(jnp.cumprod(matches, axis=1), axis=1)  # [batch]
+    num_rejected = num_draft_tokens - num_accepted
+    valid = (jnp.arange(num_draft_tokens + 1) <= num_accepted[:, None]).astype(jnp.int8)
+
+    last = num_accepted[:, None]
+    next_pos = decode_state["next_pos"] + last + 1
+    generated_tokens = decode_state["generated_tokens"] + last + 1
+    new_token = jnp.take_along_axis(target_tokens, last, axis=1)
+
+    result = engine_api.ResultTokens(
+        data=jnp.concatenate((target_tokens, valid, generated_tokens), axis=1),
+        tokens_idx=(0, num_draft_tokens + 1),
+        valid_idx=(num_draft_tokens + 1, 2 * (num_draft_tokens + 1)),
+        length_idx=(2 * (num_draft_tokens + 1), 2 * (num_draft_tokens + 1) + 1),
+        log_prob=token_logp,
+        samples_per_slot=1,
+    )
+
+    new_state = {
+        **self._decode_state_logits(jnp.take_along_axis(out_logits, last[:, :, None], axis=1)),
+        "cache": self._rollback_ar_cache(new_cache, num_rejected, num_draft_tokens + 1),
+        "next_pos": next_pos,
+        "generated_tokens": generated_tokens,
+        "tokens": new_token,
+        "token_logp": jnp.take_along_axis(token_logp, last, axis=1),
+        **sampling_params,
+    }
+    # The draft cache holds the same k + 1 tokens, and the draft continues from the token of the target.
+    new_draft_state = draft_decode_state | {
+        "cache": draft_engine._rollback_ar_cache(  # pylint: disable=protected-access
+            draft_decode_state["cache"], num_rejected, num_draft_tokens + 1
+        ),
+        "next_pos": next_pos,
+        "generated_tokens": generated_tokens,
+        "tokens": new_token,
+    }
+    return new_state, new_draft_state, result
+
+  def _rollback_ar_cache(self, cache: Any, num_rejected: jax.Array, block_size: int) -> Any:
+    """Drops the last `num_rejected` tokens per slot of the last `block_size` tokens written to the AR cache.
+
+    The AR cache index is shared by all slots, so it moves back by the fewest
+    rejected tokens of any slot. The dropped positions of the other slots are
+    masked out, and the AR cache rows of these slots are rotated forward past
+    them. Every slot thus keeps its tokens in consecutive positions that end
+    right before the AR cache index, and only ever overwrites its own tokens
+    once it has more than fit in the AR cache.
+    """
+    flat_cache = jax.tree_util.tree_flatten_with_path(cache)[0]
+    flat_annotations = jax.tree_util.tree_leaves(self.kv_cache_annotations_named, is_leaf=lambda x: isinstance(x, tuple))
+    cache_ar_index, cache_length = None, None
+    for (path, leaf), annotations in zip(flat_cache, flat_annotations):
+      if path[-1].key == "cache_ar_index" and cache_ar_index is None:
+        cache_ar_index = leaf.reshape(-1)[0]
+      elif path[-1].key == "cache_ar_segment_id" and cache_length is None:
+        cache_length = leaf.shape[annotations.index("cache_sequence")]
+    min_rejected = jnp.min(num_rejected)
+    shift = num_rejected - min_rejected  # [batch]
+    # Offset of every AR cache position from the start of the last block.
+    offsets = jnp.mod(jnp.arange(cache_length) - cache_ar_index + block_size, cache_length)
+    rejected = (offsets < block_size) & (offsets >= block_size - num_rejected[:, None])  # [batch, cache_length]
+    # Row positions after rotating every row forward by its shift.
+    rolled_positions = jnp.mod(jnp.arange(cache_length) - shift[:, None], cache_length)  # [batch, cache_length]
+
+    def rollback(path, leaf, annotations):
+      path_key = path[-1].key
+      if path_key in ("cache_ar_segment_id", "cached_ar_key", "cached_ar_value"):
+        batch_idx, seq_idx = annotations.index("cache_batch"), annotations.index("cache_sequence")
+      elif path_key in ("cached_ar_key_scale", "cached_ar_value_scale"):
+        batch_idx, seq_idx = annotations.index("cache_scale_batch"), annotations.index("cache_scale_sequence")
+      elif path_key == "cached_ar_lengths":
+        shape = [1] * leaf.ndim
+        shape[annotations.index("cache_batch")] = -1
+        return leaf - num_rejected.reshape(shape)
+      elif path_key == "cache_ar_index":
+        return jnp.mod(leaf - min_rejected, cache_length).astype(leaf.dtype)
+      else:
+        return leaf
+      # Move the batch and sequence axes last, to mask and rotate the [batch, cache_length] rows.
+      leaf = jnp.moveaxis(leaf, (batch_idx, seq_idx), (-2, -1))
+      if path_key == "cache_ar_segment_id":
+        leaf = jnp.where(rejected, 0, leaf)
+      leaf = jax.lax.cond(
+          jnp.any(shift > 0),
+          lambda x: jnp.take_along_axis(x, jnp.broadcast_to(rolled_positions, x.shape), axis=-1),
+          lambda x: x,
+          leaf,
+      )
+      return jnp.moveaxis(leaf, (-2, -1), (batch_idx, seq_idx))
+
+    return jax.tree_util.tree_map_with_path(rollback, cache, self.kv_cache_annotations_named)
+
   @functools.partial(
       jax.jit,
       static_argnums=(0,),
@@ -1130,10 +1535,10 @@ class MaxEngine(engine_api.Engine):
         self.kv_cache_annotations_named,
     )
 
+    prefix_logits = self._decode_state_logits(unboxed_prefix["logits"])
     for i, slot in enumerate(slots):
-      decode_state["logits"] = jax.lax.dynamic_update_index_in_dim(
-          decode_state["logits"], unboxed_prefix["logits"], slot, 0
-      )
+      for key, value in prefix_logits.items():
+        decode_state[key] = jax.lax.dynamic_update_index_in_dim(decode_state[key], value, slot, 0)
       decode_state["next_pos"] = jax.lax.dynamic_update_index_in_dim(
           decode_state["next_pos"], unboxed_prefix["next_pos"], slot, 0
       )
@@ -1155,8 +1560,15 @@ class MaxEngine(engine_api.Engine):
           slot,
           0,
       )
+      for key in SAMPLING_PARAM_KEYS:
+        if key in decode_state:
+          decode_state[key] = jax.lax.dynamic_update_index_in_dim(
+              decode_state[key], jnp.expand_dims(unboxed_prefix[key][i], axis=0), slot, 0
+          )
 
-    inserted_logits = jax.lax.with_sharding_constraint(decode_state["logits"], self.replicated_sharding)
+    inserted_logits = {
+        key: jax.lax.with_sharding_constraint(decode_state[key], self.replicated_sharding) for key in prefix_logits
+    }
     inserted_generated_tokens = jax.lax.with_sharding_constraint(
         decode_state["generated_tokens"], self.replicated_sharding
     )
@@ -1164,14 +1576,20 @@ class MaxEngine(engine_api.Engine):
     inserted_tokens = jax.lax.with_sharding_constraint(decode_state["tokens"], self.replicated_sharding)
     inserted_cache = jax.lax.with_sharding_constraint(inserted_cache, self.kv_cache_shardings)
     inserted_token_logp = jax.lax.with_sharding_constraint(decode_state["token_logp"], self.replicated_sharding)
+    inserted_sampling_params = {
+        key: jax.lax.with_sharding_constraint(decode_state[key], self.replicated_sharding)
+        for key in SAMPLING_PARAM_KEYS
+        if key in decode_state
+    }
 
     return {
-        "logits": inserted_logits,
+        **inserted_logits,
         "cache": inserted_cache,
         "next_pos": inserted_next_pos,
         "generated_tokens": inserted_generated_tokens,
         "tokens": inserted_tokens,
         "token_logp": inserted_token_logp,
+        **inserted_sampling_params,
     }
 
   @functools.partial(jax.jit, static_argnums=(0,), donate_argnames=("prefix", "decode_state"))
@@ -1237,7 +1655,7 @@ class MaxEngine(engine_api.Engine):
 
       def _copy_paged(path, prefix_cache, decode_state_cache):
         path_key = path[-1].key
-        if path_key in ["key_pages", "value_pages"]:
+        if path_key in ["key_pages", "value_pages", "key_scale_pages", "value_scale_pages"]:
           page_map_for_slot = page_state_in.page_map[slot]  # pytype: disable=attribute-error
           num_pages_to_copy = page_state_in.num_pages_used[slot]  # pytype: disable=attribute-error
 
@@ -1273,7 +1691,10 @@ class MaxEngine(engine_api.Engine):
           self.kv_cache_annotations_named,
       )
 
-    inserted_logits = jax.lax.dynamic_update_index_in_dim(decode_state["logits"], unboxed_prefix["logits"], slot, 0)
+    inserted_logits = {
+        key: jax.lax.dynamic_update_index_in_dim(decode_state[key], value, slot, 0)
+        for key, value in self._decode_state_logits(unboxed_prefix["logits"]).items()
+    }
     inserted_next_pos = jax.lax.dynamic_update_index_in_dim(decode_state["next_pos"], unboxed_prefix["next_pos"], slot, 0)
     inserted_generated_tokens = jax.lax.dynamic_update_index_in_dim(
         decode_state["generated_tokens"],
@@ -1285,6 +1706,11 @@ class MaxEngine(engine_api.Engine):
     inserted_token_logp = jax.lax.dynamic_update_index_in_dim(
         decode_state["token_logp"], unboxed_prefix["token_logp"], slot, 0
     )
+    inserted_sampling_params = {
+        key: jax.lax.dynamic_update_index_in_dim(decode_state[key], unboxed_prefix[key], slot, 0)
+        for key in SAMPLING_PARAM_KEYS
+        if key in decode_state
+    }
 
     inserted_logits = jax.lax.with_sharding_constraint(inserted_logits, self.replicated_sharding)
     inserted_generated_tokens = jax.lax.with_sharding_constraint(inserted_generated_tokens, self.replicated_sharding)
@@ -1292,14 +1718,16 @@ class MaxEngine(engine_api.Engine):
     inserted_tokens = jax.lax.with_sharding_constraint(inserted_tokens, self.replicated_sharding)
     inserted_cache = jax.lax.with_sharding_constraint(inserted_cache, self.kv_cache_shardings)
     inserted_token_logp = jax.lax.with_sharding_constraint(inserted_token_logp, self.replicated_sharding)
+    inserted_sampling_params = jax.lax.with_sharding_constraint(inserted_sampling_params, self.replicated_sharding)
 
     return {
-        "logits": inserted_logits,
+        **inserted_logits,
         "cache": inserted_cache,
         "next_pos": inserted_next_pos,
         "generated_tokens": inserted_generated_tokens,
         "tokens": inserted_tokens,
         "token_logp": inserted_token_logp,
+        **inserted_sampling_params,
     }
 
   def insert(
@@ -1382,7 +1810,9 @@ class MaxEngine(engine_api.Engine):
 
       if path_key == "cache_ar_segment_id":
         ### goal: zero this out in case there is existing data
-        zeros = jnp.zeros((1, self.config.max_target_length - self.config.max_prefill_predict_length), dtype=jnp.int32)
+        s = list(full_cache.shape)
+        s[batch_idx] = 1
+        zeros = jnp.zeros(tuple(s), dtype=jnp.int32)
         return jax.lax.dynamic_update_index_in_dim(full_cache, zeros, slot, batch_idx)
       elif path_key == "cache_prefill_segment_id":
         zeros = jnp.zeros((1, self.config.max_prefill_predict_length), dtype=jnp.int32)
@@ -1423,11 +1853,13 @@ class MaxEngine(engine_api.Engine):
         raise ValueError(f"We don't have a strategy for inserting {path_key}")
 
     inserted_cache = decode_state["cache"]
-    inserted_logits = decode_state["logits"]
+    prefix_logits = self._decode_state_logits(unboxed_prefix["logits"])
+    inserted_logits = {key: decode_state[key] for key in prefix_logits}
     inserted_next_pos = decode_state["next_pos"]
     inserted_generated_tokens = decode_state["generated_tokens"]
     inserted_tokens = decode_state["tokens"]
     inserted_token_logp = decode_state["token_logp"]
+    inserted_sampling_params = {key: decode_state[key] for key in SAMPLING_PARAM_KEYS if key in decode_state}
 
     for i in range(num_prompts):
       start_idx = start_indices[i]
@@ -1435,7 +1867,10 @@ class MaxEngine(engine_api.Engine):
       inserted_cache = jax.tree_util.tree_map_with_path(
           copy, cache_unboxed, inserted_cache, self.kv_cache_annotations_named
       )
-      inserted_logits = jax.lax.dynamic_update_index_in_dim(inserted_logits, unboxed_prefix["logits"][i, ...], slot, 0)
+      inserted_logits = {
+          key: jax.lax.dynamic_update_index_in_dim(value, prefix_logits[key][i, ...], slot, 0)
+          for key, value in inserted_logits.items()
+      }
       inserted_next_pos = jax.lax.dynamic_update_index_in_dim(
           inserted_next_pos, unboxed_prefix["next_pos"][i, ...], slot, 0
       )
@@ -1449,6 +1884,10 @@ class MaxEngine(engine_api.Engine):
       inserted_token_logp = jax.lax.dynamic_update_index_in_dim(
           inserted_token_logp, unboxed_prefix["token_logp"][i, ...], slot, 0
       )
+      inserted_sampling_params = {
+          key: jax.lax.dynamic_update_index_in_dim(value, unboxed_prefix[key][i, ...], slot, 0)
+          for key, value in inserted_sampling_params.items()
+      }
 
     inserted_logits = jax.lax.with_sharding_constraint(inserted_logits, self.replicated_sharding)
     inserted_generated_tokens = jax.lax.with_sharding_constraint(inserted_generated_tokens, self.replicated_sharding)
@@ -1456,14 +1895,16 @@ class MaxEngine(engine_api.Engine):
     inserted_tokens = jax.lax.with_sharding_constraint(inserted_tokens, self.replicated_sharding)
     inserted_cache = jax.lax.with_sharding_constraint(inserted_cache, self.kv_cache_shardings)
     inserted_token_logp = jax.lax.with_sharding_constraint(inserted_token_logp, self.replicated_sharding)
+    inserted_sampling_params = jax.lax.with_sharding_constraint(inserted_sampling_params, self.replicated_sharding)
 
     return {
-        "logits": inserted_logits,
+        **inserted_logits,
         "cache": inserted_cache,
         "next_pos": inserted_next_pos,
         "generated_tokens": inserted_generated_tokens,
         "tokens": inserted_tokens,
         "token_logp": inserted_token_logp,
+        **inserted_sampling_params,
     }
 
   def release_pages(self, slot: int):
@@ -1475,6 +1916,73 @@ class MaxEngine(engine_api.Engine):
         page_state=self.page_state, page_group_id=slot
     )  # pytype: disable=attribute-error
     self.page_state = new_page_state
+    self.memory_pressure_policy.priorities.pop(slot, None)
+
+  def can_admit(self, num_tokens: int, slot: int | None = None) -> bool:
+    """Admission control for paged attention: whether `num_tokens` tokens fit into the free pages.
+
+    Callers check this before prefilling a request into `slot`, with
+    `num_tokens` the prompt length plus the number of tokens to generate. If
+    it does not fit, `make_room` can preempt lower-priority slots. Always True
+    without paged attention.
+    """
+    if self.memory_pressure_policy is None:
+      return True
+    return self.memory_pressure_policy.can_admit(self.page_state, num_tokens, page_group_id=slot)
+
+  def set_slot_priority(self, slot: int, priority: float):
+    """Records the priority of the request inserted into `slot`, used to choose the slots `make_room` preempts."""
+    if self.memory_pressure_policy is not None:
+      self.memory_pressure_policy.set_priority(slot, priority)
+
+  def make_room(
+      self, decode_state: DecodeState, num_tokens: int, priority: float = 0.0, slot: int | None = None
+  ) -> list[PreemptedGroup]:
+    """Preempts slots with a lower priority than a request until its `num_tokens` tokens fit.
+
+    The pages of the preempted slots are released, after copying them to host
+    memory if `pagedattn_preemption_mode` is "swap". The caller stops decoding
+    the preempted slots and queues their requests again, to `resume` them if
+    they were swapped out or to prefill their tokens again otherwise. Nothing
+    is preempted if the request cannot be made to fit.
+
+    Args:
+      decode_state: The current decode state, which is not modified.
+      num_tokens: The number of tokens of the request to admit.
+      priority: The priority of the request; only slots with a lower one are
+        preempted.
+      slot: The slot the request will be inserted into.
+
+    Returns:
+      The preempted sequences, with the rows of their slots in the decode
+      state saved in `slot_state` when swapped out.
+    """
+    if self.memory_pressure_policy is None:
+      return []
+    self.page_state, preempted = self.memory_pressure_policy.make_room(
+        self.page_state, decode_state["cache"], num_tokens, priority=priority, page_group_id=slot
+    )
+    for record in preempted:
+      if record.host_pages is not None:
+        slot_rows = {key: value[record.page_group_id] for key, value in decode_state.items() if key != "cache"}
+        record.slot_state = jax.device_get(slot_rows)
+    return preempted
+
+  def resume(self, decode_state: DecodeState, preempted: PreemptedGroup, slot: int | None = None) -> DecodeState:
+    """Restores a sequence swapped out by `make_room` into `slot`, by default the slot it was preempted from.
+
+    The caller checks `can_admit(preempted.sequence_length, slot)` first. The
+    cache of `decode_state` is donated.
+    """
+    if self.memory_pressure_policy is None:
+      raise ValueError("resume requires paged attention")
+    slot = preempted.page_group_id if slot is None else slot
+    self.page_state, cache = self.memory_pressure_policy.resume(
+        self.page_state, decode_state["cache"], preempted, page_group_id=slot
+    )
+    decode_state = {key: value for key, value in decode_state.items() if key != "cache"}
+    decode_state = jax.tree.map(lambda value, row: value.at[slot].set(row), decode_state, preempted.slot_state)
+    return {**decode_state, "cache": cache}
 
   def get_prefix_destination_sharding(self) -> Any:
     return {
@@ -1484,6 +1992,7 @@ class MaxEngine(engine_api.Engine):
         "generated_tokens": self.replicated_sharding,
         "tokens": self.replicated_sharding,
         "token_logp": self.replicated_sharding,
+        **{key: self.replicated_sharding for key in self._per_slot_sampling_params(1, None, None, None, None)},
     }
 
   def get_tokenizer(self) -> TokenizerParameters:
@@ -1572,19 +2081,23 @@ class MaxEngine(engine_api.Engine):
           (int(self.config.per_device_batch_size * self.mesh.size), 1),
           dtype=jnp.float32,
       )
+      logits = jnp.zeros(
+          (
+              int(self.config.per_device_batch_size * self.mesh.size),
+              1,
+              self.config.vocab_size,
+          )
+      )
       return {
-          "logits": jnp.zeros(
-              (
-                  int(self.config.per_device_batch_size * self.mesh.size),
-                  1,
-                  self.config.vocab_size,
-              )
-          ),
+          **self._decode_state_logits(logits),
           "cache": cache["cache"],
           "next_pos": next_pos,
           "generated_tokens": generated_tokens,
           "tokens": tokens,
           "token_logp": token_logp,
+          **self._per_slot_sampling_params(
+              int(self.config.per_device_batch_size * self.mesh.size), None, None, None, None
+          ),
       }
 
     with nn_partitioning.axis_rules(self.config.logical_axis_rules):
@@ -288,7 +288,9 @@ class MetricLogger:
         gcp_workload_monitor.start_performance_reporting_thread(performance_metric_queue)
     return performance_metric_queue
 
-  def buffer_and_write_train_metrics(self, metrics, step, step_time_delta):
+  def buffer_and_write_train_metrics(
+      self, metrics, step, step_time_delta, data_loading_metrics=None, checkpoint_stall_time=None
+  ):
     """
     Buffers metrics for the current training step and simultaneously writes the training metrics
     for the previous step to GCS and/or TensorBoard. This buffering strategy allows for back-to-back
@@ -296,15 +298,23 @@ class MetricLogger:
     This significantly boosts training efficiency.
     """
     if self.buffered_train_metrics is not None:
-      (step_to_write, metrics_to_write) = self.buffered_train_metrics
+      step_to_write, metrics_to_write = self.buffered_train_metrics
       self.write_metrics(metrics_to_write, step_to_write)
 
-    self.record_train_metrics(metrics, step, step_time_delta.total_seconds())
+    self.record_train_metrics(metrics, step, step_time_delta.total_seconds(), data_loading_metrics, checkpoint_stall_time)
     self.buffered_train_metrics = (step, metrics)
 
-  def record_train_metrics(self, metrics, step, step_time):
-    """Records training metrics for the current step."""
+  def record_train_metrics(self, metrics, step, step_time, data_loading_metrics=None, checkpoint_stall_time=None):
+    """Records training metrics for the current step.
+
+    `data_loading_metrics` are the input wait time and prefetch queue depth of `DataLoader.get_metrics()`, and
+    `checkpoint_stall_time` is the time in seconds that the training loop spent in saving a checkpoint.
+    """
     metrics["scalar"].update({"perf/step_time_seconds": step_time})
+    if data_loading_metrics:
+      metrics["scalar"].update(data_loading_metrics)
+    if checkpoint_stall_time is not None:
+      metrics["scalar"].update({"perf/checkpoint_save_stall_seconds": checkpoint_stall_time})
     metrics["scalar"].update({"learning/current_learning_rate": self.learning_rate_schedule(step)})
     if step >= self.config.rampup_end_step:
       metrics["scalar"].update({"perf/per_device_tflops": self.metadata[MetadataKey.PER_DEVICE_TFLOPS]})
@@ -368,7 +378,7 @@ class MetricLogger:
     underlying writer objects (e.g., TensorBoard SummaryWriter) will be closed.
     """
     if self.buffered_train_metrics is not None:
-      (step_to_write, metrics_to_write) = self.buffered_train_metrics
+      step_to_write, metrics_to_write = self.buffered_train_metrics
       self.write_metrics(metrics_to_write, step_to_write)
 
     max_utils.close_summary_writer(self.writer)
@@ -381,6 +381,42 @@ def add_data_to_sharding(mesh, path, aval, sharding):
   return sharding
 
 
+def add_axes_to_sharding(aval, sharding, axes):
+  """Adds mesh axes to a sharding spec, each on the largest dimension it divides.
+
+  This function is mainly used to reduce-scatter the gradients of every microbatch over the
+  `gradient_accumulation_overlap_reduction_axes` inside the gradient accumulation loop. Axes of
+  size one, axes already in the spec and axes that divide no dimension are skipped, and so are
+  dimensions partitioned over 'tensor', as in `add_data_to_sharding`.
+
+  Args:
+    aval: Abstract value with shape information
+    sharding: Current NamedSharding to augment
+    axes: Names of the mesh axes to add
+
+  Returns:
+    NamedSharding: Updated sharding, or the original one if no axis could be added
+  """
+  pspec = list(sharding.spec) + [None] * (len(aval.shape) - len(sharding.spec))
+  updated = False
+  for axis in axes:
+    axis_size = sharding.mesh.shape[axis]
+    if axis_size == 1 or axis in jax.tree.leaves(pspec):
+      continue
+    sharded_shape = jax.sharding.NamedSharding(sharding.mesh, jax.sharding.PartitionSpec(*pspec)).shard_shape(aval.shape)
+    for idx in sorted(range(len(sharded_shape)), key=sharded_shape.__getitem__, reverse=True):
+      partition = pspec[idx] or ()
+      if isinstance(partition, str):
+        partition = (partition,)
+      if sharded_shape[idx] % axis_size == 0 and "tensor" not in partition:
+        pspec[idx] = (axis,) + partition
+        updated = True
+        break
+  if not updated:
+    return sharding
+  return jax.sharding.NamedSharding(sharding.mesh, jax.sharding.PartitionSpec(*pspec))
+
+
 def maybe_update_params_sharding_with_opt(config, state_mesh_shardings):
   """Updates parameter sharding configuration when optimizer state sharding is enabled.
 
@@ -12,10 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Provides op for tokenizing a dataset."""
+"""Provides op for tokenizing a dataset, and incremental detokenization of generated tokens."""
 
 from typing import Iterable, Literal, Sequence, Collection
 from pathlib import Path
+import codecs
+import collections
+import os
 import tensorflow as tf
 import tensorflow_text as tftxt
 from MaxText import max_logging
@@ -24,7 +27,6 @@ import tiktoken
 from tiktoken.load import load_tiktoken_bpe
 from sentencepiece import SentencePieceProcessor
 
-
 Features = dict[str, tf.Tensor]
 
 
@@ -255,6 +257,192 @@ class HFTokenizer:
     return self.tokenizer.decode(t)
 
 
+class IncrementalDetokenizer:
+  """
+  Detokenizes a growing sequence of token IDs into stable text deltas.
+
+  Decoding the whole sequence after every new token costs O(n) per token. This
+  class instead keeps the decoded text and only decodes what the newest token
+  changes, so `add` is amortized O(1):
+
+  * `TikTokenTokenizer`: the bytes of each token are fed to an incremental UTF-8
+    decoder, so a character split across tokens is emitted once it is complete.
+  * Any other tokenizer with a `decode(ids) -> str` method (SentencePiece, HF or
+    JetStream tokenizers): a short window starting at the last stable token is
+    decoded, which keeps context-dependent whitespace identical to a full
+    decode. While the window ends in U+FFFD (a byte-fallback piece of an
+    incomplete UTF-8 character) its text is held back, for at most
+    `MAX_PENDING_TOKENS` tokens. Once it is released, the offsets of the held
+    back tokens are backfilled from the same window.
+
+  Attributes:
+    offsets: For every token added, the character offset into `text` at which
+      its text starts; the start of a character split across tokens for all of
+      its pieces. Only final once the token's text has been returned.
+  """
+
+  # Longest UTF-8 sequence, i.e. the most byte-fallback tokens one character can span.
+  MAX_PENDING_TOKENS = 4
+
+  def __init__(self, tokenizer, skip_token_ids: Iterable[int] = ()):
+    """
+    Args:
+      tokenizer: The tokenizer that produced the token IDs.
+      skip_token_ids: Token IDs that produce no text, e.g. EOS.
+    """
+    self._skip_token_ids = {int(t) for t in skip_token_ids}
+    self._parts: list[str] = []
+    self._length = 0
+    self.offsets: list[int] = []
+    if isinstance(tokenizer, TikTokenTokenizer):
+      self._token_bytes = tokenizer.model.decode_single_token_bytes
+      self._utf8_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    else:
+      self._token_bytes = None
+      self._decode = tokenizer.decode
+      self._ids: list[int] = []
+      self._offset_indices: list[int] = []  # Index into `offsets` of each entry of `_ids`.
+      self._prefix_offset = 0
+      self._read_offset = 0
+
+  @property
+  def text(self) -> str:
+    """The stable text decoded so far."""
+    if len(self._parts) > 1:
+      self._parts = ["".join(self._parts)]
+    return self._parts[0] if self._parts else ""
+
+  def add(self, token_id: int) -> str:
+    """Appends a token and returns the text it made stable, possibly empty."""
+    token_id = int(token_id)
+    self.offsets.append(self._length)
+    if token_id in self._skip_token_ids:
+      return ""
+    if self._token_bytes is not None:
+      delta = self._utf8_decoder.decode(self._token_bytes(token_id))
+    else:
+      self._ids.append(token_id)
+      self._offset_indices.append(len(self.offsets) - 1)
+      delta = self._decode_window(final=False)
+    return self._emit(delta)
+
+  def flush(self) -> str:
+    """Returns any text still held back, e.g. an incomplete character at the end of generation."""
+    if self._token_bytes is not None:
+      delta = self._utf8_decoder.decode(b"", final=True)
+    else:
+      delta = self._decode_window(final=True)
+    return self._emit(delta)
+
+  def _decode_window(self, final: bool) -> str:
+    """Decodes the tokens after the last stable one and returns their text once it is stable."""
+    prefix_text = _to_str(self._decode(self._ids[self._prefix_offset : self._read_offset]))
+    new_text = _to_str(self._decode(self._ids[self._prefix_offset :]))
+    pending_tokens = len(self._ids) - self._read_offset
+    if not final and (len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd")):
+      if pending_tokens < self.MAX_PENDING_TOKENS:
+        return ""
+    delta = new_text[len(prefix_text) :]
+    # Tokens after the first pending one were added before their text was stable.
+    for i in range(self._read_offset + 1, len(self._ids)):
+      partial_text = _to_str(self._decode(self._ids[self._prefix_offset : i]))
+      start = len(os.path.commonprefix([partial_text, new_text])) - len(prefix_text)
+      self.offsets[self._offset_indices[i]] = self._length + min(max(start, 0), len(delta))
+    self._prefix_offset = self._read_offset
+    self._read_offset = len(self._ids)
+    return delta
+
+  def _emit(self, delta: str) -> str:
+    if delta:
+      self._parts.append(delta)
+      self._length += len(delta)
+    return delta
+
+
+def _to_str(decoded) -> str:
+  """Converts the output of a tokenizer's `decode` to `str`; TF-based tokenizers return byte tensors."""
+  if isinstance(decoded, str):
+    return decoded
+  if hasattr(decoded, "numpy"):
+    decoded = decoded.numpy()
+  if isinstance(decoded, bytes):
+    return decoded.decode("utf-8", errors="replace")
+  return str(decoded)
+
+
+class StopSequenceMatcher:
+  """
+  Aho-Corasick matcher for stop sequences in text that arrives incrementally.
+
+  Each fed character costs amortized O(1) regardless of the number and length
+  of the stop sequences, and nothing is re-scanned when more text arrives.
+  """
+
+  def __init__(self, stop_sequences: Iterable[str]):
+    self.stop_sequences = [s for s in stop_sequences if s]
+    # Trie nodes: transitions, failure link, depth and the length of the longest
+    # stop sequence ending at the node (following failure links).
+    self._goto: list[dict[str, int]] = [{}]
+    self._fail = [0]
+    self._depth = [0]
+    self._match_length = [0]
+    for stop in self.stop_sequences:
+      node = 0
+      for ch in stop:
+        if ch not in self._goto[node]:
+          self._goto.append({})
+          self._fail.append(0)
+          self._depth.append(self._depth[node] + 1)
+          self._match_length.append(0)
+          self._goto[node][ch] = len(self._goto) - 1
+        node = self._goto[node][ch]
+      self._match_length[node] = len(stop)
+
+    # Breadth-first so that failure links always point to shallower, finished nodes.
+    queue = collections.deque(self._goto[0].values())
+    while queue:
+      node = queue.popleft()
+      for ch, child in self._goto[node].items():
+        fail = self._fail[node]
+        while fail and ch not in self._goto[fail]:
+          fail = self._fail[fail]
+        self._fail[child] = self._goto[fail].get(ch, 0)
+        self._match_length[child] = max(self._match_length[child], self._match_length[self._fail[child]])
+        queue.append(child)
+
+    self._node = 0
+    self._num_chars = 0
+    self.match_start = -1
+
+  def feed(self, text: str) -> int:
+    """
+    Feeds the next piece of text.
+
+    Returns:
+      The character index, counted over all text fed so far, where the first
+      stop sequence to complete starts, or -1 if none has completed yet.
+    """
+    if self.match_start != -1:
+      return self.match_start
+    goto, fail = self._goto, self._fail
+    node = self._node
+    for ch in text:
+      while node and ch not in goto[node]:
+        node = fail[node]
+      node = goto[node].get(ch, 0)
+      self._num_chars += 1
+      if self._match_length[node]:
+        self.match_start = self._num_chars - self._match_length[node]
+        break
+    self._node = node
+    return self.match_start
+
+  @property
+  def num_pending_chars(self) -> int:
+    """Number of trailing characters that could still become a stop sequence, i.e. must not be emitted yet."""
+    return self._depth[self._node]
+
+
 def build_tokenizer(tokenizer_path, tokenizer_type, add_bos, add_eos, hf_access_token, dataset_type):
   """Loads the tokenizer at `tokenizer_path`"""
   max_logging.log(f"Tokenizer path: {tokenizer_path}")
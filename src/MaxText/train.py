@@ -458,7 +458,9 @@ def train_loop(config, recorder, state=None):
       last_step_completion = datetime.datetime.now()
 
       state_to_save = state if not config.use_dpo else _split_dpo_state(state)[0]
+      checkpoint_start = datetime.datetime.now()
       checkpointing.maybe_save_checkpoint(checkpoint_manager, state_to_save, config, data_iterator, step)
+      checkpoint_stall_time = (datetime.datetime.now() - checkpoint_start).total_seconds()
 
       if config.dump_hlo and step == (config.dump_step if config.dump_step >= 0 else start_step):
         jax.block_until_ready(state)  # Ensure compilation has finished.
@@ -496,7 +498,9 @@ def train_loop(config, recorder, state=None):
       if step == start_step:
         max_utils.print_mem_stats("After params initialized")
 
-      metric_logger.buffer_and_write_train_metrics(metrics, step, step_time_delta)
+      metric_logger.buffer_and_write_train_metrics(
+          metrics, step, step_time_delta, data_loader.get_metrics(), checkpoint_stall_time
+      )
 
     if config.save_checkpoint_on_completion:
       state_to_save = state if not config.use_dpo else _split_dpo_state(state)[0]
@@ -507,6 +511,7 @@ def train_loop(config, recorder, state=None):
   except exceptions.StopTraining as e:
     max_logging.log(f"Training stopped: {str(e)}")
   finally:
+    data_loader.close()
     metric_logger.flush_metrics_and_cleanup()
 
   return state
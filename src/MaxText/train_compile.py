@@ -137,6 +137,42 @@ def jit_and_compile(
   return compiled
 
 
+def compile_train_step(topology_mesh, config):
+  """Jit and compile train_step for topology_mesh, with the shapes and shardings that train.py uses."""
+  # Get shaped inputs
+  shaped_train_args, shaped_train_kwargs, state_mesh_shardings, model = get_shaped_inputs(topology_mesh, config)
+
+  # Get data sharding
+  data_sharding = sharding.get_input_data_sharding(config, topology_mesh)
+
+  # Get function to compile and shardings
+  params_shardings, state_mesh_shardings = sharding.maybe_update_params_sharding_with_opt(config, state_mesh_shardings)
+  func_to_compile, in_shard, out_shard, static_argnums, donate_argnums = (
+      maxtext_utils.get_functional_train_with_signature(
+          train.train_step, data_sharding, state_mesh_shardings, model, config, params_shardings
+      )
+  )
+
+  # print weights sharding info under debug sharding mode
+  if config.debug_sharding:
+    max_utils.print_non_trivial_mesh_axis(topology_mesh)
+    maxtext_utils.print_state_mesh_shardings_params(shaped_train_args[0], state_mesh_shardings, topology_mesh)
+
+  # Compile
+  print("Jitting and compiling train step...", flush=True)
+  return jit_and_compile(
+      func_to_compile,
+      shaped_train_args,
+      shaped_train_kwargs,
+      topology_mesh,
+      in_shard,
+      out_shard,
+      static_argnums,
+      donate_argnums,
+      nn_partitioning.axis_rules(config.logical_axis_rules),
+  )
+
+
 def save_compiled(compiled, save_name):
   """Serialize and save the compiled function."""
   serialized, _, _ = serialize(compiled)
@@ -157,31 +193,8 @@ def is_oom(argv: Sequence[str]) -> bool:
   # prematurely initializing the backend.
   max_utils.print_system_information()
 
-  # Get shaped inputs
-  shaped_train_args, shaped_train_kwargs, state_mesh_shardings, model = get_shaped_inputs(topology_mesh, config)
-
-  # Get data sharding
-  data_sharding = sharding.get_input_data_sharding(config, topology_mesh)
-
-  # Get function to compile and shardings
-  func_to_compile, in_shard, out_shard, static_argnums, donate_argnums = (
-      maxtext_utils.get_functional_train_with_signature(
-          train.train_step, data_sharding, state_mesh_shardings, model, config
-      )
-  )
-
   try:
-    _ = jit_and_compile(
-        func_to_compile,
-        shaped_train_args,
-        shaped_train_kwargs,
-        topology_mesh,
-        in_shard,
-        out_shard,
-        static_argnums,
-        donate_argnums,
-        nn_partitioning.axis_rules(config.logical_axis_rules),
-    )
+    _ = compile_train_step(topology_mesh, config)
     return False
   except Exception as e:
     # return true if OOM error happens
@@ -212,37 +225,7 @@ def main(argv: Sequence[str]) -> None:
   # prematurely initializing the backend.
   max_utils.print_system_information()
 
-  # Get shaped inputs
-  shaped_train_args, shaped_train_kwargs, state_mesh_shardings, model = get_shaped_inputs(topology_mesh, config)
-
-  # Get data sharding
-  data_sharding = sharding.get_input_data_sharding(config, topology_mesh)
-
-  # Get function to compile and shardings
-  func_to_compile, in_shard, out_shard, static_argnums, donate_argnums = (
-      maxtext_utils.get_functional_train_with_signature(
-          train.train_step, data_sharding, state_mesh_shardings, model, config
-      )
-  )
-
-  # print weights sharding info under debug sharding mode
-  if config.debug_sharding:
-    max_utils.print_non_trivial_mesh_axis(topology_mesh)
-    maxtext_utils.print_state_mesh_shardings_params(shaped_train_args[0], state_mesh_shardings, topology_mesh)
-
-  # Compile
-  print("Jitting and compiling train step...", flush=True)
-  compiled = jit_and_compile(
-      func_to_compile,
-      shaped_train_args,
-      shaped_train_kwargs,
-      topology_mesh,
-      in_shard,
-      out_shard,
-      static_argnums,
-      donate_argnums,
-      nn_partitioning.axis_rules(config.logical_axis_rules),
-  )
+  compiled = compile_train_step(topology_mesh, config)
   print("Jitting and compilation complete!", flush=True)
 
   # Serialize and save the compiled object
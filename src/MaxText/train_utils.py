@@ -77,6 +77,8 @@ def create_training_tools(config, model, mesh):
         use_zarr3,
         config.enable_continuous_checkpointing,
         config.max_num_checkpoints_to_keep,
+        config.delta_checkpoint_base_period,
+        config.checkpoint_host_snapshot,
     )
 
   return init_rng, checkpoint_manager, learning_rate_schedule, tx
@@ -73,9 +73,10 @@ from MaxText.utils.ckpt_conversion.utils.hf_model_configs import HF_MODEL_CONFIG
 from MaxText.utils.ckpt_conversion.utils.utils import (
     validate_and_filter_param_map_keys,
     process_maxtext_param,
-    save_model_files,
-    load_orbax_checkpoint,
-    detect_and_extract_checkpoint,
+    get_hf_weight_sizes,
+    save_model_files_streaming,
+    print_ram_usage,
+    OrbaxParamReader,
     HF_IDS,
 )
 
@@ -114,10 +115,12 @@ def _get_model_mappings(
 def main(argv: Sequence[str]) -> None:
   """Main function to convert a MaxText checkpoint to HuggingFace format.
 
-  This function orchestrates the entire conversion process. It loads the
-  MaxText checkpoint, transforms the parameter keys and weights according to
-  pre-defined mappings, and saves the resulting model, configuration, and
-  tokenizer in a format compatible with the Hugging Face ecosystem.
+  This function orchestrates the entire conversion process. It streams the
+  MaxText checkpoint one parameter at a time, transforms the parameter keys and
+  weights according to pre-defined mappings, and appends them to the safetensors
+  shards of the resulting model, so that the whole model is never in memory. It
+  also saves the configuration and tokenizer in a format compatible with the
+  Hugging Face ecosystem.
 
   Args:
     argv: Command-line arguments, which are parsed by `pyconfig`.
@@ -133,11 +136,9 @@ def main(argv: Sequence[str]) -> None:
   max_utils.print_system_information()
   overall_start = time.time()
 
-  # Load Maxtext checkpoint using Orbax to get full parameter dict
-  max_logging.log(f"\nLoading Orbax checkpoint from: {config.load_parameters_path}")
-  start = time.time()
-  checkpoint_dict = load_orbax_checkpoint(config)
-  max_logging.log(f"Elapse for checkpoint load: {(time.time() - start) / 60:.2f} min")
+  # Read the metadata of the Maxtext checkpoint; the parameters are restored one at a time below
+  max_logging.log(f"\nLoading Orbax checkpoint metadata from: {config.load_parameters_path}")
+  param_reader = OrbaxParamReader(config)
 
   if not config.base_output_directory:
     output_directory = f"tmp/{config.run_name}"
@@ -167,49 +168,42 @@ def main(argv: Sequence[str]) -> None:
   hook_fn_map = mappings["hook_fn_mapping"]
 
   # 4. Extract and transform weights for Linen/NNX-SFT/NNX-RL checkpoints
-  maxtext_state_dict = detect_and_extract_checkpoint(checkpoint_dict)
+  maxtext_param_metadata = param_reader.param_metadata
 
   # Validate that checkpoint keys match the parameter mapping
-  filtered_map_keys = validate_and_filter_param_map_keys(param_map.keys(), maxtext_state_dict.keys())
-
-  # Iterate through the parameter map to transform and collect weights.
-  # This loop handles both simple 1-to-1 mappings and complex N-to-1 mappings
-  # (where multiple MaxText weights are combined into a single HF weight).
-  max_logging.log("\nProccessing weight...")
-  start = time.time()
-  processed_params_list = []
-
-  for key in tqdm(filtered_map_keys, total=len(filtered_map_keys)):
-    if isinstance(key, tuple):
-      # if key is tuple of param names, weight is list of param weights
-      weight = [maxtext_state_dict[subkey] for subkey in key]
-    else:
-      # if key is single param name, weight is single param weight
-      weight = maxtext_state_dict[key]
-
-    processed_params = process_maxtext_param(key, weight, param_map, hook_fn_map, shape_map, config)
-    processed_params_list.extend(processed_params)
-
-  transformed_hf_weights = dict(processed_params_list)
-  max_logging.log(f"Elapse for transform: {(time.time() - start) / 60:.2f} min")
-
-  # 5. Save in HuggingFace Format
-  if not transformed_hf_weights:
+  filtered_map_keys = validate_and_filter_param_map_keys(param_map.keys(), maxtext_param_metadata.keys())
+  if not filtered_map_keys:
     print("Error: No weights were transformed. Check mappings and parameter paths.")
     return
 
-  max_logging.log("\nSaving HuggingFace model...")
+  # Iterate through the parameter map to restore, transform and yield weights one parameter at a time.
+  # This loop handles both simple 1-to-1 mappings and complex N-to-1 mappings
+  # (where multiple MaxText weights are combined into a single HF weight).
+  def _transformed_hf_weights():
+    for key in tqdm(filtered_map_keys, total=len(filtered_map_keys)):
+      if isinstance(key, tuple):
+        # if key is tuple of param names, weight is list of param weights
+        weight = param_reader.restore(key)
+      else:
+        # if key is single param name, weight is single param weight
+        weight = param_reader.restore([key])[0]
+      yield from process_maxtext_param(key, weight, param_map, hook_fn_map, shape_map, config)
+
+  # 5. Transform and save in HuggingFace Format
+  max_logging.log("\nProccessing and saving HuggingFace model...")
   start = time.time()
-  save_model_files(
-      weight_arrays=transformed_hf_weights,
+  save_model_files_streaming(
+      weight_sizes=get_hf_weight_sizes(filtered_map_keys, param_map, shape_map, maxtext_param_metadata),
+      weights=_transformed_hf_weights(),
       config=hf_config_obj,
       tokenizer=tokenizer,
       processor=processor,
       output_dir=output_directory,
   )
   max_logging.log(f"✅ MaxText model successfully saved in HuggingFace format at {output_directory}")
-  max_logging.log(f"Elapse for save: {(time.time() - start) / 60:.2f} min")
+  max_logging.log(f"Elapse for transform and save: {(time.time() - start) / 60:.2f} min")
   max_logging.log(f"Overall Elapse: {(time.time() - overall_start) / 60:.2f} min")
+  print_ram_usage("Program Ends")
 
 
 if __name__ == "__main__":
@@ -30,6 +30,10 @@ Key Parameters (to be set in the config file or as command-line overrides):
              Defaults to False.
   --hf_model_path: (Optional) Specify a local HF path, rather than the default repo `HF_IDS[model_name]`. 
               Useful for locally dequantized HF model like GPT-OSS or DeepSeek.
+  --num_workers: (int) Number of threads that read and transform the HF tensors in parallel
+             with lazy loading. Defaults to 8.
+  --ram_budget_gb: (float) Maximum size of the converted tensors held in RAM at once with lazy
+             loading. Defaults to half of the available RAM.
 
 Environment Variables:
   HF_AUTH_TOKEN: (Required) HuggingFace authentication token, needed to
@@ -57,11 +61,13 @@ Example Usage:
 """
 
 import argparse
+import asyncio
 import os
 import time
 import sys
 import json
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from typing import Sequence, List, Any, Callable
 import numpy as np
@@ -72,7 +78,6 @@ import flax.linen as nn
 from transformers import AutoConfig
 from tqdm import tqdm
 from huggingface_hub import hf_hub_download, list_repo_files
-from safetensors import safe_open
 import absl
 
 from orbax.checkpoint import type_handlers
@@ -86,7 +91,14 @@ from MaxText.inference_utils import str2bool
 from MaxText.layers import models, quantizations
 from MaxText.checkpointing import save_checkpoint
 from MaxText.utils.ckpt_conversion.utils.param_mapping import HOOK_FNS, PARAM_MAPPING
-from MaxText.utils.ckpt_conversion.utils.utils import apply_hook_fns, HF_IDS, print_ram_usage, get_hf_model, validate_and_filter_param_map_keys
+from MaxText.utils.ckpt_conversion.utils.utils import (
+    apply_hook_fns,
+    HF_IDS,
+    print_ram_usage,
+    get_hf_model,
+    validate_and_filter_param_map_keys,
+    SAFETENSORS_DTYPES,
+)
 
 jax.config.update("jax_platform_name", "cpu")
 
@@ -126,6 +138,31 @@ class MemoryMonitorTqdm(tqdm):
     return super().format_meter(n=n, total=total, elapsed=elapsed, postfix=postfix, **extra_kwargs)
 
 
+class SafetensorsShard:
+  """
+  A memory-mapped safetensors file.
+
+  The file is mapped once, and `get_tensor` returns a NumPy view of the mapped
+  bytes of a tensor, so reading a tensor neither reopens the file nor copies it.
+  The mapping is copy-on-write, so hooks may modify the returned arrays in place
+  without touching the file.
+  """
+
+  def __init__(self, path: str):
+    # A safetensors file is an 8-byte little-endian header size, a JSON header and the tensor bytes.
+    with open(path, "rb") as f:
+      header_size = int.from_bytes(f.read(8), "little")
+      header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    self.tensor_infos = header
+    self._data = np.memmap(path, dtype=np.uint8, mode="c", offset=8 + header_size)
+
+  def get_tensor(self, key: str) -> np.ndarray:
+    info = self.tensor_infos[key]
+    begin, end = info["data_offsets"]
+    return np.asarray(self._data[begin:end]).view(SAFETENSORS_DTYPES[info["dtype"]]).reshape(info["shape"])
+
+
 class LazyHFLoader:
   """
   Loads Hugging Face weights on-demand to minimize RAM usage.
@@ -138,13 +175,14 @@ class LazyHFLoader:
   When a specific tensor is requested via `get_tensor`, this class:
   1. Identifies the correct shard file.
   2. Downloads the shard file if not already cached by `huggingface_hub`.
-  3. Opens the shard and extracts *only* the requested tensor into memory.
-
-  This approach is highly memory-efficient, especially for `safetensors`, as
-  it avoids loading entire multi-gigabyte shard files when only a small piece
-  is needed. A threading lock (`_ram_lock`) is used to ensure that memory-intensive
-  file-opening operations are serialized to prevent RAM spikes, while downloads
-  can still occur in parallel.
+  3. Memory-maps the shard on its first use, and returns a view of *only* the
+     requested tensor.
+
+  This approach is highly memory-efficient, as it avoids loading entire
+  multi-gigabyte shard files when only a small piece is needed. The mapped shards
+  are kept in a pool (`_shards`) and shared by all threads, so that tensors can be
+  read in parallel; the RAM used by the tensors being converted is bounded by
+  `LazyTensorHandler` instead.
   """
 
   def __init__(self, model_id, token):
@@ -153,22 +191,23 @@ class LazyHFLoader:
     # Whether loads from local directory
     self.is_local = os.path.isdir(self.model_id)
     self.shard_map = {}
-    self.current_shard_name = None
-    self.current_shard_content = {}
-    # Use a lock to serialize heavy RAM operations, but NOT downloads
-    self._ram_lock = threading.Lock()
+    # Memory-mapped shards by local path, opened on first use.
+    self._shards = {}
+    self._shards_lock = threading.Lock()
     self._initialize_index()
 
   def __getstate__(self):
-    """Allows pickling/copying by excluding the non-pickleable lock."""
+    """Allows pickling/copying by excluding the non-pickleable lock and the mapped shards."""
     state = self.__dict__.copy()
-    del state["_ram_lock"]
+    del state["_shards"]
+    del state["_shards_lock"]
     return state
 
   def __setstate__(self, state):
-    """Restores state after pickling/copying and recreates a new lock."""
+    """Restores state after pickling/copying with an empty pool of mapped shards."""
     self.__dict__.update(state)
-    self._ram_lock = threading.Lock()
+    self._shards = {}
+    self._shards_lock = threading.Lock()
 
   def _initialize_index(self):
     """Fetches and parses the Hugging Face model index file to build a shard map."""
@@ -197,17 +236,8 @@ class LazyHFLoader:
       index_data = json.load(f)
     self.shard_map = index_data["weight_map"]
 
-  def get_tensor(self, key: str) -> np.ndarray:
-    """
-    Retrieves a specific tensor by name, lazily loading its shard if necessary.
-
-    This is the main entry point for accessing model weights. It determines
-    which shard file contains the tensor, ensures it's downloaded, and then
-    reads the tensor data.
-
-    For safetensors, this is extremely efficient as it memory-maps the file
-    and reads only the required tensor's data from disk.
-    """
+  def get_shard_name(self, key: str) -> str:
+    """Returns the name of the shard file that contains the tensor `key`."""
     # Handle single-file models (shard map key might be None or we just know the filename)
     shard_name = self.shard_map.get(key)
     if shard_name is None and None in self.shard_map:
@@ -216,33 +246,50 @@ class LazyHFLoader:
       # Fallback: sometimes keys in index don't perfectly match requested keys if there are prefix mismatches.
       # You might need advanced fuzzy matching here if you encounter errors.
       raise ValueError(f"Key {key} not found in HF checkpoint index.")
+    return shard_name
 
+  def _get_shard(self, shard_name: str) -> SafetensorsShard:
+    """Returns the mapped shard `shard_name`, downloading and mapping it on its first use."""
     if self.is_local:
       local_path = os.path.join(self.model_id, shard_name)
     else:
-      # STEP 1: Download outside the lock.
-      # multiple threads can download different shards at the same time.
+      # Download outside the lock, so that multiple threads can download different shards at the same time.
       local_path = hf_hub_download(repo_id=self.model_id, filename=shard_name, token=self.token)
+    with self._shards_lock:
+      if local_path not in self._shards:
+        self._shards[local_path] = SafetensorsShard(local_path)
+      return self._shards[local_path]
+
+  def get_tensor(self, key: str) -> np.ndarray:
+    """
+    Retrieves a specific tensor by name, lazily loading its shard if necessary.
 
-    # STEP 2: Lock ONLY the reading into RAM.
-    # This prevents multiple threads from simultaneously allocating large chunks of RAM.
-    with self._ram_lock:
-      with safe_open(local_path, framework="np", device="cpu") as f:
-        return f.get_tensor(key)
+    This is the main entry point for accessing model weights. It determines
+    which shard file contains the tensor, ensures it's downloaded and mapped,
+    and returns a view of the tensor data, which is only read from disk when
+    it is used.
+    """
+    return self._get_shard(self.get_shard_name(key)).get_tensor(key)
 
 
 class LazyTensor:
   """
   A proxy object that looks like a NumPy array but delays actual loading
   and transformation until __array__ is called (e.g., by Orbax during save).
+
+  `shard` is the HF shard file that the tensor is read from, used to group the
+  reads of the same shard.
   """
 
-  def __init__(self, load_fn: Callable[[], np.ndarray], shape: tuple, dtype, name: str = "unknown"):
+  def __init__(
+      self, load_fn: Callable[[], np.ndarray], shape: tuple, dtype, name: str = "unknown", shard: str | None = None
+  ):
     self._load_fn = load_fn
     self.shape = shape
     self.dtype = np.dtype(dtype)
     self.ndim = len(shape)
     self.name = name
+    self.shard = shard
 
   @property
   def size(self):
@@ -290,6 +337,25 @@ class LazyTensor:
     return f"LazyTensor(name={self.name}, shape={self.shape}, dtype={self.dtype})"
 
 
+class _ByteBudget:
+  """Bounds the total size of the tensors held in RAM, while always admitting a tensor when none is held."""
+
+  def __init__(self, max_bytes: int):
+    self._max_bytes = max_bytes
+    self._held_bytes = 0
+    self._condition = asyncio.Condition()
+
+  async def acquire(self, nbytes: int):
+    async with self._condition:
+      await self._condition.wait_for(lambda: self._held_bytes == 0 or self._held_bytes + nbytes <= self._max_bytes)
+      self._held_bytes += nbytes
+
+  async def release(self, nbytes: int):
+    async with self._condition:
+      self._held_bytes -= nbytes
+      self._condition.notify_all()
+
+
 class LazyTensorHandler(type_handlers.NumpyHandler):
   """
   Custom Orbax handler for LazyTensor.
@@ -297,15 +363,44 @@ class LazyTensorHandler(type_handlers.NumpyHandler):
   It masquerades as a standard NumpyHandler so that the resulting checkpoint
   has the standard 'array_metadatas' structure and can be loaded by
   standard MaxText instances.
-  """
 
-  async def serialize(self, value, *args, **kwargs):
-    # MATERIALIZE: Trigger the lazy load (__array__) explicitly before saving.
-    # This ensures the parent NumpyHandler receives a real np.ndarray.
-    if hasattr(value, "__array__"):
-      value = np.array(value)
+  The tensors are materialized by a pool of `num_workers` threads, in the order
+  of their HF shards so that the reads of a shard are close together, and each
+  one is written as soon as it is loaded. At most `ram_budget_bytes` of loaded
+  tensors are held at once, half of the available RAM if None.
 
-    return await super().serialize(value, *args, **kwargs)
+  The LazyTensors are not deep-copied before they are serialized, since a copy
+  would copy their `LazyHFLoader` with an empty pool of mapped shards, and map
+  every shard again for every tensor.
+  """
+
+  def __init__(self, num_workers: int = 8, ram_budget_bytes: int | None = None, **kwargs):
+    super().__init__(deepcopy_host_arrays=False, **kwargs)
+    self._num_workers = num_workers
+    self._ram_budget_bytes = ram_budget_bytes
+
+  async def _background_serialize(self, values, infos, args=None):
+    args = args or [type_handlers.SaveArgs()] * len(values)
+    ram_budget_bytes = self._ram_budget_bytes or psutil.virtual_memory().available // 2
+    budget = _ByteBudget(ram_budget_bytes)
+    loop = asyncio.get_running_loop()
+    write = super()._background_serialize
+
+    async def _load_and_write(pool, value, info, arg):
+      try:
+        # MATERIALIZE: Trigger the lazy load (__array__) so the parent NumpyHandler receives a real np.ndarray.
+        array = await loop.run_in_executor(pool, np.asarray, value)
+        await write([array], [info], [arg])
+      finally:
+        await budget.release(value.nbytes)
+
+    order = sorted(range(len(values)), key=lambda i: getattr(values[i], "shard", None) or "")
+    with ThreadPoolExecutor(max_workers=self._num_workers) as pool:
+      tasks = []
+      for i in order:
+        await budget.acquire(values[i].nbytes)
+        tasks.append(asyncio.create_task(_load_and_write(pool, values[i], infos[i], args[i])))
+      await asyncio.gather(*tasks)
 
 
 # Register LazyTensor with the custom handler.
@@ -358,6 +453,16 @@ def get_maxtext_model_info(config):
   return maxtext_abstract_dict, abstract_params_treedef
 
 
+def _write_stacked_slice(stacked_slices: np.ndarray, index: tuple, processed_hf_tensor: np.ndarray, hf_key: str):
+  """Writes a processed HF weight into its slice of a preallocated stacked MaxText tensor, like `np.stack` would."""
+  if processed_hf_tensor.shape != stacked_slices.shape[len(index) :]:
+    raise ValueError(
+        f"Shape mismatch for {hf_key}: Expected {stacked_slices.shape[len(index):]} like the other stacked weights, "
+        f"got {processed_hf_tensor.shape}"
+    )
+  stacked_slices[index] = processed_hf_tensor
+
+
 def _build_multi_axis_stacked_tensor(
     hf_source_keys: List[List[str]],
     tensor_getter_fn: Callable[[str], np.ndarray],
@@ -381,21 +486,27 @@ def _build_multi_axis_stacked_tensor(
   Returns:
       The final, assembled NumPy array for the MaxText parameter.
   """
-  all_expert_tensors = []
   # The hook function needs the shape of an individual slice, not the full stacked tensor.
   # For multi-axis stacking (experts, layers, ...), the slice shape is target_shape[2:]
   mt_slice_shape = target_shape[2:]
+  num_layers = len(hf_source_keys[0])
+  if any(len(layer_keys_for_expert) != num_layers for layer_keys_for_expert in hf_source_keys):
+    raise ValueError("All experts must have the same number of layers.")
 
+  stacked_tensor = None
   # Outer loop iterates through experts
-  for layer_keys_for_expert in hf_source_keys:
-    layer_tensors_for_expert = []
+  for expert_idx, layer_keys_for_expert in enumerate(hf_source_keys):
     # Inner loop iterates through layers for the current expert
-    for hf_key_single in layer_keys_for_expert:
+    for layer_idx, hf_key_single in enumerate(layer_keys_for_expert):
       hf_tensor_numpy = tensor_getter_fn(hf_key_single)
       processed_hf_tensor = apply_hook_fns(hf_tensor_numpy, mt_slice_shape, hook_fns)
-      layer_tensors_for_expert.append(processed_hf_tensor)
-    all_expert_tensors.append(np.stack(layer_tensors_for_expert, axis=0))
-  return np.stack(all_expert_tensors, axis=0)
+      if stacked_tensor is None:
+        # Write each weight into its slice of the output, rather than stacking copies of all weights.
+        stacked_tensor = np.empty(
+            (len(hf_source_keys), num_layers) + processed_hf_tensor.shape, dtype=processed_hf_tensor.dtype
+        )
+      _write_stacked_slice(stacked_tensor, (expert_idx, layer_idx), processed_hf_tensor, hf_key_single)
+  return stacked_tensor
 
 
 def _build_single_axis_stacked_tensor(
@@ -420,8 +531,6 @@ def _build_single_axis_stacked_tensor(
   Returns:
       The final, assembled NumPy array for the MaxText parameter.
   """
-  tensors_to_stack = []
-
   if config.scan_layers:
     # If it's a standard scanned layer, we use the configured param_scan_axis.
     axis_to_stack = config.param_scan_axis
@@ -435,13 +544,20 @@ def _build_single_axis_stacked_tensor(
   del mt_slice_shape_list[axis_to_stack]
   mt_slice_shape = tuple(mt_slice_shape_list)
 
-  for hf_key_single in hf_source_keys:
+  stacked_tensor = stacked_slices = None
+  for i, hf_key_single in enumerate(hf_source_keys):
     hf_tensor_numpy = tensor_getter_fn(hf_key_single)
     processed_hf_tensor = apply_hook_fns(hf_tensor_numpy, mt_slice_shape, hook_fns)
-    tensors_to_stack.append(processed_hf_tensor)
-
-  # Stack all processed tensors along the determined axis.
-  return np.stack(tensors_to_stack, axis=axis_to_stack)
+    if stacked_tensor is None:
+      # Write each weight into its slice along the stacking axis of the output, rather than stacking copies of all
+      # weights.
+      slice_shape = processed_hf_tensor.shape
+      stacked_shape = slice_shape[:axis_to_stack] + (len(hf_source_keys),) + slice_shape[axis_to_stack:]
+      stacked_tensor = np.empty(stacked_shape, dtype=processed_hf_tensor.dtype)
+      # A view of the output with the stacking axis first.
+      stacked_slices = np.moveaxis(stacked_tensor, axis_to_stack, 0)
+    _write_stacked_slice(stacked_slices, (i,), processed_hf_tensor, hf_key_single)
+  return stacked_tensor
 
 
 def _get_hf_loading_function(hf_source_keys_or_key, tensor_getter, hook_fn, mt_target_shape_or_shapes, config):
@@ -514,11 +630,13 @@ def _get_maxtext_weight(
     final_mt_weights,
     config,
     use_lazy_load,
+    shard=None,
 ):
   """Loads Hugging Face parameters and converts them to MaxText parameters.
 
   This function handles loading based on tensor mode (eager or lazy) and
   processes MaxText keys, which can be `atomic_mt_key` or `composite_mt_key`.
+  In lazy mode, `shard` is the HF shard that the weights are read from.
   """
   is_composite_mt_key = isinstance(mt_param_key_or_keys, tuple)
   if not use_lazy_load:
@@ -553,7 +671,9 @@ def _get_maxtext_weight(
     # to load the tensor later (the `load_fn`, shape, dtype).
     # The actual data will only be loaded when Orbax calls `__array__`
     # on this object during the saving process.
-    final_mt_tensor_numpy = LazyTensor(load_fn, mt_target_shape_or_shapes, config.weight_dtype, name=mt_param_key_or_keys)
+    final_mt_tensor_numpy = LazyTensor(
+        load_fn, mt_target_shape_or_shapes, config.weight_dtype, name=mt_param_key_or_keys, shard=shard
+    )
     if not is_composite_mt_key:
       # Case 2.1: Lazy mode, `atomic_mt_key`
       final_mt_weights[mt_target_idx_or_indices] = final_mt_tensor_numpy
@@ -575,6 +695,7 @@ def _get_maxtext_weight(
             mt_target_shape_or_shapes[i],
             config.weight_dtype,
             name=mt_param_key_or_keys[i],
+            shard=shard,
         )
 
 
@@ -623,6 +744,10 @@ def main(args: Sequence[str], test_args: Sequence[str]) -> None:
   if use_lazy_load:
     max_logging.log(f"Lazy loading ENABLED. Initializing LazyHFLoader for: {model_id}...")
     hf_loader = LazyHFLoader(model_id, hf_token)
+    ram_budget_bytes = int(test_args.ram_budget_gb * 1024**3) or None
+    type_handlers.register_type_handler(
+        LazyTensor, LazyTensorHandler(test_args.num_workers, ram_budget_bytes), override=True
+    )
     hf_config_obj = AutoConfig.from_pretrained(model_id, token=hf_token)
     print_ram_usage("After LazyLoader init")
     tensor_getter = hf_loader.get_tensor
@@ -670,7 +795,7 @@ def main(args: Sequence[str], test_args: Sequence[str]) -> None:
 
   # Weight transformation
   max_logging.log("Starting weight transformation...")
-  start = time.time()
+  start = transform_start = time.time()
   final_mt_weights = [None] * len(maxtext_abstract_dict)
 
   # Preprocess key
@@ -692,6 +817,13 @@ def main(args: Sequence[str], test_args: Sequence[str]) -> None:
     mt_target_idx_or_indices, mt_target_shape_or_shapes = _get_maxtext_indices_and_shapes(
         mt_param_key_or_keys, maxtext_abstract_dict
     )
+    shard = None
+    if use_lazy_load:
+      # Tag the lazy tensors with the shard of their first HF weight, so that they are loaded in shard order.
+      first_hf_key = hf_source_keys_or_key
+      while isinstance(first_hf_key, list):
+        first_hf_key = first_hf_key[0]
+      shard = hf_loader.get_shard_name(first_hf_key)
 
     # Step 2: Determine the loading function for hf key
     # based on hf_key form (unscanned, scanned, unscanned with expert stacking, or scanned with expert stacking)
@@ -707,6 +839,7 @@ def main(args: Sequence[str], test_args: Sequence[str]) -> None:
         final_mt_weights,
         config,
         use_lazy_load,
+        shard,
     )
 
   del hf_state_dict_numpy
@@ -714,6 +847,7 @@ def main(args: Sequence[str], test_args: Sequence[str]) -> None:
   max_logging.log(f"Elapse for transform: {(time.time() - start) / 60:.2f} min")
   print_ram_usage("Before creating full JAX tree")
 
+  converted_bytes = sum(weight.nbytes for weight in final_mt_weights if weight is not None)
   # Create final MaxText parameters tree
   jax_weights = jax.tree_util.tree_unflatten(abstract_params_treedef, final_mt_weights)
   del final_mt_weights, abstract_params_treedef
@@ -742,6 +876,8 @@ def main(args: Sequence[str], test_args: Sequence[str]) -> None:
   print_ram_usage("Program Ends")
   max_logging.log(f"Conversion complete. Checkpoint saved to {output_directory}")
   max_logging.log(f"Elapse for save: {(time.time() - start) / 60:.2f} min")
+  # With lazy loading, the HF weights are read and transformed during the save.
+  max_logging.log(f"Conversion throughput: {converted_bytes / 1e9 / (time.time() - transform_start):.2f} GB/s")
   max_logging.log(f"Overall Elapse: {(time.time() - overall_start) / 60:.2f} min")
 
 
@@ -761,9 +897,24 @@ if __name__ == "__main__":
   parser.add_argument(
       "--hf_model_path", type=str, required=False, default="", help="local path to hf model, or custom remote hf repo"
   )
+  parser.add_argument(
+      "--num_workers",
+      type=int,
+      required=False,
+      default=8,
+      help="Number of threads that read and transform the HF tensors in parallel with lazy loading.",
+  )
+  parser.add_argument(
+      "--ram_budget_gb",
+      type=float,
+      required=False,
+      default=0.0,
+      help="Maximum size in GB of the converted tensors held in RAM at once with lazy loading, 0 for half of the "
+      "available RAM.",
+  )
   local_args, _ = parser.parse_known_args()
   model_args = sys.argv
-  to_remove_args = ["--lazy_load_tensors", "--hf_model_path"]
+  to_remove_args = ["--lazy_load_tensors", "--hf_model_path", "--num_workers", "--ram_budget_gb"]
   for a in to_remove_args:
     model_args = [s for s in model_args if not s.startswith(a)]
   main(model_args, local_args)
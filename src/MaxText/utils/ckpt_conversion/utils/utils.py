@@ -17,17 +17,19 @@
 import contextlib
 import io
 import os
+import resource
 import tempfile
 import time
 import json
 from concurrent.futures import ThreadPoolExecutor
-from typing import Any
+from typing import Any, Iterable, Sequence
 
 import jax
 from jax.experimental import multihost_utils
 
 from jaxtyping import Array
 
+import ml_dtypes
 import numpy as np
 
 from google.cloud.storage import Client, transfer_manager
@@ -53,6 +55,26 @@ SAFE_TENSORS_WEIGHTS_FILE = "model.safetensors"
 SAFE_TENSORS_INDEX_FILE = "model.safetensors.index.json"
 DEFAULT_MAX_SHARD_SIZE = 1024 * 1024 * 1024 * 3  # 3GB default
 
+# NumPy dtypes of the safetensors dtype names.
+SAFETENSORS_DTYPES = {
+    "BOOL": np.bool_,
+    "U8": np.uint8,
+    "I8": np.int8,
+    "U16": np.uint16,
+    "I16": np.int16,
+    "U32": np.uint32,
+    "I32": np.int32,
+    "U64": np.uint64,
+    "I64": np.int64,
+    "F16": np.float16,
+    "BF16": ml_dtypes.bfloat16,
+    "F32": np.float32,
+    "F64": np.float64,
+    "F8_E4M3": ml_dtypes.float8_e4m3fn,
+    "F8_E5M2": ml_dtypes.float8_e5m2,
+}
+_SAFETENSORS_DTYPE_NAMES = {np.dtype(dtype): name for name, dtype in SAFETENSORS_DTYPES.items()}
+
 
 # Mapping from MaxText model key to Hugging Face tokenizer identifiers
 HF_IDS = {
@@ -326,6 +348,31 @@ def process_maxtext_param(
   return output_weights
 
 
+def get_hf_weight_sizes(
+    maxtext_param_keys: Sequence[str | tuple[str, ...]],
+    param_map: dict[str, Any],
+    hf_shape_map: dict[str, Any],
+    maxtext_param_metadata: dict[str, Any],
+) -> list[tuple[str, int]]:
+  """Returns the name and size in bytes of the HF weights of MaxText parameters, used in to_huggingface.
+
+  The HF weights are listed in the order that `process_maxtext_param` returns them,
+  i.e. the (nested) order of their HF paths in `param_map`, and keep the dtype of
+  their MaxText parameter in `maxtext_param_metadata`.
+  """
+  weight_sizes = []
+  for key in maxtext_param_keys:
+    # For a `composite_mt_key`, the HF weights take the dtype of the first MaxText parameter.
+    itemsize = np.dtype(maxtext_param_metadata[key[0] if isinstance(key, tuple) else key].dtype).itemsize
+    hf_paths = param_map[key]
+    if not isinstance(hf_paths, list):
+      hf_paths = [hf_paths]
+    elif isinstance(hf_paths[0], list):
+      hf_paths = [hf_path for expert_paths in hf_paths for hf_path in expert_paths]
+    weight_sizes.extend((hf_path, int(np.prod(hf_shape_map[hf_path])) * itemsize) for hf_path in hf_paths)
+  return weight_sizes
+
+
 def create_huggingface_hub_repo_if_not_exist(repo_id, repo_type):
   if not repo_exists(repo_id, repo_type=repo_type):
     api = HfApi()
@@ -376,65 +423,146 @@ def save_config_file(
         )
 
 
-def shard_checkpoint(
-    weights_dict: dict[str, Array],
+def _plan_shards(
+    weight_sizes: Iterable[tuple[str, int]],
     max_shard_size: int = DEFAULT_MAX_SHARD_SIZE,
     weights_name: str = "model.safetensors",
-) -> tuple[dict[str, dict[str, Array]], None | dict]:
-  """Shards a model checkpoint into smaller pieces based on size constraints.
+) -> tuple[dict[str, str], None | dict]:
+  """Assigns weights to shards based on size constraints, keeping the order of the weights.
 
   Args:
-      weights_dict: Model weights dictionary to shard
+      weight_sizes: Name and size in bytes of each weight, in the order that they are stored
       max_shard_size: Maximum size in bytes for each shard
       weights_name: Base filename for the shards
 
   Returns:
-      tuple of (sharded weights dict, optional index dict)
+      tuple of (shard filename of each weight, optional index dict)
       Index contains metadata and weight mapping information
   """
   # Track current shard and accumulated sizes
-  current_shard: dict[str, Array] = {}
-  shards: list[dict[str, Array]] = [current_shard]
+  shards: list[list[str]] = [[]]
   current_size = 0
   total_size = 0
 
-  # Iterate through weights in sorted order for deterministic sharding
-  for key, tensor in sorted(weights_dict.items()):
-    weight_size = tensor.size * tensor.itemsize
+  for key, weight_size in weight_sizes:
     # Start new shard if current one would exceed size limit
-    if (current_size + weight_size > max_shard_size) and len(current_shard.items()):
-      current_shard = {}
-      shards.append(current_shard)
+    if (current_size + weight_size > max_shard_size) and shards[-1]:
+      shards.append([])
       current_size = 0
 
     # Add weight to current shard and update sizes
-    current_shard[key] = tensor
+    shards[-1].append(key)
     current_size += weight_size
     total_size += weight_size
 
-  # Return single shard without index if no sharding needed
+  # Single shard without index if no sharding needed
   if len(shards) == 1:
-    return {weights_name: shards[0]}, None
+    return {key: weights_name for key in shards[0]}, None
 
   # Generate shard filenames and build index
-  shard_dict = {}
   weight_map = {}
-
   for idx, shard in enumerate(shards, 1):
     # Create numbered shard filename
     shard_name = weights_name.replace(".safetensors", f"-{idx:05d}-of-{len(shards):05d}.safetensors")
-    shard_dict[shard_name] = shard
-
     # Map each weight to its shard file
     for key in shard:
       weight_map[key] = shard_name
 
-  return shard_dict, {
+  return weight_map, {
       "metadata": {"total_size": total_size},
       "weight_map": weight_map,
   }
 
 
+def shard_checkpoint(
+    weights_dict: dict[str, Array],
+    max_shard_size: int = DEFAULT_MAX_SHARD_SIZE,
+    weights_name: str = "model.safetensors",
+) -> tuple[dict[str, dict[str, Array]], None | dict]:
+  """Shards a model checkpoint into smaller pieces based on size constraints.
+
+  Args:
+      weights_dict: Model weights dictionary to shard
+      max_shard_size: Maximum size in bytes for each shard
+      weights_name: Base filename for the shards
+
+  Returns:
+      tuple of (sharded weights dict, optional index dict)
+      Index contains metadata and weight mapping information
+  """
+  # Iterate through weights in sorted order for deterministic sharding
+  sorted_weights = sorted(weights_dict.items())
+  weight_map, index = _plan_shards(
+      [(key, tensor.size * tensor.itemsize) for key, tensor in sorted_weights], max_shard_size, weights_name
+  )
+
+  # Return single shard without index if no sharding needed
+  shard_dict = {weights_name: {}} if index is None else {}
+  for key, tensor in sorted_weights:
+    shard_dict.setdefault(weight_map[key], {})[key] = tensor
+  return shard_dict, index
+
+
+class SafetensorsWriter:
+  """
+  Writes a safetensors file one tensor at a time, without holding the tensors in memory.
+
+  The safetensors header holds the offsets of all tensors and comes before their
+  data. The space for the header of the tensors `keys` is reserved at the start of
+  the file, the tensor data is written after it as it comes, and `close` writes the
+  header into the reserved space, padded with spaces.
+  """
+
+  # Upper bound on the size of the header entry of a tensor, besides its key: its dtype, shape and offsets.
+  _MAX_TENSOR_INFO_BYTES = 256
+
+  def __init__(self, path: str, keys: Iterable[str], metadata: None | dict[str, str] = None):
+    self.path = path
+    self._keys = set(keys)
+    self._metadata = metadata
+    self._tensor_infos = {}
+    self._size = 0
+    header_size = len(json.dumps({"__metadata__": metadata})) + sum(
+        len(json.dumps(key)) + self._MAX_TENSOR_INFO_BYTES for key in self._keys
+    )
+    # Aligns the tensor data to 8 bytes, like the safetensors library.
+    self._header_size = header_size + (-header_size % 8)
+    self._file = open(path, "wb")  # pylint: disable=consider-using-with
+    self._file.seek(8 + self._header_size)
+
+  def write(self, key: str, array: np.ndarray):
+    """Appends `array` as the tensor `key`."""
+    if key not in self._keys:
+      raise ValueError(f"Tensor '{key}' is not one of the tensors of {self.path}.")
+    array = np.ascontiguousarray(array)
+    self._tensor_infos[key] = {
+        "dtype": _SAFETENSORS_DTYPE_NAMES[array.dtype],
+        "shape": list(array.shape),
+        "data_offsets": [self._size, self._size + array.nbytes],
+    }
+    self._file.write(array.reshape(-1).view(np.uint8).data)
+    self._size += array.nbytes
+
+  @property
+  def size(self) -> int:
+    """Size in bytes of the tensors written so far."""
+    return self._size
+
+  def close(self):
+    """Writes the header and closes the safetensors file."""
+    header = {"__metadata__": self._metadata} if self._metadata else {}
+    header.update(self._tensor_infos)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    if len(header_bytes) > self._header_size:
+      self._file.close()
+      raise ValueError(f"The header of {self.path} is larger than its reserved {self._header_size} bytes.")
+    header_bytes += b" " * (self._header_size - len(header_bytes))
+    self._file.seek(0)
+    self._file.write(len(header_bytes).to_bytes(8, "little"))
+    self._file.write(header_bytes)
+    self._file.close()
+
+
 def save_safetensor_file(
     state_dict,
     local_dir_to_save_to: str,
@@ -566,6 +694,60 @@ def get_local_save_path_manager(output_dir: str):
     yield output_dir, False  # path, is_temporary
 
 
+def _save_tokenizer_and_config_files(
+    config,
+    tokenizer: None | Any,
+    processor,
+    output_dir: str,
+    current_save_path: str,
+    remove_local_copy: bool,
+    repo_id: None | str,
+):
+  """Saves the tokenizer or processor files and the model configuration file, used in `save_model_files*`."""
+  if jax.process_index() == 0:
+    files_to_upload = []
+    if processor is not None:
+      max_logging.log(f"    Saving image processor files to {current_save_path}...")
+      saved_image_processor_files = processor.save_pretrained(current_save_path)
+      max_logging.log(f"    Processor files saved locally: {saved_image_processor_files}")
+    elif tokenizer is not None:
+      max_logging.log(f"    Saving tokenizer files to {current_save_path}...")
+      saved_tokenizer_files = tokenizer.save_pretrained(current_save_path)
+      max_logging.log(f"    Tokenizer files saved locally: {saved_tokenizer_files}")
+    files_to_upload = [os.path.join(current_save_path, f) for f in os.listdir(current_save_path)]
+
+    if output_dir.startswith("gs://"):
+      for local_file_path in files_to_upload:
+        if not os.path.exists(local_file_path):
+          max_logging.log(f"   Warning: Tokenizer file {local_file_path} not found locally. Skipping upload to GCS.")
+          continue
+        file_name = os.path.basename(local_file_path)
+        upload_file_to_gcs(
+            local_file_path,
+            os.path.join(output_dir, file_name),
+            remove_local_file_after_upload=remove_local_copy,
+        )
+    elif output_dir.startswith("hf://") and repo_id:
+      api = HfApi()
+      for local_file_path in files_to_upload:
+        if not os.path.exists(local_file_path):
+          max_logging.log(f"   Warning: Tokenizer file {local_file_path} not found locally. Skipping upload to HF Hub.")
+          continue
+        file_name = os.path.basename(local_file_path)
+        api.upload_file(
+            path_or_fileobj=local_file_path,
+            path_in_repo=file_name,
+            repo_id=repo_id,
+            repo_type="model",
+        )
+        if remove_local_copy:
+          os.remove(local_file_path)
+          max_logging.log(f"   Removed local copy: {local_file_path}")
+
+    # Save config.json
+    save_config_file(config, current_save_path, output_dir, SAFE_TENSORS_CONFIG_FILE, remove_local_copy)
+
+
 def save_model_files(
     weight_arrays: dict,
     config,  # HF config object
@@ -591,48 +773,9 @@ def save_model_files(
   with get_local_save_path_manager(output_dir) as (current_save_path, is_temp_path):
     remove_local_copy = is_temp_path
 
-    if jax.process_index() == 0:
-      files_to_upload = []
-      if processor is not None:
-        max_logging.log(f"    Saving image processor files to {current_save_path}...")
-        saved_image_processor_files = processor.save_pretrained(current_save_path)
-        max_logging.log(f"    Processor files saved locally: {saved_image_processor_files}")
-      elif tokenizer is not None:
-        max_logging.log(f"    Saving tokenizer files to {current_save_path}...")
-        saved_tokenizer_files = tokenizer.save_pretrained(current_save_path)
-        max_logging.log(f"    Tokenizer files saved locally: {saved_tokenizer_files}")
-      files_to_upload = [os.path.join(current_save_path, f) for f in os.listdir(current_save_path)]
-
-      if output_dir.startswith("gs://"):
-        for local_file_path in files_to_upload:
-          if not os.path.exists(local_file_path):
-            max_logging.log(f"   Warning: Tokenizer file {local_file_path} not found locally. Skipping upload to GCS.")
-            continue
-          file_name = os.path.basename(local_file_path)
-          upload_file_to_gcs(
-              local_file_path,
-              os.path.join(output_dir, file_name),
-              remove_local_file_after_upload=remove_local_copy,
-          )
-      elif output_dir.startswith("hf://") and repo_id:
-        api = HfApi()
-        for local_file_path in files_to_upload:
-          if not os.path.exists(local_file_path):
-            max_logging.log(f"   Warning: Tokenizer file {local_file_path} not found locally. Skipping upload to HF Hub.")
-            continue
-          file_name = os.path.basename(local_file_path)
-          api.upload_file(
-              path_or_fileobj=local_file_path,
-              path_in_repo=file_name,
-              repo_id=repo_id,
-              repo_type="model",
-          )
-          if remove_local_copy:
-            os.remove(local_file_path)
-            max_logging.log(f"   Removed local copy: {local_file_path}")
-
-      # Save config.json
-      save_config_file(config, current_save_path, output_dir, SAFE_TENSORS_CONFIG_FILE, remove_local_copy)
+    _save_tokenizer_and_config_files(
+        config, tokenizer, processor, output_dir, current_save_path, remove_local_copy, repo_id
+    )
 
     # Save .safetensors files (sharding can be outside process guard if weights are replicated)
     # The actual file saving within save_weight_files is guarded.
@@ -644,6 +787,91 @@ def save_model_files(
     max_logging.log(f"✅ Model and tokenizer (if provided) successfully processed for {output_dir}")
 
 
+def _finish_shard_file(writer: SafetensorsWriter, output_dir: str, remove_local_copy: bool, repo_id: None | str):
+  """Writes a streamed shard file and uploads it when saving to GCS/HF hub."""
+  writer.close()
+  file_name = os.path.basename(writer.path)
+  max_logging.log(f"   Saved {file_name} to {writer.path}")
+  if output_dir.startswith("gs://"):
+    upload_file_to_gcs(writer.path, os.path.join(output_dir, file_name), remove_local_file_after_upload=remove_local_copy)
+  elif output_dir.startswith("hf://") and repo_id:
+    HfApi().upload_file(path_or_fileobj=writer.path, path_in_repo=file_name, repo_id=repo_id, repo_type="model")
+    max_logging.log(f"  Successfully uploaded {file_name} to HF repo: {repo_id}")
+    if remove_local_copy:
+      os.remove(writer.path)
+
+
+def save_model_files_streaming(
+    weight_sizes: Sequence[tuple[str, int]],
+    weights: Iterable[tuple[str, np.ndarray]],
+    config,  # HF config object
+    tokenizer: None | Any,  # transformers.PreTrainedTokenizerBase
+    processor,
+    output_dir: str,
+    max_shard_size: int = DEFAULT_MAX_SHARD_SIZE,
+):
+  """
+  Saves model files (config and weights) like `save_model_files`, writing each weight as soon as it is produced.
+
+  The weights are assigned to shards upfront from `weight_sizes`, the name and
+  size in bytes of each weight in the order that `weights` yields them. Each
+  weight is then appended to its shard file, and each shard is written (and
+  uploaded when saving to GCS/HF hub) once complete, so that the weights are
+  never all in memory.
+  """
+  if output_dir.startswith("hf://"):
+    create_huggingface_hub_repo_if_not_exist(repo_id=output_dir.lstrip("hf://"), repo_type="model")
+    repo_id = output_dir.lstrip("hf://")
+  else:
+    repo_id = None
+
+  max_logging.log(f"\n-> Saving model and tokenizer (if provided) to {output_dir}...")
+
+  with get_local_save_path_manager(output_dir) as (current_save_path, is_temp_path):
+    remove_local_copy = is_temp_path
+
+    _save_tokenizer_and_config_files(
+        config, tokenizer, processor, output_dir, current_save_path, remove_local_copy, repo_id
+    )
+
+    weight_map, index = _plan_shards(weight_sizes, max_shard_size, SAFE_TENSORS_WEIGHTS_FILE)
+    shard_keys = {}
+    for key, shard_name in weight_map.items():
+      shard_keys.setdefault(shard_name, []).append(key)
+    writer = None
+    finished_shards = set()
+    total_size = 0
+    # All processes produce the weights, which may gather sharded arrays, while process 0 writes them.
+    for key, weight in weights:
+      if key not in weight_map:
+        raise ValueError(f"HF weight '{key}' not found in the weight sizes.")
+      if jax.process_index() != 0:
+        continue
+      shard_name = weight_map[key]
+      if writer is None or os.path.basename(writer.path) != shard_name:
+        if shard_name in finished_shards:
+          raise ValueError(f"HF weight '{key}' is not in the order of the weight sizes.")
+        if writer is not None:
+          _finish_shard_file(writer, output_dir, remove_local_copy, repo_id)
+          finished_shards.add(os.path.basename(writer.path))
+          total_size += writer.size
+        writer = SafetensorsWriter(
+            os.path.join(current_save_path, shard_name), shard_keys[shard_name], metadata={"format": "pt"}
+        )
+      writer.write(key, weight)
+    if writer is not None:
+      _finish_shard_file(writer, output_dir, remove_local_copy, repo_id)
+      total_size += writer.size
+
+    if index is not None:
+      # The sizes of the written weights, in case a hook changed a dtype.
+      index["metadata"]["total_size"] = total_size
+      save_index_file(index, current_save_path, output_dir, SAFE_TENSORS_INDEX_FILE, remove_local_copy)
+
+  if jax.process_index() == 0:
+    max_logging.log(f"✅ Model and tokenizer (if provided) successfully processed for {output_dir}")
+
+
 def upload_state_dict_to_gcs(state_dict: dict, gs_bucket_path: str):
   """Uploads a state_dict from memory to Google Cloud Storage.
 
@@ -747,9 +975,24 @@ def upload_folder_to_gcs(local_folder: str, gs_bucket_path: str, num_workers: in
 
 
 def print_ram_usage(stage=""):
+  """Logs the RAM usage of the system, and the peak RSS of this process so far."""
   memory = psutil.virtual_memory()
+  # ru_maxrss is in KiB on Linux.
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
   max_logging.log(
-      f"[{stage}] RAM Usage: {memory.used / (1024**3):.2f}/{memory.total / (1024**3):.2f} GB ({memory.percent:.1f}%)"
+      f"[{stage}] RAM Usage: {memory.used / (1024**3):.2f}/{memory.total / (1024**3):.2f} GB ({memory.percent:.1f}%), "
+      f"peak RSS: {peak_rss / (1024**3):.2f} GB"
+  )
+
+
+def _create_orbax_checkpointer(config) -> ocp.Checkpointer:
+  """Creates the Orbax checkpointer that reads the parameter-only checkpoint of `config`."""
+  return ocp.Checkpointer(
+      ocp.PyTreeCheckpointHandler(
+          restore_concurrent_gb=config.checkpoint_storage_concurrent_gb,
+          use_ocdbt=config.checkpoint_storage_use_ocdbt,
+          use_zarr3=config.checkpoint_storage_use_zarr3,
+      )
   )
 
 
@@ -763,13 +1006,7 @@ def load_orbax_checkpoint(config) -> dict:
     Dictionary containing the full checkpoint structure
   """
   # Create Orbax checkpointer
-  ckptr = ocp.Checkpointer(
-      ocp.PyTreeCheckpointHandler(
-          restore_concurrent_gb=config.checkpoint_storage_concurrent_gb,
-          use_ocdbt=config.checkpoint_storage_use_ocdbt,
-          use_zarr3=config.checkpoint_storage_use_zarr3,
-      )
-  )
+  ckptr = _create_orbax_checkpointer(config)
 
   # Get checkpoint metadata
   checkpoint_path = epath.Path(config.load_parameters_path)
@@ -798,6 +1035,59 @@ def load_orbax_checkpoint(config) -> dict:
   return ckptr.restore(checkpoint_path, restore_args=restore_args)
 
 
+class OrbaxParamReader:
+  """Restores the parameters of an Orbax checkpoint on demand, as unsharded arrays replicated on all devices.
+
+  Only the checkpoint metadata is read upfront. `restore` then reads the requested
+  parameters with an Orbax partial restore, so that the whole checkpoint is never
+  in memory at once.
+
+  Attributes:
+    param_metadata: The `ArrayMetadata` of each parameter, by MaxText parameter name
+      like in `detect_and_extract_checkpoint`.
+  """
+
+  def __init__(self, config):
+    self._checkpointer = _create_orbax_checkpointer(config)
+    self._checkpoint_path = epath.Path(config.load_parameters_path)
+    # Replicated on the devices of all processes, so that every process has the whole parameters.
+    mesh = jax.sharding.Mesh(np.array(jax.devices()).reshape((-1,)), ("x",))
+    self._sharding = jax.sharding.NamedSharding(mesh, jax.sharding.PartitionSpec())
+    metadata_tree = self._checkpointer.metadata(self._checkpoint_path).item_metadata.tree
+    self.param_metadata = detect_and_extract_checkpoint(metadata_tree)
+    # Path of each array in the checkpoint tree, by its Orbax name.
+    self._paths = {
+        leaf.name: tuple(k.key for k in path)
+        for path, leaf in jax.tree_util.tree_leaves_with_path(metadata_tree)
+        if isinstance(leaf, ocp.metadata.ArrayMetadata)
+    }
+
+  def restore(self, maxtext_param_keys: Sequence[str]) -> list[jax.Array]:
+    """Restores the parameters `maxtext_param_keys` of the checkpoint."""
+    paths = [self._paths[self.param_metadata[key].name] for key in maxtext_param_keys]
+    # The partial tree of the requested parameters, and its restore args.
+    item, restore_args = {}, {}
+    for key, path in zip(maxtext_param_keys, paths):
+      item_node, args_node = item, restore_args
+      for k in path[:-1]:
+        item_node = item_node.setdefault(k, {})
+        args_node = args_node.setdefault(k, {})
+      metadata = self.param_metadata[key]
+      item_node[path[-1]] = jax.ShapeDtypeStruct(metadata.shape, metadata.dtype, sharding=self._sharding)
+      args_node[path[-1]] = ocp.ArrayRestoreArgs(sharding=self._sharding)
+    restored = self._checkpointer.restore(
+        self._checkpoint_path,
+        args=ocp.args.PyTreeRestore(item=item, restore_args=restore_args, partial_restore=True),
+    )
+    weights = []
+    for path in paths:
+      node = restored
+      for k in path:
+        node = node[k]
+      weights.append(node)
+    return weights
+
+
 def extract_nnx_weights(weights_dict: dict) -> dict[str, np.ndarray]:
   """Extract weights from NNX checkpoint structure.
 
@@ -821,7 +1111,7 @@ def extract_nnx_weights(weights_dict: dict) -> dict[str, np.ndarray]:
     if path_keys[-1] == "value":
       path_keys = path_keys[:-1]
     maxtext_param_key = "params-" + "-".join(path_keys)
-    if not isinstance(leaf_value, (jax.Array, np.ndarray)):
+    if not isinstance(leaf_value, (jax.Array, np.ndarray, ocp.metadata.ArrayMetadata)):
       raise ValueError(f"Leaf value for {maxtext_param_key} is not an array. Type: {type(leaf_value)}.")
     result[maxtext_param_key] = leaf_value
   return result
@@ -845,7 +1135,7 @@ def extract_linen_weights(weights_dict: dict) -> dict[str, np.ndarray]:
     path_keys = [k.key for k in path_tuple]
     # Construct maxtext_param_key from path_tuple
     maxtext_param_key = "params-" + "-".join(path_keys)
-    if not isinstance(leaf_value, (jax.Array, np.ndarray)):
+    if not isinstance(leaf_value, (jax.Array, np.ndarray, ocp.metadata.ArrayMetadata)):
       raise ValueError(f"Leaf value for {maxtext_param_key} is not an array. Type: {type(leaf_value)}.")
     result[maxtext_param_key] = leaf_value
   return result
@@ -864,10 +1154,10 @@ def detect_and_extract_checkpoint(checkpoint_dict: dict) -> dict[str, np.ndarray
   for both Linen and NNX checkpoints.
 
   Args:
-    checkpoint_dict: Raw checkpoint dictionary from Orbax
+    checkpoint_dict: Raw checkpoint dictionary from Orbax, or its metadata tree
 
   Returns:
-    Dictionary mapping MaxText parameter names to weight arrays
+    Dictionary mapping MaxText parameter names to weight arrays (or their `ArrayMetadata`)
   """
   # Detect checkpoint type by structure
   actual_weights_dict = checkpoint_dict.get("params")
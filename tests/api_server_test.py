@@ -0,0 +1,202 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for continuous batching and streaming in the API server."""
+
+import os.path
+import sys
+import types
+import unittest
+
+import pytest
+
+from benchmarks.api_server.maxtext_generator import MaxTextGenerator, SamplingParams
+from benchmarks.api_server.request_replayer import SyntheticRequest, replay, synthetic_requests
+from benchmarks.api_server import broadcast_utils
+from benchmarks.api_server import server_utils
+from MaxText.globals import MAXTEXT_PKG_DIR
+
+pytestmark = pytest.mark.external_serving
+
+
+class ContinuousBatchingTest(unittest.TestCase):
+  """Replays synthetic traces through the generator slot API with a tiny model.
+  Command: pytest tests/api_server_test.py
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    argv = [
+        sys.argv[0],
+        os.path.join(MAXTEXT_PKG_DIR, "configs", "base.yml"),
+        "run_name=api_server_test",
+        "per_device_batch_size=4",
+        "max_prefill_predict_length=32",
+        "max_target_length=64",
+        "attention=dot_product",
+        "base_emb_dim=128",
+        "base_mlp_dim=256",
+        "base_num_query_heads=4",
+        "base_num_kv_heads=4",
+        "head_dim=32",
+        "base_num_decoder_layers=2",
+        "scan_layers=False",
+        "enable_checkpointing=False",
+        "skip_jax_distributed_system=True",
+    ]
+    cls.llm = MaxTextGenerator(argv)
+    # Random weights: run every request to its max_tokens so lengths are deterministic.
+    cls.llm.eos_ids = []
+
+  @pytest.mark.cpu_only
+  def test_replay_completes_all_requests(self):
+    requests = synthetic_requests(num_requests=3 * self.llm.batch_size, min_tokens=1, max_tokens=12)
+    stats = replay(self.llm, requests, continuous=True)
+
+    self.assertEqual(stats.num_requests, len(requests))
+    for request in requests:
+      self.assertIsNotNone(request.completion)
+      self.assertEqual(request.completion.completion_token_count, request.params.max_tokens)
+    self.assertEqual(self.llm.num_active_slots, 0)
+
+  @pytest.mark.cpu_only
+  def test_short_request_is_not_blocked_by_long_one(self):
+    long_request = SyntheticRequest(
+        key="long", prompt="a long story", params=SamplingParams(max_tokens=24, temperature=0)
+    )
+    short_request = SyntheticRequest(
+        key="short", prompt="a short story", params=SamplingParams(max_tokens=3, temperature=0), arrival_step=2
+    )
+    replay(self.llm, [long_request, short_request], continuous=True)
+
+    self.assertEqual(short_request.admit_step, short_request.arrival_step)
+    self.assertLess(short_request.finish_step, long_request.finish_step)
+
+  @pytest.mark.cpu_only
+  def test_continuous_beats_static_batching(self):
+    static_stats = replay(self.llm, synthetic_requests(num_requests=3 * self.llm.batch_size), continuous=False)
+    continuous_stats = replay(self.llm, synthetic_requests(num_requests=3 * self.llm.batch_size), continuous=True)
+
+    self.assertLessEqual(continuous_stats.num_steps, static_stats.num_steps)
+    self.assertLess(continuous_stats.mean_latency_steps, static_stats.mean_latency_steps)
+    self.assertGreater(continuous_stats.slot_utilization, static_stats.slot_utilization)
+
+  @pytest.mark.cpu_only
+  def test_slot_api_rejects_overfull_insert(self):
+    self.llm.reset_slots()
+    num_prompts = self.llm.batch_size + 1
+    with self.assertRaises(ValueError):
+      self.llm.insert_requests(
+          list(range(num_prompts)), ["hi"] * num_prompts, [SamplingParams(max_tokens=2)] * num_prompts
+      )
+
+  @pytest.mark.cpu_only
+  def test_slot_api_rejects_mixed_sampling(self):
+    # Without decode_sampling_per_slot, all slots decode with the params of one request.
+    self.llm.reset_slots()
+    self.llm.insert_requests(["greedy"], ["hi"], [SamplingParams(max_tokens=8, temperature=0)])
+    self.assertFalse(self.llm.can_admit(SamplingParams(max_tokens=8, temperature=0.7)))
+    self.assertFalse(self.llm.can_admit(SamplingParams(max_tokens=8, temperature=0, seed=3)))
+    with self.assertRaises(ValueError):
+      self.llm.insert_requests(["sampled"], ["hi"], [SamplingParams(max_tokens=8, temperature=0.7)])
+    self.assertEqual(self.llm.num_active_slots, 1)
+    self.llm.reset_slots()
+
+
+class StreamingTextTest(unittest.TestCase):
+  """Tests incremental detokenization and stop handling of streamed text."""
+
+  VOCAB = {1: "He", 2: "llo", 3: " wor", 4: "ld", 5: "STO", 6: "P", 7: "!", 9: "</s>"}
+
+  def setUp(self):
+    super().setUp()
+
+    def decode(ids):
+      return "".join(self.VOCAB[i] for i in ids if i != 9)
+
+    self.llm = types.SimpleNamespace(tokenizer=types.SimpleNamespace(decode=decode), eos_ids=[9])
+
+  def _stream(self, token_ids, stop=None):
+    text_stream = server_utils.TextStream(self.llm, stop)
+    deltas = [text_stream.add(t) for t in token_ids]
+    deltas.append(text_stream.finish())
+    return deltas, text_stream.stopped
+
+  def test_deltas_concatenate_to_full_text(self):
+    deltas, stopped = self._stream([1, 2, 3, 4, 7, 9])
+    self.assertEqual("".join(deltas), "Hello world!")
+    self.assertFalse(stopped)
+
+  def test_stop_sequence_is_never_streamed(self):
+    deltas, stopped = self._stream([1, 2, 3, 4, 5, 6, 7], stop=["STOP"])
+    self.assertEqual("".join(deltas), "Hello world")
+    self.assertTrue(all("S" not in d for d in deltas))
+    self.assertTrue(stopped)
+
+  def test_latency_metrics_summary(self):
+    metrics = server_utils.LatencyMetrics()
+    metrics.record_first_token(0.1)
+    for _ in range(3):
+      metrics.record_next_token(0.02)
+    summary = metrics.summary()
+    self.assertEqual(summary["num_tokens"], 4)
+    self.assertEqual(summary["time_to_first_token"]["count"], 1)
+    self.assertAlmostEqual(summary["inter_token_latency"]["p50_ms"], 20.0)
+
+
+class BroadcastTest(unittest.TestCase):
+  """Tests the encoding and two-phase protocol used to broadcast admitted prompts."""
+
+  def test_batch_round_trip(self):
+    keys = [["req_a", 0], ["req_b", 1]]
+    token_ids = [[1, 2, 3], [128_000, 5]]
+    params = [{"max_tokens": 4, "temperature": 0.0}, {"max_tokens": 8, "temperature": None}]
+    batch = broadcast_utils.decode_batch(broadcast_utils.encode_batch(keys, token_ids, params))
+    self.assertEqual(batch, {"keys": keys, "params": params, "token_ids": token_ids})
+
+  def test_bucket_size(self):
+    self.assertEqual(broadcast_utils.bucket_size(1, 1024), 1024)
+    self.assertEqual(broadcast_utils.bucket_size(1024, 1024), 1024)
+    self.assertEqual(broadcast_utils.bucket_size(1025, 1024), 2048)
+
+  def test_broadcaster_sends_small_payloads_in_header(self):
+    shapes = []
+
+    def broadcast_fn(x):
+      shapes.append(x.shape)
+      return x
+
+    broadcaster = broadcast_utils.PayloadBroadcaster(
+        max_payload_size=1 << 20, header_size=64, min_bucket_size=128, broadcast_fn=broadcast_fn
+    )
+    self.assertIsNone(broadcaster.broadcast(None))
+    self.assertEqual(broadcaster.broadcast(b"small"), b"small")
+    self.assertEqual(shapes, [(64,), (64,)])
+
+    payload = bytes(range(256)) * 2
+    self.assertEqual(broadcaster.broadcast(payload), payload)
+    self.assertEqual(shapes[2:], [(64,), (512,)])
+    with self.assertRaises(ValueError):
+      broadcaster.broadcast(b"x" * ((1 << 20) + 1))
+
+  def test_idle_backoff(self):
+    backoff = broadcast_utils.IdleBackoff(min_wait_s=0.01, max_wait_s=0.03)
+    self.assertEqual([backoff.next_wait() for _ in range(4)], [0.01, 0.02, 0.03, 0.03])
+    backoff.reset()
+    self.assertEqual(backoff.next_wait(), 0.01)
+
+
+if __name__ == "__main__":
+  unittest.main()
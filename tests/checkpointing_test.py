@@ -0,0 +1,189 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the delta checkpoints of checkpointing.py."""
+
+import tempfile
+import unittest
+
+import grain
+import jax
+import jax.numpy as jnp
+import numpy as np
+import orbax.checkpoint as ocp
+
+from MaxText import checkpointing
+
+BASE_PERIOD = 3
+NUM_STEPS = 6
+
+
+def _state(step):
+  """A train-state-like pytree whose float arrays change a little every step, as under training."""
+  params = jax.random.normal(jax.random.PRNGKey(0), (64, 128))
+  update = 1e-3 * jax.random.normal(jax.random.PRNGKey(1), (64, 128))
+  return {
+      "step": jnp.array(step, dtype=jnp.int32),
+      "params": {"kernel": params + step * update, "scale": (params[0] + step * update[0]).astype(jnp.bfloat16)},
+      "opt_state": {"mu": step * update, "count": jnp.array(step, dtype=jnp.int32)},
+  }
+
+
+def _manager(directory):
+  return checkpointing.create_orbax_checkpoint_manager(
+      directory,
+      enable_checkpointing=True,
+      use_async=False,
+      save_interval_steps=1,
+      delta_checkpoint_base_period=BASE_PERIOD,
+  )
+
+
+class DeltaCheckpointTest(unittest.TestCase):
+  """Saves full and delta checkpoints and restores them."""
+
+  def setUp(self):
+    super().setUp()
+    self.directory = tempfile.mkdtemp()
+    manager = _manager(self.directory)
+    for step in range(NUM_STEPS):
+      checkpointing.save_checkpoint(manager, step, _state(step))
+    manager.wait_until_finished()
+    manager.close()
+
+  def test_saves_deltas_between_bases(self):
+    manager = _manager(self.directory)
+    self.assertEqual(manager.all_steps(), list(range(NUM_STEPS)))
+    for step in range(NUM_STEPS):
+      self.assertEqual(manager.is_delta_step(step), step % BASE_PERIOD != 0)
+    self.assertEqual(manager.base_step(4), 3)
+    # The delta holds 4 bytes per float32 too, but the planes of the sign and exponent bytes are mostly zeros.
+    full_bytes = checkpointing.checkpoint_size_bytes(manager, BASE_PERIOD)
+    self.assertLess(checkpointing.checkpoint_size_bytes(manager, BASE_PERIOD + 1), 0.85 * full_bytes)
+
+  def test_restore_delta(self):
+    abstract_state = jax.eval_shape(_state, 0)
+    for step in range(NUM_STEPS):
+      with self.subTest(step=step):
+        restored, _ = checkpointing.load_state_if_possible(
+            _manager(self.directory), None, "", "", 1, abstract_state, step=step
+        )
+        jax.tree.map(np.testing.assert_array_equal, restored["items"], _state(step))
+
+  def test_continues_deltas_after_restore(self):
+    manager = _manager(self.directory)
+    abstract_state = jax.eval_shape(_state, 0)
+    checkpointing.load_state_if_possible(manager, None, "", "", 1, abstract_state)
+    # Not a multiple of BASE_PERIOD, so a delta against the base of the restored delta checkpoint.
+    step = NUM_STEPS + 1
+    checkpointing.save_checkpoint(manager, step, _state(step))
+    manager.wait_until_finished()
+    self.assertTrue(manager.is_delta_step(step))
+    self.assertEqual(manager.base_step(step), manager.base_step(NUM_STEPS - 1))
+
+    restored, _ = checkpointing.load_state_if_possible(_manager(self.directory), None, "", "", 1, abstract_state)
+    jax.tree.map(np.testing.assert_array_equal, restored["items"], _state(step))
+
+  def test_base_state_is_in_host_memory(self):
+    manager = _manager(self.directory)
+    checkpointing.load_state_if_possible(manager, None, "", "", 1, jax.eval_shape(_state, 0))
+    for x in jax.tree.leaves(manager._base_state):  # pylint: disable=protected-access
+      self.assertEqual(x.sharding.memory_kind, "pinned_host")
+
+  def test_forced_save_keeps_base(self):
+    # The smallest number of checkpoints to keep with a full checkpoint every 2 checkpoints.
+    directory = tempfile.mkdtemp()
+    manager = checkpointing.create_orbax_checkpoint_manager(
+        directory,
+        enable_checkpointing=True,
+        use_async=False,
+        save_interval_steps=2,
+        max_num_checkpoints_to_keep=3,
+        delta_checkpoint_base_period=4,
+    )
+    for step in range(8):
+      # Step 7 is not a checkpoint step, saved as on completion.
+      checkpointing.save_checkpoint(manager, step, _state(step), force=step == 7)
+    manager.wait_until_finished()
+    self.assertEqual(manager.all_steps(), [4, 6, 7])
+
+    restored, _ = checkpointing.load_state_if_possible(manager, None, "", "", 1, jax.eval_shape(_state, 0))
+    jax.tree.map(np.testing.assert_array_equal, restored["items"], _state(7))
+
+
+class HostSnapshotCheckpointTest(unittest.TestCase):
+  """Saves host snapshots of states whose device buffers are donated right after the save."""
+
+  def test_snapshot_save_and_restore(self):
+    directory = tempfile.mkdtemp()
+    manager = checkpointing.create_orbax_checkpoint_manager(
+        directory,
+        enable_checkpointing=True,
+        use_async=True,
+        save_interval_steps=2,
+        dataset_type="grain",
+        enable_host_snapshot=True,
+    )
+    iterator = iter(grain.MapDataset.range(100).to_iter_dataset())
+    iterator_states = {}
+    for step in range(NUM_STEPS):
+      state = _state(step)
+      next(iterator)
+      args = ocp.args.Composite(
+          items=ocp.args.PyTreeSave(item=state), iter=checkpointing.GrainCheckpointSave(item=iterator)
+      )
+      if manager.save(step, args=args):
+        iterator_states[step] = iterator.get_state()
+      # As the next train step would, with the state donated and the iterator advanced.
+      jax.tree.map(lambda x: x.delete(), state)
+      next(iterator)
+    manager.wait_until_finished()
+    self.assertEqual(manager.all_steps(), list(range(0, NUM_STEPS, 2)))
+
+    abstract_state = jax.eval_shape(_state, 0)
+    for step in manager.all_steps():
+      with self.subTest(step=step):
+        restored_iterator = iter(grain.MapDataset.range(100).to_iter_dataset())
+        restored = manager.restore(
+            step,
+            args=ocp.args.Composite(
+                items=ocp.args.PyTreeRestore(item=abstract_state),
+                iter=checkpointing.GrainCheckpointRestore(restored_iterator),
+            ),
+        )
+        jax.tree.map(np.testing.assert_array_equal, restored["items"], _state(step))
+        self.assertEqual(restored_iterator.get_state(), iterator_states[step])
+    manager.close()
+
+  def test_failed_snapshot_frees_its_slot(self):
+    manager = checkpointing.create_orbax_checkpoint_manager(
+        tempfile.mkdtemp(),
+        enable_checkpointing=True,
+        use_async=True,
+        save_interval_steps=1,
+        enable_host_snapshot=True,
+    )
+    for step in range(2):
+      state = _state(step)
+      jax.tree.map(lambda x: x.delete(), state)
+      with self.assertRaises(RuntimeError):
+        manager.save(step, args=ocp.args.Composite(items=ocp.args.PyTreeSave(item=state)))
+    # Both snapshot slots are free again, so that later saves do not block.
+    for _ in range(2):
+      self.assertTrue(manager._free_snapshots.acquire(blocking=False))  # pylint: disable=protected-access
+    manager.close()
+
+
+if __name__ == "__main__":
+  unittest.main()
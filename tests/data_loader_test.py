@@ -16,9 +16,12 @@
 
 import unittest
 import os.path
+import tempfile
 import numpy as np
 
+import grain
 import jax
+from etils import epath
 
 from unittest.mock import MagicMock
 from jax.sharding import Mesh
@@ -26,6 +29,7 @@ from jax.sharding import Mesh
 from MaxText.data_loader import DataLoader, RampUpDataLoader
 from MaxText.rampup_batch import RampupBatchManager
 from MaxText.maxtext_utils import create_device_mesh
+from MaxText import checkpointing
 from MaxText import exceptions
 from MaxText import pyconfig
 from MaxText.globals import MAXTEXT_PKG_DIR
@@ -46,6 +50,7 @@ class DataLoaderTest(unittest.TestCase):
         # global_rampup_samples: (rampup increment number) * (Samples for initial 5 steps)
         global_rampup_samples=3 * (1 * jax.device_count() * 5),
     )
+    self.config_prefetch = self.get_test_config(reuse_example_batch=False, per_device_batch_size=1, data_prefetch_depth=2)
     self.mesh = Mesh(create_device_mesh(self.config), self.config.mesh_axes)
     self.mock_data_iterator = MagicMock()
 
@@ -127,6 +132,80 @@ class DataLoaderTest(unittest.TestCase):
       _ = data_loader.load_next_batch()
     self.assertTrue(str(e.exception).startswith("You may have run out of training data."))
 
+  def test_prefetch_keeps_batch_order(self):
+    expected_shape = [jax.device_count(), self.config.max_target_length]
+    expected_batches = [{"inputs": np.full(expected_shape, i, dtype=int)} for i in range(4)]
+    self.mock_data_iterator.__next__.side_effect = expected_batches
+
+    data_loader = DataLoader(self.config_prefetch, self.mesh, self.mock_data_iterator, None)
+    for expected_batch in expected_batches:
+      batch = data_loader.load_next_batch()
+      self.assertTrue((batch["inputs"] == expected_batch["inputs"]).all())
+    metrics = data_loader.get_metrics()
+    self.assertIn("perf/data_prefetch_queue_depth", metrics)
+    self.assertGreaterEqual(metrics["perf/data_wait_time_seconds"], 0.0)
+
+    with self.assertRaises(exceptions.StopTraining) as e:
+      data_loader.load_next_batch()
+    self.assertTrue(str(e.exception).startswith("You may have run out of training data."))
+    data_loader.close()
+
+  def test_prefetch_checkpoints_state_of_consumed_batch(self):
+    """The saved iterator state must not include batches still in the prefetch queue."""
+    expected_shape = [jax.device_count(), self.config.max_target_length]
+
+    class CountingIterator:
+      """A checkpointable iterator whose state is the number of batches read."""
+
+      def __init__(self):
+        self.count = 0
+
+      def __next__(self):
+        self.count += 1
+        return {"inputs": np.full(expected_shape, self.count, dtype=int)}
+
+      def get_state(self):
+        return {"count": self.count}
+
+      def set_state(self, state):
+        self.count = state["count"]
+
+    data_iterator = MagicMock()
+    data_iterator.local_iterator = CountingIterator()
+    data_iterator.__next__.side_effect = lambda: next(data_iterator.local_iterator)
+
+    data_loader = DataLoader(self.config_prefetch, self.mesh, data_iterator, None)
+    batch = data_loader.load_next_batch()
+    self.assertTrue((batch["inputs"] == 1).all())
+    self.assertEqual(data_iterator.local_iterator.get_state(), {"count": 1})
+    batch = data_loader.load_next_batch()
+    self.assertTrue((batch["inputs"] == 2).all())
+    self.assertEqual(data_iterator.local_iterator.get_state(), {"count": 2})
+    data_loader.close()
+
+  def test_prefetch_checkpoints_through_grain_handler(self):
+    """A Grain iterator read ahead of by the prefetcher saves and restores through the checkpoint handler."""
+    expected_shape = [jax.device_count(), self.config.max_target_length]
+
+    def make_iterator():
+      dataset = grain.MapDataset.range(100).map(lambda i: {"inputs": np.full(expected_shape, i, dtype=int)})
+      return iter(dataset.to_iter_dataset())
+
+    data_iterator = MagicMock()
+    data_iterator.local_iterator = make_iterator()
+    data_iterator.__next__.side_effect = lambda: next(data_iterator.local_iterator)
+    data_loader = DataLoader(self.config_prefetch, self.mesh, data_iterator, None)
+    for _ in range(2):
+      data_loader.load_next_batch()
+    directory = epath.Path(tempfile.mkdtemp())
+    handler = checkpointing.GrainCheckpointHandler()
+    handler.save(directory, args=checkpointing.GrainCheckpointSave(item=data_iterator.local_iterator))
+    data_loader.close()
+
+    restored_iterator = make_iterator()
+    handler.restore(directory, args=checkpointing.GrainCheckpointRestore(item=restored_iterator))
+    self.assertTrue((next(restored_iterator)["inputs"] == 2).all())
+
   def test_rampup_data_loader(self):
     """Tests that RampUpLoader correctly slices and increment."""
     # Mock iterator returns a FULL batch (size 4)
@@ -185,6 +264,31 @@ class DataLoaderTest(unittest.TestCase):
       )
       self.assertTrue((batch["inputs"] == 1).all())
 
+  def test_rampup_data_loader_with_prefetch(self):
+    """Prefetching must not change the batches of the ramp-up phase."""
+
+    def load_batches(data_prefetch_depth):
+      config = self.get_test_config(
+          reuse_example_batch=False,
+          per_device_batch_size=4.0,
+          enable_rampup_batch_size=True,
+          per_device_batch_size_start=1.0,
+          per_device_batch_size_increment=1.0,
+          global_rampup_samples=3 * (1 * jax.device_count() * 5),
+          data_prefetch_depth=data_prefetch_depth,
+      )
+      full_shape = [int(config.per_device_batch_size * config.num_target_devices), config.max_target_length]
+      data_iterator = MagicMock()
+      data_iterator.__next__.side_effect = [{"inputs": np.full(full_shape, i, dtype=int)} for i in range(8)]
+      rampup_manager = RampupBatchManager(config, -1)
+      data_loader = RampUpDataLoader(config, self.mesh, data_iterator, None)
+      batches = [np.asarray(data_loader.load_next_batch(rampup_manager=rampup_manager)["inputs"]) for _ in range(12)]
+      data_loader.close()
+      return batches
+
+    for batch, prefetched_batch in zip(load_batches(0), load_batches(2)):
+      np.testing.assert_array_equal(prefetched_batch, batch)
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,89 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the NumPy first-fit packing transform of the Grain pipeline."""
+
+import unittest
+
+import grain.python as grain
+import numpy as np
+
+from MaxText.input_pipeline._grain_packing import NumpyFirstFitPackIterDataset
+
+MAX_LENGTH = 16
+NUM_BINS = 4
+
+
+def _dataset(num_examples=200, seed=0):
+  rng = np.random.default_rng(seed)
+  examples = []
+  for i in range(num_examples):
+    tokens = rng.integers(1, 1000, size=rng.integers(1, MAX_LENGTH + 1), dtype=np.int32)
+    examples.append({"inputs": tokens, "targets": tokens, "id": i})
+  return grain.MapDataset.source(examples).to_iter_dataset()
+
+
+def _pack(cls, dataset, **kwargs):
+  return cls(
+      dataset,
+      length_struct={"inputs": MAX_LENGTH, "targets": MAX_LENGTH},
+      num_packing_bins=NUM_BINS,
+      **kwargs,
+  )
+
+
+def _assert_same_elements(test, actual, expected):
+  test.assertEqual(len(actual), len(expected))
+  for a, e in zip(actual, expected):
+    test.assertEqual(sorted(a), sorted(e))
+    for key in e:
+      np.testing.assert_array_equal(a[key], e[key], err_msg=key)
+      test.assertEqual(a[key].dtype, e[key].dtype, key)
+
+
+class NumpyFirstFitPackIterDatasetTest(unittest.TestCase):
+  """Compares the packer with Grain's first-fit packing and checks its checkpointing."""
+
+  def test_matches_grain_first_fit(self):
+    for kwargs in ({}, {"shuffle_bins": False}, {"max_sequences_per_bin": 2}, {"seed": 3}):
+      with self.subTest(**kwargs):
+        expected = list(_pack(grain.experimental.FirstFitPackIterDataset, _dataset(), **kwargs))
+        actual = list(_pack(NumpyFirstFitPackIterDataset, _dataset(), **kwargs))
+        _assert_same_elements(self, actual, expected)
+
+  def test_max_sequences_per_bin(self):
+    for element in _pack(NumpyFirstFitPackIterDataset, _dataset(), max_sequences_per_bin=2):
+      self.assertLessEqual(element["inputs_segment_ids"].max(), 2)
+
+  def test_checkpoint_restore(self):
+    expected = list(_pack(NumpyFirstFitPackIterDataset, _dataset()))
+    for num_consumed in (0, 1, 3, NUM_BINS, 10, len(expected) - 1):
+      with self.subTest(num_consumed=num_consumed):
+        it = iter(_pack(NumpyFirstFitPackIterDataset, _dataset()))
+        for _ in range(num_consumed):
+          next(it)
+        state = it.get_state()
+        restored = iter(_pack(NumpyFirstFitPackIterDataset, _dataset()))
+        restored.set_state(state)
+        _assert_same_elements(self, list(restored), expected[num_consumed:])
+
+  def test_too_long_example_raises(self):
+    dataset = grain.MapDataset.source([{"inputs": np.ones(MAX_LENGTH + 1, np.int32)}]).to_iter_dataset()
+    packed = NumpyFirstFitPackIterDataset(dataset, length_struct={"inputs": MAX_LENGTH}, num_packing_bins=NUM_BINS)
+    with self.assertRaisesRegex(ValueError, "truncated"):
+      next(iter(packed))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,156 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the lazy loading of HF checkpoints of to_maxtext.py, on a synthetic safetensors checkpoint."""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from functools import partial
+from types import SimpleNamespace
+from unittest import mock
+
+import jax
+import ml_dtypes
+import numpy as np
+from orbax.checkpoint import type_handlers
+from safetensors.numpy import save_file
+
+from MaxText import checkpointing
+from MaxText import max_logging
+from MaxText.utils.ckpt_conversion import to_maxtext
+
+NUM_LAYERS = 6
+EMBED_DIM = 256
+MLP_DIM = 512
+
+
+def _hf_key(layer, name):
+  return f"model.layers.{layer}.mlp.{name}.weight"
+
+
+def _write_checkpoint(directory):
+  """Writes the layers of a synthetic HF model into two shards, and returns its tensors."""
+  rng = np.random.default_rng(0)
+  tensors = {}
+  weight_map = {}
+  for shard in range(2):
+    shard_name = f"model-0000{shard + 1}-of-00002.safetensors"
+    shard_tensors = {}
+    for layer in range(shard * NUM_LAYERS // 2, (shard + 1) * NUM_LAYERS // 2):
+      shard_tensors[_hf_key(layer, "up_proj")] = rng.standard_normal((MLP_DIM, EMBED_DIM)).astype(ml_dtypes.bfloat16)
+      shard_tensors[_hf_key(layer, "down_proj")] = rng.standard_normal((EMBED_DIM, MLP_DIM)).astype(np.float32)
+    save_file(shard_tensors, os.path.join(directory, shard_name))
+    tensors.update(shard_tensors)
+    weight_map.update({key: shard_name for key in shard_tensors})
+  with open(os.path.join(directory, "model.safetensors.index.json"), "w", encoding="utf-8") as f:
+    json.dump({"metadata": {}, "weight_map": weight_map}, f)
+  return tensors
+
+
+def _transpose(x, target_shape):
+  del target_shape
+  return x.T
+
+
+class LazyHFLoaderTest(unittest.TestCase):
+  """Converts the weights of a synthetic HF checkpoint from its memory-mapped shards."""
+
+  def setUp(self):
+    super().setUp()
+    self.directory = tempfile.mkdtemp()
+    self.tensors = _write_checkpoint(self.directory)
+    self.loader = to_maxtext.LazyHFLoader(self.directory, token=None)
+    self.config = SimpleNamespace(scan_layers=True, param_scan_axis=1)
+
+  def test_get_tensor(self):
+    for key, tensor in self.tensors.items():
+      loaded = self.loader.get_tensor(key)
+      self.assertEqual(loaded.dtype, tensor.dtype)
+      np.testing.assert_array_equal(loaded, tensor)
+    self.assertEqual(self.loader.get_shard_name(_hf_key(NUM_LAYERS - 1, "up_proj")), "model-00002-of-00002.safetensors")
+
+  def test_stacked_tensors(self):
+    keys = [_hf_key(layer, "up_proj") for layer in range(NUM_LAYERS)]
+    stacked = to_maxtext._build_single_axis_stacked_tensor(  # pylint: disable=protected-access
+        keys, self.loader.get_tensor, _transpose, (EMBED_DIM, NUM_LAYERS, MLP_DIM), self.config
+    )
+    np.testing.assert_array_equal(stacked, np.stack([self.tensors[k].T for k in keys], axis=1))
+
+    expert_keys = [keys[:3], keys[3:]]
+    stacked = to_maxtext._build_multi_axis_stacked_tensor(  # pylint: disable=protected-access
+        expert_keys, self.loader.get_tensor, _transpose, (2, 3, EMBED_DIM, MLP_DIM), self.config
+    )
+    expected = np.stack([np.stack([self.tensors[k].T for k in layer_keys]) for layer_keys in expert_keys])
+    np.testing.assert_array_equal(stacked, expected)
+
+  def test_save_lazy_tensors(self):
+    # A budget of one stacked tensor, so that the workers wait for the writes of the previous tensors.
+    ram_budget_bytes = NUM_LAYERS * EMBED_DIM * MLP_DIM * 4
+    type_handlers.register_type_handler(
+        to_maxtext.LazyTensor,
+        to_maxtext.LazyTensorHandler(num_workers=4, ram_budget_bytes=ram_budget_bytes),
+        override=True,
+    )
+    self.addCleanup(
+        type_handlers.register_type_handler, to_maxtext.LazyTensor, to_maxtext.LazyTensorHandler(), override=True
+    )
+
+    params, expected = {}, {}
+    for name in ("up_proj", "down_proj"):
+      keys = [_hf_key(layer, name) for layer in range(NUM_LAYERS)]
+      expected[name] = np.stack([self.tensors[k].T.astype(np.float32) for k in keys], axis=1)
+      load_fn = partial(
+          to_maxtext._build_single_axis_stacked_tensor,  # pylint: disable=protected-access
+          keys,
+          self.loader.get_tensor,
+          _transpose,
+          expected[name].shape,
+          self.config,
+      )
+      params[name] = to_maxtext.LazyTensor(
+          load_fn, expected[name].shape, np.float32, name=name, shard=self.loader.get_shard_name(keys[0])
+      )
+      # One single-layer tensor per layer as well.
+      for layer, key in enumerate(keys):
+        params[f"{name}_{layer}"] = to_maxtext.LazyTensor(
+            partial(self.loader.get_tensor, key), self.tensors[key].shape, self.tensors[key].dtype, name=key
+        )
+        expected[f"{name}_{layer}"] = self.tensors[key]
+
+    output_directory = tempfile.mkdtemp()
+    manager = checkpointing.create_orbax_checkpoint_manager(
+        output_directory, enable_checkpointing=True, use_async=False, save_interval_steps=1
+    )
+    start = time.time()
+    with mock.patch.object(to_maxtext, "SafetensorsShard", wraps=to_maxtext.SafetensorsShard) as shard_cls:
+      checkpointing.save_checkpoint(manager, 0, params)
+      manager.wait_until_finished()
+    # All the tensors share the mapped shards of the loader.
+    self.assertEqual(shard_cls.call_count, 2)
+    converted_bytes = sum(param.nbytes for param in params.values())
+    max_logging.log(f"Conversion throughput: {converted_bytes / 1e9 / (time.time() - start):.2f} GB/s")
+
+    sharding = jax.sharding.SingleDeviceSharding(jax.devices()[0])
+    abstract_params = {
+        name: jax.ShapeDtypeStruct(param.shape, param.dtype, sharding=sharding) for name, param in params.items()
+    }
+    restored, _ = checkpointing.load_state_if_possible(manager, None, "", "", 1, abstract_params)
+    jax.tree.map(np.testing.assert_array_equal, restored["items"], expected)
+
+
+if __name__ == "__main__":
+  unittest.main()
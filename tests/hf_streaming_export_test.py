@@ -0,0 +1,202 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the streaming export of MaxText checkpoints to HuggingFace safetensors shards."""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import ml_dtypes
+import numpy as np
+import orbax.checkpoint as ocp
+import psutil
+from safetensors.numpy import load_file
+from transformers import LlamaConfig
+
+from MaxText.utils.ckpt_conversion.utils import utils
+
+NUM_LAYERS = 4
+EMBED_DIM = 64
+MLP_DIM = 128
+# Room for the weights of 3 layers of a shard.
+MAX_SHARD_SIZE = 3 * EMBED_DIM * MLP_DIM * 2
+
+
+def _transpose(x, target_shape):
+  del target_shape
+  return x.T
+
+
+class SafetensorsWriterTest(unittest.TestCase):
+  """Writes safetensors files one tensor at a time."""
+
+  def test_write(self):
+    tensors = {
+        "bf16": np.arange(12, dtype=np.float32).reshape(3, 4).astype(ml_dtypes.bfloat16),
+        "f32_transposed": np.arange(6, dtype=np.float32).reshape(2, 3).T,
+        "i32_scalar": np.array(7, dtype=np.int32),
+    }
+    path = os.path.join(tempfile.mkdtemp(), "model.safetensors")
+    writer = utils.SafetensorsWriter(path, tensors.keys(), metadata={"format": "pt"})
+    for key, tensor in tensors.items():
+      writer.write(key, tensor)
+    with self.assertRaises(ValueError):
+      writer.write("unknown", tensors["bf16"])
+    writer.close()
+
+    self.assertEqual(os.listdir(os.path.dirname(path)), ["model.safetensors"])
+    loaded = load_file(path)
+    self.assertEqual(loaded.keys(), tensors.keys())
+    for key, tensor in tensors.items():
+      self.assertEqual(loaded[key].dtype, tensor.dtype)
+      np.testing.assert_array_equal(loaded[key], tensor)
+
+  def test_shard_checkpoint(self):
+    weights = {f"w{i}": np.zeros((i + 1, 8), dtype=np.float32) for i in range(4)}
+    shards, index = utils.shard_checkpoint(weights, max_shard_size=3 * 8 * 4)
+    self.assertEqual(
+        {name: list(shard) for name, shard in shards.items()},
+        {
+            "model-00001-of-00003.safetensors": ["w0", "w1"],
+            "model-00002-of-00003.safetensors": ["w2"],
+            "model-00003-of-00003.safetensors": ["w3"],
+        },
+    )
+    self.assertEqual(index["metadata"]["total_size"], 10 * 8 * 4)
+    shards, index = utils.shard_checkpoint(weights)
+    self.assertEqual(list(shards), ["model.safetensors"])
+    self.assertIsNone(index)
+
+
+class StreamingExportTest(unittest.TestCase):
+  """Exports a scanned Linen checkpoint one parameter at a time."""
+
+  def setUp(self):
+    super().setUp()
+    rng = np.random.default_rng(0)
+    self.params = {
+        "decoder": {
+            "layers": {"mlp": {"wi": rng.standard_normal((EMBED_DIM, NUM_LAYERS, MLP_DIM)).astype(ml_dtypes.bfloat16)}},
+            "decoder_norm": {"scale": rng.standard_normal((EMBED_DIM,)).astype(np.float32)},
+        },
+    }
+    checkpoint_path = os.path.join(tempfile.mkdtemp(), "items")
+    ocp.Checkpointer(ocp.PyTreeCheckpointHandler()).save(checkpoint_path, {"params": {"params": self.params}})
+    self.config = SimpleNamespace(
+        load_parameters_path=checkpoint_path,
+        checkpoint_storage_concurrent_gb=1,
+        checkpoint_storage_use_ocdbt=True,
+        checkpoint_storage_use_zarr3=True,
+        scan_layers=True,
+        param_scan_axis=1,
+    )
+    self.param_map = {
+        "params-decoder-layers-mlp-wi": [f"model.layers.{i}.mlp.up_proj.weight" for i in range(NUM_LAYERS)],
+        "params-decoder-decoder_norm-scale": "model.norm.weight",
+    }
+    self.hook_fn_map = {"params-decoder-layers-mlp-wi": _transpose}
+    self.shape_map = {f"model.layers.{i}.mlp.up_proj.weight": [MLP_DIM, EMBED_DIM] for i in range(NUM_LAYERS)}
+    self.shape_map["model.norm.weight"] = [EMBED_DIM]
+
+  def test_restore_one_param(self):
+    reader = utils.OrbaxParamReader(self.config)
+    self.assertEqual(set(reader.param_metadata), set(self.param_map))
+    scale = reader.restore(["params-decoder-decoder_norm-scale"])[0]
+    np.testing.assert_array_equal(scale, self.params["decoder"]["decoder_norm"]["scale"])
+
+  def test_streaming_export(self):
+    reader = utils.OrbaxParamReader(self.config)
+    keys = list(self.param_map)
+    output_dir = tempfile.mkdtemp()
+
+    def _weights():
+      for key in keys:
+        if key == "params-decoder-decoder_norm-scale":
+          # The first shard, with the first 3 layers, is written before the next parameter is restored.
+          self.assertTrue(os.path.exists(os.path.join(output_dir, "model-00001-of-00002.safetensors")))
+        weight = reader.restore([key])[0]
+        yield from utils.process_maxtext_param(key, weight, self.param_map, self.hook_fn_map, self.shape_map, self.config)
+
+    utils.save_model_files_streaming(
+        weight_sizes=utils.get_hf_weight_sizes(keys, self.param_map, self.shape_map, reader.param_metadata),
+        weights=_weights(),
+        config=LlamaConfig(),
+        tokenizer=None,
+        processor=None,
+        output_dir=output_dir,
+        max_shard_size=MAX_SHARD_SIZE,
+    )
+
+    with open(os.path.join(output_dir, utils.SAFE_TENSORS_INDEX_FILE), encoding="utf-8") as f:
+      index = json.load(f)
+    shard_names = sorted(set(index["weight_map"].values()))
+    self.assertEqual(shard_names, ["model-00001-of-00002.safetensors", "model-00002-of-00002.safetensors"])
+    self.assertFalse([f for f in os.listdir(output_dir) if f.endswith(".tmp")])
+
+    exported = {}
+    for shard_name in shard_names:
+      exported.update(load_file(os.path.join(output_dir, shard_name)))
+    self.assertEqual(exported.keys(), index["weight_map"].keys())
+    self.assertEqual(index["metadata"]["total_size"], sum(weight.nbytes for weight in exported.values()))
+    wi = self.params["decoder"]["layers"]["mlp"]["wi"]
+    for i in range(NUM_LAYERS):
+      np.testing.assert_array_equal(exported[f"model.layers.{i}.mlp.up_proj.weight"], wi[:, i, :].T)
+    np.testing.assert_array_equal(exported["model.norm.weight"], self.params["decoder"]["decoder_norm"]["scale"])
+
+  def test_streaming_export_memory(self):
+    num_weights, weight_shape = 16, (1024, 4096)
+    weight_bytes = 1024 * 4096 * 4
+    keys = [f"model.layers.{i}.mlp.up_proj.weight" for i in range(num_weights)]
+    output_dir = tempfile.mkdtemp()
+
+    process = psutil.Process()
+    base_rss = process.memory_info().rss
+    peak_rss = base_rss
+    done = threading.Event()
+
+    def _sample_rss():
+      nonlocal peak_rss
+      while not done.is_set():
+        peak_rss = max(peak_rss, process.memory_info().rss)
+        time.sleep(0.001)
+
+    sampler = threading.Thread(target=_sample_rss)
+    sampler.start()
+    try:
+      utils.save_model_files_streaming(
+          weight_sizes=[(key, weight_bytes) for key in keys],
+          weights=((key, np.full(weight_shape, i, dtype=np.float32)) for i, key in enumerate(keys)),
+          config=LlamaConfig(),
+          tokenizer=None,
+          processor=None,
+          output_dir=output_dir,
+          max_shard_size=4 * weight_bytes,
+      )
+    finally:
+      done.set()
+      sampler.join()
+
+    # 256 MB of weights are exported, with only about one of them in memory at a time.
+    self.assertLess(peak_rss - base_rss, 4 * weight_bytes)
+    exported = load_file(os.path.join(output_dir, "model-00004-of-00004.safetensors"))
+    np.testing.assert_array_equal(exported[keys[-1]], np.full(weight_shape, num_weights - 1, dtype=np.float32))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -31,7 +31,7 @@ import numpy as np
 from MaxText.globals import MAXTEXT_PKG_DIR
 from MaxText import max_logging
 from MaxText import pyconfig
-from MaxText.inference.offline_engine import OfflineEngine, InputData, CompletionOutput
+from MaxText.inference.offline_engine import OfflineEngine, InputData, CompletionOutput, SchedulingPolicy
 
 
 def get_metrics(results: list[CompletionOutput], start_time, end_time):
@@ -138,7 +138,35 @@ def run(
     max_logging.log(f"Tokens per second: {tokens / (end_time - start_time)}")
 
 
+def run_scheduling_policies():
+  """Compare prefill packing efficiency and throughput of the scheduling policies on mixed length prompts."""
+  mixed_input_data = [
+      InputData(id=i, tokens=np.arange(1, length + 1), true_length=length)
+      for i, length in enumerate(
+          random.randint(1, config.max_prefill_predict_length) for _ in range(config.global_batch_size_to_train_on)
+      )
+  ]
+  inference_engine = OfflineEngine(
+      config,
+      params=None,
+      enable_batch_prefill=True,
+      rng=jax.random.PRNGKey(0),
+      eos_ids=[1002],
+      debug=False,
+  )
+  for policy in SchedulingPolicy:
+    inference_engine.update_scheduler(policy)
+    _ = [inference_engine.batch_inference(mixed_input_data) for _ in range(2)]
+    start_time = time.time()
+    results = inference_engine.batch_inference(mixed_input_data)
+    end_time = time.time()
+    max_logging.log(f"Scheduling policy {policy.value}: {inference_engine.worker.prefill_helper.stats.summary()}")
+    max_logging.log(f"Scheduling policy {policy.value}: {inference_engine.worker.dispatch_stats.summary()}")
+    get_metrics(results, start_time, end_time)
+
+
 run(
     profile=True,
     profile_path=f"gs://runner-maxtext-logs/mohitkhatwani_offline_benchmark/app_2/0908/{time.strftime('%Y%m%d-%H%M%S')}/",
 )
+run_scheduling_policies()
@@ -0,0 +1,108 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-benchmark of the PageManager allocators, sweeping `pagedattn_num_pages`.
+
+Compares the scanning allocator against the free-list allocator
+(`pagedattn_free_list_allocator=True`) for prefill reservation, decode-step
+allocation and release.
+
+Command: python tests/inference/benchmark_page_manager.py
+"""
+
+import os
+import sys
+import time
+from typing import Sequence
+
+from absl import app
+
+import jax
+
+from MaxText import max_logging
+from MaxText import pyconfig
+from MaxText.globals import MAXTEXT_PKG_DIR
+from MaxText.inference.page_manager import PageManager
+
+NUM_PAGES_SWEEP = (1024, 4096, 16384, 65536)
+TOKENS_PER_PAGE = 16
+MAX_TARGET_LENGTH = 1024
+PREFILL_LENGTH = 512
+NUM_DECODE_STEPS = 64
+NUM_ITERS = 3
+
+
+def init_page_manager(num_pages: int, use_free_list: bool) -> PageManager:
+  """Build a PageManager for the given pool size and allocator."""
+  config = pyconfig.initialize(
+      [sys.argv[0], os.path.join(MAXTEXT_PKG_DIR, "configs", "base.yml")],
+      run_name="benchmark_page_manager",
+      per_device_batch_size=1,
+      enable_checkpointing=False,
+      log_config=False,
+      max_prefill_predict_length=PREFILL_LENGTH,
+      max_target_length=MAX_TARGET_LENGTH,
+      pagedattn_num_pages=num_pages,
+      pagedattn_tokens_per_page=TOKENS_PER_PAGE,
+      pagedattn_max_pages_per_group=(MAX_TARGET_LENGTH + TOKENS_PER_PAGE - 1) // TOKENS_PER_PAGE,
+      pagedattn_free_list_allocator=use_free_list,
+  )
+  return PageManager(config)
+
+
+def run_cycle(pm: PageManager):
+  """Prefill every page group, run decode steps, then release every group."""
+  state = pm.get_initial_page_state()
+
+  start = time.perf_counter()
+  for group_id in range(pm.max_page_groups):
+    state = pm.update_prefill_pages(state, group_id, PREFILL_LENGTH)
+  jax.block_until_ready(state)
+  prefill_time = time.perf_counter() - start
+
+  start = time.perf_counter()
+  for _ in range(NUM_DECODE_STEPS):
+    state = pm.update_decode_pages(state)
+  jax.block_until_ready(state)
+  decode_time = time.perf_counter() - start
+
+  start = time.perf_counter()
+  for group_id in range(pm.max_page_groups):
+    state = pm.release_pages(state, group_id)
+  jax.block_until_ready(state)
+  release_time = time.perf_counter() - start
+
+  return prefill_time, decode_time, release_time
+
+
+def main(argv: Sequence[str]) -> None:
+  del argv
+  for num_pages in NUM_PAGES_SWEEP:
+    for use_free_list in (False, True):
+      pm = init_page_manager(num_pages, use_free_list)
+      run_cycle(pm)  # Warmup / compile.
+      timings = [run_cycle(pm) for _ in range(NUM_ITERS)]
+      prefill_time, decode_time, release_time = (min(t) for t in zip(*timings))
+      allocator = "free_list" if use_free_list else "scan"
+      max_logging.log(
+          f"num_pages={num_pages} allocator={allocator} groups={pm.max_page_groups}: "
+          f"prefill {prefill_time / pm.max_page_groups * 1e3:.3f} ms/group, "
+          f"decode {decode_time / NUM_DECODE_STEPS * 1e3:.3f} ms/step, "
+          f"release {release_time / pm.max_page_groups * 1e3:.3f} ms/group"
+      )
+
+
+if __name__ == "__main__":
+  app.run(main)
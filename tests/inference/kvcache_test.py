@@ -19,7 +19,7 @@ import unittest
 import jax
 import jax.numpy as jnp
 
-from MaxText.common_types import MODEL_MODE_PREFILL, MODEL_MODE_AUTOREGRESSIVE
+from MaxText.common_types import AttentionType, MODEL_MODE_PREFILL, MODEL_MODE_AUTOREGRESSIVE
 from MaxText.inference import kvcache
 
 
@@ -147,3 +147,77 @@ class MlaKVCacheTest(unittest.TestCase):
     )
     self.assertEqual(ar_low_rank_main[0][0][0][0], low_rank_main_1[0][0][0])
     self.assertEqual(ar_key_rope[0][0][0][0], key_rope_1[0][0][0][0])
+
+
+class LocalWindowKVCacheTest(unittest.TestCase):
+  """Tests the window sized AR cache of local attention layers."""
+
+  prefill_len = 8
+  target_len = 32
+  prompt_len = 5
+  window = 4
+
+  def _positions_attended(self, attention_type, num_steps):
+    """Decodes `num_steps` tokens and returns the positions each one attends to.
+
+    The key of the token at position p is p, so the positions are read from the
+    keys of the returned caches that are not masked out by their segment ids.
+    """
+    cache = kvcache.KVCache(
+        max_prefill_length=self.prefill_len,
+        max_target_length=self.target_len,
+        batch=1,
+        key_seq_len=self.prefill_len,
+        value_seq_len=self.prefill_len,
+        key_heads=1,
+        value_heads=1,
+        key_head_size=1,
+        value_head_size=1,
+        dtype=jnp.float32,
+        model_mode=MODEL_MODE_PREFILL,
+        attention_type=attention_type,
+        local_window_size=self.window,
+    )
+    self.assertEqual(cache.cached_ar_key.value.shape[cache.ar_cache_axis_order.index(1)], self.window)
+
+    prompt = jnp.arange(self.prefill_len, dtype=jnp.float32).reshape(1, self.prefill_len, 1, 1)
+    segment_ids = (jnp.arange(self.prefill_len) < self.prompt_len).astype(jnp.int32)[None, :]
+    cache(prompt, prompt, segment_ids, MODEL_MODE_PREFILL)
+
+    attended = []
+    for step in range(num_steps):
+      token = jnp.full((1, 1, 1, 1), self.prompt_len + step, dtype=jnp.float32)
+      (prefill_key, _, prefill_segment_ids), (ar_key, _, ar_segment_ids, _) = cache(
+          token, token, None, MODEL_MODE_AUTOREGRESSIVE
+      )
+      keys = jnp.concatenate([prefill_key[0, :, 0, 0], ar_key[0, :, 0, 0]])
+      active = jnp.concatenate([prefill_segment_ids[0], ar_segment_ids[0]]) == 1
+      attended.append(sorted(int(k) for k in keys[active]))
+    return attended
+
+  def test_sliding_window(self):
+    for step, positions in enumerate(self._positions_attended(AttentionType.LOCAL_SLIDING, 10)):
+      query_position = self.prompt_len + step
+      self.assertEqual(positions, list(range(query_position - self.window + 1, query_position + 1)))
+
+  def test_chunk_attention(self):
+    for step, positions in enumerate(self._positions_attended(AttentionType.CHUNK, 10)):
+      query_position = self.prompt_len + step
+      chunk_start = query_position // self.window * self.window
+      self.assertEqual(positions, list(range(chunk_start, query_position + 1)))
+
+  def test_requires_local_attention(self):
+    with self.assertRaisesRegex(ValueError, "local_window_size"):
+      kvcache.KVCache(
+          max_prefill_length=self.prefill_len,
+          max_target_length=self.target_len,
+          batch=1,
+          key_seq_len=1,
+          value_seq_len=1,
+          key_heads=1,
+          value_heads=1,
+          key_head_size=1,
+          value_head_size=1,
+          dtype=jnp.float32,
+          local_window_size=self.window,
+      )
@@ -0,0 +1,96 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for batch prefill with the offline inference engine."""
+
+import os.path
+import sys
+import unittest
+
+import jax
+import numpy as np
+
+from MaxText import pyconfig
+from MaxText.globals import MAXTEXT_PKG_DIR
+from MaxText.inference.offline_engine import InputData, OfflineEngine
+
+
+class BatchPrefillTest(unittest.TestCase):
+  """Runs batch inference with packed prefills of a tiny random model.
+  Command: pytest tests/inference/offline_engine_batch_prefill_test.py
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    cls.config = pyconfig.initialize(
+        [sys.argv[0], os.path.join(MAXTEXT_PKG_DIR, "configs", "base.yml")],
+        run_name="offline_engine_batch_prefill_test",
+        per_device_batch_size=1,
+        max_prefill_predict_length=128,
+        max_target_length=136,
+        return_log_prob=True,
+        decode_sampling_strategy="greedy",
+        attention="dot_product",
+        base_emb_dim=128,
+        base_mlp_dim=256,
+        base_num_query_heads=4,
+        base_num_kv_heads=4,
+        head_dim=32,
+        base_num_decoder_layers=2,
+        scan_layers=False,
+        skip_jax_distributed_system=True,
+    )
+    cls.engine = OfflineEngine(
+        config=cls.config,
+        params=None,
+        enable_batch_prefill=True,
+        rng=jax.random.PRNGKey(0),
+        eos_ids=[],
+    )
+
+  def test_more_inputs_than_decode_slots(self):
+    # Short prompts are packed, so every decode slot can wait in a partly filled prefill bucket.
+    num_inputs = 3 * self.engine.worker.decode_batch_size
+    input_data = [InputData(id=f"input_{i}", tokens=np.arange(1, 11 + i), true_length=10 + i) for i in range(num_inputs)]
+    results = self.engine.batch_inference(input_data)
+
+    results = {result.index: result for result in results}
+    self.assertEqual(len(results), num_inputs)
+    for row in input_data:
+      result = results[row.id]
+      self.assertEqual(result.prompt_length, row.true_length)
+      np.testing.assert_array_equal(result.token_ids[: row.true_length], row.tokens)
+
+  def test_packed_prefill_matches_single_prefill(self):
+    input_data = [InputData(id=f"input_{i}", tokens=np.arange(1, 11 + i), true_length=10 + i) for i in range(4)]
+    single_engine = OfflineEngine(
+        config=self.config,
+        params=None,
+        enable_batch_prefill=False,
+        rng=jax.random.PRNGKey(0),
+        eos_ids=[],
+    )
+    results = single_engine.batch_inference(input_data)
+    packed_results = self.engine.batch_inference(input_data)
+
+    for row, result, packed_result in zip(input_data, results, packed_results):
+      np.testing.assert_array_equal(packed_result.token_ids, result.token_ids)
+      # The log probability of the first generated token comes from the packed prefill.
+      np.testing.assert_allclose(packed_result.logprobs[row.true_length :], result.logprobs[row.true_length :], atol=1e-2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,72 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the on-device decode loop of the offline inference engine."""
+
+import os.path
+import sys
+import unittest
+
+import jax
+import numpy as np
+
+from MaxText import pyconfig
+from MaxText.globals import MAXTEXT_PKG_DIR
+from MaxText.inference.offline_engine import InputData, OfflineEngine
+
+
+class DecodeLoopTest(unittest.TestCase):
+  """Runs batch inference with a tiny random model.
+  Command: pytest tests/inference/offline_engine_decode_test.py
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    cls.config = pyconfig.initialize(
+        [sys.argv[0], os.path.join(MAXTEXT_PKG_DIR, "configs", "base.yml")],
+        run_name="offline_engine_decode_test",
+        per_device_batch_size=1,
+        max_prefill_predict_length=64,
+        max_target_length=72,
+        return_log_prob=True,
+        attention="dot_product",
+        base_emb_dim=128,
+        base_mlp_dim=256,
+        base_num_query_heads=4,
+        base_num_kv_heads=4,
+        head_dim=32,
+        base_num_decoder_layers=2,
+        scan_layers=False,
+        skip_jax_distributed_system=True,
+    )
+
+  def test_deprecated_min_decode_steps(self):
+    engine = OfflineEngine(config=self.config, params=None, min_decode_steps=3, rng=jax.random.PRNGKey(0), eos_ids=[])
+    self.assertEqual(engine.max_decode_steps_per_loop, 3)
+    self.assertEqual(engine.worker.max_decode_steps_per_loop, 3)
+
+    input_data = [InputData(id=f"input_{i}", tokens=np.arange(1, 11 + i), true_length=10 + i) for i in range(2)]
+    results = engine.batch_inference(input_data)
+    # Runs to the maximum length with no EOS.
+    max_decode_length = self.config.max_target_length - self.config.max_prefill_predict_length
+    for result in results:
+      self.assertEqual(len(result.token_ids), result.prompt_length + max_decode_length)
+
+    with self.assertRaises(TypeError):
+      OfflineEngine(config=self.config, min_decode_steps=3, max_decode_steps_per_loop=3)
+
+
+if __name__ == "__main__":
+  unittest.main()
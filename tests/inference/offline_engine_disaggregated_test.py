@@ -0,0 +1,99 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for disaggregated prefill with the offline inference engine."""
+
+import os.path
+import sys
+import unittest
+
+import jax
+import numpy as np
+
+from MaxText import pyconfig
+from MaxText.globals import MAXTEXT_PKG_DIR
+from MaxText.inference.offline_engine import InputData, OfflineEngine, _config_for_num_devices
+
+
+class DisaggregatedPrefillTest(unittest.TestCase):
+  """Runs prefill and decode on separate device pools with a tiny random model.
+  Command: pytest tests/inference/offline_engine_disaggregated_test.py
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    cls.config = pyconfig.initialize(
+        [sys.argv[0], os.path.join(MAXTEXT_PKG_DIR, "configs", "base.yml")],
+        run_name="offline_engine_disaggregated_test",
+        per_device_batch_size=2,
+        max_prefill_predict_length=128,
+        max_target_length=136,
+        return_log_prob=True,
+        attention="dot_product",
+        base_emb_dim=128,
+        base_mlp_dim=256,
+        base_num_query_heads=4,
+        base_num_kv_heads=4,
+        head_dim=32,
+        base_num_decoder_layers=2,
+        scan_layers=False,
+        skip_jax_distributed_system=True,
+    )
+
+  def test_config_for_num_devices(self):
+    config = _config_for_num_devices(self.config, 3)
+    self.assertEqual(config.num_target_devices, 3)
+    # All batch sizes are computed again for the devices, not only those of the KV cache.
+    self.assertEqual(config.micro_batch_size_to_train_on, 6)
+    self.assertEqual(config.global_batch_size_to_train_on, 6)
+    self.assertEqual(config.global_batch_size_to_load, 6)
+    self.assertEqual(config.per_device_batch_size, self.config.per_device_batch_size)
+    self.assertEqual(self.config.num_target_devices, jax.device_count())
+
+  def test_disaggregated_prefill(self):
+    if jax.device_count() < 2:
+      self.skipTest("Needs 2 devices, e.g. XLA_FLAGS=--xla_force_host_platform_device_count=4 on CPU.")
+    num_prefill_devices = jax.device_count() // 2
+    input_lengths = [100, 20, 70, 40, 60]
+    input_data = [
+        InputData(id=f"input_{i}", tokens=np.arange(1, length + 1), true_length=length)
+        for i, length in enumerate(input_lengths)
+    ]
+    inference_engine = OfflineEngine(
+        config=self.config,
+        params=None,
+        rng=jax.random.PRNGKey(0),
+        eos_ids=[],
+        num_prefill_devices=num_prefill_devices,
+    )
+
+    results = inference_engine.batch_inference(input_data)
+
+    worker = inference_engine.worker
+    self.assertEqual(
+        worker.decode_batch_size, self.config.per_device_batch_size * (jax.device_count() - num_prefill_devices)
+    )
+    completion_length = self.config.max_target_length - self.config.max_prefill_predict_length
+    for result, length in zip(results, input_lengths):
+      np.testing.assert_array_equal(result.token_ids[:length], np.arange(1, length + 1))
+      self.assertEqual(result.token_ids.shape, (length + completion_length,))
+      self.assertEqual(result.logprobs.shape, (length + completion_length,))
+    for monitor in worker.pool_monitors.values():
+      self.assertTrue(0 < monitor.utilization <= 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
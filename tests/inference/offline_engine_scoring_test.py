@@ -0,0 +1,89 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for candidate next-token scoring with the offline inference engine."""
+
+import os.path
+import sys
+import unittest
+
+import jax
+import numpy as np
+
+from MaxText import pyconfig
+from MaxText.globals import MAXTEXT_PKG_DIR
+from MaxText.inference.offline_engine import InputData, OfflineEngine
+
+
+class ScoreNextTokensTest(unittest.TestCase):
+  """Scores candidate tokens with a tiny random model.
+  Command: pytest tests/inference/offline_engine_scoring_test.py
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    cls.config = pyconfig.initialize(
+        [sys.argv[0], os.path.join(MAXTEXT_PKG_DIR, "configs", "base.yml")],
+        run_name="offline_engine_scoring_test",
+        per_device_batch_size=1,
+        max_prefill_predict_length=128,
+        max_target_length=136,
+        return_log_prob=True,
+        attention="dot_product",
+        base_emb_dim=128,
+        base_mlp_dim=256,
+        base_num_query_heads=4,
+        base_num_kv_heads=4,
+        head_dim=32,
+        base_num_decoder_layers=2,
+        scan_layers=False,
+        skip_jax_distributed_system=True,
+    )
+    cls.candidates = [3, 7, 11]
+    cls.input_data = [
+        InputData(id=f"input_{i}", tokens=np.arange(1, length + 1), true_length=length)
+        for i, length in enumerate([20, 45, 70, 100])
+    ]
+
+  def _score(self, enable_batch_prefill):
+    engine = OfflineEngine(
+        config=self.config,
+        params=None,
+        enable_batch_prefill=enable_batch_prefill,
+        rng=jax.random.PRNGKey(0),
+        eos_ids=[],
+    )
+    return engine, engine.score_next_tokens(self.input_data, self.candidates)
+
+  def test_single_scores_are_log_probabilities(self):
+    engine, scores = self._score(enable_batch_prefill=False)
+    for row in self.input_data:
+      self.assertEqual(scores[row.id].shape, (len(self.candidates),))
+      self.assertTrue(np.all(scores[row.id] <= 0))
+    # Later calls reuse the compiled prefill and must score the same.
+    rescored = engine.worker.score_next_tokens(self.input_data, self.candidates)
+    for row in self.input_data:
+      np.testing.assert_array_equal(rescored[row.id], scores[row.id])
+
+  def test_packed_scores_match_single_scores(self):
+    _, scores = self._score(enable_batch_prefill=False)
+    _, packed_scores = self._score(enable_batch_prefill=True)
+    for row in self.input_data:
+      # Packing several inputs into one prefill must not change their scores.
+      np.testing.assert_allclose(packed_scores[row.id], scores[row.id], atol=1e-2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -20,15 +20,24 @@ import unittest
 
 import jax
 import jax.numpy as jnp
+import numpy as np
 
 from MaxText import pyconfig
 from MaxText.globals import MAXTEXT_PKG_DIR
-from MaxText.inference.page_manager import PageManager, PageState
+from MaxText.inference.page_manager import (
+    FreeListPageState,
+    MemoryPressurePolicy,
+    PageManager,
+    PageState,
+    PreemptionMode,
+)
 
 
 class TestPageManager(unittest.TestCase):
   """Test page manager."""
 
+  use_free_list = False
+
   def setUp(self):
     super().setUp()
     self.num_pages = 128
@@ -37,7 +46,17 @@ class TestPageManager(unittest.TestCase):
     self.max_target_length = 256
     self.max_pages_per_group = (self.max_target_length + self.tokens_per_page - 1) // self.tokens_per_page
 
-    config = pyconfig.initialize(
+    config = self._config(free_list_allocator=self.use_free_list)
+    self.config = config
+    self.max_page_groups = self.config.global_batch_size_to_load
+
+    print("Note: Running PageManager tests locally without a JAX mesh.")
+
+    self.key = jax.random.PRNGKey(0)
+    self.pm = PageManager(config=self.config)
+
+  def _config(self, free_list_allocator):
+    return pyconfig.initialize(
         [sys.argv[0], os.path.join(MAXTEXT_PKG_DIR, "configs", "base.yml")],
         per_device_batch_size=1.0,
         run_name="test",
@@ -47,14 +66,12 @@ class TestPageManager(unittest.TestCase):
         pagedattn_num_pages=self.num_pages,
         pagedattn_tokens_per_page=self.tokens_per_page,
         pagedattn_max_pages_per_group=self.max_pages_per_group,
+        pagedattn_free_list_allocator=free_list_allocator,
     )
-    self.config = config
-    self.max_page_groups = self.config.global_batch_size_to_load
 
-    print("Note: Running PageManager tests locally without a JAX mesh.")
-
-    self.key = jax.random.PRNGKey(0)
-    self.pm = PageManager(config=self.config)
+  def _skip_if_fewer_page_groups(self, num_page_groups):
+    if self.max_page_groups < num_page_groups:
+      self.skipTest(f"Needs at least {num_page_groups} page groups, one per device with per_device_batch_size=1.")
 
   def _validate_state_shapes(self, state: PageState):
     """Helper function to assert that all PageState arrays have correct global shapes."""
@@ -171,6 +188,7 @@ class TestPageManager(unittest.TestCase):
 
   def test_reserve_prefill_edge_cases(self):
     """Tests update_prefill_pages with edge cases: exact page multiple, partial page (global state)."""
+    self._skip_if_fewer_page_groups(3)
     initial_state = self.pm.get_initial_page_state()
 
     # Test case 1: Exact page multiple - correct number of pages should be allocated.
@@ -192,6 +210,7 @@ class TestPageManager(unittest.TestCase):
 
   def test_release_pages(self):
     """Tests the release_pages method of PageManager (global state)."""
+    self._skip_if_fewer_page_groups(2)
     page_group_id = 1
     initial_length = 10
 
@@ -230,6 +249,7 @@ class TestPageManager(unittest.TestCase):
 
   def test_update_decode_pages(self):
     """Tests the update_decode_pages function (global state)."""
+    self._skip_if_fewer_page_groups(2)
     initial_state = self.pm.get_initial_page_state()
 
     # Test case 1: Decode step with no active groups - state should not change.
@@ -541,5 +561,202 @@ class TestPageManager(unittest.TestCase):
     )
 
 
+class TestFreeListPageManager(TestPageManager):
+  """Runs the page manager tests against the free-list allocator, and tests its free stack."""
+
+  use_free_list = True
+
+  def _assert_free_list_consistent(self, state: FreeListPageState):
+    """Checks that the free stack holds exactly the pages marked free in `page_status`."""
+    num_free = int(state.num_free_pages)
+    free_on_stack = sorted(int(p) for p in state.free_pages[:num_free])
+    free_in_status = [int(p) for p in jnp.where(state.page_status == 0)[0]]
+    self.assertEqual(free_on_stack, free_in_status, "Free stack and page_status disagree")
+
+  def test_reserve_prefill_no_space(self):
+    """Tests update_prefill_pages when the free stack is empty."""
+    page_group_id = 0
+    true_length = 12
+
+    initial_state = self.pm.get_initial_page_state()
+    initial_state = initial_state.replace(
+        page_status=jnp.ones((self.num_pages,), dtype=jnp.int32),
+        num_free_pages=jnp.array(0, dtype=jnp.int32),
+    )
+
+    updated_state = self.pm.update_prefill_pages(
+        page_state=initial_state, page_group_id=page_group_id, true_length=true_length
+    )
+
+    self.assertTrue(jnp.all(updated_state.page_status == 1))
+    self.assertEqual(int(updated_state.num_free_pages), 0)
+    self.assertEqual(int(updated_state.sequence_lengths[page_group_id]), 0)
+    self.assertEqual(int(updated_state.num_pages_used[page_group_id]), 0)
+    self.assertFalse(bool(updated_state.has_active_page[page_group_id]))
+
+  def test_matches_scanning_allocator(self):
+    """Checks that both allocators hand out the same pages for the same sequence of operations."""
+    scan_pm = PageManager(self._config(free_list_allocator=False))
+    scan_state = scan_pm.get_initial_page_state()
+    free_list_state = self.pm.get_initial_page_state()
+    num_test_groups = min(3, self.max_page_groups)
+
+    for page_group_id in range(num_test_groups):
+      length = self.tokens_per_page * (page_group_id + 1)
+      scan_state = scan_pm.update_prefill_pages(scan_state, page_group_id, length)
+      free_list_state = self.pm.update_prefill_pages(free_list_state, page_group_id, length)
+    for _ in range(2):
+      scan_state = scan_pm.update_decode_pages(scan_state)
+      free_list_state = self.pm.update_decode_pages(free_list_state)
+
+    for field in scan_state.__dataclass_fields__:
+      self.assertTrue(
+          jnp.array_equal(getattr(scan_state, field), getattr(free_list_state, field)), f"Field '{field}' mismatch."
+      )
+    self._assert_free_list_consistent(free_list_state)
+
+  def test_decode_allocation_with_few_free_pages(self):
+    """Tests that decode allocation serves groups in order when free pages run out."""
+    num_test_groups = min(3, self.max_page_groups)
+    if num_test_groups < 2:
+      self.skipTest("Needs at least two page groups.")
+
+    state = self.pm.get_initial_page_state()
+    for page_group_id in range(num_test_groups):
+      state = self.pm.update_prefill_pages(state, page_group_id, self.tokens_per_page)
+    # Leave a single free page for the decode step.
+    state = state.replace(num_free_pages=jnp.array(1, dtype=jnp.int32))
+    expected_page = int(state.free_pages[0])
+
+    state = self.pm.update_decode_pages(state)
+
+    self.assertEqual(int(state.num_free_pages), 0)
+    self.assertEqual(int(state.num_pages_used[0]), 2)
+    self.assertEqual(int(state.active_page[0]), expected_page)
+    for page_group_id in range(1, num_test_groups):
+      self.assertEqual(int(state.num_pages_used[page_group_id]), 1)
+      self.assertEqual(int(state.sequence_lengths[page_group_id]), self.tokens_per_page + 1)
+
+  def test_free_list_consistency(self):
+    """Checks the free stack after prefill, decode and release."""
+    state = self.pm.get_initial_page_state()
+    self.assertIsInstance(state, FreeListPageState)
+    self.assertEqual(int(state.num_free_pages), self.num_pages - 1)
+    self._assert_free_list_consistent(state)
+
+    state = self.pm.update_prefill_pages(state, 0, 3 * self.tokens_per_page)
+    self._assert_free_list_consistent(state)
+    state = self.pm.update_decode_pages(state)
+    self._assert_free_list_consistent(state)
+    state = self.pm.update_prefill_pages(state, 0, 5)
+    self._assert_free_list_consistent(state)
+    state = self.pm.release_pages(state, 0)
+    self._assert_free_list_consistent(state)
+    self.assertEqual(int(state.num_free_pages), self.num_pages - 1)
+
+
+class TestMemoryPressurePolicy(unittest.TestCase):
+  """Tests admission control, preemption and swapping of page groups."""
+
+  def setUp(self):
+    super().setUp()
+    self.num_pages = 16
+    self.tokens_per_page = 4
+    self.pm = PageManager(config=self._config(free_list_allocator=False))
+    # [num_kv_heads, num_pages, tokens_per_page, head_dim], every page filled with its index.
+    pages = jnp.broadcast_to(jnp.arange(self.num_pages, dtype=jnp.float32)[None, :, None, None], (2, 16, 4, 8))
+    self.kv_cache = {"decoder": {"layers_0": {"key_pages": pages, "value_pages": -pages}}}
+
+  def _config(self, free_list_allocator):
+    return pyconfig.initialize(
+        [sys.argv[0], os.path.join(MAXTEXT_PKG_DIR, "configs", "base.yml")],
+        per_device_batch_size=4.0,
+        run_name="test",
+        enable_checkpointing=False,
+        max_prefill_predict_length=16,
+        max_target_length=32,
+        pagedattn_num_pages=self.num_pages,
+        pagedattn_tokens_per_page=self.tokens_per_page,
+        pagedattn_max_pages_per_group=8,
+        pagedattn_free_list_allocator=free_list_allocator,
+    )
+
+  def _fill(self, policy, lengths_and_priorities):
+    """Prefills page groups 0, 1, ... with the given lengths and priorities."""
+    state = self.pm.get_initial_page_state()
+    for group, (length, priority) in enumerate(lengths_and_priorities):
+      state = self.pm.update_prefill_pages(state, group, length)
+      policy.set_priority(group, priority)
+    return state
+
+  def test_can_admit(self):
+    policy = MemoryPressurePolicy(self.pm)
+    # 15 free pages, page 0 is never used.
+    state = self._fill(policy, [(24, 0.0), (20, 0.0)])
+    self.assertEqual(policy.num_free_pages(state), 4)
+    self.assertTrue(policy.can_admit(state, 16))
+    self.assertFalse(policy.can_admit(state, 17))
+    # Prefilling group 1 again releases its pages first.
+    self.assertTrue(policy.can_admit(state, 32, page_group_id=1))
+
+  def test_can_admit_free_list(self):
+    self.pm = PageManager(config=self._config(free_list_allocator=True))
+    policy = MemoryPressurePolicy(self.pm)
+    state = self._fill(policy, [(24, 0.0), (20, 0.0)])
+    self.assertEqual(policy.num_free_pages(state), 4)
+    self.assertTrue(policy.can_admit(state, 32, page_group_id=1))
+    # The free pages are read from the counter of the free stack, not counted in `page_status`.
+    state = state.replace(num_free_pages=jnp.array(2, dtype=jnp.int32))
+    self.assertEqual(policy.num_free_pages(state), 2)
+    self.assertFalse(policy.can_admit(state, 16))
+
+  def test_make_room_preempts_lowest_priority(self):
+    policy = MemoryPressurePolicy(self.pm, PreemptionMode.RECOMPUTE)
+    state = self._fill(policy, [(16, 2.0), (8, 0.0), (16, 1.0), (12, 0.0)])
+    self.assertEqual(policy.num_free_pages(state), 2)
+
+    # Nothing has a lower priority than 0.
+    self.assertIsNone(policy.select_victims(state, 32, priority=0.0))
+    # Among equal priorities, the group holding more pages is preempted first.
+    self.assertEqual(policy.select_victims(state, 20, priority=1.0), [3])
+    state, preempted = policy.make_room(state, self.kv_cache, 32, priority=1.5)
+    self.assertEqual([record.page_group_id for record in preempted], [3, 1, 2])
+    self.assertEqual([record.sequence_length for record in preempted], [12, 8, 16])
+    self.assertTrue(all(record.host_pages is None for record in preempted))
+    self.assertTrue(policy.can_admit(state, 32))
+    self.assertFalse(bool(state.has_active_page[2]))
+    self.assertEqual(policy.priorities, {0: 2.0})
+    with self.assertRaisesRegex(ValueError, "prefilled again"):
+      policy.resume(state, self.kv_cache, preempted[0])
+
+    # Nothing is preempted if the request cannot fit.
+    state, preempted = policy.make_room(state, self.kv_cache, 64, priority=3.0)
+    self.assertEqual(preempted, [])
+    self.assertTrue(bool(state.has_active_page[0]))
+
+  def test_swap_out_and_resume(self):
+    policy = MemoryPressurePolicy(self.pm, PreemptionMode.SWAP)
+    state = self._fill(policy, [(32, 1.0), (12, 0.0)])
+    swapped_pages = np.asarray(state.page_map[1, :3])
+
+    state, [preempted] = policy.make_room(state, self.kv_cache, 20, priority=1.0, page_group_id=2)
+    self.assertEqual(preempted.page_group_id, 1)
+    np.testing.assert_array_equal(preempted.host_pages[0][0, :, 0, 0], swapped_pages)
+    np.testing.assert_array_equal(preempted.host_pages[1][0, :, 0, 0], -swapped_pages)
+
+    # Another sequence reuses the pages before the swapped-out one resumes in group 3.
+    state = self.pm.update_prefill_pages(state, 2, 20)
+    state = self.pm.release_pages(state, 0)
+    state, kv_cache = policy.resume(state, self.kv_cache, preempted, page_group_id=3)
+
+    self.assertEqual(int(state.sequence_lengths[3]), 12)
+    self.assertEqual(int(state.num_pages_used[3]), 3)
+    self.assertEqual(policy.priorities[3], 0.0)
+    restored_pages = state.page_map[3, :3]
+    key_pages = kv_cache["decoder"]["layers_0"]["key_pages"]
+    np.testing.assert_array_equal(key_pages[0, restored_pages, 0, 0], swapped_pages)
+    np.testing.assert_array_equal(kv_cache["decoder"]["layers_0"]["value_pages"][0, restored_pages, 0, 0], -swapped_pages)
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,196 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for quantized KV pages of the paged attention op."""
+
+import unittest
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
+from flax import nnx
+
+from MaxText.common_types import MODEL_MODE_AUTOREGRESSIVE
+from MaxText.inference import page_manager
+from MaxText.inference import paged_attention
+
+NUM_PAGES = 16
+TOKENS_PER_PAGE = 4
+MAX_PAGES_PER_SLOT = 4
+NUM_KV_HEADS = 2
+NUM_HEADS = 4
+HEAD_DIM = 16
+BATCH_SIZE = 2
+# Tokens written per slot, ending in a partially filled page.
+NUM_TOKENS = 14
+QUANT_CONFIGS = [("int8", "token"), ("int8", "page"), ("fp8", "token"), ("fp8", "page")]
+# Relative error of the decode attention output, fp8 e4m3 keeps 3 mantissa bits.
+MAX_RELATIVE_ERROR = {"int8": 0.03, "fp8": 0.15}
+
+
+def _op(kv_quant_dtype="", kv_quant_granularity="token", dtype=jnp.float32):
+  return paged_attention.PagedAttentionOp(
+      mesh=jax.sharding.Mesh(np.array(jax.devices()[:1]), ("tensor",)),
+      num_pages=NUM_PAGES,
+      tokens_per_page=TOKENS_PER_PAGE,
+      max_pages_per_slot=MAX_PAGES_PER_SLOT,
+      max_pages_per_prefill=MAX_PAGES_PER_SLOT,
+      pages_per_compute_block=1,
+      num_kv_heads=NUM_KV_HEADS,
+      kv_head_dim_size=HEAD_DIM,
+      dtype=dtype,
+      kv_quant_dtype=kv_quant_dtype,
+      kv_quant_granularity=kv_quant_granularity,
+      rngs=nnx.Rngs(0),
+  )
+
+
+def _page_state(step):
+  """The page state of decode step `step`, with slot i using pages 1 + i * MAX_PAGES_PER_SLOT onwards."""
+  page_map = 1 + jnp.arange(BATCH_SIZE * MAX_PAGES_PER_SLOT, dtype=jnp.int32).reshape(BATCH_SIZE, MAX_PAGES_PER_SLOT)
+  state = page_manager.initialize_page_state(NUM_PAGES, BATCH_SIZE, MAX_PAGES_PER_SLOT)
+  return state.replace(
+      page_map=page_map,
+      sequence_lengths=jnp.full((BATCH_SIZE,), step + 1, dtype=jnp.int32),
+      active_page=page_map[:, step // TOKENS_PER_PAGE],
+      has_active_page=jnp.ones((BATCH_SIZE,), dtype=jnp.bool_),
+      active_page_position=jnp.full((BATCH_SIZE,), step % TOKENS_PER_PAGE, dtype=jnp.int32),
+  )
+
+
+def _write_decode_steps(op, keys, values, num_steps):
+  """Writes the first `num_steps` tokens of `keys` and `values` step by step."""
+  key_pages, value_pages = op.get_kv_pages()
+  key_scales, value_scales = op.get_kv_scale_pages()
+  for step in range(num_steps):
+    op.update_decode_step_pages(
+        key_pages,
+        value_pages,
+        keys[:, step : step + 1],
+        values[:, step : step + 1],
+        _page_state(step),
+        key_scale_pages_cache=key_scales,
+        value_scale_pages_cache=value_scales,
+    )
+  return key_pages, value_pages, key_scales, value_scales
+
+
+def _decode(op, keys, values, query):
+  """Writes `keys` and `values` step by step and attends to them with `query`."""
+  key_pages, value_pages, key_scales, value_scales = _write_decode_steps(op, keys, values, NUM_TOKENS)
+  return op.paged_attention_reference_decode(
+      query, key_pages, value_pages, _page_state(NUM_TOKENS - 1), key_scales, value_scales
+  )
+
+
+def _nbytes(op):
+  caches = [op.key_pages, op.value_pages]
+  if op.kv_quant_dtype is not None:
+    caches += [op.key_scale_pages, op.value_scale_pages]
+  return sum(cache.value.nbytes for cache in caches)
+
+
+class QuantizedPagedAttentionTest(unittest.TestCase):
+  """Compares quantized KV pages with the unquantized pages."""
+
+  def setUp(self):
+    super().setUp()
+    k1, k2, k3 = jax.random.split(jax.random.PRNGKey(0), 3)
+    self.keys = jax.random.normal(k1, (BATCH_SIZE, NUM_TOKENS, NUM_KV_HEADS, HEAD_DIM))
+    self.values = jax.random.normal(k2, (BATCH_SIZE, NUM_TOKENS, NUM_KV_HEADS, HEAD_DIM))
+    self.query = jax.random.normal(k3, (BATCH_SIZE, 1, NUM_HEADS, HEAD_DIM))
+
+  def test_reference_decode_matches_dense_attention(self):
+    attn = _decode(_op(), self.keys, self.values, self.query)
+
+    group = NUM_HEADS // NUM_KV_HEADS
+    keys = jnp.repeat(self.keys, group, axis=2)
+    values = jnp.repeat(self.values, group, axis=2)
+    weights = jax.nn.softmax(jnp.einsum("bqnd,bsnd->bnqs", self.query, keys), axis=-1)
+    expected = jnp.einsum("bnqs,bsnd->bqnd", weights, values)
+    np.testing.assert_allclose(attn, expected, rtol=1e-5, atol=1e-5)
+
+  def test_quantized_decode_matches_unquantized(self):
+    expected = _decode(_op(), self.keys, self.values, self.query)
+    for kv_quant_dtype, granularity in QUANT_CONFIGS:
+      with self.subTest(kv_quant_dtype=kv_quant_dtype, granularity=granularity):
+        op = _op(kv_quant_dtype, granularity)
+        attn = _decode(op, self.keys, self.values, self.query)
+        self.assertEqual(op.key_pages.value.dtype, paged_attention.KV_QUANT_DTYPES[kv_quant_dtype])
+        relative_error = jnp.linalg.norm(attn - expected) / jnp.linalg.norm(expected)
+        self.assertLess(relative_error, MAX_RELATIVE_ERROR[kv_quant_dtype])
+
+  @pytest.mark.tpu_only
+  def test_int8_kernel_decode_matches_bfloat16(self):
+    # Decodes the last step through __call__, i.e. the v1 kernel, with int8 and with bfloat16 pages.
+    last = NUM_TOKENS - 1
+    keys, values, query = (x.astype(jnp.bfloat16) for x in (self.keys, self.values, self.query))
+    attn = {}
+    for kv_quant_dtype in ("", "int8"):
+      op = _op(kv_quant_dtype, dtype=jnp.bfloat16)
+      _write_decode_steps(op, keys, values, last)
+      attn[kv_quant_dtype], _, _ = op(
+          query,
+          keys[:, last:],
+          values[:, last:],
+          None,
+          MODEL_MODE_AUTOREGRESSIVE,
+          page_state=_page_state(last),
+      )
+    expected, quantized = (attn[k].astype(jnp.float32) for k in ("", "int8"))
+    relative_error = jnp.linalg.norm(quantized - expected) / jnp.linalg.norm(expected)
+    self.assertLess(relative_error, MAX_RELATIVE_ERROR["int8"])
+
+  def test_quantized_prefill_pages(self):
+    for kv_quant_dtype, granularity in QUANT_CONFIGS:
+      with self.subTest(kv_quant_dtype=kv_quant_dtype, granularity=granularity):
+        op = _op(kv_quant_dtype, granularity)
+        key_pages, value_pages = op.get_kv_pages()
+        key_scales, value_scales = op.get_kv_scale_pages()
+        keys = self.keys[:1, : 3 * TOKENS_PER_PAGE]
+        op.update_prefill_step_pages(
+            key_pages,
+            value_pages,
+            keys,
+            keys,
+            0,
+            _page_state(0),
+            key_scale_pages_cache=key_scales,
+            value_scale_pages_cache=value_scales,
+        )
+        # [num_kv_heads, num_prompt_pages, tokens_per_page, head_dim]
+        expected = jnp.reshape(jnp.transpose(keys[0], (1, 0, 2)), (NUM_KV_HEADS, 3, TOKENS_PER_PAGE, HEAD_DIM))
+        dequantized = paged_attention.dequantize_kv_pages(key_pages.value, key_scales.value)
+        np.testing.assert_allclose(dequantized, expected, atol=0.05 if kv_quant_dtype == "int8" else 0.25)
+
+  def test_quantized_pages_halve_memory(self):
+    unquantized_bytes = _nbytes(_op(dtype=jnp.bfloat16))
+    for kv_quant_dtype, granularity in QUANT_CONFIGS:
+      with self.subTest(kv_quant_dtype=kv_quant_dtype, granularity=granularity):
+        # Half the bytes of the pages, plus 4 bytes of float32 scale per token or page of a KV head.
+        scales_per_page = TOKENS_PER_PAGE if granularity == "token" else 1
+        ratio = 0.5 + 2 * scales_per_page / (TOKENS_PER_PAGE * HEAD_DIM)
+        self.assertEqual(_nbytes(_op(kv_quant_dtype, granularity)), ratio * unquantized_bytes)
+        self.assertLess(ratio, 0.65)
+
+  def test_invalid_quant_config(self):
+    with self.assertRaisesRegex(ValueError, "kv_quant_dtype"):
+      _op("int4")
+    with self.assertRaisesRegex(ValueError, "kv_quant_granularity"):
+      _op("int8", "head")
+
+
+if __name__ == "__main__":
+  unittest.main()
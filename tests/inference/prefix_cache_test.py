@@ -0,0 +1,105 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the shared-prefix KV cache."""
+
+import unittest
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from MaxText.inference.prefix_cache import PrefixCache
+
+CHUNK_SIZE = 4
+# Bytes of one cache of `_cache`.
+CACHE_BYTES = 64 * 4
+
+
+def _cache(value):
+  return {"decoder": {"cached_prefill_key": jnp.full((64,), value, dtype=jnp.float32)}}
+
+
+def _logp(length):
+  return jnp.arange(length, dtype=jnp.float32)[None, :]
+
+
+class PrefixCacheTest(unittest.TestCase):
+  """Tests lookup, insertion and eviction of the prefix cache."""
+
+  def test_lookup_returns_longest_chunk_aligned_prefix(self):
+    cache = PrefixCache(CHUNK_SIZE, hbm_bytes=10 * CACHE_BYTES)
+    self.assertIsNone(cache.lookup(np.arange(10)))
+    self.assertTrue(cache.insert(np.arange(10), _cache(1.0), _logp(10)))
+
+    hit = cache.lookup(np.concatenate([np.arange(6), [99, 99, 99]]))
+    self.assertEqual(hit.num_tokens, 4)
+    self.assertEqual(hit.prompt_logp.shape, (1, 4))
+    np.testing.assert_array_equal(hit.cache["decoder"]["cached_prefill_key"], 1.0)
+
+    self.assertEqual(cache.lookup(np.arange(12)).num_tokens, 8)
+    self.assertIsNone(cache.lookup(np.arange(1, 12)))
+    self.assertEqual(cache.stats.lookups, 4)
+    self.assertEqual(cache.stats.hits, 2)
+    self.assertAlmostEqual(cache.stats.hit_rate, 0.5)
+
+  def test_insert_skips_covered_and_replaces_shorter_prefixes(self):
+    cache = PrefixCache(CHUNK_SIZE, hbm_bytes=10 * CACHE_BYTES)
+    self.assertFalse(cache.insert(np.arange(3), _cache(0.0), _logp(3)))
+    self.assertTrue(cache.insert(np.arange(8), _cache(1.0), _logp(8)))
+    self.assertFalse(cache.insert(np.arange(5), _cache(2.0), _logp(5)))
+    self.assertTrue(cache.insert(np.arange(16), _cache(3.0), _logp(16)))
+    self.assertEqual(len(cache), 1)
+
+    self.assertTrue(cache.insert(np.array([0, 1, 2, 3, 9, 9, 9, 9]), _cache(4.0), _logp(8)))
+    self.assertEqual(len(cache), 2)
+    np.testing.assert_array_equal(cache.lookup(np.arange(8)).cache["decoder"]["cached_prefill_key"], 3.0)
+
+  def test_stored_cache_is_a_copy(self):
+    cache = PrefixCache(CHUNK_SIZE, hbm_bytes=10 * CACHE_BYTES)
+    prefill_cache = _cache(1.0)
+    cache.insert(np.arange(4), prefill_cache, _logp(4))
+    jax.tree.map(lambda x: x.delete(), prefill_cache)
+    np.testing.assert_array_equal(cache.lookup(np.arange(4)).cache["decoder"]["cached_prefill_key"], 1.0)
+
+  def test_lru_eviction_offloads_to_host(self):
+    cache = PrefixCache(CHUNK_SIZE, hbm_bytes=2 * CACHE_BYTES, host_bytes=CACHE_BYTES)
+    for i in range(3):
+      cache.insert(np.full(4, i), _cache(float(i)), _logp(4))
+    self.assertEqual(cache.device_bytes, 2 * CACHE_BYTES)
+    self.assertEqual(cache.host_bytes_used, CACHE_BYTES)
+    self.assertEqual(cache.stats.offloads, 1)
+
+    # Hitting the host entry moves it back to device and offloads the least recently used one.
+    hit = cache.lookup(np.full(4, 0))
+    self.assertIsInstance(hit.cache["decoder"]["cached_prefill_key"], jax.Array)
+    self.assertEqual(cache.stats.offloads, 2)
+
+    cache.insert(np.full(4, 3), _cache(3.0), _logp(4))
+    self.assertEqual(len(cache), 3)
+    self.assertEqual(cache.stats.evictions, 1)
+    self.assertIsNone(cache.lookup(np.full(4, 1)))
+    self.assertIsNotNone(cache.lookup(np.full(4, 0)))
+
+  def test_clear(self):
+    cache = PrefixCache(CHUNK_SIZE, hbm_bytes=10 * CACHE_BYTES)
+    cache.insert(np.arange(8), _cache(1.0), _logp(8))
+    cache.clear()
+    self.assertEqual(len(cache), 0)
+    self.assertEqual(cache.device_bytes, 0)
+    self.assertIsNone(cache.lookup(np.arange(8)))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,60 @@
+# Copyright 2023–2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the request scheduler of the offline inference engine."""
+
+import unittest
+
+import numpy as np
+
+from MaxText.inference.offline_engine import CompletionOutput, InputData, RequestScheduler, SchedulingPolicy
+
+
+def _input(i, true_length, padded_length):
+  return InputData(id=i, tokens=np.zeros(padded_length, dtype=np.int32), true_length=true_length)
+
+
+class RequestSchedulerTest(unittest.TestCase):
+  """Tests the input orders of the scheduling policies."""
+
+  def test_fifo_and_shortest_prompt_first(self):
+    data = [_input(0, 50, 64), _input(1, 10, 64), _input(2, 100, 128), _input(3, 10, 64)]
+    self.assertEqual([row.id for row in RequestScheduler("fifo").order(data, 128, 4)], [0, 1, 2, 3])
+    self.assertEqual([row.id for row in RequestScheduler("shortest_prompt_first").order(data, 128, 4)], [1, 3, 0, 2])
+
+  def test_bucket_fill(self):
+    data = [_input(0, 50, 64), _input(1, 60, 64), _input(2, 40, 64), _input(3, 50, 64), _input(4, 70, 128)]
+    scheduler = RequestScheduler(SchedulingPolicy.BUCKET_FILL)
+    # In input order, prefills of 100 tokens would be packed [50], [60, 40], [50]; first fit decreasing needs two.
+    self.assertEqual([row.id for row in scheduler.order(data, 100, 4)], [1, 2, 0, 3, 4])
+    self.assertEqual([row.id for row in scheduler.order(data, 100, 1)], [1, 0, 3, 2, 4])
+
+  def test_predicted_output_length(self):
+    data = [_input(0, 10, 64), _input(1, 100, 128), _input(2, 12, 64)]
+    scheduler = RequestScheduler(SchedulingPolicy.PREDICTED_OUTPUT_LENGTH)
+    self.assertEqual([row.id for row in scheduler.order(data, 128, 4)], [0, 1, 2])
+    scheduler.observe(
+        [
+            CompletionOutput(index="a", token_ids=np.zeros(10 + 30), logprobs=np.zeros(40), prompt_length=10),
+            CompletionOutput(index="b", token_ids=np.zeros(100 + 5), logprobs=np.zeros(105), prompt_length=100),
+        ]
+    )
+    self.assertEqual([row.id for row in scheduler.order(data, 128, 4)], [0, 2, 1])
+
+    predicted = RequestScheduler(SchedulingPolicy.PREDICTED_OUTPUT_LENGTH, output_length_predictor=lambda row: row.id)
+    self.assertEqual([row.id for row in predicted.order(data, 128, 4)], [2, 1, 0])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -28,7 +28,7 @@ from jax.sharding import Mesh
 
 from MaxText import maxtext_utils
 from MaxText import pyconfig, maxengine
-from MaxText.common_types import DECODING_ACTIVE_SEQUENCE_INDICATOR, MODEL_MODE_PREFILL
+from MaxText.common_types import DECODING_ACTIVE_SEQUENCE_INDICATOR, MODEL_MODE_PREFILL, MODEL_MODE_TRAIN
 from MaxText.globals import MAXTEXT_PKG_DIR
 from MaxText.layers import models
 from MaxText.layers import quantizations
@@ -161,6 +161,151 @@ class MaxEngineTest(unittest.TestCase):
     self.assertEqual(result_token.data.ndim, 2)
     self.assertEqual(result_token.data.shape[1], 3)
 
+  def test_decode_state_without_logits(self):
+    devices_array = maxtext_utils.create_device_mesh(self.cfg)
+    mesh = Mesh(devices_array, self.cfg.mesh_axes)
+    quant = quantizations.configure_quantization(self.cfg)
+    model = models.transformer_as_linen(config=self.cfg, mesh=mesh, quant=quant, model_mode=MODEL_MODE_PREFILL)
+    ids, decoder_segment_ids, decoder_positions = self.get_data()
+
+    transformer_vars = model.init(
+        {"params": self.rng, "aqt": self.rng, "dropout": self.rng},
+        ids,
+        decoder_positions,
+        decoder_segment_ids,
+        enable_dropout=False,
+    )
+    input_tokens = jnp.array([1, 306, 5360, 304])
+
+    def decode(cfg, steps=3):
+      engine = MaxEngine(cfg, jax.devices())
+      params = engine.load_params(params=transformer_vars)
+      decode_state = engine.init_decode_state()
+      prefill_result, _ = engine.prefill(params=params, padded_tokens=input_tokens, true_length=4)
+      decode_state = engine.insert(prefill_result, decode_state, slot=0)
+      for _ in range(steps):
+        decode_state, _ = engine.generate(params=params, decode_state=decode_state)
+      return decode_state
+
+    expected = decode(self.cfg)
+    decode_state = decode(self.init_pyconfig(decode_state_logits=False, decode_state_top_logprobs=3))
+
+    self.assertNotIn("logits", decode_state)
+    np.testing.assert_array_equal(decode_state["tokens"], expected["tokens"])
+    np.testing.assert_allclose(decode_state["token_logp"], expected["token_logp"], rtol=1e-5, atol=1e-5)
+    self.assertEqual(decode_state["top_logprobs"].shape, (expected["tokens"].shape[0], 1, 3))
+    expected_top_logprobs, expected_top_tokens = jax.lax.top_k(jax.nn.log_softmax(expected["logits"], axis=-1), 3)
+    np.testing.assert_allclose(decode_state["top_logprobs"], expected_top_logprobs, rtol=1e-5, atol=1e-5)
+    np.testing.assert_array_equal(decode_state["top_logprob_tokens"], expected_top_tokens)
+    # Greedy decoding samples the most likely token.
+    np.testing.assert_array_equal(decode_state["top_logprob_tokens"][:, 0, :1], expected["tokens"])
+
+  def test_local_window_kv_cache_matches_forward_pass(self):
+    """Greedy decoding with window sized AR caches of the local layers emits the argmax tokens of a forward pass."""
+    cfg = self.init_pyconfig(
+        decoder_block="gemma2",
+        sliding_window_size=3,
+        dtype="float32",
+        decode_sampling_strategy="greedy",
+        use_local_window_kv_cache=True,
+    )
+    devices_array = maxtext_utils.create_device_mesh(cfg)
+    mesh = Mesh(devices_array, cfg.mesh_axes)
+    quant = quantizations.configure_quantization(cfg)
+    model = models.transformer_as_linen(config=cfg, mesh=mesh, quant=quant, model_mode=MODEL_MODE_PREFILL)
+    ids, decoder_segment_ids, decoder_positions = self.get_data()
+    transformer_vars = model.init(
+        {"params": self.rng, "aqt": self.rng, "dropout": self.rng},
+        ids,
+        decoder_positions,
+        decoder_segment_ids,
+        enable_dropout=False,
+    )
+
+    engine = MaxEngine(cfg, jax.devices())
+    params = engine.load_params(params=transformer_vars)
+    prompt = jnp.array([1, 306, 5360, 304])
+    prefill_result, first_token = engine.prefill(params=params, padded_tokens=prompt, true_length=len(prompt))
+    decode_state = engine.insert(prefill_result, engine.init_decode_state(), slot=0)
+    tokens = [int(t) for t in prompt] + [int(first_token.data[0, 0])]
+    # More tokens than the window, so that the AR caches of the local layers wrap around.
+    while len(tokens) < cfg.max_target_length:
+      decode_state, result = engine.generate(params=params, decode_state=decode_state)
+      tokens.append(int(result.data[0, 0]))
+
+    train_model = models.transformer_as_linen(config=cfg, mesh=mesh, quant=quant, model_mode=MODEL_MODE_TRAIN)
+    logits = train_model.apply(
+        {"params": transformer_vars["params"]},
+        jnp.array([tokens]),
+        decoder_positions[:1],
+        decoder_segment_ids[:1],
+        enable_dropout=False,
+    )
+    expected = jnp.argmax(logits[0, len(prompt) - 1 : -1], axis=-1)
+    self.assertEqual(tokens[len(prompt) :], [int(t) for t in expected])
+
+  def test_speculative_decode_matches_generate(self):
+    """Greedy speculative decoding emits the tokens of greedy decoding, also once the AR cache index wraps."""
+    cfg = self.init_pyconfig(per_device_batch_size=2.0, decode_sampling_strategy="greedy", speculative_num_draft_tokens=3)
+    devices_array = maxtext_utils.create_device_mesh(cfg)
+    mesh = Mesh(devices_array, cfg.mesh_axes)
+    quant = quantizations.configure_quantization(cfg)
+    model = models.transformer_as_linen(config=cfg, mesh=mesh, quant=quant, model_mode=MODEL_MODE_PREFILL)
+    ids, decoder_segment_ids, decoder_positions = self.get_data()
+
+    def init_vars(rng):
+      return model.init(
+          {"params": rng, "aqt": rng, "dropout": rng}, ids, decoder_positions, decoder_segment_ids, enable_dropout=False
+      )
+
+    target_vars = init_vars(self.rng)
+    prompts = [jnp.array([1, 306, 5360, 304]), jnp.array([1, 11, 22, 33])]
+    num_tokens = cfg.max_target_length - cfg.max_prefill_predict_length
+
+    def start(engine, transformer_vars):
+      params = engine.load_params(params=transformer_vars)
+      decode_state = engine.init_decode_state()
+      for slot, prompt in enumerate(prompts):
+        prefill_result, _ = engine.prefill(params=params, padded_tokens=prompt, true_length=len(prompt))
+        decode_state = engine.insert(prefill_result, decode_state, slot=slot)
+      return params, decode_state
+
+    engine = MaxEngine(cfg, jax.devices())
+    params, decode_state = start(engine, target_vars)
+    expected = [[] for _ in prompts]
+    for _ in range(num_tokens - 1):
+      decode_state, result = engine.generate(params=params, decode_state=decode_state)
+      for slot, tokens in enumerate(expected):
+        tokens.append(int(result.data[slot, 0]))
+
+    def perturb(leaf, rng):
+      return leaf + 0.1 * jnp.std(leaf) * jax.random.normal(rng, leaf.shape, leaf.dtype)
+
+    leaves, treedef = jax.tree.flatten(target_vars)
+    noisy_vars = jax.tree.unflatten(
+        treedef, [perturb(leaf, rng) for leaf, rng in zip(leaves, jax.random.split(self.rng, len(leaves)))]
+    )
+    # The same draft accepts every token, a perturbed one accepts different numbers of tokens per slot
+    # and a differently initialized one rejects most, so that the AR cache index wraps around.
+    for draft_vars in [target_vars, noisy_vars, init_vars(jax.random.PRNGKey(1))]:
+      draft_engine = MaxEngine(cfg, jax.devices())
+      params, decode_state = start(engine, target_vars)
+      draft_params, draft_decode_state = start(draft_engine, draft_vars)
+      generated = [[] for _ in prompts]
+      num_steps = 0
+      while min(len(tokens) for tokens in generated) < num_tokens - 1:
+        decode_state, draft_decode_state, result = engine.generate_speculative(
+            params, decode_state, draft_engine, draft_params, draft_decode_state
+        )
+        num_steps += 1
+        valid_start, valid_end = result.valid_idx
+        for slot, tokens in enumerate(generated):
+          num_valid = int(np.sum(result.data[slot, valid_start:valid_end]))
+          tokens.extend(int(t) for t in result.data[slot, :num_valid])
+      for slot, tokens in enumerate(generated):
+        self.assertEqual(tokens[: num_tokens - 1], expected[slot])
+    self.assertGreater(num_steps, num_tokens // (cfg.speculative_num_draft_tokens + 1))
+
   @pytest.mark.skip(reason="Can only pass on CPU.")
   def test_chunked_prefill(self):
     """Test identical result between chunked prefill with single and multiple chunked.
@@ -684,6 +684,73 @@ class TestSamplingFunctions(unittest.TestCase):
     for token in tokens:
       self.assertIn(token.item(), top_k_indices)
 
+  def _sample_per_slot(self, rng, temperature, topk, topp, max_topk=0):
+    """Samples the 3D-reshaped logits once per slot with the given per-slot params."""
+    batch_size = len(temperature)
+    logits = jnp.tile(self.logits[:, None, :], (batch_size, 1, 1))
+    rngs = jax.random.split(rng, batch_size)
+    return inference_utils.sample_per_slot(
+        logits,
+        rngs,
+        jnp.array(temperature, dtype=jnp.float32),
+        jnp.array(topk, dtype=jnp.int32),
+        jnp.array(topp, dtype=jnp.float32),
+        max_topk=max_topk,
+    )
+
+  def test_per_slot_sampling_mixed_params(self):
+    """Tests that every slot is filtered with its own top-k / top-p / temperature."""
+    greedy_token_index = self.expected_order[0].item()
+    top_3_indices = set(self.expected_order[:3].tolist())
+    top_p_indices = set(self.expected_order[:6].tolist())
+    for r in jax.random.split(self.rng, 50):
+      tokens = self._sample_per_slot(r, temperature=[0.0, 1.0, 1.0, 1.0], topk=[0, 3, 0, 5], topp=[1.0, 1.0, 0.8, 0.8])
+      self.assertEqual(tokens.shape, (4, 1))
+      self.assertEqual(tokens[0, 0].item(), greedy_token_index)
+      self.assertIn(tokens[1, 0].item(), top_3_indices)
+      self.assertIn(tokens[2, 0].item(), top_p_indices)
+      self.assertIn(tokens[3, 0].item(), top_3_indices)
+
+  def test_per_slot_sampling_max_topk(self):
+    """Tests that a bounded candidate set gives the same top-k filtering."""
+    top_3_indices = set(self.expected_order[:3].tolist())
+    for r in jax.random.split(self.rng, 20):
+      tokens = self._sample_per_slot(r, temperature=[1.0, 1.0], topk=[3, 3], topp=[1.0, 0.9], max_topk=4)
+      for token in tokens[:, 0]:
+        self.assertIn(token.item(), top_3_indices)
+
+  def test_per_slot_sampling_unfiltered_slots_use_full_vocab(self):
+    """Tests that slots without top-k/top-p are not limited to the `max_topk` candidates of filtered slots."""
+    vocab_size = 64
+    logits = jnp.zeros((2, 1, vocab_size))
+    tokens = set()
+    for r in jax.random.split(self.rng, 20):
+      rngs = jax.random.split(r, 2)
+      sampled = inference_utils.sample_per_slot(
+          logits, rngs, jnp.array([1.0, 1.0]), jnp.array([0, 2]), jnp.array([1.0, 1.0]), max_topk=4
+      )
+      self.assertIn(sampled[1, 0].item(), range(4))
+      tokens.add(sampled[0, 0].item())
+    self.assertTrue(any(token >= 4 for token in tokens))
+
+  def test_per_slot_sampling_params(self):
+    """Tests the mapping from sampling algorithms to per-slot params."""
+    self.assertEqual(inference_utils.per_slot_sampling_params("greedy", 5, 0.5, 0.7), (0.0, 0, 1.0))
+    self.assertEqual(inference_utils.per_slot_sampling_params("weighted", 5, 0.5, 0.7), (0.7, 0, 1.0))
+    self.assertEqual(inference_utils.per_slot_sampling_params("nucleus", 5, 0.5, 0.7), (0.7, 0, 0.5))
+    self.assertEqual(inference_utils.per_slot_sampling_params("topk", 5, 0.5, 0.7), (0.7, 5, 1.0))
+    self.assertEqual(inference_utils.per_slot_sampling_params("composite", 5, 0.5, 0.7), (0.7, 5, 0.5))
+    with self.assertRaises(ValueError):
+      inference_utils.per_slot_sampling_params("beam", 5, 0.5, 0.7)
+
+  def test_per_slot_rngs_seeded_slots_are_batch_independent(self):
+    """Tests that seeded slots get the same key regardless of the step rng and batch."""
+    step = jnp.array([3, 3], dtype=jnp.int32)
+    rngs_a = inference_utils.per_slot_rngs(jax.random.PRNGKey(1), jnp.array([7, -1]), step)
+    rngs_b = inference_utils.per_slot_rngs(jax.random.PRNGKey(2), jnp.array([7, -1]), step)
+    np.testing.assert_array_equal(rngs_a[0], rngs_b[0])
+    self.assertFalse(np.array_equal(rngs_a[1], rngs_b[1]))
+
 
 class TestCalculateBytesFromPytree(unittest.TestCase):
   """Test suite for the byte calculation utility function."""
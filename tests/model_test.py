@@ -191,6 +191,51 @@ class TestModel(unittest.TestCase):
       self.assertTrue(full_train_logits_idx.shape == ar_logits.shape)
       np.testing.assert_allclose(full_train_logits_idx, ar_logits, rtol=1e-01, atol=1e-01, equal_nan=False)
 
+  def test_multi_token_autoregress_matches_single_token(self):
+    """Test that one autoregressive step over a block of tokens matches a step per token."""
+    cfg = self.init_pyconfig(dtype="float32", matmul_precision="highest")
+    devices_array = maxtext_utils.create_device_mesh(cfg)
+    mesh = Mesh(devices_array, cfg.mesh_axes)
+    model = models.transformer_as_linen(config=cfg, mesh=mesh, quant=None, model_mode=MODEL_MODE_PREFILL)
+    ids, decoder_segment_ids, decoder_positions = self.get_data()
+    transformer_vars = model.init(
+        {"params": self.rng, "aqt": self.rng},
+        ids,
+        decoder_positions,
+        model_mode=MODEL_MODE_PREFILL,
+        decoder_segment_ids=decoder_segment_ids,
+        enable_dropout=False,
+    )
+
+    def apply(cache, start, end, model_mode):
+      kwargs = {"decoder_segment_ids": decoder_segment_ids[:, start:end]} if model_mode == MODEL_MODE_PREFILL else {}
+      return model.apply(
+          transformer_vars | cache,
+          ids[:, start:end],
+          decoder_positions[:, start:end],
+          model_mode=model_mode,
+          enable_dropout=False,
+          rngs={"aqt": self.rng},
+          mutable=["cache"],
+          **kwargs,
+      )
+
+    _, cache = apply({}, 0, MAX_PREFILL_PREDICT_LENGTH, MODEL_MODE_PREFILL)
+    # One single-token step first, so that the block does not start at the beginning of the AR cache.
+    _, cache = apply(cache, MAX_PREFILL_PREDICT_LENGTH, MAX_PREFILL_PREDICT_LENGTH + 1, MODEL_MODE_AUTOREGRESSIVE)
+
+    block_start, block_end = MAX_PREFILL_PREDICT_LENGTH + 1, MAX_PREFILL_PREDICT_LENGTH + 4
+    single_token_cache = cache
+    single_token_logits = []
+    for idx in range(block_start, block_end + 1):
+      logits, single_token_cache = apply(single_token_cache, idx, idx + 1, MODEL_MODE_AUTOREGRESSIVE)
+      single_token_logits.append(logits)
+
+    block_logits, block_cache = apply(cache, block_start, block_end, MODEL_MODE_AUTOREGRESSIVE)
+    next_logits, _ = apply(block_cache, block_end, block_end + 1, MODEL_MODE_AUTOREGRESSIVE)
+    np.testing.assert_allclose(jnp.concatenate(single_token_logits[:-1], axis=1), block_logits, rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(single_token_logits[-1], next_logits, rtol=1e-4, atol=1e-4)
+
 
 if __name__ == "__main__":
   unittest.main()
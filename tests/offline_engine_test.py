@@ -21,7 +21,12 @@ import os.path
 import jax
 import jax.numpy as jnp
 import numpy as np
-from MaxText.inference.offline_engine import OfflineEngine, InputData, CompletionOutput
+from MaxText.inference.offline_engine import (
+    OfflineEngine,
+    InputData,
+    CompletionOutput,
+    SchedulingPolicy,
+)
 from MaxText import pyconfig
 from MaxText.globals import MAXTEXT_PKG_DIR
 
@@ -83,6 +88,8 @@ class OfflineEngineTest(unittest.TestCase):
       assert result.token_ids.shape == (length + completion_length,)
       assert isinstance(result.logprobs, np.ndarray)
       assert result.logprobs.shape == (length + completion_length,)
+    dispatch_stats = inference_engine.worker.dispatch_stats
+    assert dispatch_stats.dispatches == len(input_data) + dispatch_stats.decode_blocks
 
   def test_multi_sampling(self):
     config = self.cfg
@@ -98,6 +105,77 @@ class OfflineEngineTest(unittest.TestCase):
     for i in range(4):
       assert not jnp.array_equal(results_1[i].token_ids, results_2[i].token_ids)
 
+  def test_prefix_caching(self):
+    rng = jax.random.PRNGKey(0)
+    shared_prefix = np.arange(1, 151)
+    input_data = [
+        InputData(id=f"input_{i}", tokens=np.concatenate([shared_prefix, np.arange(i + 1) + 200]), true_length=151 + i)
+        for i in range(4)
+    ]
+
+    config = self.init_pyconfig(decode_sampling_strategy="greedy", use_chunked_prefill=True, prefill_chunk_size=64)
+    results = OfflineEngine(config=config, params=None, rng=rng, eos_ids=[]).batch_inference(input_data)
+    cached_config = self.init_pyconfig(
+        decode_sampling_strategy="greedy", use_chunked_prefill=True, prefill_chunk_size=64, enable_prefix_caching=True
+    )
+    cached_engine = OfflineEngine(config=cached_config, params=None, rng=rng, eos_ids=[])
+    cached_results = cached_engine.batch_inference(input_data)
+
+    stats = cached_engine.worker.prefix_cache.stats
+    assert stats.hits == len(input_data) - 1
+    assert stats.saved_prefill_tokens == (len(input_data) - 1) * 127
+    # The first prompt is prefilled in three chunks, the others only from their last cached token.
+    prefill_stats = cached_engine.worker.prefill_helper.stats
+    assert prefill_stats.num_prefills == 3 + len(input_data) - 1
+    assert prefill_stats.prompt_tokens == 151 + sum(range(25, 25 + len(input_data) - 1))
+    assert prefill_stats.prefill_tokens == 64 * (3 + len(input_data) - 1)
+    for result, cached_result in zip(results, cached_results):
+      np.testing.assert_array_equal(cached_result.token_ids, result.token_ids)
+      np.testing.assert_allclose(cached_result.logprobs, result.logprobs, atol=1e-2)
+
+  def test_stop_sequences(self):
+    config = self.cfg
+    rng = jax.random.PRNGKey(0)
+    stop_sequences = ["e", "a"]
+    inference_engine = OfflineEngine(
+        config=config, params=None, enable_batch_prefill=False, rng=rng, eos_ids=[], stop_sequences=stop_sequences
+    )
+    input_data = [InputData(id=f"input_{i}", tokens=jnp.arange(64), true_length=64) for i in range(4)]
+
+    results = inference_engine.batch_inference(input_data)
+
+    completion_length = config.max_target_length - config.max_prefill_predict_length
+    for result in results:
+      completion_text = inference_engine.tokenizer.decode(result.token_ids[result.prompt_length :].tolist())
+      assert completion_text.startswith(result.text)
+      assert not any(stop in result.text for stop in stop_sequences)
+      if len(result.token_ids) - result.prompt_length < completion_length:
+        # Generation stopped early, so the last token completed a stop sequence.
+        assert len(result.text) < len(completion_text)
+
+  def test_scheduling_policies(self):
+    rng = jax.random.PRNGKey(0)
+    input_lengths = [300, 20, 150, 40, 60, 250, 30, 100]
+    input_data = [
+        InputData(id=f"input_{i}", tokens=np.arange(1, length + 1), true_length=length)
+        for i, length in enumerate(input_lengths)
+    ]
+    config = self.init_pyconfig(decode_sampling_strategy="greedy")
+    inference_engine = OfflineEngine(
+        config=config, params=None, enable_batch_prefill=True, rng=rng, eos_ids=[], scheduler="fifo"
+    )
+
+    efficiency = {}
+    for policy in SchedulingPolicy:
+      inference_engine.update_scheduler(policy)
+      results = inference_engine.batch_inference(input_data)
+      efficiency[policy] = inference_engine.worker.prefill_helper.stats.packing_efficiency
+      # Outputs are returned in input order whatever the prefill order.
+      for result, length in zip(results, input_lengths):
+        assert result.prompt_length == length
+        np.testing.assert_array_equal(result.token_ids[:length], np.arange(1, length + 1))
+    assert efficiency[SchedulingPolicy.BUCKET_FILL] >= efficiency[SchedulingPolicy.FIFO]
+
 
 if __name__ == "__main__":
   unittest.main()
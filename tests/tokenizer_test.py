@@ -16,6 +16,7 @@
 """
 
 import numpy as np
+from MaxText import tokenizer
 from MaxText import train_tokenizer
 from MaxText.input_pipeline import _input_pipeline_utils
 from MaxText.globals import MAXTEXT_ASSETS_ROOT
@@ -130,5 +131,85 @@ class HFTokenizerTest(unittest.TestCase):
     self.assertTrue(np.array_equal(self.hf_tokenizer.encode(text), self.sp_tokenizer.encode(text)))
 
 
+class IncrementalDetokenizerTest(unittest.TestCase):
+  """Tests for tokenizer.IncrementalDetokenizer and tokenizer.StopSequenceMatcher"""
+
+  TEXT = "Hello wörld! 你好，世界 🤖🚀 and  double  spaces\nnew line"
+
+  @classmethod
+  def setUpClass(cls):
+    cls.tokenizers = {
+        "sentencepiece": tokenizer.build_tokenizer(
+            os.path.join(MAXTEXT_ASSETS_ROOT, "tokenizer.llama2"), "sentencepiece", False, False, None, "grain"
+        ),
+        "tiktoken": tokenizer.build_tokenizer(
+            os.path.join(MAXTEXT_ASSETS_ROOT, "tokenizer_llama3.tiktoken"), "tiktoken", False, False, None, "grain"
+        ),
+    }
+
+  def test_deltas_concatenate_to_full_decode(self):
+    for name, tok in self.tokenizers.items():
+      with self.subTest(name):
+        ids = list(tok.encode(self.TEXT))
+        detokenizer = tokenizer.IncrementalDetokenizer(tok)
+        deltas = [detokenizer.add(t) for t in ids]
+        deltas.append(detokenizer.flush())
+        self.assertEqual("".join(deltas), tok.decode(ids))
+        self.assertEqual(detokenizer.text, tok.decode(ids))
+        self.assertTrue(all("\ufffd" not in d for d in deltas))
+
+  def test_offsets_point_at_token_text(self):
+    for name, tok in self.tokenizers.items():
+      with self.subTest(name):
+        ids = list(tok.encode("The quick brown fox"))
+        detokenizer = tokenizer.IncrementalDetokenizer(tok)
+        for t in ids:
+          detokenizer.add(t)
+        self.assertEqual(detokenizer.offsets[0], 0)
+        self.assertEqual(detokenizer.offsets, sorted(detokenizer.offsets))
+        self.assertEqual(len(detokenizer.offsets), len(ids))
+
+  def test_offsets_match_full_decode(self):
+    for name, tok in self.tokenizers.items():
+      with self.subTest(name):
+        ids = list(tok.encode(self.TEXT))
+        if name == "sentencepiece":
+          # A stray continuation byte (piece <0x80>, after the 3 control pieces) stays U+FFFD and
+          # is released together with the next piece.
+          ids += [3 + 0x80] + list(tok.encode("tail"))
+        detokenizer = tokenizer.IncrementalDetokenizer(tok)
+        for t in ids:
+          detokenizer.add(t)
+        detokenizer.flush()
+        # A token starts where the decode of the tokens before it stops agreeing with the full decode.
+        full_text = tok.decode(ids)
+        expected = [len(os.path.commonprefix([tok.decode(ids[:i]), full_text])) for i in range(len(ids))]
+        self.assertEqual(detokenizer.offsets, expected)
+
+  def test_skip_token_ids_produce_no_text(self):
+    tok = self.tokenizers["tiktoken"]
+    ids = list(tok.encode("Hi there"))
+    detokenizer = tokenizer.IncrementalDetokenizer(tok, skip_token_ids=[tok.eos_id])
+    deltas = [detokenizer.add(t) for t in ids + [tok.eos_id]]
+    self.assertEqual("".join(deltas), "Hi there")
+
+  def test_stop_sequence_matcher(self):
+    matcher = tokenizer.StopSequenceMatcher(["STOP", "TOP!", "xyz"])
+    self.assertEqual(matcher.feed("Hello S"), -1)
+    self.assertEqual(matcher.num_pending_chars, 1)
+    self.assertEqual(matcher.feed("TO"), -1)
+    self.assertEqual(matcher.num_pending_chars, 3)
+    self.assertEqual(matcher.feed("P! more"), 6)
+
+  def test_stop_sequence_matcher_overlapping_prefixes(self):
+    matcher = tokenizer.StopSequenceMatcher(["abcd", "bc"])
+    self.assertEqual(matcher.feed("xab"), -1)
+    self.assertEqual(matcher.feed("c"), 2)
+    matcher = tokenizer.StopSequenceMatcher(["aab"])
+    self.assertEqual(matcher.feed("aaaa"), -1)
+    self.assertEqual(matcher.num_pending_chars, 2)
+    self.assertEqual(matcher.feed("b"), 2)
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -19,16 +19,40 @@ model configurations and parallelism strategies can be successfully compiled
 for different hardware topologies.
 """
 
+import re
 import unittest
 import os.path
 from tempfile import gettempdir
 
 import pytest
 
+from MaxText import pyconfig
+from MaxText.train_compile import compile_train_step, get_topology_mesh
 from MaxText.train_compile import main as train_compile_main
 from MaxText.globals import MAXTEXT_PKG_DIR
 
 
+def _collectives_in_loops(hlo_text):
+  """Returns the opcodes of the collectives of the HLO module that run inside its top-level while loops."""
+  computations = {}
+  for block in re.split(r"\n(?=%|ENTRY )", hlo_text):
+    match = re.match(r"(?:ENTRY )?%(\S+)", block)
+    if match:
+      computations[match.group(1)] = block
+  entry = next(block for block in computations.values() if block.startswith("ENTRY"))
+  pending = re.findall(r" while\(.*?body=%([\w.\-]+)", entry)
+  seen = set()
+  while pending:
+    name = pending.pop()
+    if name in seen or name not in computations:
+      continue
+    seen.add(name)
+    for callees in re.findall(r"(?:body|calls|to_apply)=(\{[^}]*\}|%\S+)", computations[name]):
+      pending.extend(re.findall(r"%([\w.\-]+)", callees))
+  collective = r"\b(all-reduce|reduce-scatter|all-gather)(?:-start)?\("
+  return {opcode for name in seen for opcode in re.findall(collective, computations[name])}
+
+
 class TrainCompile(unittest.TestCase):
   """Tests for the Ahead of Time Compilation functionality, train_compile.py"""
 
@@ -769,3 +793,25 @@ class TrainCompile(unittest.TestCase):
             "per_device_batch_size=1",
         )
     )
+
+  @pytest.mark.cpu_only
+  def test_gradient_accumulation_overlap_reduction(self):
+    """The gradients of every microbatch are reduce-scattered inside the gradient accumulation loop."""
+    config = pyconfig.initialize(
+        (
+            "",
+            os.path.join(MAXTEXT_PKG_DIR, "configs", "base.yml"),
+            "compile_topology=v5p-8",
+            "compile_topology_num_slices=1",
+            "ici_fsdp_parallelism=1",
+            "ici_data_parallelism=-1",
+            "base_emb_dim=256",
+            "base_mlp_dim=256",
+            "base_num_decoder_layers=2",
+            "per_device_batch_size=4",
+            "gradient_accumulation_steps=4",
+            "gradient_accumulation_overlap_reduction_axes=['data']",
+        )
+    )
+    compiled = compile_train_step(get_topology_mesh(config), config)
+    self.assertIn("reduce-scatter", _collectives_in_loops(compiled.as_text()))
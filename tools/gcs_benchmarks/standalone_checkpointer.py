@@ -86,6 +86,7 @@ def checkpoint_loop(config, state=None):
 
   start_step = get_first_step(state)  # this is the start_step for training
   for step in np.arange(start_step, config.steps):
+    state = simulate_train_step(state, step)
     if checkpoint_manager is not None:
       start_time = datetime.datetime.now()
       # A barrier to sync all hosts before starting to save checkpoint
@@ -94,8 +95,13 @@ def checkpoint_loop(config, state=None):
         checkpoint_manager.wait_until_finished()
         end_time = datetime.datetime.now()
         if jax.process_index() == 0:
+          is_delta = isinstance(checkpoint_manager, checkpointing.DeltaCheckpointManager) and (
+              checkpoint_manager.is_delta_step(int(step))
+          )
+          kind = "delta" if is_delta else "full"
           max_logging.log(
-              f"STANDALONE CHECKPOINTER : Checkpoint saved in {end_time - start_time} ,step {step}, on host 0"
+              f"STANDALONE CHECKPOINTER : Checkpoint saved in {end_time - start_time} ,step {step}, on host 0, "
+              f"{kind} checkpoint of {checkpointing.checkpoint_size_bytes(checkpoint_manager, int(step))} bytes"
           )
 
   return state
@@ -116,6 +122,26 @@ def add_entropy_to_checkpoint(state):
   return state
 
 
+@jax.jit
+def simulate_train_step(state, step):
+  """Changes the params and optimizer state slightly, like a training step would.
+
+  The full checkpoints do not depend on it, but the size of delta checkpoints
+  does, so successive checkpoints should not be identical.
+  Args:
+    state: The state to update
+    step: The step, used as the seed of the update
+  Returns:
+    state: The updated state
+  """
+  # Relative updates of about 1e-4 for the params and 1e-1 for the Adam moments.
+  params = jax.tree_util.tree_map(lambda p: p * (1 + 1e-4 * jnp.sin(1000 * p + step)), state.params)
+  opt_0 = state.opt_state[0]
+  opt_0 = opt_0._replace(mu=jax.tree_util.tree_map(lambda m: m * (0.9 + 0.1 * jnp.cos(step * m)), opt_0.mu))
+  opt_0 = opt_0._replace(nu=jax.tree_util.tree_map(lambda v: v * (0.999 + 0.1 * jnp.sin(step * v) ** 2), opt_0.nu))
+  return state.replace(params=params, opt_state=[opt_0] + list(state.opt_state[1:]))
+
+
 def main(argv: Sequence[str]) -> None:
   os.environ["TF_CPP_MIN_LOG_LEVEL"] = "0"
   config = pyconfig.initialize(argv)